@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+"""
+Bank Transaction Matching
+=========================
+
+Match index for bank statement transactions (camt). Open sales/purchase
+invoices, expense claims, ESR/QR references, bill numbers and supplier,
+customer and employee names are loaded once per statement. Transactions
+are then matched by exact dict lookups and an Aho-Corasick multi-pattern
+scan of the transaction reference instead of one query and one linear
+substring scan per transaction.
+
+The matching rules are the same as in the former per-transaction
+implementation of bank_wizard.read_camt_transactions, including the
+ERPNextSwiss Settings numeric_only_debtor_matching and
+ignore_special_characters.
+
+PaymentMatcher matches unallocated payment entries to open sales invoices
+(page match_payments) with a token index of the payment remarks and a
+confidence score per candidate.
+"""
+
+import re
+import unicodedata
+from collections import deque
+import frappe
+from frappe.utils import cint
+from erpnextswiss.erpnextswiss.utils import get_chunks
+
+class AhoCorasick:
+    """
+    Multi-pattern substring search: finds all patterns contained in a text
+    in one pass over the text. Each pattern carries one or more values.
+    """
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        # patterns that are contained in any text (empty pattern)
+        self._always = []
+        self._built = False
+
+    def add(self, pattern, value):
+        if pattern is None:
+            return
+        if pattern == "":
+            self._always.append(value)
+            return
+        state = 0
+        for character in pattern:
+            next_state = self._goto[state].get(character)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][character] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(value)
+        self._built = False
+        return
+
+    def build(self):
+        """
+        Compute the failure links (breadth first) and merge outputs
+        """
+        queue = deque()
+        for character, state in self._goto[0].items():
+            self._fail[state] = 0
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for character, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and character not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(character, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+        self._built = True
+        return
+
+    def search(self, text):
+        """
+        Return the set of values of all patterns contained in text
+        """
+        if not self._built:
+            self.build()
+        found = set(self._always)
+        if not text:
+            return found
+        state = 0
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        for character in text:
+            while state and character not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(character, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+class ImportedReferences:
+    """
+    Set of bank references that are already recorded as Payment Entry
+    (reference_no), kept per company. References are resolved in bulk with
+    a few chunked IN (...) queries instead of one query per transaction.
+    """
+    def __init__(self):
+        # company (None: any company) -> {reference_no: payment entry}
+        self._payment_entries = {}
+        self._resolved = {}
+
+    def prefetch(self, references, company=None):
+        payment_entries = self._payment_entries.setdefault(company, {})
+        resolved = self._resolved.setdefault(company, set())
+        missing = set(r for r in references if r) - resolved
+        for chunk in get_chunks(missing):
+            conditions = "`reference_no` IN %(references)s"
+            if company:
+                conditions += " AND `company` = %(company)s"
+            matches = frappe.db.sql("""
+                SELECT `reference_no`, `name`
+                FROM `tabPayment Entry`
+                WHERE {conditions};""".format(conditions=conditions),
+                {'references': tuple(chunk), 'company': company}, as_dict=True)
+            for match in matches:
+                # keyed like the database collation compares (case insensitive)
+                payment_entries.setdefault(get_name_key(match['reference_no']), match['name'])
+        resolved.update(missing)
+        return
+
+    def get_payment_entry(self, reference, company=None):
+        """
+        Return the payment entry that records this reference or None
+        """
+        if reference not in self._resolved.get(company, set()):
+            self.prefetch([reference], company)
+        return self._payment_entries[company].get(get_name_key(reference))
+
+def get_name_key(name):
+    """
+    Normalise a party name for lookups the way the database collation
+    compares names (case and accent insensitive, trailing spaces ignored)
+    """
+    if name is None:
+        return None
+    decomposed = unicodedata.normalize("NFKD", "{0}".format(name))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold().rstrip(" ")
+
+def get_numeric_only_reference(s):
+    return "".join(c for c in (s or "") if c.isdigit())
+
+def remove_special_characters(s):
+    return (s or "").replace(" ", "").replace("-", "")
+
+class MatchIndex:
+    """
+    Lookup structures for one statement; all sections are loaded lazily on
+    first use, so a statement with only credits never loads payables.
+    """
+    def __init__(self, settings):
+        self.numeric_only_debtor_matching = cint(settings.numeric_only_debtor_matching) == 1
+        self.ignore_special_characters = cint(settings.ignore_special_characters) == 1
+        self._receivables = None
+        self._payables = None
+        self._expenses = None
+        self._payment_proposals = {}
+
+    # --- receivables
+    def _load_receivables(self):
+        customers = {}
+        for customer in frappe.get_all("Customer", filters={'disabled': 0}, fields=['name', 'customer_name']):
+            customers.setdefault(get_name_key(customer['customer_name']), customer['name'])
+        sales_invoices = frappe.get_all("Sales Invoice",
+            filters=[['outstanding_amount', '>', 0], ['docstatus', '=', 1]],
+            fields=['name', 'customer', 'customer_name', 'outstanding_amount', 'esr_reference'])
+        by_reference = AhoCorasick()
+        by_modified_reference = AhoCorasick()
+        by_esr = {}
+        for position, sinv in enumerate(sales_invoices):
+            by_reference.add(sinv['name'], position)
+            if self.numeric_only_debtor_matching:
+                by_modified_reference.add(get_numeric_only_reference(sinv['name']), position)
+            elif self.ignore_special_characters:
+                by_modified_reference.add(remove_special_characters(sinv['name']), position)
+            if sinv.get('esr_reference'):
+                by_esr.setdefault(sinv['esr_reference'], []).append(position)
+        self._receivables = {
+            'customers': customers,
+            'sales_invoices': sales_invoices,
+            'by_reference': by_reference,
+            'by_modified_reference': by_modified_reference,
+            'by_esr': by_esr
+        }
+        return self._receivables
+
+    def match_receivable(self, party_name, transaction_reference):
+        """
+        Match an incoming payment (CRDT) to a customer and open sales invoices
+
+        Returns a tuple (party_match, invoice_matches, matched_amount)
+        """
+        receivables = self._receivables or self._load_receivables()
+        party_match = receivables['customers'].get(get_name_key(party_name))
+        invoice_matches = []
+        matched_amount = 0.0
+        transaction_reference = transaction_reference or ""
+        hits = receivables['by_reference'].search(transaction_reference)
+        hits.update(receivables['by_esr'].get(transaction_reference, []))
+        if self.numeric_only_debtor_matching:
+            hits.update(receivables['by_modified_reference'].search(transaction_reference))
+        elif self.ignore_special_characters:
+            hits.update(receivables['by_modified_reference'].search(remove_special_characters(transaction_reference)))
+        for position in sorted(hits):
+            sinv = receivables['sales_invoices'][position]
+            invoice_matches.append(sinv['name'])
+            # override party match in case there is one from the sales invoice
+            party_match = sinv['customer']
+            matched_amount += float(sinv['outstanding_amount'])
+        return party_match, invoice_matches, matched_amount
+
+    # --- payables
+    def _load_payables(self):
+        suppliers = {}
+        enabled_suppliers = {}
+        supplier_names = set()
+        for supplier in frappe.get_all("Supplier", fields=['name', 'supplier_name', 'disabled']):
+            key = get_name_key(supplier['supplier_name'])
+            supplier_names.add(supplier['name'])
+            suppliers.setdefault(key, supplier['name'])
+            if not cint(supplier['disabled']):
+                enabled_suppliers.setdefault(key, supplier['name'])
+        employees = {}
+        for employee in frappe.get_all("Employee", filters={'status': 'Active'}, fields=['name', 'employee_name']):
+            employees.setdefault(get_name_key(employee['employee_name']), employee['name'])
+        purchase_invoices = frappe.get_all("Purchase Invoice",
+            filters=[['docstatus', '=', 1], ['outstanding_amount', '>', 0]],
+            fields=['name', 'supplier', 'outstanding_amount', 'bill_no', 'esr_reference_number'])
+        by_reference = AhoCorasick()
+        by_esr_reference = AhoCorasick()
+        by_esr = {}
+        by_bill_no = {}
+        by_supplier = {}
+        for position, pinv in enumerate(purchase_invoices):
+            by_reference.add(pinv['name'], position)
+            by_reference.add(pinv['bill_no'] or pinv['name'], position)
+            if pinv['esr_reference_number']:
+                by_esr_reference.add(pinv['esr_reference_number'].replace(" ", ""), position)
+                by_esr.setdefault(pinv['esr_reference_number'], []).append(position)
+            if pinv['bill_no']:
+                by_bill_no.setdefault(pinv['bill_no'], []).append(position)
+            by_supplier.setdefault(pinv['supplier'], []).append(position)
+        self._payables = {
+            'suppliers': suppliers,
+            'enabled_suppliers': enabled_suppliers,
+            'supplier_names': supplier_names,
+            'employees': employees,
+            'purchase_invoices': purchase_invoices,
+            'by_reference': by_reference,
+            'by_esr_reference': by_esr_reference,
+            'by_esr': by_esr,
+            'by_bill_no': by_bill_no,
+            'by_supplier': by_supplier
+        }
+        return self._payables
+
+    def _load_expenses(self):
+        expense_claims = frappe.get_all("Expense Claim",
+            filters=[['docstatus', '=', 1], ['status', '=', 'Unpaid']],
+            fields=['name', 'employee', 'total_claimed_amount'])
+        by_reference = AhoCorasick()
+        for position, exp in enumerate(expense_claims):
+            by_reference.add(exp['name'], position)
+        self._expenses = {
+            'expense_claims': expense_claims,
+            'by_reference': by_reference
+        }
+        return self._expenses
+
+    def get_payment_proposal_payment(self, payment_proposal_id, idx):
+        """
+        Return the payment proposal row (by parent and idx) or None; the
+        rows of a proposal are loaded once
+        """
+        if payment_proposal_id is None or idx is None:
+            return None
+        if payment_proposal_id not in self._payment_proposals:
+            rows = frappe.get_all("Payment Proposal Payment",
+                filters={'parent': payment_proposal_id},
+                fields=['idx', 'receiver', 'receiver_address_line1', 'receiver_address_line2', 'iban',
+                    'reference', 'receiver_id', 'esr_reference'])
+            proposal = {}
+            for row in rows:
+                proposal.setdefault(row['idx'], row)
+            self._payment_proposals[payment_proposal_id] = proposal
+        return self._payment_proposals[payment_proposal_id].get(idx)
+
+    def find_supplier(self, supplier_name, enabled_only=False):
+        payables = self._payables or self._load_payables()
+        if enabled_only:
+            return payables['enabled_suppliers'].get(get_name_key(supplier_name))
+        return payables['suppliers'].get(get_name_key(supplier_name))
+
+    def match_payable(self, party_name, transaction_reference, payment_instruction_id):
+        """
+        Match an outgoing payment (DBIT) to a supplier and open purchase
+        invoices (by payment proposal instruction or reference) and to an
+        employee and unpaid expense claims
+
+        Returns a tuple (party_match, employee_match, invoice_matches, expense_matches, matched_amount)
+        """
+        payables = self._payables or self._load_payables()
+        purchase_invoices = payables['purchase_invoices']
+        party_match = None
+        employee_match = None
+        invoice_matches = []
+        expense_matches = None
+        matched_amount = 0.0
+        transaction_reference = transaction_reference or ""
+
+        # match by payment instruction id
+        possible_pinvs = []
+        if payment_instruction_id:
+            try:
+                payment_instruction_fields = payment_instruction_id.split("-")
+                try:
+                    payment_instruction_row = int(payment_instruction_fields[-1]) + 1
+                except:
+                    # invalid payment instruction id (cannot parse, e.g. on LSV or foreign pain.001 source) - no match
+                    payment_instruction_row = None
+                if len(payment_instruction_fields) > 3:
+                    # revision in payment proposal
+                    payment_proposal_id = "{0}-{1}".format(payment_instruction_fields[1], payment_instruction_fields[2])
+                elif len(payment_instruction_fields) > 1:
+                    payment_proposal_id = payment_instruction_fields[1]
+                else:
+                    payment_proposal_id = None
+                # find original instruction record
+                payment_proposal_payment = self.get_payment_proposal_payment(payment_proposal_id, payment_instruction_row)
+                if payment_proposal_payment:
+                    # supplier
+                    if payment_proposal_payment['receiver_id'] and payment_proposal_payment['receiver_id'] in payables['supplier_names']:
+                        party_match = payment_proposal_payment['receiver_id']
+                    else:
+                        # fallback to supplier name
+                        party_match = self.find_supplier(payment_proposal_payment['receiver'])
+                    # purchase invoice reference match (take each part separately)
+                    if payment_proposal_payment['esr_reference']:
+                        # match by esr reference number
+                        possible_pinvs = payables['by_esr'].get(payment_proposal_payment['esr_reference'], [])
+                    else:
+                        # check each individual reference (combined pinvs)
+                        positions = set()
+                        for bill_no in (payment_proposal_payment['reference'] or "").split(","):
+                            positions.update(payables['by_bill_no'].get(bill_no.strip(), []))
+                        possible_pinvs = sorted(positions)
+            except Exception as err:
+                # this can be the case for malformed instruction ids
+                frappe.log_error(err, "Match payment instruction error")
+        # suppliers
+        if not possible_pinvs:
+            # no payment proposal, try to estimate from other data
+            if not party_match:
+                # find suplier from name
+                party_match = self.find_supplier(party_name, enabled_only=True)
+            if party_match:
+                # restrict pinvs to supplier
+                possible_pinvs = payables['by_supplier'].get(party_match, [])
+            else:
+                possible_pinvs = None           # all open purchase invoices
+        if possible_pinvs is None or possible_pinvs:
+            if payment_instruction_id == transaction_reference:
+                # this is an override for Postfinance combined transactions that will not relay transaction ids
+                positions = range(len(purchase_invoices)) if possible_pinvs is None else possible_pinvs
+            else:
+                hits = payables['by_reference'].search(transaction_reference)
+                hits.update(payables['by_esr_reference'].search(transaction_reference.replace(" ", "")))
+                if possible_pinvs is None:
+                    positions = sorted(hits)
+                else:
+                    positions = [p for p in possible_pinvs if p in hits]
+            for position in positions:
+                pinv = purchase_invoices[position]
+                invoice_matches.append(pinv['name'])
+                # override party match in case there is one from the purchase invoice
+                party_match = pinv['supplier']
+                # add total matched amount
+                matched_amount += float(pinv['outstanding_amount'])
+        # employees
+        employee_match = payables['employees'].get(get_name_key(party_name))
+        # expense claims
+        expenses = self._expenses or self._load_expenses()
+        if expenses['expense_claims']:
+            expense_matches = []
+            for position in sorted(expenses['by_reference'].search(transaction_reference)):
+                exp = expenses['expense_claims'][position]
+                expense_matches.append(exp['name'])
+                # override party match in case there is one from the expense claim
+                employee_match = exp['employee']
+                # add total matched amount
+                matched_amount += float(exp['total_claimed_amount'])
+        return party_match, employee_match, invoice_matches, expense_matches, matched_amount
+
+# separators between the tokens of a payment remark (invoice names keep their "-", "/" and ".")
+TOKEN_SEPARATORS = re.compile(r"[\s,;:()\[\]{}<>\"'|]+")
+# confidence of a reference that is a token of the remarks / only part of a longer token
+CONFIDENCE_TOKEN = 0.7
+CONFIDENCE_CONTAINED = 0.4
+# additional confidence if the payment pays exactly the outstanding amount / is already on the customer
+CONFIDENCE_AMOUNT = 0.2
+CONFIDENCE_PARTY = 0.1
+
+def get_tokens(text):
+    """
+    Set of the (case folded) tokens of a text, without trailing dots
+    """
+    tokens = set()
+    for token in TOKEN_SEPARATORS.split(text or ""):
+        token = token.rstrip(".")
+        if token:
+            tokens.add(token.casefold())
+    return tokens
+
+class PaymentMatcher:
+    """
+    Matches unallocated payment entries (remarks) to open sales invoices by
+    invoice name (method "docid") or ESR/QR reference (method "esr").
+
+    The remarks of all payments are split into tokens and kept in a hash
+    index {token: payments}, so every invoice is one lookup. References
+    that are only part of a longer token (as matched by the former
+    substring rule) are found with one Aho-Corasick scan per payment and
+    get a lower confidence.
+    """
+    def __init__(self, sales_invoices, payments, method="docid"):
+        self.sales_invoices = sales_invoices
+        self.payments = payments
+        self.method = (method or "docid").lower()
+        self.by_token = {}
+        for position, payment in enumerate(payments):
+            for token in get_tokens(payment.get('remarks')):
+                self.by_token.setdefault(token, []).append(position)
+
+    def get_reference(self, sales_invoice):
+        if self.method == "esr":
+            return (sales_invoice.get('esr_reference') or "").replace(" ", "")
+        return sales_invoice.get('name') or ""
+
+    def get_candidates(self, min_confidence=0):
+        """
+        All (payment, sales invoice) candidates, best first
+        :returns:   list of dicts with payment_entry, sales_invoice, customer, confidence
+        """
+        hits = {}
+        references = AhoCorasick()
+        for position, sinv in enumerate(self.sales_invoices):
+            reference = self.get_reference(sinv)
+            if not reference:
+                continue
+            references.add(reference, position)
+            for payment in self.by_token.get(reference.casefold(), []):
+                hits[(payment, position)] = CONFIDENCE_TOKEN
+        for payment_position, payment in enumerate(self.payments):
+            remarks = payment.get('remarks') or ""
+            contained = references.search(remarks)
+            if self.method == "esr":
+                # ESR/QR references are often written in blocks of 5 digits
+                contained.update(references.search(remarks.replace(" ", "")))
+            for position in contained:
+                hits.setdefault((payment_position, position), CONFIDENCE_CONTAINED)
+
+        candidates = []
+        for (payment_position, position), confidence in hits.items():
+            payment = self.payments[payment_position]
+            sinv = self.sales_invoices[position]
+            if abs(float(payment.get('paid_amount') or 0) - float(sinv.get('outstanding_amount') or 0)) < 0.01:
+                confidence += CONFIDENCE_AMOUNT
+            if payment.get('party') and payment.get('party') == sinv.get('customer'):
+                confidence += CONFIDENCE_PARTY
+            confidence = round(min(confidence, 1.0), 2)
+            if confidence < min_confidence:
+                continue
+            candidates.append({
+                'payment_entry': payment['name'],
+                'sales_invoice': sinv['name'],
+                'customer': sinv.get('customer'),
+                'confidence': confidence,
+                '_order': (-confidence, payment_position, position)
+            })
+        candidates.sort(key=lambda c: c.pop('_order'))
+        return candidates
+
+    def get_allocations(self, min_confidence=0):
+        """
+        Allocate the candidates (best first) without over-allocating a payment
+        or an invoice; all invoices of a payment belong to one customer
+        :returns:   {payment entry: {'customer': customer, 'references': [(sales invoice, allocated amount)]}}
+        """
+        paid = {p['name']: float(p.get('paid_amount') or 0) for p in self.payments}
+        outstanding = {s['name']: float(s.get('outstanding_amount') or 0) for s in self.sales_invoices}
+        allocations = {}
+        for candidate in self.get_candidates(min_confidence):
+            payment_entry = candidate['payment_entry']
+            sales_invoice = candidate['sales_invoice']
+            allocation = allocations.get(payment_entry)
+            if allocation and allocation['customer'] != candidate['customer']:
+                continue
+            amount = round(min(paid[payment_entry], outstanding[sales_invoice]), 2)
+            if amount <= 0:
+                continue
+            if not allocation:
+                allocation = allocations[payment_entry] = {'customer': candidate['customer'], 'references': []}
+            allocation['references'].append((sales_invoice, amount))
+            paid[payment_entry] -= amount
+            outstanding[sales_invoice] -= amount
+        return allocations
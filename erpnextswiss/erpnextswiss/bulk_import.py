@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+"""
+Bulk Import
+===========
+
+Upsert a list of records into a doctype without loading documents one by
+one: the existing records are read once and compared in memory, new
+records are written with multi-row INSERTs and changed records with one
+UPDATE ... CASE statement per batch. Each batch is committed once.
+
+Controller hooks (validate, on_update) are not run; use this for plain
+master data such as pincodes and municipalities.
+"""
+
+import time
+import frappe
+from frappe.utils import cstr, now
+
+BATCH_SIZE = 500
+
+def get_key(record, key_fields):
+    # the database compares case-insensitive
+    return tuple(cstr(record.get(f)).strip().lower() for f in key_fields)
+
+def bulk_upsert(doctype, records, key_fields, update_fields, batch_size=BATCH_SIZE):
+    """
+    Insert new and update changed records (dicts with name and field values),
+    existing records are matched by key_fields, only update_fields are updated.
+    Returns the counts of inserted, updated and unchanged records and the duration
+    """
+    start = time.time()
+    existing = {}
+    existing_names = set()
+    for record in frappe.get_all(doctype, fields=list(set(['name'] + key_fields + update_fields))):
+        existing.setdefault(get_key(record, key_fields), record)
+        existing_names.add(record.name)
+
+    inserts = {}
+    updates = {}
+    unchanged = 0
+    for record in records:
+        key = get_key(record, key_fields)
+        if key in inserts:
+            # repeated in the file: the last row wins
+            inserts[key].update({f: record.get(f) for f in update_fields})
+            continue
+        current = existing.get(key)
+        if not current and record.get('name') in existing_names:
+            current = frappe._dict({'name': record.get('name')})
+            current.update(frappe.db.get_value(doctype, record.get('name'), update_fields, as_dict=True) or {})
+        if not current:
+            inserts[key] = dict(record)
+            continue
+        values = updates.get(current.name) or {f: current.get(f) for f in update_fields}
+        changed = {f: record.get(f) for f in update_fields if cstr(values.get(f)) != cstr(record.get(f))}
+        if changed:
+            values.update(changed)
+            updates[current.name] = values
+        elif current.name not in updates:
+            unchanged += 1
+
+    insert_records = list(inserts.values())
+    for i in range(0, len(insert_records), batch_size):
+        insert_batch(doctype, insert_records[i:i + batch_size])
+        frappe.db.commit()
+    update_records = list(updates.items())
+    for i in range(0, len(update_records), batch_size):
+        update_batch(doctype, update_records[i:i + batch_size], update_fields)
+        frappe.db.commit()
+
+    return frappe._dict({
+        'inserted': len(insert_records),
+        'updated': len(update_records),
+        'unchanged': unchanged,
+        'duration': round(time.time() - start, 2)
+    })
+
+def insert_batch(doctype, records):
+    timestamp = now()
+    user = frappe.session.user
+    fields = [f for f in records[0].keys() if f != 'name']
+    values = [
+        [r.get('name'), timestamp, timestamp, user, user, 0, 0] + [r.get(f) for f in fields]
+        for r in records
+    ]
+    frappe.db.bulk_insert(doctype,
+        ['name', 'creation', 'modified', 'owner', 'modified_by', 'docstatus', 'idx'] + fields,
+        values)
+    return
+
+def update_batch(doctype, updates, update_fields):
+    """
+    Update a batch of (name, values) in one statement
+    """
+    names = [name for name, values in updates]
+    assignments = []
+    params = {'names': tuple(names), 'modified': now(), 'modified_by': frappe.session.user}
+    for f in update_fields:
+        cases = []
+        for i, (name, values) in enumerate(updates):
+            cases.append("WHEN %(name_{i})s THEN %({f}_{i})s".format(f=f, i=i))
+            params["{0}_{1}".format(f, i)] = values.get(f)
+        assignments.append("`{f}` = CASE `name` {cases} END".format(f=f, cases=" ".join(cases)))
+    for i, name in enumerate(names):
+        params["name_{0}".format(i)] = name
+    frappe.db.sql("""
+        UPDATE `tab{doctype}`
+        SET {assignments},
+            `modified` = %(modified)s,
+            `modified_by` = %(modified_by)s
+        WHERE `name` IN %(names)s;""".format(doctype=doctype, assignments=", ".join(assignments)), params)
+    return
@@ -5,15 +5,25 @@
 # call the API from
 #   /api/method/erpnextswiss.erpnextswiss.caldav.crm_feed?secret=[secret]
 #   /api/method/erpnextswiss.erpnextswiss.caldav.todo_feed?secret=[secret]&user=[user]
+#
+# The serialized feeds are cached (until the source records change or the day
+# changes) and served with ETag and Last-Modified, so that polling calendar
+# clients get a cheap 304 Not Modified
 
+import hashlib
 from icalendar import Calendar, Event, Todo
 from datetime import datetime
 import frappe
-from frappe.utils import cint
-from datetime import datetime
+from frappe.utils import cint, today
+from werkzeug.exceptions import abort
+from werkzeug.wrappers import Response
+
+FEED_CACHE = "erpnextswiss_caldav_feed"
+# optional columns of the crm source (Lead, Customer) used in the event description
+CRM_DESCRIPTION_FIELDS = ['lead_name', 'customer_name', 'lead_owner', 'account_manager', 'email_id']
 
 def get_crm_feed_content(secret):
-    settings = frappe.get_doc("CalDav Feed", "CalDav Feed")
+    settings = frappe.get_cached_doc("CalDav Feed", "CalDav Feed")
     caldav_secret = settings.get("crm_secret")
     if not caldav_secret:
         return
@@ -29,14 +39,17 @@ def get_crm_feed_content(secret):
     cal.add('prodid', '-//libracore business software//libracore//')
     cal.add('version', '2.0')
 
-    # get records
+    # get records (only the columns used in the events)
+    meta = frappe.get_meta(settings.crm_source)
+    fields = ['name', 'owner', 'modified', settings.crm_source_field] + [f for f in CRM_DESCRIPTION_FIELDS if meta.has_field(f)]
     events = frappe.db.sql("""
-        SELECT * 
+        SELECT {fields} 
         FROM `tab{dt}` 
         WHERE 
             `{field}` >= CURDATE()
         ;
-    """.format(dt=settings.crm_source, field=settings.crm_source_field), as_dict=True)
+    """.format(fields=", ".join("`{0}`".format(f) for f in fields), dt=settings.crm_source,
+        field=settings.crm_source_field), as_dict=True)
     
     # add events
     for erp_event in events:
@@ -50,7 +63,7 @@ def get_crm_feed_content(secret):
         event.add('description', "{0}\n\r{1}\n\r{2}".format(
             erp_event.get('lead_name') or erp_event.get('customer_name'), 
             erp_event.get('lead_owner') or erp_event.get('account_manager') or erp_event.get('owner'), 
-            erp_event['email_id'] or ""))
+            erp_event.get('email_id') or ""))
         # add to calendar
         cal.add_component(event)
         
@@ -58,28 +71,20 @@ def get_crm_feed_content(secret):
 
 @frappe.whitelist(allow_guest=True)
 def crm_feed(secret):
-    frappe.local.response.filename = "crm_caldav.ics"
-    calendar = get_crm_feed_content(secret)
-    if calendar:
-        frappe.local.response.filecontent = calendar.to_ical()
-    else:
-        frappe.local.response.filecontent = "No access"
-    frappe.local.response.type = "download"
-    return
+    settings = frappe.get_cached_doc("CalDav Feed", "CalDav Feed")
+    if not settings.get("crm_secret") or secret != settings.get("crm_secret") or cint(settings.crm_feed_enabled) == 0:
+        return send_no_access("crm_caldav.ics")
+    send_feed("crm_caldav.ics", get_feed("crm", lambda: get_crm_feed_content(secret)))
 
 @frappe.whitelist(allow_guest=True)
 def todo_feed(secret, user):
-    frappe.local.response.filename = "todo_caldav.ics"
-    calendar = get_crm_feed_content(secret)
-    if calendar:
-        frappe.local.response.filecontent = calendar.to_ical()
-    else:
-        frappe.local.response.filecontent = "No access"
-    frappe.local.response.type = "download"
-    return
+    settings = frappe.get_cached_doc("CalDav Feed", "CalDav Feed")
+    if not settings.get("todo_secret") or secret != settings.get("todo_secret") or cint(settings.todo_feed_enabled) == 0:
+        return send_no_access("todo_caldav.ics")
+    send_feed("todo_caldav.ics", get_feed("todo:{0}".format(user), lambda: get_todo_feed_content(secret, user)))
     
 def get_todo_feed_content(secret, user):
-    settings = frappe.get_doc("CalDav Feed", "CalDav Feed")
+    settings = frappe.get_cached_doc("CalDav Feed", "CalDav Feed")
     caldav_secret = settings.get("todo_secret")
     if not caldav_secret:
         return
@@ -99,13 +104,13 @@ def get_todo_feed_content(secret, user):
     
     # get todos
     todos = frappe.db.sql("""
-        SELECT * 
+        SELECT `name`, `description`, `creation`, `modified` 
         FROM `tabToDo` 
         WHERE 
             `date` >= CURDATE()
-            AND `owner` = "{user}"
+            AND `owner` = %(user)s
             AND `status` = "Open";
-    """.format(user=user), as_dict=True)
+    """, {'user': user}, as_dict=True)
     # add todos
     for erp_todo in todos:
         todo = Todo()
@@ -118,3 +123,67 @@ def get_todo_feed_content(secret, user):
         cal.add_component(todo)
         
     return cal
+
+def send_no_access(filename):
+    frappe.local.response.filename = filename
+    frappe.local.response.filecontent = "No access"
+    frappe.local.response.type = "download"
+    return
+
+"""
+Serialized feed from the cache: {'content', 'etag', 'last_modified', 'date'}
+
+The feeds only contain records from today on, so a cached feed is only valid
+on the day it was built
+"""
+def get_feed(key, get_calendar):
+    feed = frappe.cache().hget(FEED_CACHE, key)
+    if not feed or feed.get('date') != today():
+        calendar = get_calendar()
+        if not calendar:
+            return None
+        content = calendar.to_ical()
+        feed = {
+            'content': content,
+            'etag': hashlib.sha1(content).hexdigest(),
+            'last_modified': datetime.utcnow().replace(microsecond=0),
+            'date': today()
+        }
+        frappe.cache().hset(FEED_CACHE, key, feed)
+    return feed
+
+def send_feed(filename, feed):
+    if not feed:
+        return send_no_access(filename)
+    response = Response(feed['content'], mimetype="text/calendar")
+    response.headers["Content-Disposition"] = 'attachment; filename="{0}"'.format(filename)
+    response.set_etag(feed['etag'])
+    response.last_modified = feed['last_modified']
+    response.cache_control.private = True
+    response.cache_control.no_cache = True          # always revalidate (cheap with If-None-Match)
+    # 304 Not Modified (without content) if the client has this version
+    response.make_conditional(frappe.request)
+    # frappe does not pass headers or status codes of whitelisted methods, werkzeug returns an aborted response as is
+    abort(response)
+
+"""
+Document hooks: drop cached feeds when their records change
+"""
+def clear_crm_feed(doc, event=None):
+    if doc.doctype == frappe.get_cached_value("CalDav Feed", "CalDav Feed", "crm_source"):
+        frappe.cache().hdel(FEED_CACHE, "crm")
+    return
+
+def clear_todo_feed(doc, event=None):
+    users = set([doc.owner])
+    previous = doc.get_doc_before_save()
+    if previous:
+        # reassigned todo
+        users.add(previous.owner)
+    for user in users:
+        frappe.cache().hdel(FEED_CACHE, "todo:{0}".format(user))
+    return
+
+def clear_feeds():
+    frappe.cache().delete_value(FEED_CACHE)
+    return
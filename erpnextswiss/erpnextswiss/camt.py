@@ -0,0 +1,614 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+"""
+CAMT Streaming Parser
+=====================
+
+Single-pass reader for camt.052 (account report), camt.053 (statement)
+and camt.054 (debit/credit notification) documents based on lxml
+iterparse.
+
+Each <Ntry> is evaluated with compiled, namespace-aware XPath expressions
+and released right after it has been read, so memory stays bounded also
+for month-end statements with many thousand entries. The parser does not
+touch the database: it returns plain dicts which are matched against
+documents in the bank wizard.
+
+parse_camt() reads a whole document in one pass into a CamtDocument
+(message type and version from the namespace, one CamtStatement per
+<Stmt>/<Rpt>/<Ntfctn> with its header, balances and entries), so that
+meta data, balances and transactions are taken from the same parse.
+"""
+
+import io
+import re
+import hashlib
+import datetime
+from lxml import etree
+
+_PREFIX = "c"
+
+# compiled expressions per document namespace
+_expression_cache = {}
+
+# message type: (document container, statement element)
+CAMT_MESSAGES = {
+    'camt.052': ("BkToCstmrAcctRpt", "Rpt"),
+    'camt.053': ("BkToCstmrStmt", "Stmt"),
+    'camt.054': ("BkToCstmrDbtCdtNtfctn", "Ntfctn")
+}
+_NAMESPACE_PATTERN = re.compile(r"(camt\.05[234])\.001\.(\d+)")
+
+def _to_stream(content):
+    """
+    Wrap string or bytes content into a binary stream for iterparse.
+
+    Returns a tuple (stream, encoding override or None)
+    """
+    if isinstance(content, bytes):
+        return io.BytesIO(content), None
+    # a unicode string: the xml declaration might state a different encoding
+    return io.BytesIO(content.encode("utf-8")), "utf-8"
+
+def _first_path(namespace, *tags):
+    """
+    Build an expression that behaves like chained BeautifulSoup attribute
+    access: the first element matches the context node or a descendant,
+    each further element is the first descendant of the previous match.
+    """
+    prefix = "{0}:".format(_PREFIX) if namespace else ""
+    expression = "(descendant-or-self::{0}{1})[1]".format(prefix, tags[0])
+    for tag in tags[1:]:
+        expression = "({0}/descendant::{1}{2})[1]".format(expression, prefix, tag)
+    return expression
+
+def _get_expressions(namespace):
+    """
+    Return the compiled expressions for a document namespace (cached)
+    """
+    if namespace in _expression_cache:
+        return _expression_cache[namespace]
+
+    namespaces = {_PREFIX: namespace} if namespace else None
+    prefix = "{0}:".format(_PREFIX) if namespace else ""
+    paths = {
+        'booking_date': ('BookgDt', 'Dt'),
+        'booking_datetime': ('BookgDt', 'DtTm'),
+        'value_date': ('ValDt', 'Dt'),
+        'amount': ('Amt', ),
+        'credit_debit': ('CdtDbtInd', ),
+        'account_service_reference': ('AcctSvcrRef', ),
+        'entry_reference': ('NtryRef', ),
+        'bank_transaction_code': ('BkTxCd', 'Prtry', 'Cd'),
+        'transaction_id': ('TxId', ),
+        'payment_instruction_id': ('PmtInfId', ),
+        'tx_account_service_reference': ('TxDtls', 'Refs', 'AcctSvcrRef'),
+        'tx_amount': ('TxDtls', 'TxAmt', 'Amt'),
+        'tx_plain_amount': ('TxDtls', 'Amt'),
+        'related_parties': ('TxDtls', 'RltdPties'),
+        'creditor': ('Cdtr', ),
+        'debtor': ('Dbtr', ),
+        'creditor_iban': ('CdtrAcct', 'Id', 'IBAN'),
+        'debtor_iban': ('DbtrAcct', 'Id', 'IBAN'),
+        'name': ('Nm', ),
+        'street': ('StrtNm', ),
+        'building_number': ('BldgNb', ),
+        'postal_code': ('PstCd', ),
+        'town': ('TwnNm', ),
+        'country': ('Ctry', ),
+        'charges': ('Chrgs', 'TtlChrgsAndTaxAmt'),
+        'structured_reference': ('RmtInf', 'Strd', 'CdtrRefInf', 'Ref'),
+        'unstructured_reference': ('RmtInf', 'Ustrd'),
+        'end_to_end_id': ('EndToEndId', ),
+        'additional_information': ('AddtlTxInf', ),
+    }
+    # header and balance fields: direct children only (not from the entries)
+    child_paths = {
+        'message_id': ('MsgId', ),
+        'statement_id': ('Id', ),
+        'electronic_sequence_number': ('ElctrncSeqNb', ),
+        'creation_datetime': ('CreDtTm', ),
+        'from_datetime': ('FrToDt', 'FrDtTm'),
+        'to_datetime': ('FrToDt', 'ToDtTm'),
+        'account_iban': ('Acct', 'Id', 'IBAN'),
+        'account_other_id': ('Acct', 'Id', 'Othr', 'Id'),
+        'account_currency': ('Acct', 'Ccy'),
+        'balance_code': ('Tp', 'CdOrPrtry', 'Cd'),
+        'balance_amount': ('Amt', ),
+        'balance_credit_debit': ('CdtDbtInd', ),
+        'balance_date': ('Dt', 'Dt'),
+        'balance_datetime': ('Dt', 'DtTm'),
+    }
+    expressions = {}
+    for key, tags in paths.items():
+        expressions[key] = etree.XPath(_first_path(namespace, *tags), namespaces=namespaces)
+    for key, tags in child_paths.items():
+        expressions[key] = etree.XPath("/".join(prefix + tag for tag in tags), namespaces=namespaces)
+    expressions['transactions'] = etree.XPath("descendant::{0}TxDtls".format(prefix), namespaces=namespaces)
+    expressions['address_lines'] = etree.XPath("descendant::{0}AdrLine".format(prefix), namespaces=namespaces)
+
+    _expression_cache[namespace] = expressions
+    return expressions
+
+def _find(expressions, key, element):
+    if element is None:
+        return None
+    matches = expressions[key](element)
+    return matches[0] if matches else None
+
+def _text(element):
+    return "".join(element.itertext())
+
+def _find_text(expressions, key, element):
+    """
+    Return the text of the first match or None if the node does not exist
+    """
+    match = _find(expressions, key, element)
+    if match is None:
+        return None
+    return _text(match)
+
+def _release(element):
+    """
+    Free an element that has been read, including already processed siblings
+    """
+    element.clear(keep_tail=True)
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+    return
+
+def iterparse_elements(content, localname):
+    """
+    Stream all elements with a given local name (any namespace).
+
+    Yields tuples (element, namespace); the element is released after the
+    consumer continues, so do not keep references to it.
+    """
+    stream, encoding = _to_stream(content)
+    context = etree.iterparse(stream, events=('end', ), tag="{{*}}{0}".format(localname),
+        encoding=encoding, huge_tree=True, resolve_entities=False)
+    for event, element in context:
+        yield element, etree.QName(element).namespace
+        _release(element)
+    return
+
+def read_account_iban(content):
+    """
+    Find the account IBAN of a camt document (first IBAN node). Credit Suisse
+    does not provide an IBAN: in this case, the first <Othr><Id> is returned.
+
+    Stops reading as soon as an IBAN is found.
+    """
+    stream, encoding = _to_stream(content)
+    other_id = None
+    other_depth = 0
+    context = etree.iterparse(stream, events=('start', 'end'), encoding=encoding,
+        huge_tree=True, resolve_entities=False)
+    for event, element in context:
+        localname = etree.QName(element).localname
+        if event == 'start':
+            if localname == "Othr":
+                other_depth += 1
+            continue
+        if localname == "IBAN":
+            return _text(element).strip()
+        elif localname == "Id" and other_depth > 0 and other_id is None:
+            other_id = _text(element).strip()
+        elif localname == "Othr":
+            other_depth -= 1
+    if other_id is not None:
+        return other_id
+    return "n/a"
+
+def iter_camt_entries(content, use_entry_transaction_type=False, numeric_only_reference=False):
+    """
+    Parse the entries (<Ntry>) of a camt.053 document in a single pass
+
+    Input: camt.053-xml-string (str or bytes)
+        use_entry_transaction_type: always use the entry credit/debit indicator
+        numeric_only_reference: do not fall back to the unique reference as transaction reference
+    Output: generator of entry dicts, each with a list of transaction dicts
+        (entries without <TxDtls> have an empty list)
+    """
+    for entry, namespace in iterparse_elements(content, "Ntry"):
+        yield parse_entry(entry, _get_expressions(namespace),
+            use_entry_transaction_type=use_entry_transaction_type,
+            numeric_only_reference=numeric_only_reference)
+    return
+
+def get_message_type(namespace, container=None):
+    """
+    Message type and version of a camt document, e.g. ("camt.053", "04")
+
+    From the namespace (urn:iso:std:iso:20022:tech:xsd:camt.053.001.04),
+    documents without namespace by their container element (version None).
+    The fields read here are the same in .04 and .08 (.08 wraps related
+    parties in <Pty>, which the descendant expressions cover).
+    """
+    match = _NAMESPACE_PATTERN.search(namespace or "")
+    if match:
+        return match.group(1), match.group(2)
+    for message_type, (container_tag, statement_tag) in CAMT_MESSAGES.items():
+        if container_tag == container:
+            return message_type, None
+    return None, None
+
+def parse_camt(content, read_entries=True, use_entry_transaction_type=False, numeric_only_reference=False,
+        recover=False):
+    """
+    Parse a camt.052/053/054 document in a single pass
+
+    Input: camt-xml-string (str or bytes)
+        read_entries: parse the entries (otherwise, only header and balances are read)
+        use_entry_transaction_type, numeric_only_reference: see iter_camt_entries
+        recover: read as much as possible from malformed or truncated content (instead of raising XMLSyntaxError)
+    Output: CamtDocument
+    """
+    stream, encoding = _to_stream(content)
+    document = CamtDocument()
+    containers = {container_tag: message_type for message_type, (container_tag, statement_tag) in CAMT_MESSAGES.items()}
+    statement_tags = set(statement_tag for container_tag, statement_tag in CAMT_MESSAGES.values())
+    statement_tag = None
+    statement = None
+    expressions = None
+    tags = ["{{*}}{0}".format(tag) for tag in list(containers) + list(statement_tags) + ["GrpHdr", "Bal", "Ntry"]]
+    context = etree.iterparse(stream, events=('start', 'end'), tag=tags, encoding=encoding,
+        huge_tree=True, resolve_entities=False, recover=recover)
+    for event, element in context:
+        qname = etree.QName(element)
+        localname = qname.localname
+        if event == 'start':
+            if localname in containers and expressions is None:
+                # dispatch on message type and version
+                document.namespace = qname.namespace
+                document.message_type, document.version = get_message_type(qname.namespace, localname)
+                statement_tag = CAMT_MESSAGES[document.message_type or containers[localname]][1]
+                expressions = _get_expressions(qname.namespace)
+            elif localname == statement_tag and statement is None:
+                statement = CamtStatement(document.message_type)
+                document.statements.append(statement)
+            continue
+
+        if expressions is None:
+            # not a camt document (no container)
+            continue
+        if localname == "GrpHdr":
+            document.message_id = _find_text(expressions, 'message_id', element)
+            document.creation_datetime = _find_text(expressions, 'creation_datetime', element)
+            _release(element)
+        elif statement is None:
+            continue
+        elif localname == "Bal":
+            statement.read_header(element.getparent(), expressions)
+            statement.add_balance(element, expressions)
+            _release(element)
+        elif localname == "Ntry":
+            statement.read_header(element.getparent(), expressions)
+            if read_entries:
+                statement.entries.append(parse_entry(element, expressions,
+                    use_entry_transaction_type=use_entry_transaction_type,
+                    numeric_only_reference=numeric_only_reference))
+            _release(element)
+        elif localname == statement_tag:
+            statement.read_header(element, expressions)
+            statement = None
+            _release(element)
+    return document
+
+"""
+Parse result of a camt document (see parse_camt)
+"""
+class CamtDocument:
+    def __init__(self):
+        self.namespace = None
+        self.message_type = None            # camt.052, camt.053 or camt.054
+        self.version = None                 # e.g. 04 or 08
+        self.message_id = None
+        self.creation_datetime = None
+        self.statements = []
+
+    @property
+    def iban(self):
+        """
+        Account of the first statement (IBAN or other account id), "n/a" if there is none
+        """
+        for statement in self.statements:
+            if statement.iban:
+                return statement.iban
+        return "n/a"
+
+    def get_entries(self):
+        """
+        Entries of all statements (in document order)
+        """
+        return [entry for statement in self.statements for entry in statement.entries]
+
+    def get_meta(self):
+        """
+        Statement meta data (camt.053) of the first statement:
+        iban, electronic_sequence_number, msgid, currency, opening_balance, closing_balance and statement_date
+        """
+        statement = self.statements[0] if self.statements else CamtStatement(self.message_type)
+        creation_datetime = self.creation_datetime or statement.creation_datetime
+        return {
+            'iban': self.iban,
+            'electronic_sequence_number': statement.electronic_sequence_number or "n/a",
+            'msgid': statement.id or "n/a",
+            'currency': statement.get_currency(),
+            'opening_balance': statement.balances.get("OPBD", 0.0),
+            'closing_balance': statement.balances.get("CLBD", 0.0),
+            # note: creation date of the document (first CreDtTm)
+            'statement_date': creation_datetime[:10] if creation_datetime else None
+        }
+
+    def get_report_meta(self):
+        """
+        Report meta data (camt.052) of the first report:
+        iban, report_id, creation_datetime, currency and (if reported) intraday_balance and available_balance
+        """
+        statement = self.statements[0] if self.statements else CamtStatement(self.message_type)
+        meta = {
+            'iban': self.iban,
+            'report_id': statement.id or "n/a",
+            'creation_datetime': statement.creation_datetime,
+            'currency': statement.get_currency()
+        }
+        for code, key in (("ITBD", 'intraday_balance'), ("CLAV", 'available_balance')):
+            if code in statement.balances:
+                meta[key] = statement.balances[code]
+        return meta
+
+"""
+One <Stmt> (camt.053), <Rpt> (camt.052) or <Ntfctn> (camt.054)
+"""
+class CamtStatement:
+    def __init__(self, message_type=None):
+        self.message_type = message_type
+        self.id = None
+        self.electronic_sequence_number = None
+        self.creation_datetime = None
+        self.from_datetime = None
+        self.to_datetime = None
+        self.iban = None
+        self.currency = None
+        self.balances = {}                  # {type code (OPBD, CLBD, ITBD, ...): signed amount}
+        self.entries = []                   # entry dicts (see parse_entry)
+        self.header_read = False
+        self.currency_from_balance = False
+
+    def read_header(self, element, expressions):
+        """
+        Read the header fields; this is done before the first balance or entry is released
+        """
+        if self.header_read or element is None:
+            return
+        self.header_read = True
+        for key, expression_key in (('id', 'statement_id'),
+                ('electronic_sequence_number', 'electronic_sequence_number'),
+                ('creation_datetime', 'creation_datetime'),
+                ('from_datetime', 'from_datetime'),
+                ('to_datetime', 'to_datetime'),
+                ('currency', 'account_currency')):
+            value = _find_text(expressions, expression_key, element)
+            setattr(self, key, value.strip() if value is not None else None)
+        # Credit Suisse does not provide an IBAN: use the other account id
+        iban = _find_text(expressions, 'account_iban', element) or _find_text(expressions, 'account_other_id', element)
+        self.iban = iban.strip() if iban is not None else None
+
+    def get_currency(self):
+        """
+        Balance currency, account currency or currency of the first entry (default CHF)
+        """
+        if self.currency:
+            return self.currency
+        if self.entries:
+            return self.entries[0]['currency']
+        return "CHF"
+
+    def add_balance(self, element, expressions):
+        code = _find_text(expressions, 'balance_code', element)
+        amount_node = _find(expressions, 'balance_amount', element)
+        if code is None or amount_node is None:
+            return
+        try:
+            amount = float(_text(amount_node))
+        except ValueError:
+            return
+        if (_find_text(expressions, 'balance_credit_debit', element) or "").strip() == "DBIT":
+            amount = -amount
+        self.balances[code.strip()] = amount
+        if amount_node.get("Ccy") and not self.currency_from_balance:
+            # the balance currency takes precedence over the account currency
+            self.currency = amount_node.get("Ccy")
+            self.currency_from_balance = True
+        return
+
+def parse_entry(entry, expressions, use_entry_transaction_type=False, numeric_only_reference=False):
+    """
+    Read one <Ntry> element into an entry dict
+    """
+    # booking date
+    date = _find_text(expressions, 'booking_date', entry)
+    if date is None:
+        date_time = _find_text(expressions, 'booking_datetime', entry)
+        if date_time is not None:
+            date = date_time[:10]
+        else:
+            # not booked yet (e.g. camt.052 intraday): value date
+            date = _find_text(expressions, 'value_date', entry) or datetime.datetime.today().strftime("%Y-%m-%d")
+    # entry amount as fallback
+    amount_node = _find(expressions, 'amount', entry)
+    parsed_entry = {
+        'date': date,
+        'amount': float(_text(amount_node)),
+        'currency': amount_node.get("Ccy"),
+        'credit_debit': _find_text(expressions, 'credit_debit', entry),
+        'account_service_reference': _find_text(expressions, 'account_service_reference', entry),
+        'entry_reference': _find_text(expressions, 'entry_reference', entry),
+        'transaction_id': _find_text(expressions, 'transaction_id', entry),
+        'payment_instruction_id': _find_text(expressions, 'payment_instruction_id', entry),
+        'transactions': []
+    }
+
+    transactions = expressions['transactions'](entry)
+    if transactions:
+        for transaction_count, transaction in enumerate(transactions, 1):
+            parsed_entry['transactions'].append(parse_transaction(transaction, transaction_count,
+                parsed_entry, entry, expressions, use_entry_transaction_type, numeric_only_reference))
+    else:
+        # transaction without TxDtls: occurs at CS when transaction is from a pain.001 instruction
+        unique_reference = None
+        for key in ('account_service_reference', 'transaction_id', 'payment_instruction_id'):
+            if parsed_entry[key] is not None:
+                unique_reference = parsed_entry[key]
+                break
+        if unique_reference is None:
+            code = "{0}:{1}:{2}".format(date, parsed_entry['currency'], parsed_entry['amount'])
+            unique_reference = hashlib.md5(code.encode("utf-8")).hexdigest()
+        parsed_entry['unique_reference'] = unique_reference
+    return parsed_entry
+
+def parse_transaction(transaction, transaction_count, parsed_entry, entry, expressions,
+    use_entry_transaction_type=False, numeric_only_reference=False):
+    """
+    Read one <TxDtls> element into a transaction dict
+    """
+    # --- find transaction type: paid or received: (DBIT: paid, CRDT: received)
+    credit_debit = None
+    if not use_entry_transaction_type:
+        credit_debit = _find_text(expressions, 'credit_debit', transaction)
+    if credit_debit is None:
+        credit_debit = parsed_entry['credit_debit']
+
+    payment_instruction_id = _find_text(expressions, 'payment_instruction_id', transaction)
+
+    # --- find unique reference
+    unique_reference = _find_text(expressions, 'tx_account_service_reference', transaction)
+    if unique_reference is None:
+        # fallback: use tx id, then payment instruction id
+        unique_reference = _find_text(expressions, 'transaction_id', transaction)
+    if unique_reference is None:
+        unique_reference = payment_instruction_id
+    if unique_reference is None:
+        if parsed_entry['entry_reference'] is not None:
+            unique_reference = parsed_entry['entry_reference']
+        elif parsed_entry['account_service_reference']:
+            # fallback to group account service reference plus transaction_count
+            unique_reference = "{0}-{1}".format(parsed_entry['account_service_reference'], transaction_count)
+        else:
+            # fallback booking code (wise) (for banks this is often not unique)
+            unique_reference = _find_text(expressions, 'bank_transaction_code', entry)
+    if unique_reference is None:
+        # fallback to hash
+        code = "{0}:{1}:{2}".format(parsed_entry['date'],
+            _find_text(expressions, 'tx_plain_amount', transaction) or "",
+            _find_text(expressions, 'name', transaction) or "")
+        unique_reference = hashlib.md5(code.encode("utf-8")).hexdigest()
+
+    # --- find amount and currency (<TxAmt>, pure <Amt> or entry level)
+    amount = None
+    currency = None
+    for key in ('tx_amount', 'tx_plain_amount'):
+        amount_node = _find(expressions, key, transaction)
+        if amount_node is not None and amount_node.get("Ccy") is not None:
+            try:
+                amount = float(_text(amount_node))
+                currency = amount_node.get("Ccy")
+                break
+            except ValueError:
+                pass
+    if currency is None:
+        amount = parsed_entry['amount']
+        currency = parsed_entry['currency']
+
+    # --- find party
+    party_name, party_address, party_iban = parse_party(transaction, credit_debit, expressions)
+
+    # --- charges
+    try:
+        charges = float(_find_text(expressions, 'charges', transaction))
+    except (TypeError, ValueError):
+        charges = 0.0
+
+    # --- find reference: ESR, user-defined (e.g. SINV.), end-to-end ID or AddtlTxInf
+    transaction_reference = None
+    for key in ('structured_reference', 'unstructured_reference', 'end_to_end_id', 'additional_information'):
+        transaction_reference = _find_text(expressions, key, transaction)
+        if transaction_reference is not None:
+            break
+    if transaction_reference is None:
+        # in case of numeric only matching, do not fall back to transaction id
+        if numeric_only_reference:
+            transaction_reference = "???"
+        else:
+            transaction_reference = unique_reference
+
+    return {
+        'date': parsed_entry['date'],
+        'currency': currency,
+        'amount': amount,
+        'credit_debit': credit_debit,
+        'payment_instruction_id': payment_instruction_id,
+        'unique_reference': unique_reference,
+        'party_name': party_name,
+        'party_address': party_address,
+        'party_iban': party_iban,
+        'charges': charges,
+        'transaction_reference': transaction_reference
+    }
+
+def parse_party(transaction, credit_debit, expressions):
+    """
+    Read the counterparty of a transaction (DBIT: creditor, CRDT: debtor)
+
+    Returns a tuple (party_name, party_address, party_iban)
+    """
+    related_parties = _find(expressions, 'related_parties', transaction)
+    if related_parties is None:
+        # key related parties not found / no customer info
+        return "", "", ""
+    if credit_debit == "DBIT":
+        party = _find(expressions, 'creditor', related_parties)
+        party_iban = _find_text(expressions, 'creditor_iban', transaction) or ""
+    else:
+        party = _find(expressions, 'debtor', related_parties)
+        party_iban = _find_text(expressions, 'debtor_iban', transaction) or ""
+
+    address_line1 = ""
+    address_line2 = ""
+    party_name = _find_text(expressions, 'name', party)
+    address_lines = expressions['address_lines'](party) if party is not None else []
+    if party_name is not None:
+        street = _find_text(expressions, 'street', party)
+        if street is not None:
+            # parse by street name, ...
+            street_number = _find_text(expressions, 'building_number', party)
+            if street_number is not None:
+                address_line1 = "{0} {1}".format(street, street_number)
+            else:
+                address_line1 = street
+            address_line2 = "{0} {1}".format(
+                _find_text(expressions, 'postal_code', party) or "",
+                _find_text(expressions, 'town', party) or "")
+        elif len(address_lines) > 1:
+            # parse by address lines
+            address_line1 = _text(address_lines[0])
+            address_line2 = _text(address_lines[1])
+    elif address_lines:
+        # party is not defined (e.g. DBIT from Bank): fallback for ZKB which does not provide nm tag, but address line
+        party_name = _text(address_lines[0])
+    else:
+        party_name = "not found"
+
+    country = _find_text(expressions, 'country', party) or ""
+    if (address_line1 != "") and (address_line2 != ""):
+        party_address = "{0}, {1}, {2}".format(address_line1, address_line2, country)
+    elif (address_line1 != ""):
+        party_address = "{0}, {1}".format(address_line1, country)
+    else:
+        party_address = "{0}".format(country)
+    return party_name, party_address, party_iban
@@ -10,6 +10,7 @@ import ast
 from frappe.utils import cint
 from frappe.utils.data import rounded
 from erpnextswiss.erpnextswiss.finance import get_booking_pairs
+from erpnextswiss.erpnextswiss.utils import get_chunks
 from frappe import _
 from bs4 import BeautifulSoup
 
@@ -221,7 +222,7 @@ class AbacusExportFile(Document):
         return
         
     # prepare transfer file
-    def render_transfer_file(self, restrict_currencies=None):
+    def render_transfer_file(self, restrict_currencies=None, prefetch=True):
         if restrict_currencies and type(restrict_currencies) == str:
             restrict_currencies = ast.list_eval(restrict_currencies)
         # collect task information
@@ -234,7 +235,7 @@ class AbacusExportFile(Document):
         else:
             # normal method (each document)
             data = {
-                'transactions': self.get_individual_transactions(restrict_currencies)
+                'transactions': self.get_individual_transactions(restrict_currencies, prefetch=prefetch)
             }            
             
         
@@ -393,36 +394,17 @@ class AbacusExportFile(Document):
         return transactions
 
 
-    def get_individual_transactions(self, restrict_currencies=None):
+    def get_individual_transactions(self, restrict_currencies=None, prefetch=True):
         base_currency = frappe.get_value("Company", self.company, "default_currency")
         transactions = []
-        sinvs = self.get_docs([ref.__dict__ for ref in self.references], "Sales Invoice")
-        sql_query = """SELECT `tabSales Invoice`.`name`, 
-                  `tabSales Invoice`.`posting_date`, 
-                  `tabSales Invoice`.`currency`, 
-                  `tabSales Invoice`.`grand_total` AS `debit`, 
-                  `tabSales Invoice`.`base_grand_total` AS `base_debit`,
-                  `tabSales Invoice`.`debit_to`,
-                  `tabSales Invoice`.`net_total` AS `income`, 
-                  `tabSales Invoice`.`base_net_total` AS `base_income`,  
-                  `tabSales Invoice`.`base_total_taxes_and_charges` AS `tax`, 
-                  `tabSales Taxes and Charges`.`account_head`,
-                  `tabSales Invoice`.`taxes_and_charges`,
-                  `tabSales Taxes and Charges`.`rate`,
-                  `tabSales Invoice`.`customer_name`,
-                  `tabSales Invoice`.`conversion_rate`
-                FROM `tabSales Invoice`
-                LEFT JOIN `tabSales Taxes and Charges` ON (`tabSales Invoice`.`name` = `tabSales Taxes and Charges`.`parent` AND  `tabSales Taxes and Charges`.`idx` = 1)
-                WHERE `tabSales Invoice`.`name` IN ({sinvs});""".format(sinvs=self.get_sql_list(sinvs))
-        sinv_items = frappe.db.sql(sql_query, as_dict=True)    
-        for item in sinv_items:
+        data = AbacusExportData(self.references, prefetch=prefetch)
+        for item in data.sales_invoices:
             # if this is a zero-sum transaction, skip
             if item['debit'] == 0:
                 continue
                 
             if item.taxes_and_charges:
-                tax_record = frappe.get_doc("Sales Taxes and Charges Template", item.taxes_and_charges)
-                tax_code = tax_record.tax_code
+                tax_code = data.get_tax_code("Sales Taxes and Charges Template", item.taxes_and_charges)
             else:
                 tax_code = None
             # create content
@@ -432,18 +414,11 @@ class AbacusExportFile(Document):
                 text2 = ""
             # find against accounts
             against_positions = []
-            for account in frappe.db.sql("""
-                SELECT 
-                    `income_account`, 
-                    SUM(`base_net_amount`) AS `key_amount`, 
-                    SUM(`net_amount`) AS `amount`
-                FROM `tabSales Invoice Item`
-                WHERE `parent` = "{sinv}"
-                GROUP BY `income_account`;""".format(sinv=item.name), as_dict=True):
+            for account in data.get_item_accounts("Sales Invoice", item.name):
                 if account['amount']:               # only append non-zero entries
                     tax_amount = rounded((account['amount'] * (item.rate or 0) / 100), 2)
                     against_positions.append({
-                        'account': self.get_account_number(account['income_account']),
+                        'account': data.get_account_number(account['account']),
                         'amount': rounded(account['amount'], 2),
                         'currency': item.currency,
                         'key_amount': rounded(account['key_amount'], 2),
@@ -453,7 +428,7 @@ class AbacusExportFile(Document):
                     })
             
             _tx = {
-                'account': self.get_account_number(item.debit_to), 
+                'account': data.get_account_number(item.debit_to), 
                 'amount': rounded(item.base_debit, 2), 
                 'currency': base_currency, 
                 'key_amount': rounded(item.base_debit, 2), 
@@ -462,7 +437,7 @@ class AbacusExportFile(Document):
                 'against_singles': against_positions,
                 'debit_credit': "D", 
                 'date': item.posting_date, 
-                'tax_account': self.get_account_number(item.account_head) or None, 
+                'tax_account': data.get_account_number(item.account_head) or None, 
                 # 'tax_amount': item.tax or None,    # this takes the complete tax amount
                 # 'tax_amount': None,                  # calculate on the basis of the item
                 'tax_amount': (item.base_debit * (item.rate or 0) / 100),
@@ -480,33 +455,10 @@ class AbacusExportFile(Document):
             if item.base_debit != 0 or cint(self.exclude_zero_sum_txs) == 0:     # if exclude zero, do not add this component
                 transactions.append(totalise_key_currency(_tx))
              
-        
-        pinvs = self.get_docs([ref.__dict__ for ref in self.references], "Purchase Invoice")
-        sql_query = """SELECT `tabPurchase Invoice`.`name`, 
-                  `tabPurchase Invoice`.`posting_date`, 
-                  `tabPurchase Invoice`.`currency`, 
-                  `tabPurchase Invoice`.`grand_total` AS `credit`, 
-                  `tabPurchase Invoice`.`base_grand_total` AS `base_credit`,
-                  `tabPurchase Invoice`.`credit_to`,
-                  `tabPurchase Invoice`.`net_total` AS `expense`,
-                  `tabPurchase Invoice`.`base_net_total` AS `base_expense`, 
-                  `tabPurchase Invoice`.`base_total_taxes_and_charges` AS `tax`, 
-                  `tabPurchase Taxes and Charges`.`account_head`,
-                  `tabPurchase Invoice`.`taxes_and_charges`,
-                  `tabPurchase Taxes and Charges`.`rate`,
-                  `tabPurchase Invoice`.`supplier_name`,
-                  `tabPurchase Invoice`.`conversion_rate`
-                FROM `tabPurchase Invoice`
-                LEFT JOIN `tabPurchase Taxes and Charges` ON (`tabPurchase Invoice`.`name` = `tabPurchase Taxes and Charges`.`parent` AND  `tabPurchase Taxes and Charges`.`idx` = 1)
-                WHERE `tabPurchase Invoice`.`name` IN ({pinvs});""".format(pinvs=self.get_sql_list(pinvs))
-        
-        pinv_items = frappe.db.sql(sql_query, as_dict=True)
-
-        for item in pinv_items:
+        for item in data.purchase_invoices:
             # create item entries
             if item.taxes_and_charges:
-                tax_record = frappe.get_doc("Purchase Taxes and Charges Template", item.taxes_and_charges)
-                tax_code = tax_record.tax_code
+                tax_code = data.get_tax_code("Purchase Taxes and Charges Template", item.taxes_and_charges)
             else:
                 tax_code = None
             
@@ -517,17 +469,10 @@ class AbacusExportFile(Document):
             
             # find against accounts
             against_positions = []
-            for account in frappe.db.sql("""
-                SELECT 
-                    `expense_account`, 
-                    SUM(`base_net_amount`) AS `key_amount`, 
-                    SUM(`net_amount`) AS `amount`
-                FROM `tabPurchase Invoice Item`
-                WHERE `parent` = "{pinv}"
-                GROUP BY `expense_account`;""".format(pinv=item.name), as_dict=True):
+            for account in data.get_item_accounts("Purchase Invoice", item.name):
                 tax_amount = rounded((account['amount'] * (item.rate or 0) / 100), 2)
                 against_positions.append({
-                    'account': self.get_account_number(account['expense_account']),
+                    'account': data.get_account_number(account['account']),
                     'amount': rounded(account['amount'], 2),
                     'currency': item.currency,
                     'key_amount': rounded(account['key_amount'], 2),
@@ -537,7 +482,7 @@ class AbacusExportFile(Document):
                 })
             # create content
             _tx = {
-                'account': self.get_account_number(item.credit_to), 
+                'account': data.get_account_number(item.credit_to), 
                 'amount': rounded(item.base_credit, 2), 
                 'key_amount': rounded(item.base_credit, 2), 
                 'key_currency': base_currency,
@@ -546,7 +491,7 @@ class AbacusExportFile(Document):
                 'debit_credit': "C", 
                 'date': item.posting_date, 
                 'currency': base_currency, 
-                'tax_account': self.get_account_number(item.account_head) or None, 
+                'tax_account': data.get_account_number(item.account_head) or None, 
                 # 'tax_amount': item.tax or None,    # this takes the complete tax amount
                 # 'tax_amount': None,                  # calculate on the basis of the item
                 # 'tax_amount': (item.base_credit * (item.rate or 0) / 100),
@@ -565,27 +510,18 @@ class AbacusExportFile(Document):
                 transactions.append(totalise_key_currency(_tx))
             
         # add payment entry transactions
-        pes = self.get_docs([ref.__dict__ for ref in self.references], "Payment Entry")
-        sql_query = """SELECT `tabPayment Entry`.`name`
-                    FROM `tabPayment Entry`
-                    WHERE`tabPayment Entry`.`name` IN ({pes})
-            """.format(pes=self.get_sql_list(pes))
-
-        pe_items = frappe.db.sql(sql_query, as_dict=True)
-        
-        # create item entries
-        for item in pe_items:
-            pe_record = frappe.get_doc("Payment Entry", item.name)
+        for item in data.payment_entries:
+            pe_record = data.get_payment_entry(item.name)
             if pe_record.payment_type == "Pay":
                 debit_credit = "C"
             else:
                 debit_credit = "D"
             # create content
             transaction = {
-                'account': self.get_account_number(pe_record.paid_to),  # bank
+                'account': data.get_account_number(pe_record.paid_to),  # bank
                 'amount': rounded(pe_record.paid_amount, 2), 
                 'against_singles': [{
-                    'account': self.get_account_number(pe_record.paid_from),    # debtor
+                    'account': data.get_account_number(pe_record.paid_from),    # debtor
                     'amount': rounded(pe_record.total_allocated_amount, 2),
                     'currency': pe_record.paid_from_account_currency,
                     'key_currency': base_currency,
@@ -609,7 +545,7 @@ class AbacusExportFile(Document):
                 if frappe.get_cached_value("Account", deduction.account, 'root_type') in ['Asset', 'Expense']:
                     sign = (-1)
                 transaction['against_singles'].append({
-                    'account': self.get_account_number(deduction.account),
+                    'account': data.get_account_number(deduction.account),
                     'amount': rounded(sign * (deduction.amount / pe_record.source_exchange_rate), 2),    # virtual valuation to other currency
                     'currency': pe_record.paid_to_account_currency,
                     'key_amount': rounded(sign * deduction.amount, 2),
@@ -631,17 +567,8 @@ class AbacusExportFile(Document):
             transactions.append(transaction)  
 
         # add journal entry transactions
-        jvs = self.get_docs([ref.__dict__ for ref in self.references], "Journal Entry")
-        sql_query = """SELECT `tabJournal Entry`.`name`
-                    FROM `tabJournal Entry`
-                    WHERE`tabJournal Entry`.`name` IN ({jvs})
-            """.format(jvs=self.get_sql_list(jvs))
-
-        jv_items = frappe.db.sql(sql_query, as_dict=True)
-        
-        # create item entries
-        for item in jv_items:
-            jv_record = frappe.get_doc("Journal Entry", item.name)
+        for item in data.journal_entries:
+            jv_record = data.get_journal_entry(item.name)
             key_currency = frappe.get_cached_value("Company", jv_record.company, "default_currency")
             if jv_record.accounts[0].debit_in_account_currency != 0:
                 debit_credit = "D"
@@ -653,7 +580,7 @@ class AbacusExportFile(Document):
                 key_amount = jv_record.accounts[0].credit
             # create content
             transaction = {
-                'account': self.get_account_number(jv_record.accounts[0].account), 
+                'account': data.get_account_number(jv_record.accounts[0].account), 
                 'amount': rounded(amount, 2), 
                 'against_singles': [],
                 'debit_credit': debit_credit, 
@@ -679,7 +606,7 @@ class AbacusExportFile(Document):
                     amount = jv_record.accounts[i].debit_in_account_currency - jv_record.accounts[i].credit_in_account_currency
                     key_amount = jv_record.accounts[i].debit - jv_record.accounts[i].credit
                 transaction_single = {
-                    'account': self.get_account_number(jv_record.accounts[i].account),
+                    'account': data.get_account_number(jv_record.accounts[i].account),
                     'amount': rounded(amount, 2),
                     'currency': jv_record.accounts[i].account_currency,
                     'key_currency': key_currency,
@@ -693,6 +620,198 @@ class AbacusExportFile(Document):
             transactions.append(transaction)  
                     
         return transactions        
+
+"""
+Data source of the individual transactions: loads the referenced documents and, 
+with prefetch, their item accounts, tax templates, payment and journal entries 
+and account numbers in a few chunked queries instead of one query per document. 
+Without prefetch, every lookup runs its own query (per-document behaviour; 
+used to verify that both produce the same transfer file)
+"""
+class AbacusExportData:
+    PAYMENT_ENTRY_FIELDS = ['name', 'payment_type', 'posting_date', 'paid_from', 'paid_to', 
+        'paid_from_account_currency', 'paid_to_account_currency', 'paid_amount', 'base_paid_amount', 
+        'total_allocated_amount', 'base_total_allocated_amount', 'source_exchange_rate']
+    JOURNAL_ENTRY_FIELDS = ['name', 'company', 'posting_date', 'multi_currency']
+    JOURNAL_ENTRY_ACCOUNT_FIELDS = ['parent', 'account', 'account_currency', 'exchange_rate', 
+        'debit_in_account_currency', 'credit_in_account_currency', 'debit', 'credit']
+    
+    def __init__(self, references, prefetch=True):
+        self.prefetch = prefetch
+        self.references = {}
+        for r in references:
+            self.references.setdefault(r.get('dt'), []).append(r.get('dn'))
+        self.item_accounts = {}
+        self.tax_codes = {}
+        self.payment_entry_records = {}
+        self.journal_entry_records = {}
+        self.account_numbers = {}
+        
+        self.sales_invoices = self.load_invoices("Sales Invoice")
+        self.purchase_invoices = self.load_invoices("Purchase Invoice")
+        self.payment_entries = self.load_names("Payment Entry")
+        self.journal_entries = self.load_names("Journal Entry")
+        
+        if prefetch:
+            self.load_item_accounts("Sales Invoice", [i.name for i in self.sales_invoices])
+            self.load_item_accounts("Purchase Invoice", [i.name for i in self.purchase_invoices])
+            self.load_tax_codes("Sales Taxes and Charges Template", [i.taxes_and_charges for i in self.sales_invoices])
+            self.load_tax_codes("Purchase Taxes and Charges Template", [i.taxes_and_charges for i in self.purchase_invoices])
+            self.load_payment_entries([i.name for i in self.payment_entries])
+            self.load_journal_entries([i.name for i in self.journal_entries])
+            self.load_account_numbers()
+        return
+    
+    def load_invoices(self, dt):
+        if dt == "Sales Invoice":
+            amount_fields = """`tabSales Invoice`.`grand_total` AS `debit`, 
+                  `tabSales Invoice`.`base_grand_total` AS `base_debit`,
+                  `tabSales Invoice`.`debit_to`,
+                  `tabSales Invoice`.`net_total` AS `income`, 
+                  `tabSales Invoice`.`base_net_total` AS `base_income`,"""
+            tax_table = "Sales Taxes and Charges"
+            party_field = "customer_name"
+        else:
+            amount_fields = """`tabPurchase Invoice`.`grand_total` AS `credit`, 
+                  `tabPurchase Invoice`.`base_grand_total` AS `base_credit`,
+                  `tabPurchase Invoice`.`credit_to`,
+                  `tabPurchase Invoice`.`net_total` AS `expense`,
+                  `tabPurchase Invoice`.`base_net_total` AS `base_expense`,"""
+            tax_table = "Purchase Taxes and Charges"
+            party_field = "supplier_name"
+        sql_query = """SELECT `tab{dt}`.`name`, 
+                  `tab{dt}`.`posting_date`, 
+                  `tab{dt}`.`currency`, 
+                  {amount_fields}
+                  `tab{dt}`.`base_total_taxes_and_charges` AS `tax`, 
+                  `tab{tax_table}`.`account_head`,
+                  `tab{dt}`.`taxes_and_charges`,
+                  `tab{tax_table}`.`rate`,
+                  `tab{dt}`.`{party_field}`,
+                  `tab{dt}`.`conversion_rate`
+                FROM `tab{dt}`
+                LEFT JOIN `tab{tax_table}` ON (`tab{dt}`.`name` = `tab{tax_table}`.`parent` AND  `tab{tax_table}`.`idx` = 1)
+                WHERE `tab{dt}`.`name` IN ({docs});""".format(dt=dt, amount_fields=amount_fields, 
+                    tax_table=tax_table, party_field=party_field, docs=self.get_sql_list(dt))
+        return frappe.db.sql(sql_query, as_dict=True)
+    
+    def load_names(self, dt):
+        sql_query = """SELECT `tab{dt}`.`name`
+                    FROM `tab{dt}`
+                    WHERE`tab{dt}`.`name` IN ({docs})
+            """.format(dt=dt, docs=self.get_sql_list(dt))
+        return frappe.db.sql(sql_query, as_dict=True)
+    
+    def get_sql_list(self, dt):
+        docs = self.references.get(dt)
+        if docs:
+            return (','.join('"{0}"'.format(w) for w in docs))
+        else:
+            return '""'
+    
+    def get_account_field(self, dt):
+        return "income_account" if dt == "Sales Invoice" else "expense_account"
+    
+    # item amounts per income/expense account (grouped by account, as in the per-document query)
+    def load_item_accounts(self, dt, invoices):
+        for chunk in get_chunks(invoices):
+            for row in frappe.db.sql("""
+                SELECT 
+                    `parent`,
+                    `{account_field}` AS `account`, 
+                    SUM(`base_net_amount`) AS `key_amount`, 
+                    SUM(`net_amount`) AS `amount`
+                FROM `tab{dt} Item`
+                WHERE `parent` IN %(invoices)s
+                GROUP BY `parent`, `{account_field}`
+                ORDER BY `parent`, `{account_field}`;""".format(dt=dt, account_field=self.get_account_field(dt)), 
+                {'invoices': tuple(chunk)}, as_dict=True):
+                self.item_accounts.setdefault((dt, row.parent), []).append(row)
+        return
+    
+    def get_item_accounts(self, dt, invoice):
+        if self.prefetch:
+            return self.item_accounts.get((dt, invoice), [])
+        return frappe.db.sql("""
+            SELECT 
+                `{account_field}` AS `account`, 
+                SUM(`base_net_amount`) AS `key_amount`, 
+                SUM(`net_amount`) AS `amount`
+            FROM `tab{dt} Item`
+            WHERE `parent` = %(invoice)s
+            GROUP BY `{account_field}`;""".format(dt=dt, account_field=self.get_account_field(dt)), 
+            {'invoice': invoice}, as_dict=True)
+    
+    def load_tax_codes(self, template_dt, templates):
+        for chunk in get_chunks(set(t for t in templates if t)):
+            for t in frappe.get_all(template_dt, filters={'name': ['in', chunk]}, fields=['name', 'tax_code']):
+                self.tax_codes[(template_dt, t.name)] = t.tax_code
+        return
+    
+    def get_tax_code(self, template_dt, template):
+        if (template_dt, template) in self.tax_codes:
+            return self.tax_codes[(template_dt, template)]
+        # not prefetched: a missing template raises as before
+        return frappe.get_doc(template_dt, template).tax_code
+    
+    def load_payment_entries(self, payment_entries):
+        for chunk in get_chunks(payment_entries):
+            for pe in frappe.get_all("Payment Entry", filters={'name': ['in', chunk]}, fields=self.PAYMENT_ENTRY_FIELDS):
+                pe.deductions = []
+                self.payment_entry_records[pe.name] = pe
+            for deduction in frappe.get_all("Payment Entry Deduction", 
+                    filters={'parent': ['in', chunk], 'parenttype': "Payment Entry"},
+                    fields=['parent', 'account', 'amount'], order_by="parent, idx"):
+                self.payment_entry_records[deduction.parent].deductions.append(deduction)
+        return
+    
+    def get_payment_entry(self, payment_entry):
+        return self.payment_entry_records.get(payment_entry) or frappe.get_doc("Payment Entry", payment_entry)
+    
+    def load_journal_entries(self, journal_entries):
+        for chunk in get_chunks(journal_entries):
+            for jv in frappe.get_all("Journal Entry", filters={'name': ['in', chunk]}, fields=self.JOURNAL_ENTRY_FIELDS):
+                jv.accounts = []
+                self.journal_entry_records[jv.name] = jv
+            for account in frappe.get_all("Journal Entry Account", 
+                    filters={'parent': ['in', chunk], 'parenttype': "Journal Entry"},
+                    fields=self.JOURNAL_ENTRY_ACCOUNT_FIELDS, order_by="parent, idx"):
+                self.journal_entry_records[account.parent].accounts.append(account)
+        return
+    
+    def get_journal_entry(self, journal_entry):
+        return self.journal_entry_records.get(journal_entry) or frappe.get_doc("Journal Entry", journal_entry)
+    
+    # account numbers of all accounts used by the prefetched documents
+    def load_account_numbers(self):
+        accounts = set()
+        for i in self.sales_invoices:
+            accounts.update([i.debit_to, i.account_head])
+        for i in self.purchase_invoices:
+            accounts.update([i.credit_to, i.account_head])
+        for rows in self.item_accounts.values():
+            accounts.update(r.account for r in rows)
+        for pe in self.payment_entry_records.values():
+            accounts.update([pe.paid_from, pe.paid_to])
+            accounts.update(d.account for d in pe.deductions)
+        for jv in self.journal_entry_records.values():
+            accounts.update(a.account for a in jv.accounts)
+        accounts.discard(None)
+        accounts.discard("")
+        for chunk in get_chunks(accounts):
+            for a in frappe.get_all("Account", filters={'name': ['in', chunk]}, fields=['name', 'account_number']):
+                self.account_numbers[a.name] = a.account_number
+        # accounts that do not exist have no number
+        for account in accounts:
+            self.account_numbers.setdefault(account, None)
+        return
+    
+    def get_account_number(self, account_name):
+        if not account_name:
+            return None
+        if account_name in self.account_numbers:
+            return self.account_numbers[account_name]
+        return frappe.get_value("Account", account_name, "account_number")
         
 def set_export_flag(dt, docs, exported):
     update_query = """
@@ -3,8 +3,15 @@
 # See license.txt
 from __future__ import unicode_literals
 
-# import frappe
+import frappe
 import unittest
 
 class TestAbacusExportFile(unittest.TestCase):
-	pass
+	def test_prefetched_transfer_file_is_identical(self):
+		for export_file in frappe.get_all("Abacus Export File", filters={'aggregated': 0, 'docstatus': 1}, 
+				order_by="creation DESC", limit=5):
+			doc = frappe.get_doc("Abacus Export File", export_file.name)
+			self.assertEqual(
+				doc.render_transfer_file(prefetch=True).get('content'),
+				doc.render_transfer_file(prefetch=False).get('content')
+			)
@@ -6,6 +6,7 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import cint
 from frappe import _
+from erpnextswiss.erpnextswiss.caldav import clear_feeds
 
 class CalDavFeed(Document):
     def before_save(self):
@@ -32,4 +33,8 @@ class CalDavFeed(Document):
                 self.todo_secret = frappe.generate_hash(self.doctype, 20)
         
         return
-        
+
+    def on_update(self):
+        # source, field or secrets might have changed
+        clear_feeds()
+        return
@@ -7,12 +7,13 @@ import frappe
 from frappe.model.document import Document
 from datetime import datetime
 import time
-import html          # used to escape xml content
 from frappe import _
 from frappe.utils.data import get_url_to_form
 from frappe.utils import cint
 from unidecode import unidecode
 from erpnextswiss.erpnextswiss.xml_utils import validate_xml_against_xsd
+from erpnextswiss.erpnextswiss.pain_writer import PainWriter, PAIN008_CH_03, PAIN008_02, PAIN008_08, format_amount
+from erpnextswiss.erpnextswiss.utils import get_chunks
 import os
 
 XML_SCHEMA_FILES = {
@@ -141,135 +142,93 @@ class DirectDebitProposal(Document):
         return inserted_payment_entry
             
     def create_bank_file(self):
-        # create xml header
-        content = make_line("<?xml version=\"1.0\" encoding=\"UTF-8\"?>")
-        # define xml template reference
         # load namespace based on banking region
         settings = frappe.get_doc("ERPNextSwiss Settings", "ERPNextSwiss Settings")
         xml_version = settings.get("xml_version")
         banking_region = settings.get("banking_region")
         if xml_version == "09":
-            content += make_line("<Document xmlns=\"urn:iso:std:iso:20022:tech:xsd:pain.008.001.08\" xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\" xsi:schemaLocation=\"urn:iso:std:iso:20022:tech:xsd:pain.008.001.08 pain.008.001.08.xsd\">")
+            schema = PAIN008_08
         elif banking_region == "AT":
-            content += make_line("<Document xmlns=\"urn:iso:std:iso:20022:tech:xsd:pain.008.001.02\" xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\" xsi:schemaLocation=\"urn:iso:std:iso:20022:tech:xsd:pain.008.001.02 pain.008.001.02.xsd\">")
+            schema = PAIN008_02
         else:
-            content += make_line("<Document xmlns=\"http://www.six-interbank-clearing.com/de/pain.008.001.03.ch.02.xsd\" xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\" xsi:schemaLocation=\"http://www.six-interbank-clearing.com/de/pain.008.001.03.ch.02.xsd  pain.008.001.03.ch.02.xsd\">")
-        # transaction holder
-        content += make_line("  <CstmrDrctDbtInitn>")
-        ### Group Header (GrpHdr, A-Level)
-        # create group header
-        content += make_line("    <GrpHdr>")
-        # message ID (unique, SWIFT-characters only)
-        content += make_line("      <MsgId>MSG-" + time.strftime("%Y%m%d%H%M%S") + "</MsgId>")
-        # creation date and time ( e.g. 2010-02-15T07:30:00 )
-        content += make_line("      <CreDtTm>" + time.strftime("%Y-%m-%dT%H:%M:%S") + "</CreDtTm>")
-        # number of transactions in the file
-        transaction_count = 0
-        transaction_count_identifier = "<!-- $COUNT -->"
-        content += make_line("      <NbOfTxs>" + transaction_count_identifier + "</NbOfTxs>")
-        # total amount of all transactions ( e.g. 15850.00 )  (sum of all amounts)
-        control_sum = 0.0
-        control_sum_identifier = "<!-- $CONTROL_SUM -->"
-        content += make_line("      <CtrlSum>" + control_sum_identifier + "</CtrlSum>")
-        # initiating party requires at least name or identification
-        content += make_line("      <InitgPty>")
-        # initiating party name ( e.g. MUSTER AG )
+            schema = PAIN008_CH_03
         company_name = get_company_name(self.sales_invoices[0].sales_invoice)
-        content += make_line("        <Nm>{0}</Nm>".format(html.escape(company_name)))
-        content += make_line("      </InitgPty>")
-        content += make_line("    </GrpHdr>")
-        
         # get participation ID
         participation_number = frappe.get_value("ERPNextSwiss Settings", "ERPNextSwiss Settings", "participant_number")
-        ### level B
         company_account = frappe.get_doc('Account', self.receive_to_account)
-        content += make_line("    <PmtInf>")
-        content += make_line("     <PmtInfId>{0}</PmtInfId>".format(self.name))
-        content += make_line("     <PmtMtd>DD</PmtMtd>")
-        content += make_line("     <PmtTpInf>")
-        content += make_line("      <SvcLvl>")
-        content += make_line("       <Cd>SEPA</Cd>")
-        content += make_line("      </SvcLvl>")
-        content += make_line("      <LclInstrm>")
-        content += make_line("       <Cd>CORE</Cd>")
-        content += make_line("      </LclInstrm>")
-        content += make_line("      <SeqTp>RCUR</SeqTp>")
-        content += make_line("     </PmtTpInf>")
-        content += make_line("     <ReqdColltnDt>{0}</ReqdColltnDt>".format(self.date))
-        content += make_line("     <Cdtr>")
-        content += make_line("      <Nm>{0}</Nm>".format(html.escape(company_name)))
-        content += make_line("     </Cdtr>")
-        content += make_line("     <CdtrAcct>")
-        content += make_line("      <Id>")
-        content += make_line("       <IBAN>{0}</IBAN>".format(company_account.iban.replace(" ", "")))
-        content += make_line("      </Id>")
-        content += make_line("     </CdtrAcct>")
-        content += make_line("     <CdtrAgt>")
-        content += make_line("      <FinInstnId>")
-        content += make_line("       <BIC>{0}</BIC>".format(company_account.bic))
-        content += make_line("      </FinInstnId>")
-        content += make_line("     </CdtrAgt>")
-        content += make_line("     <ChrgBr>SLEV</ChrgBr>")
+        # debtor mandates and bank details of all customers at once
+        customers = {}
+        for chunk in get_chunks(set(p.customer for p in self.payments)):
+            for c in frappe.get_all("Customer", filters={'name': ['in', chunk]}, 
+                    fields=['name', 'customer_name', 'lsv_code', 'lsv_date', 'bic', 'iban']):
+                customers[c.name] = c
+        # make sure there are no extra decimals, this would fail the validation
+        control_sum = sum(round(payment.amount, 2) for payment in self.payments)
         
-        # payments
-        for payment in self.payments:
-            transaction_count += 1
-            customer = frappe.get_doc("Customer", payment.customer)
-            content += make_line("<DrctDbtTxInf>")
-            content += make_line(" <PmtId>")
-            content += make_line("  <InstrId>SEPA1-{0}-{1}</InstrId>".format(self.date, transaction_count))
-            content += make_line("  <EndToEndId>{0}-{1}</EndToEndId>".format(self.name, transaction_count))
-            content += make_line(" </PmtId>")
-            rounded_amount = round(payment.amount, 2)  # make sure there are no extra decimals, this would fail the validation
-            content += make_line(" <InstdAmt Ccy=\"{0}\">{1}</InstdAmt>".format(payment.currency, rounded_amount))
-            control_sum += rounded_amount
-            content += make_line(" <DrctDbtTx>")
-            content += make_line("  <MndtRltdInf>")
-            content += make_line("   <MndtId>{0}</MndtId>".format(customer.lsv_code))
-            content += make_line("   <DtOfSgntr>{0}</DtOfSgntr>".format(customer.lsv_date))
-            content += make_line("   <AmdmntInd>false</AmdmntInd>")
-            content += make_line("  </MndtRltdInf>")
-            content += make_line("  <CdtrSchmeId>")
-            content += make_line("   <Id>")
-            content += make_line("    <PrvtId>")
-            content += make_line("     <Othr>")
-            content += make_line("      <Id>{0}</Id>".format(participation_number))
-            content += make_line("      <SchmeNm>")
-            content += make_line("       <Prtry>SEPA</Prtry>")
-            content += make_line("      </SchmeNm>")
-            content += make_line("     </Othr>")
-            content += make_line("    </PrvtId>")
-            content += make_line("   </Id>")
-            content += make_line("  </CdtrSchmeId>")
-            content += make_line(" </DrctDbtTx>")
-            content += make_line(" <DbtrAgt>")
-            content += make_line("  <FinInstnId>")
-            if xml_version == "09":
-                content += make_line("    <Othr><Id>NOTPROVIDED</Id></Othr>")
-            else:
-                content += make_line("    <BIC>{0}</BIC>".format(customer.bic))
-            content += make_line("  </FinInstnId>")
-            content += make_line(" </DbtrAgt>")
-            content += make_line(" <Dbtr>")
-            content += make_line("  <Nm>{0}</Nm>".format(html.escape(customer.customer_name)))
-            content += make_line(" </Dbtr>")
-            content += make_line(" <DbtrAcct>")
-            content += make_line("  <Id>")
-            content += make_line("   <IBAN>{0}</IBAN>".format(customer.iban.replace(" ", "")))
-            content += make_line("  </Id>")
-            content += make_line(" </DbtrAcct>")
-            content += make_line(" <RmtInf>")
-            content += make_line("  <Ustrd>{0}</Ustrd>".format(payment.reference))
-            content += make_line(" </RmtInf>")
-            content += make_line("</DrctDbtTxInf>")
-      
-        # add footer
-        content += make_line("    </PmtInf>")
-        content += make_line("  </CstmrDrctDbtInitn>")
-        content += make_line("</Document>")
-        # insert control numbers
-        content = content.replace(transaction_count_identifier, "{0}".format(transaction_count))
-        content = content.replace(control_sum_identifier, "{:.2f}".format(control_sum))
+        with PainWriter(schema, "CstmrDrctDbtInitn") as writer:
+            ### Group Header (GrpHdr, A-Level)
+            writer.group_header(
+                msg_id="MSG-" + time.strftime("%Y%m%d%H%M%S"),      # message ID (unique, SWIFT-characters only)
+                transaction_count=len(self.payments),
+                control_sum=control_sum,
+                initiating_party=company_name
+            )
+            ### level B
+            with writer.block("PmtInf"):
+                writer.element("PmtInfId", self.name)
+                writer.element("PmtMtd", "DD")
+                with writer.block("PmtTpInf"):
+                    with writer.block("SvcLvl"):
+                        writer.element("Cd", "SEPA")
+                    with writer.block("LclInstrm"):
+                        writer.element("Cd", "CORE")
+                    writer.element("SeqTp", "RCUR")
+                writer.element("ReqdColltnDt", self.date)
+                with writer.block("Cdtr"):
+                    writer.element("Nm", company_name)
+                with writer.block("CdtrAcct"):
+                    with writer.block("Id"):
+                        writer.element("IBAN", company_account.iban.replace(" ", ""))
+                with writer.block("CdtrAgt"):
+                    with writer.block("FinInstnId"):
+                        writer.element("BIC", company_account.bic)
+                writer.element("ChrgBr", "SLEV")
+                
+                # payments (C-level)
+                for transaction_count, payment in enumerate(self.payments, 1):
+                    customer = customers.get(payment.customer) or frappe.get_doc("Customer", payment.customer)
+                    with writer.block("DrctDbtTxInf"):
+                        with writer.block("PmtId"):
+                            writer.element("InstrId", "SEPA1-{0}-{1}".format(self.date, transaction_count))
+                            writer.element("EndToEndId", "{0}-{1}".format(self.name, transaction_count))
+                        writer.element("InstdAmt", format_amount(round(payment.amount, 2)), Ccy=payment.currency)
+                        with writer.block("DrctDbtTx"):
+                            with writer.block("MndtRltdInf"):
+                                writer.element("MndtId", customer.lsv_code)
+                                writer.element("DtOfSgntr", customer.lsv_date)
+                                writer.element("AmdmntInd", "false")
+                            with writer.block("CdtrSchmeId"):
+                                with writer.block("Id"):
+                                    with writer.block("PrvtId"):
+                                        with writer.block("Othr"):
+                                            writer.element("Id", participation_number)
+                                            with writer.block("SchmeNm"):
+                                                writer.element("Prtry", "SEPA")
+                        with writer.block("DbtrAgt"):
+                            with writer.block("FinInstnId"):
+                                if xml_version == "09":
+                                    with writer.block("Othr"):
+                                        writer.element("Id", "NOTPROVIDED")
+                                else:
+                                    writer.element("BIC", customer.bic)
+                        with writer.block("Dbtr"):
+                            writer.element("Nm", customer.customer_name)
+                        with writer.block("DbtrAcct"):
+                            with writer.block("Id"):
+                                writer.element("IBAN", (customer.iban or "").replace(" ", ""))
+                        with writer.block("RmtInf"):
+                            writer.element("Ustrd", payment.reference)
+        content = writer.getvalue()
         
         # use unicode if enabled (this will decode utf-8 to ascii)
         if cint(settings.get("use_unidecode")) == 1:
@@ -337,9 +296,3 @@ def create_direct_debit_proposal(company=None):
         new_record = proposal_record.name
         frappe.db.commit()
     return get_url_to_form("Direct Debit Proposal", new_record) if new_record else None
-
-# adds Windows-compatible line endings (to make the xml look nice)    
-def make_line(line):
-    return line + "\r\n"
-
-
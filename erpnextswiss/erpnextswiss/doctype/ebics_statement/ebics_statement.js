@@ -3,66 +3,48 @@
 
 frappe.ui.form.on('ebics Statement', {
     refresh: function(frm) {
-        // Debug logging
-        console.log(`ebics Statement refresh - ${frm.doc.name}: ${frm.doc.transactions ? frm.doc.transactions.length : 0} transactions, status: ${frm.doc.status}`);
-        // Add flag to prevent infinite loop
-        if (frm._reloading) {
-            return;
+        let onload = frm.doc.__onload || {};
+        frm.transaction_totals = onload.transaction_totals || null;
+        frm.invoice_count = onload.invoice_count || 0;
+        
+        // Ensure transactions are visible even if empty
+        if (!frm.doc.transactions) {
+            frm.doc.transactions = [];
         }
         
-        // If document exists but transactions are not loaded, fetch them
-        if (!frm.is_new() && (!frm.doc.transactions || frm.doc.transactions.length === 0)) {
-            frappe.call({
-                method: 'erpnextswiss.erpnextswiss.doctype.ebics_statement.ebics_statement.get_transactions',
-                args: {
-                    docname: frm.doc.name
-                },
-                callback: function(r) {
-                    if (r.message && r.message.success && r.message.transactions.length > 0) {
-                        console.log(`Loaded ${r.message.transactions.length} transactions from server`);
-                        frm.doc.transactions = r.message.transactions;
-                        frm.refresh_field('transactions');
-                        
-                        // Re-run the display functions with loaded transactions
-                        check_display_bank_wizard(frm);
-                        show_linked_documents(frm);
-                    } else {
-                        console.log("No transactions found in database");
-                        frm.doc.transactions = [];
-                        
-                        // If we have XML content but no transactions, automatically re-parse
-                        if (frm.doc.xml_content) {
-                            console.log("XML content found but no transactions - automatically re-parsing...");
-                            frappe.call({
-                                method: 'erpnextswiss.erpnextswiss.doctype.ebics_statement.ebics_statement.reparse_xml',
-                                args: {
-                                    docname: frm.doc.name
-                                },
-                                callback: function(r) {
-                                    if (r.message && r.message.success) {
-                                        frappe.show_alert({
-                                            message: __('Transactions automatically loaded from XML: {0} transactions found.', [r.message.transaction_count]),
-                                            indicator: 'green'
-                                        });
-                                        frm._reloading = true;
-                                        frm.reload_doc();
-                                    } else {
-                                        frappe.show_alert({
-                                            message: __('Error loading transactions from XML: {0}', [r.message.message || 'Unknown error']),
-                                            indicator: 'red'
-                                        });
-                                    }
-                                }
+        if (is_lazy(frm)) {
+            // large statement: the rows are not loaded with the form, fetch them page by page
+            frm.set_df_property('transactions', 'hidden', 1);
+            render_transaction_browser(frm);
+        } else {
+            frm.set_df_property('transactions', 'hidden', 0);
+            frm.fields_dict.transactions_html.$wrapper.empty();
+            
+            // If we have XML content but no transactions, automatically re-parse
+            if (!frm.is_new() && frm.doc.transactions.length === 0 && frm.doc.xml_content && !frm._reloading) {
+                console.log("XML content found but no transactions - automatically re-parsing...");
+                frappe.call({
+                    method: 'erpnextswiss.erpnextswiss.doctype.ebics_statement.ebics_statement.reparse_xml',
+                    args: {
+                        docname: frm.doc.name
+                    },
+                    callback: function(r) {
+                        if (r.message && r.message.success) {
+                            frappe.show_alert({
+                                message: __('Transactions automatically loaded from XML: {0} transactions found.', [r.message.transaction_count]),
+                                indicator: 'green'
+                            });
+                            frm._reloading = true;
+                            frm.reload_doc();
+                        } else {
+                            frappe.show_alert({
+                                message: __('Error loading transactions from XML: {0}', [r.message.message || 'Unknown error']),
+                                indicator: 'red'
                             });
                         }
                     }
-                }
-            });
-        }
-        
-        // Ensure transactions are visible even if empty
-        if (!frm.doc.transactions) {
-            frm.doc.transactions = [];
+                });
+            }
         }
         
         check_display_bank_wizard(frm);
@@ -71,19 +53,167 @@ frappe.ui.form.on('ebics Statement', {
     }
 });
 
+function is_lazy(frm) {
+    return (frm.doc.__onload && frm.doc.__onload.lazy_transactions) ? true : false;
+}
+
 function check_display_bank_wizard(frm) {
-    if (frm.doc.transactions) {
-        for (let i = 0; i < frm.doc.transactions.length; i++) {
-            if (frm.doc.transactions[i].status === "Pending") {
-                frm.add_custom_button(__("Bank Wizard"), function() {
-                    start_bank_wizard();
-                });
-                break;
-            }
-        }
+    let has_pending = false;
+    if (is_lazy(frm) && frm.transaction_totals) {
+        has_pending = frm.transaction_totals.pending > 0;
+    } else if (frm.doc.transactions) {
+        has_pending = frm.doc.transactions.some(t => t.status === "Pending");
+    }
+    // while the auto posting job writes the rows, the form must not change them
+    let is_posting = (frm.doc.auto_posting_status === "Queued" || frm.doc.auto_posting_status === "Running");
+    if (has_pending && !is_posting) {
+        frm.add_custom_button(__("Bank Wizard"), function() {
+            start_bank_wizard();
+        });
+        frm.add_custom_button(__("Auto Post Matches"), function() {
+            start_auto_posting(frm);
+        });
     }
 }
 
+function render_transaction_browser(frm) {
+    let wrapper = frm.fields_dict.transactions_html.$wrapper;
+    wrapper.html(`
+        <div class="row transaction-filters" style="margin-bottom: 10px;">
+            <div class="col-sm-2">
+                <select class="form-control input-sm" data-filter="status">
+                    <option value="">${__("All")}</option>
+                    <option value="Pending">${__("Pending")}</option>
+                    <option value="Completed">${__("Completed")}</option>
+                    <option value="Error">${__("Error")}</option>
+                </select>
+            </div>
+            <div class="col-sm-2">
+                <select class="form-control input-sm" data-filter="credit_debit">
+                    <option value="">${__("Credit and Debit")}</option>
+                    <option value="CRDT">${__("Credit")}</option>
+                    <option value="DBIT">${__("Debit")}</option>
+                </select>
+            </div>
+            <div class="col-sm-4">
+                <input type="text" class="form-control input-sm" data-filter="party" placeholder="${__("Party")}">
+            </div>
+            <div class="col-sm-2">
+                <input type="number" class="form-control input-sm" data-filter="min_amount" placeholder="${__("Min Amount")}">
+            </div>
+            <div class="col-sm-2">
+                <input type="number" class="form-control input-sm" data-filter="max_amount" placeholder="${__("Max Amount")}">
+            </div>
+        </div>
+        <div class="transaction-page"></div>
+        <div class="row">
+            <div class="col-sm-8 transaction-totals text-muted"></div>
+            <div class="col-sm-4 text-right">
+                <button class="btn btn-xs btn-default btn-previous-page">${__("Previous")}</button>
+                <span class="transaction-range" style="margin: 0px 8px;"></span>
+                <button class="btn btn-xs btn-default btn-next-page">${__("Next")}</button>
+            </div>
+        </div>
+    `);
+    frm.transaction_start = 0;
+    wrapper.find('[data-filter]').on('change', function() {
+        frm.transaction_start = 0;
+        load_transaction_page(frm);
+    });
+    wrapper.find('.btn-previous-page').on('click', function() {
+        frm.transaction_start = Math.max(0, frm.transaction_start - (frm.transaction_page_length || 50));
+        load_transaction_page(frm);
+    });
+    wrapper.find('.btn-next-page').on('click', function() {
+        frm.transaction_start += (frm.transaction_page_length || 50);
+        load_transaction_page(frm);
+    });
+    load_transaction_page(frm);
+}
+
+function get_transaction_filters(frm) {
+    let filters = {};
+    frm.fields_dict.transactions_html.$wrapper.find('[data-filter]').each(function() {
+        if ($(this).val()) {
+            filters[$(this).attr('data-filter')] = $(this).val();
+        }
+    });
+    return filters;
+}
+
+function load_transaction_page(frm) {
+    let wrapper = frm.fields_dict.transactions_html.$wrapper;
+    frappe.call({
+        'method': 'erpnextswiss.erpnextswiss.doctype.ebics_statement.ebics_statement.get_transaction_page',
+        'args': Object.assign({
+            'statement': frm.doc.name,
+            'start': frm.transaction_start || 0
+        }, get_transaction_filters(frm)),
+        'callback': function(r) {
+            let page = r.message;
+            frm.transaction_page = page.transactions;
+            frm.transaction_page_length = page.page_length;
+            let html = `<table class="table table-condensed table-hover">
+                <thead><tr>
+                    <th>#</th><th>${__("Date")}</th><th>${__("Credit/Debit")}</th><th class="text-right">${__("Amount")}</th>
+                    <th>${__("Party")}</th><th>${__("Reference")}</th><th>${__("Status")}</th><th>${__("Payment Entry")}</th>
+                </tr></thead><tbody>`;
+            page.transactions.forEach(function(t) {
+                html += `<tr>
+                    <td>${t.idx}</td>
+                    <td>${frappe.datetime.str_to_user(t.date)}</td>
+                    <td>${t.credit_debit || ""}</td>
+                    <td class="text-right">${format_currency(t.amount, t.currency || frm.doc.currency)}</td>
+                    <td>${frappe.utils.escape_html(t.party_match || t.employee_match || t.party_name || "")}</td>
+                    <td>${frappe.utils.escape_html(t.transaction_reference || "")}</td>
+                    <td>${__(t.status || "")}</td>
+                    <td>${t.payment_entry ? `<a href="/app/payment-entry/${t.payment_entry}">${t.payment_entry}</a>` : ""}</td>
+                </tr>`;
+            });
+            html += `</tbody></table>`;
+            wrapper.find('.transaction-page').html(html);
+            
+            let totals = page.totals;
+            let end = page.start + page.transactions.length;
+            wrapper.find('.transaction-range').html(`${totals.count ? page.start + 1 : 0}-${end} / ${totals.count}`);
+            wrapper.find('.transaction-totals').html(`${__("Credit")}: ${format_currency(totals.total_credit, frm.doc.currency)} | 
+                ${__("Debit")}: ${format_currency(totals.total_debit, frm.doc.currency)} | 
+                ${__("Pending")}: ${totals.pending}`);
+            wrapper.find('.btn-previous-page').prop('disabled', page.start === 0);
+            wrapper.find('.btn-next-page').prop('disabled', end >= totals.count);
+            
+            // links of the rows on this page
+            show_linked_documents(frm);
+        }
+    });
+}
+
+function start_auto_posting(frm) {
+    frappe.call({
+        'method': 'erpnextswiss.erpnextswiss.ebics_posting.enqueue_auto_posting',
+        'args': {
+            'statement': frm.doc.name
+        },
+        'callback': function(r) {
+            frappe.show_alert( __("Posting matched transactions...") );
+            frm.reload_doc();
+            frappe.realtime.on("ebics_auto_posting_progress", function(data) {
+                if (data.statement !== frm.doc.name) {
+                    return;
+                }
+                if (data.done) {
+                    frappe.hide_progress();
+                    frappe.realtime.off("ebics_auto_posting_progress");
+                    frappe.show_alert( __("{0} payments posted, {1} errors").replace("{0}", data.posted).replace("{1}", data.errors) );
+                    frm.reload_doc();
+                } else {
+                    frappe.show_progress(__("Auto Post Matches"), data.progress, data.total, frm.doc.name);
+                }
+            });
+        }
+    });
+}
+
 function prepare_defaults(frm) {
     locals.bank_wizard = {};
     frappe.call({
@@ -134,14 +264,33 @@ function prepare_defaults(frm) {
 }
 
 function start_bank_wizard() {
-    // get pending transactions
-    let pending_transactions = [];
-    for (let i = 0; i < cur_frm.doc.transactions.length; i++) {
-        if (cur_frm.doc.transactions[i].status === "Pending") {
-            pending_transactions.push(cur_frm.doc.transactions[i]);
+    if (is_lazy(cur_frm)) {
+        // large statement: fetch the next pending transactions
+        frappe.call({
+            'method': 'erpnextswiss.erpnextswiss.doctype.ebics_statement.ebics_statement.get_transaction_page',
+            'args': {
+                'statement': cur_frm.doc.name,
+                'status': "Pending",
+                'page_length': 200
+            },
+            'callback': function(r) {
+                cur_frm.bank_wizard_transactions = r.message.transactions;
+                open_bank_wizard(r.message.transactions);
+            }
+        });
+    } else {
+        // get pending transactions
+        let pending_transactions = [];
+        for (let i = 0; i < cur_frm.doc.transactions.length; i++) {
+            if (cur_frm.doc.transactions[i].status === "Pending") {
+                pending_transactions.push(cur_frm.doc.transactions[i]);
+            }
         }
+        open_bank_wizard(pending_transactions);
     }
-    
+}
+
+function open_bank_wizard(pending_transactions) {
     if (pending_transactions.length > 0) {
         frappe.call({
             'method': 'erpnextswiss.erpnextswiss.page.bank_wizard.bank_wizard.render_transactions',
@@ -463,6 +612,35 @@ function create_payment_entry(payment, txid) {
 }
 
 function close_entry(txid, reference_doc, doc_type) {
+    if (is_lazy(cur_frm)) {
+        // rows are not loaded in the form: update the transaction on the server
+        let transaction = (cur_frm.bank_wizard_transactions || []).find(t => t.txid === txid);
+        if (transaction) {
+            frappe.call({
+                'method': 'erpnextswiss.erpnextswiss.doctype.ebics_statement.ebics_statement.close_transaction',
+                'args': {
+                    'statement': cur_frm.doc.name,
+                    'transaction': transaction.name,
+                    'payment_entry': (doc_type === 'Journal Entry') ? null : reference_doc,
+                    'journal_entry': (doc_type === 'Journal Entry') ? reference_doc : null
+                },
+                'callback': function(r) {
+                    cur_frm.transaction_totals = r.message;
+                    load_transaction_page(cur_frm);
+                }
+            });
+        }
+    } else {
+        update_transaction_row(txid, reference_doc, doc_type);
+    }
+    // close the entry in the list
+    let table_row = document.getElementById("row-transaction-" + txid);
+    if (table_row) {
+        table_row.classList.add("hidden");
+    }
+}
+
+function update_transaction_row(txid, reference_doc, doc_type) {
     // update transaction row
     for (let i = 0; i < cur_frm.doc.transactions.length; i++) {
         if (cur_frm.doc.transactions[i].txid === txid) {
@@ -484,11 +662,6 @@ function close_entry(txid, reference_doc, doc_type) {
         }
     }
     cur_frm.save();
-    // close the entry in the list
-    let table_row = document.getElementById("row-transaction-" + txid);
-    if (table_row) {
-        table_row.classList.add("hidden");
-    }
 }
 
 function create_journal_entry_dialog(transaction, bank_account, company) {
@@ -591,7 +764,9 @@ function create_journal_entry_dialog(transaction, bank_account, company) {
 function show_linked_documents(frm) {
     console.log("show_linked_documents");
     
-    if (!frm.doc.__islocal && frm.doc.transactions) {
+    // large statements: links of the current page, statistics from the server totals
+    let transactions = is_lazy(frm) ? (frm.transaction_page || []) : frm.doc.transactions;
+    if (!frm.doc.__islocal && transactions) {
         // Remove any existing linked documents sections
         frm.$wrapper.find('[data-fieldname="linked_summary"]').remove();
         frm.$wrapper.find('[data-fieldname="linked_documents"]').remove();
@@ -604,7 +779,7 @@ function show_linked_documents(frm) {
         let customers = new Set();
         let suppliers = new Set();
         
-        frm.doc.transactions.forEach(function(transaction) {
+        transactions.forEach(function(transaction) {
             if (transaction.payment_entry) {
                 payment_entries.push(transaction.payment_entry);
             }
@@ -647,7 +822,7 @@ function show_linked_documents(frm) {
         let pending_count = 0;
         let completed_count = 0;
         
-        frm.doc.transactions.forEach(function(t) {
+        transactions.forEach(function(t) {
             if (t.credit_debit === 'DBIT') {
                 total_debit += t.amount;
             } else {
@@ -660,6 +835,27 @@ function show_linked_documents(frm) {
                 completed_count++;
             }
         });
+        let transaction_count = transactions.length;
+        let linked = {
+            'payments': payment_entries.length,
+            'journals': journal_entries.length,
+            'invoices': sales_invoices.length + purchase_invoices.length,
+            'parties': customers.size + suppliers.size
+        };
+        let totals = frm.transaction_totals;
+        if (is_lazy(frm) && totals) {
+            transaction_count = totals.count;
+            total_debit = totals.total_debit;
+            total_credit = totals.total_credit;
+            pending_count = totals.pending;
+            completed_count = totals.completed;
+            linked = {
+                'payments': totals.payment_entries,
+                'journals': totals.journal_entries,
+                'invoices': frm.invoice_count || 0,
+                'parties': totals.parties
+            };
+        }
         
         // Build the HTML using Frappe standard dashboard structure
         let html = `
@@ -671,7 +867,7 @@ function show_linked_documents(frm) {
                         <div class="col-sm-4">
                             <div class="stat-wrapper text-center">
                                 <div class="stat-title text-muted">Total Transactions</div>
-                                <div class="stat-value">${frm.doc.transactions.length}</div>
+                                <div class="stat-value">${transaction_count}</div>
                                 <div class="stat-footer">
                                     <span class="text-success">Completed: ${completed_count}</span> | 
                                     <span class="text-warning">Pending: ${pending_count}</span>
@@ -693,12 +889,12 @@ function show_linked_documents(frm) {
                         <div class="col-sm-4">
                             <div class="stat-wrapper text-center">
                                 <div class="stat-title text-muted">Linked Documents</div>
-                                <div class="stat-value">${payment_entries.length + journal_entries.length + sales_invoices.length + purchase_invoices.length + customers.size + suppliers.size}</div>
+                                <div class="stat-value">${linked.payments + linked.journals + linked.invoices + linked.parties}</div>
                                 <div class="stat-footer">
-                                    Payments: ${payment_entries.length} | 
-                                    Journal: ${journal_entries.length} |
-                                    Invoices: ${sales_invoices.length + purchase_invoices.length} | 
-                                    Parties: ${customers.size + suppliers.size}
+                                    Payments: ${linked.payments} | 
+                                    Journal: ${linked.journals} |
+                                    Invoices: ${linked.invoices} | 
+                                    Parties: ${linked.parties}
                                 </div>
                             </div>
                         </div>
@@ -4,30 +4,28 @@
 
 import frappe
 from frappe.model.document import Document
-from erpnextswiss.erpnextswiss.page.bank_wizard.bank_wizard import read_camt053_meta, read_camt053, make_payment_entry, get_default_accounts
+from frappe.utils import cint, flt
+from erpnextswiss.erpnextswiss.page.bank_wizard.bank_wizard import read_camt053_meta, read_camt053, parse_camt_document
+from erpnextswiss.erpnextswiss.ebics_posting import enqueue_auto_posting, post_statement
+from erpnextswiss.erpnextswiss.bank_matching import ImportedReferences, get_name_key
+from erpnextswiss.erpnextswiss.utils import get_chunks
 from frappe import _
 import ast
 
+TRANSACTION_PAGE_LENGTH = 50
+LAZY_TRANSACTIONS = 500             # statements with more rows are loaded page by page in the form
+
 class ebicsStatement(Document):
     def onload(self):
-        # Always load transactions from database to ensure they're visible
-        if self.name and not self.is_new():
-            # Force load child table data
-            self.load_transactions_from_db()
-            
-        # Ensure transactions are loaded and visible
-        if not hasattr(self, 'transactions') or self.transactions is None:
+        if self.is_new():
+            return
+        totals = get_transaction_totals(self.name)
+        self.set_onload('transaction_totals', totals)
+        if totals['count'] > (cint(frappe.conf.get('ebics_statement_lazy_transactions')) or LAZY_TRANSACTIONS):
+            # large statement: do not ship the rows with the form, it fetches them page by page (get_transaction_page)
             self.transactions = []
-        
-        # Force the transactions field to be visible
-        if hasattr(self, 'set_onload'):
-            self.set_onload('show_transactions', True)
-            # Also set the transactions data in onload
-            self.set_onload('transactions', self.transactions)
-        
-        # Debug logging
-        frappe.logger().debug(f"ebics Statement onload - {self.name}: {len(self.transactions)} transactions loaded, status: {self.status}")
-        
+            self.set_onload('lazy_transactions', 1)
+            self.set_onload('invoice_count', get_invoice_count(self.name))
         return
     
     def load_transactions_from_db(self):
@@ -44,6 +42,13 @@ class ebicsStatement(Document):
                 self.append('transactions', transaction)
     
     def before_save(self):
+        if not self.is_new() and frappe.db.get_value("ebics Statement", self.name, 'auto_posting_status') in ("Queued", "Running"):
+            # the auto posting job writes the transaction rows: do not overwrite them
+            frappe.throw( _("Auto posting is running for this statement, please reload when it has completed") )
+        if not self.transactions and not self.is_new() and not self.flags.reset_transactions \
+                and frappe.db.exists("ebics Statement Transaction", {'parent': self.name, 'parenttype': "ebics Statement"}):
+            # saved from a form without rows (large statement): keep the stored transactions
+            self.load_transactions_from_db()
         if self.status != "Completed":
             self.update_status_from_transactions()
         return
@@ -58,9 +63,11 @@ class ebicsStatement(Document):
             self.status = "Completed"
         return
         
-    def parse_content(self, debug=False):
+    def parse_content(self, debug=False, camt_document=None):
         """
         Read the xml content and parse into the doctype record
+
+        :params:camt_document:  already parsed content (see bank_wizard.parse_camt_document)
         """
         if not self.xml_content:
             frappe.throw( _("Cannot parse this file: {0}. No content found.").format(self.name) )
@@ -73,8 +80,10 @@ class ebicsStatement(Document):
         else:
             content_hash = hashlib.md5(self.xml_content.encode()).hexdigest()
         
-        # read meta data
-        meta = read_camt053_meta(self.xml_content)
+        # parse once: meta data and transactions are read from the same result
+        if not camt_document:
+            camt_document = parse_camt_document(self.xml_content)
+        meta = read_camt053_meta(self.xml_content, camt_document)
         self.update({
             'currency': meta.get('currency'),
             'opening_balance': meta.get('opening_balance'),
@@ -105,32 +114,22 @@ class ebicsStatement(Document):
             self.account = account_matches[0]['name']
             self.company = account_matches[0]['company']
             self.transactions = []
+            self.flags.reset_transactions = True
             self.status = "Pending"             # reset status: transaction being added
             
             # read transactions (only if account is available) - note: transactions that are already recorded as payment entry are supressed
-            transactions = read_camt053(self.xml_content, self.account)
+            transactions = read_camt053(self.xml_content, self.account, camt_document)
             
             if debug:
                 print("Txns: {0}".format(transactions))
+            # verify that unique IDs have not already been imported (happens do to the licence block in fintech)
+            duplicates = get_imported_statement_transactions(
+                [t.get("unique_reference") for t in transactions.get('transactions')], self.name)
             # read transactions into the child table
             for transaction in transactions.get('transactions'):
                 if debug:
                     print("{0}".format(transaction))
-                # verify that this unique ID has not already been imported (happens do to the licence block in fintech)
-                duplicates = frappe.db.sql("""
-                    SELECT `name`
-                    FROM `tabebics Statement Transaction`
-                    WHERE `unique_reference` = %(ref)s
-                      AND `date` = %(date)s
-                      AND `parent` != %(stmt)s;""",
-                    {
-                        'ref': transaction.get("unique_reference"),
-                        'date': transaction.get("date"),
-                        'stmt': self.name
-                    },
-                    as_dict=True
-                )
-                if len(duplicates) > 0:
+                if (get_name_key(transaction.get("unique_reference")), "{0}".format(transaction.get("date"))) in duplicates:
                     continue                # skip, this transaction has 
                 # stringify lists to store them in child table
                 if transaction.get("invoice_matches"):
@@ -151,76 +150,15 @@ class ebicsStatement(Document):
         
         return
 
-    def process_transactions(self):
+    def process_transactions(self, background=True):
         """
-        Analyse transactions and if possible, match them
+        Create and submit the payment entries of all fully matched transactions
+        (background job, see ebics_posting; post_process runs after posting)
         """
-        default_accounts = get_default_accounts(self.account)
-        
-        for t in self.transactions:
-            # if matched amount equals the transaction amount, create and submit payment
-            if t.status == "Pending" and not t.payment_entry and t.matched_amount == t.amount and (t.party_match or t.employee_match):
-                payment = {
-                    'amount': t.amount,
-                    'date': t.date,
-                    'reference_no': t.unique_reference,
-                    'party_iban': t.party_iban
-                }
-                if t.credit_debit == "DBIT":
-                    # outflow: purchase invoice or expense
-                    if t.invoice_matches:
-                        payment.update({
-                            'paid_from': self.account,
-                            'paid_to': default_accounts.get('payable_account'),
-                            'type': "Pay",
-                            'party_type': "Supplier",
-                            'party': t.party_match,
-                            'references': t.invoice_matches,            # note: string will be parsed in make_payment_entry
-                            'remarks': "{0}, {1}, {2}".format(t.transaction_reference or "", t.party_name or "", t.party_address or ""),
-                            'auto_submit': 1,
-                            'company': self.company
-                        })
-                    elif t.expense_matches:
-                        payment.update({
-                            'paid_from': self.account,
-                            'paid_to': default_accounts.get('payable_account'),
-                            'type': "Pay",
-                            'party_type': "Employee",
-                            'party': t.employee_match,
-                            'references': t.expense_matches,            # note: string will be parsed in make_payment_entry
-                            'remarks': "{0}, {1}, {2}".format(t.transaction_reference or "", t.party_name or "", t.party_address or ""),
-                            'auto_submit': 1,
-                            'company': self.company
-                        })
-                else:
-                    # inflow: debtor
-                    payment.update({
-                        'paid_from': default_accounts.get('receivable_account'),
-                        'paid_to': self.account,
-                        'type': "Receive",
-                        'party_type': "Customer",
-                        'party': t.party_match,
-                        'references': t.invoice_matches,            # note: string will be parsed in make_payment_entry
-                        'remarks': "{0}, {1}, {2}".format(t.transaction_reference or "", t.party_name or "", t.party_address or ""),
-                        'auto_submit': 1,
-                        'company': self.company
-                    })
-                
-                try:
-                    payment = make_payment_entry(**payment)
-                    t.payment_entry = payment.get('payment_entry')
-                    t.status = "Completed"
-                except Exception as err:
-                    t.status == "Error"
-                    t.remarks = "{0}".format(err)
-        
-        # save
-        self.save()
-        frappe.db.commit()
-        
-        # run post-processing triggers
-        self.post_process()
-        
+        if background:
+            enqueue_auto_posting(self.name)
+        else:
+            post_statement(self.name)
         return
 
     def post_process(self):
@@ -244,6 +182,30 @@ class ebicsStatement(Document):
                     
         return
 
+def get_imported_statement_transactions(unique_references, statement):
+    """
+    Find transactions of other statements with these unique references
+
+    Returns a set of (unique reference key, date) tuples, resolved with
+    chunked IN (...) queries (index on unique_reference, date)
+    """
+    imported = set()
+    for chunk in get_chunks(set(r for r in unique_references if r)):
+        matches = frappe.db.sql("""
+            SELECT `unique_reference`, `date`
+            FROM `tabebics Statement Transaction`
+            WHERE `unique_reference` IN %(refs)s
+              AND `parent` != %(stmt)s;""",
+            {
+                'refs': tuple(chunk),
+                'stmt': statement
+            },
+            as_dict=True
+        )
+        for match in matches:
+            imported.add((get_name_key(match['unique_reference']), "{0}".format(match['date'])))
+    return imported
+
 @frappe.whitelist()
 def delete_all_statements():
     """Delete all ebics Statement records"""
@@ -301,6 +263,7 @@ def reparse_xml(docname):
         
         # Clear existing transactions
         doc.transactions = []
+        doc.flags.reset_transactions = True
         
         # Parse XML directly to get all transactions (including those already imported)
         meta = read_camt053_meta(doc.xml_content)
@@ -409,11 +372,13 @@ def reparse_xml(docname):
                 frappe.log_error(f"Error parsing transaction: {str(e)}", "EBICS Re-parse Transaction")
         
         # Add transactions to document
+        imported_references = ImportedReferences()
+        imported_references.prefetch([t.get("unique_reference") for t in transactions.get('transactions', [])],
+            account_matches[0]['company'])
         for transaction in transactions.get('transactions', []):
             # Check if this transaction has a payment entry
-            payment_entry = frappe.db.get_value('Payment Entry', 
-                {'reference_no': transaction.get("unique_reference"), 'company': account_matches[0]['company']}, 
-                'name')
+            payment_entry = imported_references.get_payment_entry(transaction.get("unique_reference"), 
+                account_matches[0]['company'])
             
             if payment_entry:
                 transaction['payment_entry'] = payment_entry
@@ -465,6 +430,124 @@ def get_transactions(docname):
             'message': str(e)
         }
 
+def get_transaction_conditions(statement, status=None, party=None, min_amount=None, max_amount=None, credit_debit=None):
+    """
+    WHERE clause and values for the transactions of a statement (filters are optional)
+    """
+    conditions = ["`parent` = %(statement)s", "`parenttype` = 'ebics Statement'"]
+    values = {'statement': statement}
+    if status:
+        conditions.append("`status` = %(status)s")
+        values['status'] = status
+    if credit_debit:
+        conditions.append("`credit_debit` = %(credit_debit)s")
+        values['credit_debit'] = credit_debit
+    if party:
+        conditions.append("(`party_name` LIKE %(party)s OR `party_match` LIKE %(party)s OR `employee_match` LIKE %(party)s)")
+        values['party'] = "%{0}%".format(party)
+    if min_amount not in (None, ""):
+        conditions.append("`amount` >= %(min_amount)s")
+        values['min_amount'] = flt(min_amount)
+    if max_amount not in (None, ""):
+        conditions.append("`amount` <= %(max_amount)s")
+        values['max_amount'] = flt(max_amount)
+    return " AND ".join(conditions), values
+
+def get_transaction_totals(statement, **filters):
+    """
+    Number of rows by status, credit/debit sums and linked documents (without invoices, see
+    get_invoice_count) of the (filtered) transactions
+    """
+    conditions, values = get_transaction_conditions(statement, **filters)
+    totals = frappe.db.sql("""
+        SELECT
+            COUNT(`name`) AS `count`,
+            SUM(IF(`status` = "Pending", 1, 0)) AS `pending`,
+            SUM(IF(`status` = "Completed", 1, 0)) AS `completed`,
+            SUM(IF(`status` = "Error", 1, 0)) AS `errors`,
+            SUM(IF(`credit_debit` = "DBIT", 0, `amount`)) AS `total_credit`,
+            SUM(IF(`credit_debit` = "DBIT", `amount`, 0)) AS `total_debit`,
+            SUM(IF(IFNULL(`payment_entry`, "") != "", 1, 0)) AS `payment_entries`,
+            SUM(IF(`remarks` LIKE "%%Journal Entry: %%", 1, 0)) AS `journal_entries`,
+            COUNT(DISTINCT NULLIF(`party_match`, "")) AS `parties`
+        FROM `tabebics Statement Transaction`
+        WHERE {conditions};""".format(conditions=conditions), values, as_dict=True)[0]
+    for key in ('pending', 'completed', 'errors', 'payment_entries', 'journal_entries'):
+        totals[key] = cint(totals[key])
+    for key in ('total_credit', 'total_debit'):
+        totals[key] = flt(totals[key])
+    return totals
+
+def get_invoice_count(statement):
+    """
+    Number of matched invoices of a statement (only read when the form is loaded)
+    """
+    conditions, values = get_transaction_conditions(statement)
+    count = 0
+    # invoice matches are stored as stringified lists
+    for invoice_matches in frappe.db.sql_list("""
+            SELECT `invoice_matches`
+            FROM `tabebics Statement Transaction`
+            WHERE {conditions} AND IFNULL(`invoice_matches`, "") != "";""".format(conditions=conditions), values):
+        try:
+            count += len(ast.literal_eval(invoice_matches))
+        except (ValueError, SyntaxError, TypeError):
+            pass
+    return count
+
+@frappe.whitelist()
+def get_transaction_page(statement, start=0, page_length=TRANSACTION_PAGE_LENGTH, status=None, party=None,
+        min_amount=None, max_amount=None, credit_debit=None):
+    """
+    One page of the (filtered) transactions of a statement with the totals of all matching rows
+    """
+    if not frappe.has_permission("ebics Statement", "read", statement):
+        frappe.throw( _("Not permitted"), frappe.PermissionError)
+    filters = {
+        'status': status,
+        'party': party,
+        'min_amount': min_amount,
+        'max_amount': max_amount,
+        'credit_debit': credit_debit
+    }
+    conditions, values = get_transaction_conditions(statement, **filters)
+    values.update({'start': cint(start), 'page_length': cint(page_length) or TRANSACTION_PAGE_LENGTH})
+    transactions = frappe.db.sql("""
+        SELECT *
+        FROM `tabebics Statement Transaction`
+        WHERE {conditions}
+        ORDER BY `idx` ASC
+        LIMIT %(start)s, %(page_length)s;""".format(conditions=conditions), values, as_dict=True)
+    return {
+        'transactions': transactions,
+        'totals': get_transaction_totals(statement, **filters),
+        'start': values['start'],
+        'page_length': values['page_length']
+    }
+
+@frappe.whitelist()
+def close_transaction(statement, transaction, payment_entry=None, journal_entry=None):
+    """
+    Mark one transaction as completed (bank wizard on a statement without loaded rows)
+    """
+    if not frappe.has_permission("ebics Statement", "write", statement):
+        frappe.throw( _("Not permitted"), frappe.PermissionError)
+    if frappe.db.get_value("ebics Statement", statement, 'auto_posting_status') in ("Queued", "Running"):
+        frappe.throw( _("Auto posting is running for this statement, please reload when it has completed") )
+    row = frappe.db.get_value("ebics Statement Transaction", transaction, ['parent', 'remarks'], as_dict=True)
+    if not row or row.parent != statement:
+        frappe.throw( _("Transaction {0} not found in {1}").format(transaction, statement) )
+    values = {'status': "Completed"}
+    if payment_entry:
+        values['payment_entry'] = payment_entry
+    if journal_entry:
+        values['remarks'] = "{0}Journal Entry: {1}".format("{0}\n".format(row.remarks) if row.remarks else "", journal_entry)
+    frappe.db.set_value("ebics Statement Transaction", transaction, values, update_modified=False)
+    if not frappe.db.exists("ebics Statement Transaction", {'parent': statement, 'parenttype': "ebics Statement",
+            'status': ['!=', "Completed"]}):
+        frappe.db.set_value("ebics Statement", statement, 'status', "Completed")
+    return get_transaction_totals(statement)
+
 @frappe.whitelist()
 def find_and_merge_duplicates():
     """Find and merge duplicate ebics Statements based on bank_statement_id"""
@@ -20,9 +20,17 @@ class LabelPrinter(Document):
 
 # creates a pdf based on a label printer and a html content
 def create_pdf(label_printer, content, preview=False):
-	# create temporary file
-	fname = os.path.join("/tmp", "frappe-pdf-{0}.pdf".format(frappe.generate_hash()))
+	html_content = get_label_html(content)
+	if preview:
+		return html_content
+	return render_pdf(label_printer, html_content)
+
+# creates one pdf with a page per label (list of html contents), rendered in a single wkhtmltopdf call
+def create_labels_pdf(label_printer, contents):
+	pages = "".join("""<div class="label-page">{0}</div>""".format(content) for content in contents)
+	return render_pdf(label_printer, get_label_html(pages))
 
+def render_pdf(label_printer, html_content):
 	options = {
 		'page-width': '{0}mm'.format(label_printer.width),
 		'page-height': '{0}mm'.format(label_printer.height),
@@ -31,6 +39,10 @@ def create_pdf(label_printer, content, preview=False):
 		'margin-left': '0mm',
 		'margin-right': '0mm' }
 
+	# output_path False: pdfkit returns the pdf instead of writing a file
+	return pdfkit.from_string(html_content, False, options=options)
+
+def get_label_html(content):
 	css_content = """
             p {
                 line-height: 1!important;
@@ -53,6 +65,13 @@ def create_pdf(label_printer, content, preview=False):
                 flex: 1;
                 text-align: left;
             }
+            .label-page {
+                page-break-after: always;
+                page-break-inside: avoid;
+            }
+            .label-page:last-child {
+                page-break-after: auto;
+            }
         """
 
 
@@ -70,16 +89,7 @@ def create_pdf(label_printer, content, preview=False):
 	<body>
 	</html>
 	""".format(content=content, css_content=css_content)
-	if preview:
-		return html_content
-	pdfkit.from_string(html_content, fname, options=options or {})
-
-	with open(fname, "rb") as fileobj:
-		filedata = fileobj.read()
-
-	cleanup(fname)
-
-	return filedata
+	return html_content
 
 def cleanup(fname):
 	if os.path.exists(fname):
@@ -108,17 +118,39 @@ def generate_labels_for_products(label_details, selected_items, preview=False):
     label_details = json.loads(label_details)
     selected_items = json.loads(selected_items)
 
-    pdfs = []
-    errors = []
-    html_preview = ""
-
     # get label printer details
     label_printer = frappe.get_doc("Label Printer", label_details.get("label_print"))
+    pages, errors = get_label_pages(label_details, selected_items, max_pages=1 if preview else None)
+
+    if preview:
+        return {"pdf": create_pdf(label_printer, pages[0], preview=True) if pages else "", "errors": errors}
+    # Render all labels into a single PDF
+    if len(pages) > 0:
+        combined_pdf_path = save_labels_pdf(create_labels_pdf(label_printer, pages))
+    else:
+        combined_pdf_path = None
+
+    return {"pdf": combined_pdf_path, "errors": errors}
+
+def get_label_pages(label_details, selected_items, max_pages=None):
+    """
+    Returns the html content of all label copies and the errors per item;
+    items, barcodes and prices are loaded once per item
+    """
+    pages = []
+    errors = []
+    items = {}
+    barcodes = {}
+    prices = {}
     type = label_details.get("type")
+    # Get the quantity of labels per item
+    quantity = int(label_details.get("label_quantity", 1))
 
     for item_name in selected_items:
         item_name = unquote(item_name)
-        item = frappe.get_doc("Item", item_name)
+        if item_name not in items:
+            items[item_name] = frappe.get_doc("Item", item_name)
+        item = items[item_name]
 
         # Determine the barcode value based on the 'value' and 'type' fields
         barcode_value = item.item_code  # default to item_code
@@ -132,91 +164,73 @@ def generate_labels_for_products(label_details, selected_items, preview=False):
                 else:
                     errors += [("Item {0} : No suitable barcode found for type {1}<br>".format(item_name, type))]
                     continue
-                    #raise ValueError(f"No suitable barcode found for item {item_name} for type {label_details.get('type')}")
-            #else:
-                #raise ValueError(f"No barcodes associated with item {item_name}")
 
         # Check if the barcode_value is numeric and the chosen type is EAN13
         if not barcode_value.isnumeric() and "EAN" in type:
             errors += [("Item {0} : Unable to generate EAN13 barcode for non-numeric value {1}<br>".format(item_name, barcode_value))]
             continue
-            #raise ValueError("Unable to generate EAN13 barcode for non-numeric value: {}".format(barcode_value))
         if "EAN" in type:
             digits = int(type.replace("EAN", ""))
             if digits and len(barcode_value) != digits:
                 errors += [("Item {0} : Unable to generate EAN barcode for value {1} with length {2}. Expected length: {3}<br>".format(item_name, barcode_value, len(barcode_value), digits))]
                 continue
-                #raise ValueError("Unable to generate EAN barcode for value {} with length {}. Expected length: {}".format(barcode_value, len(barcode_value), digits))
 
         # Generate barcode for the determined value
-        barcode_img = generate_barcode_or_qr(barcode_value, type, label_details.get("bodebar_color"), label_details.get("codebar_height"), label_details.get("show_number"))
-        barcode_img_tag = '<img style="height:{}px;" src="data:image/png;base64, {}"/>'.format(label_details.get("codebar_height"), barcode_img)
-
-        # Get the quantity of labels for this item
-        quantity = int(label_details.get("label_quantity", 1))
-
-        for _ in range(quantity):
-            item_pricing = get_price(item.item_code, label_details.get("price_list"), label_details.get("customer_group"), label_details.get("company"), qty=1)
-            price = ''
-            promo_price = ''
-            promo_from = ''
-            promo_to = ''
-            if item_pricing:
-                price = item_pricing.get('formatted_mrp').replace("'", '') if item_pricing.get('formatted_mrp') else item_pricing.get('formatted_price').replace("'", '')
-                promo_price = item_pricing.get('formatted_price').replace("'", '') if item_pricing.get('formatted_mrp') else ''
-                promo_from = item_pricing.get('valid_from') if item_pricing and item_pricing.get('valid_from') else ''
-                promo_to = item_pricing.get('valid_upto') if item_pricing and item_pricing.get('valid_upto') else ''
-            content = label_details.get("content")
-            if '{promo_price}' in content:
-                if '{price}' in content:
-                    if promo_price and promo_price != price:
-                        content = content.replace("{promo_price}", promo_price)
-                    else:
-                        content = content.replace("{promo_price}", "")
-                else:
-                    content = content.replace("{promo_price}", promo_price)
-            if '{promo_from}' in content and promo_price and promo_price != price:
-                date_from = promo_from.split(" ")[0]
-                date_from = datetime.strptime(date_from, "%Y-%m-%d")
-                date_from = date_from.strftime("%d-%m-%Y")
-                content = content.replace("{promo_from}",date_from)
-            else:
-                content = content.replace("{promo_from}", "")
-            if '{promo_to}' in content and promo_price and promo_price != price:
-                date_to = promo_from.split(" ")[0]
-                date_to = datetime.strptime(date_to, "%Y-%m-%d")
-                date_to = date_to.strftime("%d-%m-%Y")
-                content = content.replace("{promo_to}", date_to)
+        if barcode_value not in barcodes:
+            barcode_img = generate_barcode_or_qr(barcode_value, type, label_details.get("bodebar_color"), label_details.get("codebar_height"), label_details.get("show_number"))
+            barcodes[barcode_value] = '<img style="height:{}px;" src="data:image/png;base64, {}"/>'.format(label_details.get("codebar_height"), barcode_img)
+
+        if item.item_code not in prices:
+            prices[item.item_code] = get_price(item.item_code, label_details.get("price_list"), label_details.get("customer_group"), label_details.get("company"), qty=1)
+
+        # all copies of an item are the same label
+        content = barcodes[barcode_value] + get_label_content(label_details.get("content"), item, prices[item.item_code])
+        pages += [content] * quantity
+        if max_pages and len(pages) >= max_pages:
+            return pages[:max_pages], errors
+
+    return pages, errors
+
+def get_label_content(content, item, item_pricing):
+    price = ''
+    promo_price = ''
+    promo_from = ''
+    promo_to = ''
+    if item_pricing:
+        price = item_pricing.get('formatted_mrp').replace("'", '') if item_pricing.get('formatted_mrp') else item_pricing.get('formatted_price').replace("'", '')
+        promo_price = item_pricing.get('formatted_price').replace("'", '') if item_pricing.get('formatted_mrp') else ''
+        promo_from = item_pricing.get('valid_from') if item_pricing and item_pricing.get('valid_from') else ''
+        promo_to = item_pricing.get('valid_upto') if item_pricing and item_pricing.get('valid_upto') else ''
+    if '{promo_price}' in content:
+        if '{price}' in content:
+            if promo_price and promo_price != price:
+                content = content.replace("{promo_price}", promo_price)
             else:
-                content = content.replace("{promo_to}", "")
-            content = content.replace("{price}", price)
-            #content = content.replace("{price}", "{:.2f}".format(item.standard_rate) if item.standard_rate else "")
-            content = content.replace("{reference}", item.item_code if item.item_code else "")
-            content = content.replace("{unit}", item.stock_uom if item.stock_uom else "")
-            content = content.replace("{brand}", item.brand if item.brand else "")
-            content = content.replace("{category}", item.item_group if item.item_group else "")
-            content = content.replace("{name}", item.item_name if item.item_name else "")
-            content = content.replace("{description}", item.description if item.description else "")
-            content = barcode_img_tag + content
-
-            # Use the existing create_pdf function to generate the label
-            if preview:
-                html_preview = create_pdf(label_printer, content, preview=True)
-                break
-            else:
-                pdf_content = create_pdf(label_printer, content)
-                pdfs.append(pdf_content)
-        if html_preview:
-            break
-    if preview:
-        return {"pdf": html_preview, "errors": errors}
-    # Combine all the generated labels into a single PDF
-    if len(pdfs) > 0:
-        combined_pdf_path = combine_pdfs(pdfs)
+                content = content.replace("{promo_price}", "")
+        else:
+            content = content.replace("{promo_price}", promo_price)
+    if '{promo_from}' in content and promo_price and promo_price != price:
+        date_from = promo_from.split(" ")[0]
+        date_from = datetime.strptime(date_from, "%Y-%m-%d")
+        date_from = date_from.strftime("%d-%m-%Y")
+        content = content.replace("{promo_from}",date_from)
     else:
-        combined_pdf_path = None
-
-    return {"pdf": combined_pdf_path, "errors": errors}
+        content = content.replace("{promo_from}", "")
+    if '{promo_to}' in content and promo_price and promo_price != price:
+        date_to = promo_from.split(" ")[0]
+        date_to = datetime.strptime(date_to, "%Y-%m-%d")
+        date_to = date_to.strftime("%d-%m-%Y")
+        content = content.replace("{promo_to}", date_to)
+    else:
+        content = content.replace("{promo_to}", "")
+    content = content.replace("{price}", price)
+    content = content.replace("{reference}", item.item_code if item.item_code else "")
+    content = content.replace("{unit}", item.stock_uom if item.stock_uom else "")
+    content = content.replace("{brand}", item.brand if item.brand else "")
+    content = content.replace("{category}", item.item_group if item.item_group else "")
+    content = content.replace("{name}", item.item_name if item.item_name else "")
+    content = content.replace("{description}", item.description if item.description else "")
+    return content
 
 def get_barcode(value, barcode_type, writer):
     """Renvoie un objet de code-barres basé sur le type fourni."""
@@ -283,15 +297,20 @@ def combine_pdfs(pdfs):
 
         merger.append(pdf)
 
+    output = BytesIO()
+    merger.write(output)
+    return save_labels_pdf(output.getvalue())
+
+def save_labels_pdf(filedata):
+    """Enregistre le PDF des étiquettes sur le disque.
+    :return: Chemin du fichier PDF sauvegardé adapté pour l'URL correcte.
+    """
     # Définissez le chemin où vous souhaitez enregistrer le fichier PDF combiné
-    # Vous pouvez ajuster ce chemin selon vos besoins
     output_path = os.path.join(frappe.get_site_path("public", "files"), "combined_labels.pdf")
 
-    # Enregistrez le PDF combiné sur le disque
     with open(output_path, "wb") as f:
-        merger.write(f)
+        f.write(filedata)
 
-    # Retournez le chemin du fichier PDF sauvegardé adapté pour l'URL correcte
     return "/files/combined_labels.pdf"
 
 @frappe.whitelist()
@@ -8,14 +8,17 @@ from frappe.model.document import Document
 from frappe import _
 import csv
 from frappe.utils.background_jobs import enqueue
+from frappe.utils import cint
+from erpnextswiss.erpnextswiss.bulk_import import bulk_upsert
 
 class Municipality(Document):
     pass
 
 @frappe.whitelist()
-def enqueue_import_municipality(content):
+def enqueue_import_municipality(content, bulk=1):
     kwargs={
-          'content': content
+          'content': content,
+          'bulk': cint(bulk)
         }
     
     enqueue("erpnextswiss.erpnextswiss.doctype.municipality.municipality.import_municipality",
@@ -24,11 +27,13 @@ def enqueue_import_municipality(content):
         **kwargs)
     return {'result': _('Import started...')}
 
-def import_municipality(content):   
+def import_municipality(content, bulk=True):   
     isfirst = True
     field_index = {}
     # read csv
     elements = csv.reader(content.splitlines(), dialect=csv.excel)
+    if bulk:
+        return import_municipality_bulk(elements)
     # process elements
     for element in elements:
         if isfirst:
@@ -58,3 +63,30 @@ def import_municipality(content):
             frappe.db.commit()
     
     return {'result': _('Successfully imported')}
+
+"""
+Bulk mode: compare the file with the existing municipalities in memory and write batches
+"""
+def import_municipality_bulk(elements):
+    field_index = {}
+    records = []
+    for element in elements:
+        if not field_index:
+            # header: loop through cells
+            for i in range(0, len(element)):
+                field_index[element[i].lower()] = i
+            continue
+        if not element or not element[field_index['bfsnr']]:
+            continue
+        records.append({
+            'name': element[field_index['bfsnr']] or "",
+            'bfsnr': element[field_index['bfsnr']] or "",
+            'municipality': element[field_index['municipality']] or ""
+        })
+    
+    result = bulk_upsert("Municipality", records, 
+        key_fields=['bfsnr'], 
+        update_fields=['municipality'])
+    result['result'] = _("Successfully imported: {0} inserted, {1} updated, {2} unchanged ({3} s)").format(
+        result.inserted, result.updated, result.unchanged, result.duration)
+    return result
@@ -11,7 +11,8 @@ import time
 from erpnextswiss.erpnextswiss.common_functions import get_building_number, get_street_name, get_pincode, get_city, get_primary_address, split_address_to_street_and_building
 from erpnextswiss.erpnextswiss.xml_utils import validate_xml_against_xsd
 import html          # used to escape xml content
-from frappe.utils import cint, get_url_to_form, rounded
+from frappe.utils import cint, get_url_to_form, rounded, getdate, now
+from erpnextswiss.erpnextswiss.utils import get_chunks
 from unidecode import unidecode     # used to remove German/French-type special characters from bank identifieres
 import os
 
@@ -85,90 +86,90 @@ class PaymentProposal(Document):
         # clean payments (to prevent accumulation on re-submit)
         self.payments = []
         # create the aggregated payment table
-        # collect customers
-        suppliers = []
-        total = 0
+        # collect suppliers (in order of appearance) with their invoices
+        suppliers = {}
         for purchase_invoice in self.purchase_invoices:
-            if purchase_invoice.supplier not in suppliers:
-                suppliers.append(purchase_invoice.supplier)
+            suppliers.setdefault(purchase_invoice.supplier, []).append(purchase_invoice)
+        # master data of all invoices, suppliers and addresses
+        invoice_data = get_records("Purchase Invoice", [p.purchase_invoice for p in self.purchase_invoices],
+            ['supplier_address', 'credit_to', 'currency', 'conversion_rate'])
+        supplier_data = get_records("Supplier", suppliers.keys(), ['supplier_name', 'iban', 'bic'])
+        address_data = get_records("Address", [i.supplier_address for i in invoice_data.values()],
+            ['address_line1', 'pincode', 'city', 'country'])
+        total = 0
+        # execution date of intermediate payments (expenses and salaries use the date of the last supplier)
+        exec_date = to_datetime(self.date) + timedelta(days=90)
         # aggregate purchase invoices
-        for supplier in suppliers:
+        for supplier, purchase_invoices in suppliers.items():
             amount = 0
             references = []
             currency = ""
             address = ""
             payment_type = "SEPA"
+            supl = supplier_data.get(supplier) or frappe._dict({'name': supplier})
             # try executing in 90 days (will be reduced by actual due dates)
-            exec_date = datetime.strptime(self.date, "%Y-%m-%d") + timedelta(days=90)
-            for purchase_invoice in self.purchase_invoices:
-                if purchase_invoice.supplier == supplier:
-                    currency = purchase_invoice.currency
-                    pinv = frappe.get_doc("Purchase Invoice", purchase_invoice.purchase_invoice)
-                    address = pinv.supplier_address
-                    references.append(purchase_invoice.external_reference)
-                    # find if skonto applies
-                    if purchase_invoice.skonto_date:
-                        skonto_date = datetime.strptime(purchase_invoice.skonto_date, "%Y-%m-%d")
-                    due_date = datetime.strptime(purchase_invoice.due_date, "%Y-%m-%d")
-                    if (purchase_invoice.skonto_date) and (skonto_date.date() >= datetime.now().date()):  
-                        this_amount = purchase_invoice.skonto_amount    
-                        if exec_date.date() > skonto_date.date():
-                            exec_date = skonto_date
-                    else:
-                        this_amount = purchase_invoice.amount
-                        if exec_date.date() > due_date.date():
-                            exec_date = due_date
-                    payment_type = purchase_invoice.payment_type
-                    if payment_type in ["ESR", "QRR", "SCOR"] or self.individual_payments == 1:
-                        # run as individual payment (not aggregated)
-                        supl = frappe.get_doc("Supplier", supplier)
-                        addr = frappe.get_doc("Address", address)
-                        # For QRR, use ESR participation number as IBAN if available
-                        iban = supl.iban
-                        if payment_type == "QRR" and purchase_invoice.esr_participation_number:
-                            iban = purchase_invoice.esr_participation_number
-                        elif payment_type == "ESR" and purchase_invoice.esr_participation_number and 'CH' in purchase_invoice.esr_participation_number:
-                            # This is actually a QRR, use participation number as IBAN
-                            iban = purchase_invoice.esr_participation_number
-                            
-                        self.add_payment(
-                            receiver_name=supl.supplier_name, 
-                            iban=iban, 
-                            payment_type=payment_type,
-                            address_line1=addr.address_line1, 
-                            address_line2="{0} {1}".format(addr.pincode, addr.city), 
-                            country=addr.country,
-                            pincode=addr.pincode,
-                            city=addr.city,
-                            amount=this_amount, 
-                            currency=currency, 
-                            reference=purchase_invoice.external_reference, 
-                            execution_date=skonto_date or due_date, 
-                            esr_reference=purchase_invoice.esr_reference, 
-                            esr_participation_number=purchase_invoice.esr_participation_number, 
-                            bic=supl.bic,
-                            receiver_id=supl.name
-                        )
-                        total += this_amount
-                    else:
-                        amount += this_amount
-                    # mark sales invoices as proposed
-                    invoice = frappe.get_doc("Purchase Invoice", purchase_invoice.purchase_invoice)
-                    invoice.is_proposed = 1
-                    invoice.save()
-                    # create payment on intermediate
-                    if self.use_intermediate == 1:
+            exec_date = to_datetime(self.date) + timedelta(days=90)
+            for purchase_invoice in purchase_invoices:
+                currency = purchase_invoice.currency
+                pinv = invoice_data.get(purchase_invoice.purchase_invoice) or frappe._dict()
+                address = pinv.supplier_address
+                references.append(purchase_invoice.external_reference)
+                # find if skonto applies
+                skonto_date = to_datetime(purchase_invoice.skonto_date) if purchase_invoice.skonto_date else None
+                due_date = to_datetime(purchase_invoice.due_date)
+                if (skonto_date) and (skonto_date.date() >= datetime.now().date()):  
+                    this_amount = purchase_invoice.skonto_amount    
+                    if exec_date.date() > skonto_date.date():
+                        exec_date = skonto_date
+                else:
+                    this_amount = purchase_invoice.amount
+                    if exec_date.date() > due_date.date():
+                        exec_date = due_date
+                payment_type = purchase_invoice.payment_type
+                if payment_type in ["ESR", "QRR", "SCOR"] or self.individual_payments == 1:
+                    # run as individual payment (not aggregated)
+                    addr = get_address(address_data, address, purchase_invoice.purchase_invoice)
+                    # For QRR, use ESR participation number as IBAN if available
+                    iban = supl.iban
+                    if payment_type == "QRR" and purchase_invoice.esr_participation_number:
+                        iban = purchase_invoice.esr_participation_number
+                    elif payment_type == "ESR" and purchase_invoice.esr_participation_number and 'CH' in purchase_invoice.esr_participation_number:
+                        # This is actually a QRR, use participation number as IBAN
+                        iban = purchase_invoice.esr_participation_number
                         
-                        self.create_payment("Supplier", supplier, 
-                            "Purchase Invoice", purchase_invoice.purchase_invoice, exec_date,
-                            purchase_invoice.amount, self.company)
+                    self.add_payment(
+                        receiver_name=supl.supplier_name, 
+                        iban=iban, 
+                        payment_type=payment_type,
+                        address_line1=addr.address_line1, 
+                        address_line2="{0} {1}".format(addr.pincode, addr.city), 
+                        country=addr.country,
+                        pincode=addr.pincode,
+                        city=addr.city,
+                        amount=this_amount, 
+                        currency=currency, 
+                        reference=purchase_invoice.external_reference, 
+                        execution_date=skonto_date or due_date, 
+                        esr_reference=purchase_invoice.esr_reference, 
+                        esr_participation_number=purchase_invoice.esr_participation_number, 
+                        bic=supl.bic,
+                        receiver_id=supl.name
+                    )
+                    total += this_amount
+                else:
+                    amount += this_amount
+                # create payment on intermediate
+                if self.use_intermediate == 1:
+                    
+                    self.create_payment("Supplier", supplier, 
+                        "Purchase Invoice", purchase_invoice.purchase_invoice, exec_date,
+                        purchase_invoice.amount, self.company, reference_data=pinv)
             # make sure execution date is valid
             if exec_date < datetime.now():
                 exec_date = datetime.now()      # + timedelta(days=1)
             # add new payment record
             if amount > 0:
-                supl = frappe.get_doc("Supplier", supplier)
-                addr = frappe.get_doc("Address", address)
+                addr = get_address(address_data, address, purchase_invoices[-1].purchase_invoice)
                 if payment_type in ["ESR", "QRR", "SCOR"]:           # prevent if last invoice was by ESR/QRR/SCOR, but others are also present -> pay as IBAN
                     payment_type = "IBAN"
                 self.add_payment(
@@ -188,38 +189,34 @@ class PaymentProposal(Document):
                     receiver_id=supl.name
                 )
                 total += amount
+        # mark purchase invoices as proposed
+        set_proposed("Purchase Invoice", [p.purchase_invoice for p in self.purchase_invoices], 1)
         # collect employees
-        employees = []
+        employees = {}
         account_currency = frappe.get_value("Account", self.pay_from_account, 'account_currency')
         for expense_claim in self.expenses:
-            if expense_claim.employee not in employees:
-                employees.append(expense_claim.employee)
+            employees.setdefault(expense_claim.employee, []).append(expense_claim)
+        employee_data = get_records("Employee", list(employees.keys()) + [s.employee for s in self.salaries],
+            ['employee_name', 'permanent_address', 'bank_ac_no', 'bic', 'company'])
         # aggregate expense claims
-        for employee in employees:
+        for employee, expense_claims in employees.items():
             amount = 0
             references = []
             currency = ""
-            for expense_claim in self.expenses:
-                if expense_claim.employee == employee:
-                    amount += expense_claim.amount
-                    currency = account_currency
-                    references.append(expense_claim.expense_claim)
-                    # mark expense claim as proposed
-                    invoice = frappe.get_doc("Expense Claim", expense_claim.expense_claim)
-                    invoice.is_proposed = 1
-                    invoice.save()
-                    # create payment on intermediate
-                    if cint(self.use_intermediate) == 1:
-                        self.create_payment("Employee", employee, 
-                            "Expense Claim", expense_claim.expense_claim, exec_date,
-                            expense_claim.amount)
+            for expense_claim in expense_claims:
+                amount += expense_claim.amount
+                currency = account_currency
+                references.append(expense_claim.expense_claim)
+                # create payment on intermediate
+                if cint(self.use_intermediate) == 1:
+                    self.create_payment("Employee", employee, 
+                        "Expense Claim", expense_claim.expense_claim, exec_date,
+                        expense_claim.amount, self.company)
             # add new payment record
-            emp = frappe.get_doc("Employee", employee)
-            if not emp.permanent_address:
-                frappe.throw( _("Employee <a href=\"/desk#Form/Employee/{0}\">{0}</a> has no address.").format(emp.name) )
+            emp = get_employee(employee_data, employee)
             address_lines = (emp.permanent_address or "").split("\n")
             plz_city = address_lines[1].split(" ")
-            cntry = frappe.get_value("Company", emp.company, "country")
+            cntry = frappe.get_cached_value("Company", emp.company, "country")
             self.add_payment(
                 receiver_name=emp.employee_name, 
                 iban=emp.bank_ac_no,
@@ -236,24 +233,20 @@ class PaymentProposal(Document):
                 execution_date=self.date
             )
             total += amount
+        # mark expense claims as proposed
+        set_proposed("Expense Claim", [e.expense_claim for e in self.expenses], 1)
         # add salaries
         for salary in self.salaries:
-            # mark expense claim as proposed
-            salary_slip = frappe.get_doc("Salary Slip", salary.salary_slip)
-            salary_slip.is_proposed = 1
-            salary_slip.save()
             # create payment on intermediate
             if self.use_intermediate == 1:
-                self.create_payment("Employee", employee, 
+                self.create_payment("Employee", salary.employee, 
                     "Salary Slip", salary.salary_slip, exec_date,
-                    salary.amount)
+                    salary.amount, self.company)
             # add new payment record
-            emp = frappe.get_doc("Employee", salary.employee)
-            if not emp.permanent_address:
-                frappe.throw( _("Employee <a href=\"/desk#Form/Employee/{0}\">{0}</a> has no address.").format(emp.name) )
+            emp = get_employee(employee_data, salary.employee)
             address_lines = emp.permanent_address.split("\n")
             plz_city = address_lines[1].split(" ")
-            cntry = frappe.get_value("Company", emp.company, "country")
+            cntry = frappe.get_cached_value("Company", emp.company, "country")
             self.add_payment(
                 receiver_name=emp.employee_name, 
                 iban=emp.bank_ac_no,
@@ -271,6 +264,8 @@ class PaymentProposal(Document):
                 is_salary=1
             )
             total += salary.amount
+        # mark salary slips as proposed
+        set_proposed("Salary Slip", [s.salary_slip for s in self.salaries], 1)
         # update total
         self.total = total
         # save
@@ -278,21 +273,9 @@ class PaymentProposal(Document):
 
     def on_cancel(self):
         # reset is_proposed
-        for purchase_invoice in self.purchase_invoices:
-            # un-mark sales invoices as proposed
-            invoice = frappe.get_doc("Purchase Invoice", purchase_invoice.purchase_invoice)
-            invoice.is_proposed = 0
-            invoice.save()        
-        for expense_claim in self.expenses:
-            # un-mark expense claim as proposed
-            invoice = frappe.get_doc("Expense Claim", expense_claim.expense_claim)
-            invoice.is_proposed = 0
-            invoice.save()   
-        for salary_slip in self.salaries:
-            # un-mark salary slip as proposed
-            invoice = frappe.get_doc("Salary Slip", salary_slip.salary_slip)
-            invoice.is_proposed = 0
-            invoice.save()
+        set_proposed("Purchase Invoice", [p.purchase_invoice for p in self.purchase_invoices], 0)
+        set_proposed("Expense Claim", [e.expense_claim for e in self.expenses], 0)
+        set_proposed("Salary Slip", [s.salary_slip for s in self.salaries], 0)
             
         if cint(self.use_intermediate) == 1:
             # cancel payment entries
@@ -345,13 +328,16 @@ class PaymentProposal(Document):
     
     def create_payment(self, party_type, party_name, 
                             reference_type, reference_name, date,
-                            amount, company):
+                            amount, company, reference_data=None):
         intermediate_currency = frappe.get_cached_value("Account", self.intermediate_account, 'account_currency')
         if reference_type == "Purchase Invoice":
-            credit_to = frappe.get_value(reference_type, reference_name, "credit_to")
+            # credit_to, currency and conversion_rate (prefetched on submit)
+            reference_data = reference_data or frappe.get_value(reference_type, reference_name,
+                ['credit_to', 'currency', 'conversion_rate'], as_dict=True)
+            credit_to = reference_data.credit_to
             # if the document is in a foreign currency, calculate to expected value
-            if frappe.get_value(reference_type, reference_name, "currency") != intermediate_currency:
-                amount = rounded(amount * frappe.get_value(reference_type, reference_name, "conversion_rate"), 2)
+            if reference_data.currency != intermediate_currency:
+                amount = rounded(amount * reference_data.conversion_rate, 2)
         elif reference_type == "Expense Claim":
             credit_to = frappe.get_value(reference_type, reference_name, "payable_account")
         elif reference_type == "Expense Claim":
@@ -425,6 +411,7 @@ class PaymentProposal(Document):
         data['company']['iban'] = "{0}".format(payment_account.iban.replace(" ", ""))
         data['company']['bic'] = "{0}".format(payment_account.bic.replace(" ", ""))
         data['payments'] = []
+        country_codes = {c.name: (c.code or "").upper() for c in frappe.get_all("Country", fields=['name', 'code'])}
         for payment in self.payments:
             payment_content = ""
             payment_record = {
@@ -447,7 +434,7 @@ class PaymentProposal(Document):
                     'address_line2': html.escape(payment.receiver_address_line2[:35]),
                     'street': html.escape(get_street_name(payment.receiver_address_line1)[:35]),
                     'building': html.escape(get_building_number(payment.receiver_address_line1)[:5]),
-                    'country_code': frappe.get_value("Country", payment.receiver_country, "code").upper(),
+                    'country_code': country_codes.get(payment.receiver_country) or "",
                     'pincode': html.escape((payment.receiver_pincode or "")[:16]),
                     'city': html.escape((payment.receiver_city or "")[:35])
                 },
@@ -868,6 +855,44 @@ def create_payment_proposal(date=None, company=None, currency=None):
     frappe.db.commit()
     return get_url_to_form("Payment Proposal", new_record)
 
+def get_records(doctype, names, fields):
+    """
+    {name: record} for a set of documents, in chunked queries
+    """
+    records = {}
+    for chunk in get_chunks(set(n for n in names if n)):
+        for record in frappe.get_all(doctype, filters={'name': ['in', chunk]}, fields=['name'] + fields):
+            records[record.name] = record
+    return records
+
+def get_address(address_data, address, purchase_invoice):
+    if address not in address_data:
+        frappe.throw( _("Purchase Invoice {0} has no valid supplier address.").format(purchase_invoice) )
+    return address_data[address]
+
+def get_employee(employee_data, employee):
+    emp = employee_data.get(employee) or frappe._dict({'name': employee})
+    if not emp.permanent_address:
+        frappe.throw( _("Employee <a href=\"/desk#Form/Employee/{0}\">{0}</a> has no address.").format(emp.name) )
+    return emp
+
+def set_proposed(doctype, names, is_proposed):
+    """
+    Set (or reset) is_proposed of a set of documents in one update per chunk
+    """
+    for chunk in get_chunks(set(n for n in names if n)):
+        frappe.db.sql("""
+            UPDATE `tab{doctype}`
+            SET `is_proposed` = %(is_proposed)s,
+                `modified` = %(modified)s,
+                `modified_by` = %(modified_by)s
+            WHERE `name` IN %(names)s;""".format(doctype=doctype),
+            {'is_proposed': is_proposed, 'modified': now(), 'modified_by': frappe.session.user, 'names': tuple(chunk)})
+    return
+
+def to_datetime(value):
+    return datetime.combine(getdate(value), datetime.min.time())
+
 # adds Windows-compatible line endings (to make the xml look nice)    
 def make_line(line):
     return line + "\r\n"
@@ -7,11 +7,13 @@ import frappe
 from frappe.model.document import Document
 from datetime import datetime
 import json
+import time
 from frappe.utils.data import add_days
 from erpnextswiss.erpnextswiss.finance import get_customer_ledger, get_debit_accounts
 from frappe.utils.background_jobs import enqueue
 from frappe import _
 from frappe.utils import cint, flt
+from erpnextswiss.erpnextswiss.utils import get_chunks
 
 class PaymentReminder(Document):
     # this will apply all payment reminder levels and blocking days (as exclude_from_payment_reminder_until) in the sales invoices
@@ -24,7 +26,7 @@ class PaymentReminder(Document):
             sales_invoice.payment_reminder_level = invoice.reminder_level
             
             # apply exclude_from_payment_reminder_until based on blocking days
-            if len(get_blocking_days()) >= invoice.reminder_level:
+            if len(blocking_days) >= invoice.reminder_level:
                 if blocking_days[str(invoice.reminder_level)] > 0:
                     exclude_from_payment_reminder_until = add_days(self.date, blocking_days[str(invoice.reminder_level)])
                     sales_invoice.exclude_from_payment_reminder_until = exclude_from_payment_reminder_until
@@ -40,9 +42,10 @@ class PaymentReminder(Document):
     pass
 
 @frappe.whitelist()
-def enqueue_create_payment_reminders(company):
+def enqueue_create_payment_reminders(company, batch=1):
     kwargs={
-      'company': company
+      'company': company,
+      'batch': batch
     }
     
     enqueue("erpnextswiss.erpnextswiss.doctype.payment_reminder.payment_reminder.create_payment_reminders",
@@ -53,7 +56,9 @@ def enqueue_create_payment_reminders(company):
     
 # this function will create new payment reminders
 @frappe.whitelist()
-def create_payment_reminders(company):
+def create_payment_reminders(company, batch=0):
+    if cint(batch):
+        return create_payment_reminders_batch(company)
     # check auto submit
     auto_submit = frappe.get_value("ERPNextSwiss Settings", "ERPNextSwiss Settings", "payment_reminder_auto_submit")
     # get all customers with open sales invoices
@@ -69,14 +74,7 @@ def create_payment_reminders(company):
     customers = frappe.db.sql(sql_query, as_dict=True)
     # get all sales invoices that are overdue
     if customers:
-        # find maximum reminder level
-        sql_query = ("""SELECT MAX(`reminder_level`) AS `max` FROM `tabERPNextSwiss Settings Payment Reminder Charge`;""")
-        try:
-            max_level = frappe.db.sql(sql_query, as_dict=True)[0]['max']
-            if not max_level:
-                max_level = 3
-        except:
-            max_level = 3
+        max_level = get_max_level()
         for customer in customers:
             create_reminder_for_customer(customer.customer, company, auto_submit, max_level)
     return
@@ -85,9 +83,106 @@ def create_payment_reminders(company):
 def create_reminder_for_customer(customer, company, auto_submit=False, max_level=3):
     max_level = cint(max_level)
     payment_reminder_name = None
-    sql_query = ("""
+    open_invoices = get_overdue_invoices(company, customer).get(customer)
+    if open_invoices:
+        # check if this customer has an overall credit balance
+        if frappe.get_value("ERPNextSwiss Settings", "ERPNextSwiss Settings", "no_reminder_on_credit_balance"):
+            # get customer credit balance
+            debit_accounts = get_debit_accounts(company)
+            gl_records = get_customer_ledger(debit_accounts, customer)
+            if len(gl_records) > 0 and gl_records[-1]['balance'] >= 0.001:      # apply a threshold to prevent issues with python floating point operations
+                return        # skip on balance
+        
+        new_reminder = get_payment_reminder(customer, company, open_invoices, max_level, get_reminder_charges(),
+            flt(frappe.get_cached_value("ERPNextSwiss Settings", "ERPNextSwiss Settings", "reminder_min_threshold")))
+        # only create a payment reminder if the total is above the threshold (if set in the ERPNextSwiss Settings)
+        if not new_reminder:
+            return None
+        result = insert_payment_reminders([new_reminder], auto_submit)
+        if result['created']:
+            payment_reminder_name = result['created'][0]
+    return payment_reminder_name
+
+def create_payment_reminders_batch(company, chunk_size=100):
+    """
+    Create the payment reminders of all customers of a company: overdue invoices and
+    customer balances are read in one pass, reminders are inserted and committed in chunks
+    """
+    start = time.time()
+    settings = frappe.get_doc("ERPNextSwiss Settings", "ERPNextSwiss Settings")
+    max_level = get_max_level()
+    charges = get_reminder_charges()
+    min_threshold = flt(settings.get("reminder_min_threshold"))
+    overdue_invoices = get_overdue_invoices(company)
+    balances = {}
+    if settings.get("no_reminder_on_credit_balance"):
+        balances = get_customer_balances(get_debit_accounts(company), list(overdue_invoices.keys()))
+    
+    reminders = []
+    skipped = 0
+    for customer, open_invoices in overdue_invoices.items():
+        if flt(balances.get(customer)) >= 0.001:        # customer has a credit balance
+            skipped += 1
+            continue
+        reminder = get_payment_reminder(customer, company, open_invoices, max_level, charges, min_threshold)
+        if reminder:
+            reminders.append(reminder)
+        else:
+            skipped += 1
+    
+    created = []
+    errors = []
+    for i in range(0, len(reminders), chunk_size):
+        result = insert_payment_reminders(reminders[i:i + chunk_size], settings.get("payment_reminder_auto_submit"))
+        created += result['created']
+        errors += result['errors']
+        publish_progress(company, min(i + chunk_size, len(reminders)), len(reminders))
+    publish_progress(company, len(reminders), len(reminders), done=True)
+    
+    return {
+        'customers': len(overdue_invoices),
+        'created': len(created),
+        'failed': len(errors),
+        'errors': errors,
+        'skipped': skipped,
+        'duration': round(time.time() - start, 2)
+    }
+
+def publish_progress(company, progress, total, done=False):
+    frappe.publish_realtime("payment_reminder_progress", {
+        'company': company,
+        'progress': progress,
+        'total': total,
+        'done': done
+    }, user=frappe.session.user)
+    return
+
+def get_max_level():
+    # find maximum reminder level
+    sql_query = ("""SELECT MAX(`reminder_level`) AS `max` FROM `tabERPNextSwiss Settings Payment Reminder Charge`;""")
+    try:
+        max_level = frappe.db.sql(sql_query, as_dict=True)[0]['max']
+        if not max_level:
+            max_level = 3
+    except:
+        max_level = 3
+    return max_level
+
+# returns an object of reminder_level vs reminder_charge
+def get_reminder_charges():
+    charges = {}
+    for charge in frappe.get_all("ERPNextSwiss Settings Payment Reminder Charge", fields=['reminder_level', 'reminder_charge']):
+        charges.setdefault(cint(charge.reminder_level), flt(charge.reminder_charge))
+    return charges
+
+def get_overdue_invoices(company, customer=None):
+    """
+    Overdue invoices that can be reminded, grouped by customer
+    """
+    open_invoices = frappe.db.sql("""
         SELECT 
             `name`, 
+            `customer`,
             `due_date`, 
             `posting_date`, 
             `payment_reminder_level`, 
@@ -97,93 +192,139 @@ def create_reminder_for_customer(customer, company, auto_submit=False, max_level
             `contact_email`,
             `debit_to`
         FROM `tabSales Invoice` 
-        WHERE `outstanding_amount` > 0 AND `customer` = "{customer}"
+        WHERE `outstanding_amount` > 0
             AND `docstatus` = 1
             AND `enable_lsv` = 0
             AND (`due_date` < CURDATE())
-            AND `company` = "{company}"
-            AND ((`exclude_from_payment_reminder_until` IS NULL) OR (`exclude_from_payment_reminder_until` < CURDATE()));
-        """.format(customer=customer, company=company))
-    open_invoices = frappe.db.sql(sql_query, as_dict=True)
+            AND `company` = %(company)s
+            AND ((`exclude_from_payment_reminder_until` IS NULL) OR (`exclude_from_payment_reminder_until` < CURDATE()))
+            {customer_filter}
+        ORDER BY `customer` ASC, `due_date` ASC;
+        """.format(customer_filter="AND `customer` = %(customer)s" if customer else ""),
+        {'company': company, 'customer': customer}, as_dict=True)
+    invoices_by_customer = {}
+    for invoice in open_invoices:
+        invoices_by_customer.setdefault(invoice.customer, []).append(invoice)
+    return invoices_by_customer
+
+def get_customer_balances(accounts, customers):
+    """
+    Final ledger balance (credit - debit) per customer, same records as finance.get_customer_ledger:
+    entries with the customer as party or from a payment entry of the customer
+    """
+    balances = {}
+    if not accounts:
+        return balances
+    for chunk in get_chunks(customers):
+        for row in frappe.db.sql("""
+            SELECT `customer`, SUM(`amount`) AS `balance`
+            FROM (
+                SELECT 
+                    `tabGL Entry`.`party` AS `customer`,
+                    `tabGL Entry`.`credit` - `tabGL Entry`.`debit` AS `amount`
+                FROM `tabGL Entry`
+                WHERE `tabGL Entry`.`account` IN %(accounts)s
+                  AND `tabGL Entry`.`party` IN %(customers)s
+                UNION ALL
+                SELECT 
+                    `tabPayment Entry`.`party` AS `customer`,
+                    `tabGL Entry`.`credit` - `tabGL Entry`.`debit` AS `amount`
+                FROM `tabGL Entry`
+                JOIN `tabPayment Entry` ON `tabPayment Entry`.`name` = `tabGL Entry`.`voucher_no`
+                WHERE `tabGL Entry`.`account` IN %(accounts)s
+                  AND `tabPayment Entry`.`party` IN %(customers)s
+                  AND (`tabGL Entry`.`party` IS NULL OR `tabGL Entry`.`party` != `tabPayment Entry`.`party`)
+            ) AS `entries`
+            GROUP BY `customer`;""", {'accounts': tuple(accounts), 'customers': tuple(chunk)}, as_dict=True):
+            balances[row.customer] = row.balance
+    return balances
+
+def get_payment_reminder(customer, company, open_invoices, max_level, charges, min_threshold=0):
+    """
+    Build a new payment reminder (dict) from the open invoices of a customer,
+    None if the total is below the threshold (ERPNextSwiss Settings)
+    """
+    max_level = cint(max_level)
+    now = datetime.now()
+    invoices = []
+    highest_level = 0
+    total_before_charges = 0
+    currency = None
     email = None
-    if open_invoices:
-        # check if this customer has an overall credit balance
-        if frappe.get_value("ERPNextSwiss Settings", "ERPNextSwiss Settings", "no_reminder_on_credit_balance"):
-            # get customer credit balance
-            debit_accounts = get_debit_accounts(company)
-            gl_records = get_customer_ledger(debit_accounts, customer)
-            if len(gl_records) > 0 and gl_records[-1]['balance'] >= 0.001:      # apply a threshold to prevent issues with python floating point operations
-                return        # skip on balance
-                
-        now = datetime.now()
-        invoices = []
-        highest_level = 0
-        total_before_charges = 0
-        currency = None
-        for invoice in open_invoices:
-            level = invoice.payment_reminder_level + 1
-            if level > max_level:
-                level = max_level
-            new_invoice = { 
-                'sales_invoice': invoice.name,
-                'amount': invoice.grand_total,
-                'outstanding_amount': invoice.outstanding_amount,
-                'debit_account': invoice.debit_to,
-                'posting_date': invoice.posting_date,
-                'due_date': invoice.due_date,
-                'reminder_level': level
-            }
-            if level > highest_level:
-                highest_level = level
-            total_before_charges += invoice.outstanding_amount
-            invoices.append(new_invoice)
-            currency = invoice.currency
-            if invoice.contact_email:
-                email = invoice.contact_email
-        # find reminder charge
-        charge_matches = frappe.get_all("ERPNextSwiss Settings Payment Reminder Charge", 
-            filters={ 'reminder_level': highest_level },
-            fields=['reminder_charge'])
-        reminder_charge = 0
-        if charge_matches:
-            reminder_charge = charge_matches[0]['reminder_charge']
-        new_reminder = frappe.get_doc({
-            "doctype": "Payment Reminder",
-            "customer": customer,
-            "date": "{year:04d}-{month:02d}-{day:02d}".format(
-                year=now.year, month=now.month, day=now.day),
-            "title": "{customer} {year:04d}-{month:02d}-{day:02d}".format(
-                customer=customer, year=now.year, month=now.month, day=now.day),
-            "sales_invoices": invoices,
-            'highest_level': highest_level,
-            'total_before_charge': total_before_charges,
-            'reminder_charge': reminder_charge,
-            'total_with_charge': (total_before_charges + reminder_charge),
-            'company': company,
-            'currency': currency,
-            'email': email
-        })
-        # only create a payment reminder if the total is above the threshold (if set in the ERPNextSwiss Settings)
-        if total_before_charges < flt(frappe.get_cached_value("ERPNextSwiss Settings", "ERPNextSwiss Settings", "reminder_min_threshold")):
-            return None
-        flag_enabled_customer = False
+    for invoice in open_invoices:
+        level = invoice.payment_reminder_level + 1
+        if level > max_level:
+            level = max_level
+        new_invoice = { 
+            'sales_invoice': invoice.name,
+            'amount': invoice.grand_total,
+            'outstanding_amount': invoice.outstanding_amount,
+            'debit_account': invoice.debit_to,
+            'posting_date': invoice.posting_date,
+            'due_date': invoice.due_date,
+            'reminder_level': level
+        }
+        if level > highest_level:
+            highest_level = level
+        total_before_charges += invoice.outstanding_amount
+        invoices.append(new_invoice)
+        currency = invoice.currency
+        if invoice.contact_email:
+            email = invoice.contact_email
+    if total_before_charges < min_threshold:
+        return None
+    # find reminder charge
+    reminder_charge = charges.get(highest_level) or 0
+    return {
+        "doctype": "Payment Reminder",
+        "customer": customer,
+        "date": "{year:04d}-{month:02d}-{day:02d}".format(
+            year=now.year, month=now.month, day=now.day),
+        "title": "{customer} {year:04d}-{month:02d}-{day:02d}".format(
+            customer=customer, year=now.year, month=now.month, day=now.day),
+        "sales_invoices": invoices,
+        'highest_level': highest_level,
+        'total_before_charge': total_before_charges,
+        'reminder_charge': reminder_charge,
+        'total_with_charge': (total_before_charges + reminder_charge),
+        'company': company,
+        'currency': currency,
+        'email': email
+    }
+
+def insert_payment_reminders(reminders, auto_submit=False):
+    """
+    Insert (and submit) a list of payment reminders in one transaction. A failed reminder is
+    rolled back to its savepoint (no draft is left behind) and does not affect the others.
+    :returns:   dict with the created reminder names and the errors per customer
+    """
+    customers = list(set(r.get('customer') for r in reminders))
+    # in case a customer is disabled: briefly enable to allow document creation
+    # note: we directly access the DB, because set_value with update_modified=False will still create 2 unwanted timeline entries
+    disabled_customers = [c.name for c in frappe.get_all("Customer", 
+        filters={'name': ['in', customers], 'disabled': 1}, fields=['name'])] if customers else []
+    if disabled_customers:
+        frappe.db.sql("""UPDATE `tabCustomer` SET `disabled` = 0 WHERE `name` IN %(customers)s;""", 
+            {'customers': tuple(disabled_customers)})
+    created = []
+    errors = []
+    for reminder in reminders:
+        frappe.db.savepoint("payment_reminder")
         try:
-            # in case the customer is disabled: briefly enable to allow document creation
-            if cint(frappe.get_value("Customer", customer, "disabled")):
-                # note: we directly access the DB, because set_value with update_modified=False will still create 2 unwanted timeline entries
-                frappe.db.sql("""UPDATE `tabCustomer` SET `disabled` = 0 WHERE `name` = "{customer}";""".format(customer=customer))
-                flag_enabled_customer = True
-            reminder_record = new_reminder.insert(ignore_permissions=True)
-            payment_reminder_name = reminder_record.name
+            reminder_record = frappe.get_doc(reminder).insert(ignore_permissions=True)
+            if cint(auto_submit) == 1:
+                reminder_record.update_reminder_levels()
+                reminder_record.submit()
+            created.append(reminder_record.name)
         except Exception as err:
+            frappe.db.rollback(save_point="payment_reminder")
+            errors.append({'customer': reminder.get('customer'), 'error': "{0}".format(err)})
             frappe.log_error(err, _("Unable to create payment reminder") )
-        if int(auto_submit) == 1:
-            reminder_record.update_reminder_levels()
-            reminder_record.submit()
-        if flag_enabled_customer:
-            frappe.db.sql("""UPDATE `tabCustomer` SET `disabled` = 1 WHERE `name` = "{customer}";""".format(customer=customer))
-        frappe.db.commit()
-    return payment_reminder_name
+    if disabled_customers:
+        frappe.db.sql("""UPDATE `tabCustomer` SET `disabled` = 1 WHERE `name` IN %(customers)s;""", 
+            {'customers': tuple(disabled_customers)})
+    frappe.db.commit()
+    return {'created': created, 'errors': errors}
 
 # this allows to submit multiple payment reminders at once
 @frappe.whitelist()
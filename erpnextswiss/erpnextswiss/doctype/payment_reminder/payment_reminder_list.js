@@ -32,17 +32,27 @@ frappe.listview_settings['Payment Reminder'] = {
         }); 
         function create_payment_reminders(values) {
             frappe.call({
-                'method': "erpnextswiss.erpnextswiss.doctype.payment_reminder.payment_reminder.create_payment_reminders",
+                'method': "erpnextswiss.erpnextswiss.doctype.payment_reminder.payment_reminder.enqueue_create_payment_reminders",
                 'args': {
-                    'company': values.company
+                    'company': values.company,
+                    'batch': 1
                 },
                 'callback': function() {
-                    frappe.show_alert( __("Payment Reminders created") );
-                    setTimeout(function() { window.location.reload(); }, 1000);
-                    listview.refresh();
+                    frappe.show_alert( __("Creating Payment Reminders...") );
                 }
             });
-        } 
+        }
+        // progress of the batch run (background job); onload runs for each list load, keep one handler
+        frappe.realtime.off("payment_reminder_progress");
+        frappe.realtime.on("payment_reminder_progress", function(data) {
+            if (data.done) {
+                frappe.hide_progress();
+                frappe.show_alert( __("Payment Reminders created") );
+                listview.refresh();
+            } else {
+                frappe.show_progress(__("Create Payment Reminders"), data.progress, data.total, data.company);
+            }
+        });
     }
 }
 
@@ -6,9 +6,11 @@ from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
 from frappe import _
+from frappe.utils import cint
 import csv
 from frappe.utils.background_jobs import enqueue
 from math import sin, cos, sqrt, atan2, radians
+from erpnextswiss.erpnextswiss.bulk_import import bulk_upsert
 
 class Pincode(Document):
     pass
@@ -18,9 +20,10 @@ def import_pincodes_from_file(filename):
     import_pincodes(f.read())
 
 @frappe.whitelist()
-def enqueue_import_pincodes(content):
+def enqueue_import_pincodes(content, bulk=1):
     kwargs={
-          'content': content
+          'content': content,
+          'bulk': cint(bulk)
         }
     
     enqueue("erpnextswiss.erpnextswiss.doctype.pincode.pincode.import_pincodes",
@@ -29,11 +32,13 @@ def enqueue_import_pincodes(content):
         **kwargs)
     return {'result': _('Import started...')}
 
-def import_pincodes(content):   
+def import_pincodes(content, bulk=True):
     isfirst = True
     field_index = {}
     # read csv
     elements = csv.reader(content.splitlines(), dialect=csv.excel)
+    if bulk:
+        return import_pincodes_bulk(elements)
     # process elements
     for element in elements:
         if isfirst:
@@ -88,6 +93,49 @@ def import_pincodes(content):
     
     return {'result': _('Successfully imported')}
 
+"""
+Bulk mode: compare the file with the existing pincodes in memory and write batches
+"""
+def import_pincodes_bulk(elements):
+    countries = {}
+    for c in frappe.get_all("Country", fields=['name', 'code']):
+        countries.setdefault((c['code'] or "").lower(), c['name'])
+    field_index = {}
+    records = []
+    for element in elements:
+        if not field_index:
+            # header: loop through cells
+            for i in range(0, len(element)):
+                field_index[element[i].lower()] = i
+            continue
+        if not element:
+            continue
+        try:
+            country_code = element[field_index['country_code']].lower()
+        except:
+            country_code = "ch"
+        title = "{0}-{1}".format(element[field_index['pincode']] or 0, element[field_index['city']] or "")
+        records.append({
+            'name': title,
+            'pincode': element[field_index['pincode']] or 0,
+            'city': element[field_index['city']] or "",
+            'canton': element[field_index['canton']] or "",
+            'canton_code': element[field_index['canton_code']] or "",
+            'bfsnr': (element[field_index['bfsnr']] or "") if 'bfsnr' in field_index else "",
+            'country': countries.get(country_code) or "Switzerland",
+            'country_code': country_code,
+            'title': title,
+            'longitude': element[field_index['longitude']] or "",
+            'latitude': element[field_index['latitude']] or ""
+        })
+    
+    result = bulk_upsert("Pincode", records, 
+        key_fields=['pincode', 'city'], 
+        update_fields=['longitude', 'latitude', 'bfsnr'])
+    result['result'] = _("Successfully imported: {0} inserted, {1} updated, {2} unchanged ({3} s)").format(
+        result.inserted, result.updated, result.unchanged, result.duration)
+    return result
+
 @frappe.whitelist()
 def get_distance(pincode1, pincode2):
     # compute the distance between to pincodes
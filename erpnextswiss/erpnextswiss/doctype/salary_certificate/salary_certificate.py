@@ -3,8 +3,21 @@
 # For license information, please see license.txt
 
 from __future__ import unicode_literals
+import os
+import time
+import multiprocessing
 import frappe
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from frappe import _
 from frappe.model.document import Document
+from frappe.utils import cint
+from frappe.utils.pdf import get_pdf
+from frappe.utils.file_manager import save_file
+from erpnextswiss.erpnextswiss.utils import get_chunks
+from erpnextswiss.erpnextswiss.bulk_import import insert_batch
+
+BATCH_SIZE = 200
 
 class SalaryCertificate(Document):
     # this function gathers values from the database
@@ -23,156 +36,265 @@ class SalaryCertificate(Document):
  
 # Old way for compatiblity  
 def fetch_static(self):
-    sql_query = """SELECT IFNULL(SUM(`tabSalary Slip`.`gross_pay`), 0) AS `gross`, IFNULL(SUM(`tabSalary Slip`.`net_pay`), 0) AS `net` 
-        FROM `tabSalary Slip` 
-        WHERE `tabSalary Slip`.`employee` = '{0}'
-        AND `tabSalary Slip`.`posting_date` >= '{1}'
-        AND `tabSalary Slip`.`posting_date` <= '{2}'
-        AND `tabSalary Slip`.`docstatus` = 1;""".format(self.employee, self.start_date, self.end_date)
-    values = frappe.db.sql(sql_query, as_dict=True)
-    self.salary = get_component(self.employee, self.start_date, self.end_date, "B")
-    self.gross_salary = values[0].gross
-    self.net_salary = values[0].net
-    self.deduction_ahv = (get_component(self.employee, self.start_date, self.end_date, "AHV") + 
-        get_component(self.employee, self.start_date, self.end_date, "ALV") +
-        get_component(self.employee, self.start_date, self.end_date, "NBUV"))
-    self.deduction_pension = get_component(self.employee, self.start_date, self.end_date, "PK")   
-        
+    totals = SalaryTotals([self.employee], self.start_date, self.end_date)
+    self.update(get_static_values(self.employee, totals))
     self.save()
 
+def get_static_values(employee, totals):
+    gross, net = totals.get_totals(employee)
+    return {
+        'salary': totals.get_abbr(employee, "B"),
+        'gross_salary': gross,
+        'net_salary': net,
+        'deduction_ahv': (totals.get_abbr(employee, "AHV") +
+            totals.get_abbr(employee, "ALV") +
+            totals.get_abbr(employee, "NBUV")),
+        'deduction_pension': totals.get_abbr(employee, "PK")
+    }
 
 def get_component(employee, start_date, end_date, component):
-    sql_query = """SELECT `tabSalary Slip`.`employee`, IFNULL(SUM(`tabSalary Detail`.`amount`), 0) AS `amount`
-        FROM `tabSalary Slip` 
-        INNER JOIN `tabSalary Detail` ON `tabSalary Slip`.`name` = `tabSalary Detail`.`parent`
-        WHERE `tabSalary Slip`.`employee` = '{0}'
-        AND `tabSalary Slip`.`posting_date` >= '{1}'
-        AND `tabSalary Slip`.`posting_date` <= '{2}'
-        AND `tabSalary Slip`.`docstatus` = 1
-        AND `tabSalary Detail`.`abbr` = '{3}';""".format(employee, start_date, end_date, component)
-    values = frappe.db.sql(sql_query, as_dict=True)
-    return values[0].amount
+    return SalaryTotals([employee], start_date, end_date).get_abbr(employee, component)
 
 # new way to configure witch salary component is witch field in salary certificate
 
+# certificate fields with a component list in the settings (Pos 1 - 13)
+DYNAMIC_AMOUNT_FIELDS = ['salary', 'catering', 'car', 'other_salary', 'irregular', 'capital', 'participation',
+    'board', 'other', 'deduction_ahv', 'deduction_pension', 'deduction_pension_additional', 'source_tax_deduction',
+    'effective_expenses_travel', 'effective_other_expenses', 'representation_expenses', 'car_expenses',
+    'other_net_expenses', 'education']
+# certificate fields taken over from the settings
+DYNAMIC_SETTINGS_FIELDS = ['other_salary_description', 'irregular_description', 'capital_description',
+    'other_description', 'effective_expenses_travel_check', 'effective_other_expenses_description',
+    'other_net_expenses_description', 'other_salary_sides']
+
 def fetch_dynamic(self):
-    sql_query = """SELECT IFNULL(SUM(`tabSalary Slip`.`gross_pay`), 0) AS `gross`, IFNULL(SUM(`tabSalary Slip`.`net_pay`), 0) AS `net` 
-        FROM `tabSalary Slip` 
-        WHERE `tabSalary Slip`.`employee` = '{0}'
-        AND `tabSalary Slip`.`posting_date` >= '{1}'
-        AND `tabSalary Slip`.`posting_date` <= '{2}'
-        AND `tabSalary Slip`.`docstatus` = 1;""".format(self.employee, self.start_date, self.end_date)
-    values = frappe.db.sql(sql_query, as_dict=True)
-   
-    # Pos 1
-    self.salary = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').salary)
-    # Pos 2.1
-    self.catering = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').catering)
-    # Pos 2.2
-    self.car = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').car)
-    # Pos 2.3
-    self.other_salary = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').other_salary)
-    self.other_salary_description = frappe.get_doc('Salary Certificate Settings').other_salary_description
-    # Pos 3
-    self.irregular = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').irregular)
-    self.irregular_description = frappe.get_doc('Salary Certificate Settings').irregular_description
-    # Pos 4
-    self.capital = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').capital)
-    self.capital_description = frappe.get_doc('Salary Certificate Settings').capital_description
-    # Pos 5
-    self.participation = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').participation)
-    # Pos 6
-    self.board = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').board)
-    # Pos 7
-    self.other = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').other)
-    self.other_description = frappe.get_doc('Salary Certificate Settings').other_description
+    totals = SalaryTotals([self.employee], self.start_date, self.end_date)
+    self.update(get_dynamic_values(self.employee, totals, frappe.get_doc('Salary Certificate Settings')))
+    self.save()
+
+def get_dynamic_values(employee, totals, settings):
+    values = {}
+    for field in DYNAMIC_AMOUNT_FIELDS:
+        values[field] = get_component_dynamic(employee, None, None, settings.get(field), totals)
+    for field in DYNAMIC_SETTINGS_FIELDS:
+        values[field] = settings.get(field)
+    gross, net = totals.get_totals(employee)
     # Pos 8
-    self.gross_salary = values[0].gross
-    # Pos 9
-    self.deduction_ahv = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').deduction_ahv)
-    # Pos 10.1
-    self.deduction_pension = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').deduction_pension)
-    # Pos 10.2
-    self.deduction_pension_additional = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').deduction_pension_additional)
+    values['gross_salary'] = gross
     # Pos 11
-    self.net_salary = values[0].net
-    # Pos 12
-    self.source_tax_deduction = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').source_tax_deduction)
-    # Pos 13.1.1
-    self.effective_expenses_travel = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').effective_expenses_travel)
-    self.effective_expenses_travel_check = frappe.get_doc('Salary Certificate Settings').effective_expenses_travel_check
-    # Pos 13.1.2
-    self.effective_other_expenses = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').effective_other_expenses)
-    self.effective_other_expenses_description = frappe.get_doc('Salary Certificate Settings').effective_other_expenses_description
-    # Pos 13.2.1
-    self.representation_expenses = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').representation_expenses)
-    # Pos 13.2.2
-    self.car_expenses = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').car_expenses)
-    # Pos 13.2.3
-    self.other_net_expenses = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').other_net_expenses)
-    self.other_net_expenses_description = frappe.get_doc('Salary Certificate Settings').other_net_expenses_description
-    # Pos 13
-    self.education = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').education)
-    # Pos 14
-    self.other_salary_sides = frappe.get_doc('Salary Certificate Settings').other_salary_sides
+    values['net_salary'] = net
     # Pos 15
-    value = get_component_dynamic(self.employee, self.start_date, self.end_date, frappe.get_doc('Salary Certificate Settings').remarks)
+    value = get_component_dynamic(employee, None, None, settings.get('remarks'), totals)
     if value != 0.00:
-        self.remarks = frappe.get_doc('Salary Certificate Settings').remark_prefix + "{:12.2f}".format(value)
+        values['remarks'] = (settings.remark_prefix or "") + "{:12.2f}".format(value)
     else:
-        self.remarks = frappe.get_doc('Salary Certificate Settings').remark_prefix
+        values['remarks'] = settings.remark_prefix
+    return values
 
-
-    self.save()
-
- 
-
-def get_component_dynamic(employee, start_date, end_date, componentlist):
+def get_component_dynamic(employee, start_date, end_date, componentlist, totals=None):
     
-    if len(componentlist) == 0:
+    if not componentlist or len(componentlist) == 0:
         return 0.0;
 
-    expression = "";
-    
-    positiv = []
-    negativ = []
+    positiv = set()
+    negativ = set()
     for item in componentlist:
-        comp = frappe.get_doc("Salary Component", item.component)
         if item.is_negativ == 1:
-            negativ.append(comp.name)
+            negativ.add(item.component)
         else:
-            positiv.append(comp.name)
-
-    expression = "' OR `tabSalary Detail`.`salary_component` = '"
-
-    pos = 0.0
-    neg = 0.0
-
-    if len(positiv) > 0:
-        expression_pos = expression.join(positiv)
-
-        sql_query_pos = """SELECT `tabSalary Slip`.`employee`, IFNULL(SUM(`tabSalary Detail`.`amount`), 0) AS `amount`
-            FROM `tabSalary Slip` 
-            INNER JOIN `tabSalary Detail` ON `tabSalary Slip`.`name` = `tabSalary Detail`.`parent`
-            WHERE `tabSalary Slip`.`employee` = '{0}'
-            AND `tabSalary Slip`.`posting_date` >= '{1}'
-            AND `tabSalary Slip`.`posting_date` <= '{2}'
-            AND `tabSalary Slip`.`docstatus` = 1
-            AND (`tabSalary Detail`.`salary_component` = '{3}');""".format(employee, start_date, end_date, expression_pos)
-        values = frappe.db.sql(sql_query_pos, as_dict=True)
-        pos = values[0].amount
-    
-    if len(negativ) > 0:
-        expression_neg = expression.join(negativ)
-
-        sql_query_neg = """SELECT `tabSalary Slip`.`employee`, IFNULL(SUM(`tabSalary Detail`.`amount`), 0) AS `amount`
-            FROM `tabSalary Slip` 
-            INNER JOIN `tabSalary Detail` ON `tabSalary Slip`.`name` = `tabSalary Detail`.`parent`
-            WHERE `tabSalary Slip`.`employee` = '{0}'
-            AND `tabSalary Slip`.`posting_date` >= '{1}'
-            AND `tabSalary Slip`.`posting_date` <= '{2}'
-            AND `tabSalary Slip`.`docstatus` = 1
-            AND (`tabSalary Detail`.`salary_component` = '{3}');""".format(employee, start_date, end_date, expression_neg)
-        values = frappe.db.sql(sql_query_neg, as_dict=True)
-        neg = values[0].amount
-    return pos - neg
+            positiv.add(item.component)
+
+    totals = totals or SalaryTotals([employee], start_date, end_date)
+    return totals.get_components(employee, positiv) - totals.get_components(employee, negativ)
+
+"""
+Salary slip totals (gross and net pay) and salary detail amounts by component
+of a period, for a set of employees in one grouped query each
+"""
+class SalaryTotals:
+    def __init__(self, employees, start_date, end_date):
+        self.totals = {}
+        self.components = {}
+        self.abbrs = {}
+        for chunk in get_chunks(employees):
+            params = {'employees': tuple(chunk), 'start_date': start_date, 'end_date': end_date}
+            for t in frappe.db.sql("""
+                    SELECT `employee`, IFNULL(SUM(`gross_pay`), 0) AS `gross`, IFNULL(SUM(`net_pay`), 0) AS `net`
+                    FROM `tabSalary Slip`
+                    WHERE `employee` IN %(employees)s
+                    AND `posting_date` >= %(start_date)s
+                    AND `posting_date` <= %(end_date)s
+                    AND `docstatus` = 1
+                    GROUP BY `employee`;""", params, as_dict=True):
+                self.totals[t.employee] = (t.gross, t.net)
+            for d in frappe.db.sql("""
+                    SELECT `tabSalary Slip`.`employee`, `tabSalary Detail`.`salary_component`, `tabSalary Detail`.`abbr`,
+                        IFNULL(SUM(`tabSalary Detail`.`amount`), 0) AS `amount`
+                    FROM `tabSalary Slip`
+                    INNER JOIN `tabSalary Detail` ON `tabSalary Slip`.`name` = `tabSalary Detail`.`parent`
+                    WHERE `tabSalary Slip`.`employee` IN %(employees)s
+                    AND `tabSalary Slip`.`posting_date` >= %(start_date)s
+                    AND `tabSalary Slip`.`posting_date` <= %(end_date)s
+                    AND `tabSalary Slip`.`docstatus` = 1
+                    GROUP BY `tabSalary Slip`.`employee`, `tabSalary Detail`.`salary_component`, `tabSalary Detail`.`abbr`;""",
+                    params, as_dict=True):
+                key = (d.employee, d.salary_component)
+                self.components[key] = self.components.get(key, 0) + d.amount
+                key = (d.employee, d.abbr)
+                self.abbrs[key] = self.abbrs.get(key, 0) + d.amount
+
+    def get_totals(self, employee):
+        return self.totals.get(employee, (0, 0))
+
+    def get_abbr(self, employee, abbr):
+        return self.abbrs.get((employee, abbr), 0)
+
+    def get_components(self, employee, components):
+        return sum(self.components.get((employee, c), 0) for c in components)
+
+@frappe.whitelist()
+def enqueue_create_salary_certificates(company, year, render_pdf=0, print_format=None):
+    frappe.enqueue("erpnextswiss.erpnextswiss.doctype.salary_certificate.salary_certificate.create_salary_certificates",
+        queue='long',
+        timeout=15000,
+        company=company,
+        year=year,
+        render_pdf=render_pdf,
+        print_format=print_format,
+        notify=True)
+    return {'result': _('Started...')}
+
+def create_salary_certificates(company, year, render_pdf=0, print_format=None, workers=None, notify=False):
+    """
+    Create the (draft) salary certificates of a year for all employees with salary slips of a company
+    :params:render_pdf:     attach the printed certificate (pdf) to each certificate
+    :returns:               dict with the names of the created certificates, pdf errors and duration
+    """
+    start = time.time()
+    year = cint(year)
+    start_date = date(year, 1, 1)
+    end_date = date(year, 12, 31)
+    employees = get_certificate_employees(company, year, start_date, end_date)
+    totals = SalaryTotals([e.employee for e in employees], start_date, end_date)
+    settings = frappe.get_doc('Salary Certificate Settings')
+    letter_head = frappe.get_cached_value("Company", company, "default_letter_head")
+
+    certificates = []
+    for i in range(0, len(employees), BATCH_SIZE):
+        records = []
+        for employee in employees[i:i + BATCH_SIZE]:
+            record = {
+                'name': frappe.generate_hash(length=10),
+                'employee': employee.employee,
+                'employee_name': employee.employee_name,
+                'company': company,
+                'letter_head': letter_head,
+                'year': year,
+                'start_date': start_date,
+                'end_date': end_date,
+                'certificate_type': "Salary",
+                'free_transport': 0,
+                'lunch_checks': 0
+            }
+            if cint(settings.dynamic_config) == 1:
+                record.update(get_dynamic_values(employee.employee, totals, settings))
+            else:
+                record.update(get_static_values(employee.employee, totals))
+            records.append(record)
+        if records:
+            insert_batch("Salary Certificate", records)
+            frappe.db.commit()
+            certificates += [r['name'] for r in records]
+        if cint(notify):
+            publish_progress(company, len(certificates), len(employees))
+
+    errors = []
+    if cint(render_pdf) and certificates:
+        workers = cint(workers) or cint(frappe.conf.get('salary_certificate_workers')) or os.cpu_count() or 1
+        for result in render_certificates(certificates, print_format, workers):
+            if result.get('error'):
+                errors.append({'salary_certificate': result['salary_certificate'], 'error': result['error']})
+                continue
+            save_file("{0}.pdf".format(result['salary_certificate']), result['pdf'], "Salary Certificate",
+                result['salary_certificate'], is_private=1)
+            frappe.db.commit()
+        if errors:
+            frappe.log_error("\n".join("{0}: {1}".format(e['salary_certificate'], e['error']) for e in errors),
+                "Salary certificate batch")
+
+    result = {
+        'certificates': certificates,
+        'errors': errors,
+        'duration': round(time.time() - start, 2)
+    }
+    if cint(notify):
+        publish_progress(company, len(certificates), len(employees), done=True)
+    return result
+
+def get_certificate_employees(company, year, start_date, end_date):
+    """
+    Employees with submitted salary slips in the period that have no salary certificate of this year
+    """
+    return frappe.db.sql("""
+        SELECT `tabSalary Slip`.`employee`, MAX(`tabSalary Slip`.`employee_name`) AS `employee_name`
+        FROM `tabSalary Slip`
+        WHERE `tabSalary Slip`.`company` = %(company)s
+        AND `tabSalary Slip`.`posting_date` >= %(start_date)s
+        AND `tabSalary Slip`.`posting_date` <= %(end_date)s
+        AND `tabSalary Slip`.`docstatus` = 1
+        AND `tabSalary Slip`.`employee` NOT IN (
+            SELECT `tabSalary Certificate`.`employee`
+            FROM `tabSalary Certificate`
+            WHERE `tabSalary Certificate`.`year` = %(year)s
+            AND `tabSalary Certificate`.`docstatus` < 2
+        )
+        GROUP BY `tabSalary Slip`.`employee`
+        ORDER BY `tabSalary Slip`.`employee` ASC;""",
+        {'company': company, 'year': year, 'start_date': start_date, 'end_date': end_date}, as_dict=True)
+
+def publish_progress(company, progress, total, done=False):
+    frappe.publish_realtime("salary_certificate_progress", {
+        'company': company,
+        'progress': progress,
+        'total': total,
+        'done': done
+    }, user=frappe.session.user)
+    return
+
+def render_certificates(certificates, print_format=None, workers=1):
+    """
+    Yield the result of render_certificate for all certificates
+    """
+    if workers <= 1 or len(certificates) <= 1:
+        for certificate in certificates:
+            yield render_certificate(certificate, print_format)
+        return
+    # spawn: do not fork the database connection and site state of this process
+    with ProcessPoolExecutor(max_workers=min(workers, len(certificates)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(frappe.local.site, frappe.session.user)) as executor:
+        futures = {executor.submit(render_certificate, certificate, print_format): certificate
+            for certificate in certificates}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as err:
+                # e.g. a worker process died
+                yield {'salary_certificate': futures[future], 'pdf': None, 'error': str(err)}
+
+def _init_worker(site, user):
+    frappe.init(site=site)
+    frappe.connect()
+    frappe.set_user(user)
+
+def render_certificate(certificate, print_format=None):
+    """
+    Print format and pdf of one certificate (runs in a worker)
+    """
+    result = {'salary_certificate': certificate, 'pdf': None, 'error': None}
+    try:
+        html = frappe.get_print("Salary Certificate", certificate, print_format)
+        result['pdf'] = get_pdf(html)
+    except Exception as err:
+        result['error'] = "{0}".format(err)
+    return result
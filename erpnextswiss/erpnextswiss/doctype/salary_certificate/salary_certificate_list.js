@@ -0,0 +1,36 @@
+frappe.listview_settings['Salary Certificate'] = {
+    onload: function(listview) {
+        listview.page.add_button( __("Create Salary Certificates"), function() {
+            frappe.prompt(
+                [
+                    {'fieldname': 'company', 'fieldtype': 'Link', 'options': 'Company', 'label': __('Company'), 'reqd': 1, 'default': frappe.defaults.get_user_default('company')},
+                    {'fieldname': 'year', 'fieldtype': 'Int', 'label': __('Year'), 'reqd': 1, 'default': (new Date()).getFullYear() - 1},
+                    {'fieldname': 'render_pdf', 'fieldtype': 'Check', 'label': __('Attach PDF'), 'default': 0},
+                    {'fieldname': 'print_format', 'fieldtype': 'Link', 'options': 'Print Format', 'label': __('Print Format'), 'depends_on': 'eval:doc.render_pdf', 'get_query': function() { return {'filters': {'doc_type': 'Salary Certificate'}}; }}
+                ],
+                function(values){
+                    frappe.call({
+                        'method': "erpnextswiss.erpnextswiss.doctype.salary_certificate.salary_certificate.enqueue_create_salary_certificates",
+                        'args': values,
+                        'callback': function() {
+                            frappe.show_alert( __("Creating Salary Certificates...") );
+                        }
+                    });
+                },
+                __("Create Salary Certificates"),
+                __("Create")
+            );
+        });
+        // progress of the batch run (background job); onload runs for each list load, keep one handler
+        frappe.realtime.off("salary_certificate_progress");
+        frappe.realtime.on("salary_certificate_progress", function(data) {
+            if (data.done) {
+                frappe.hide_progress();
+                frappe.show_alert( __("Salary Certificates created") );
+                listview.refresh();
+            } else {
+                frappe.show_progress(__("Create Salary Certificates"), data.progress, data.total, data.company);
+            }
+        });
+    }
+}
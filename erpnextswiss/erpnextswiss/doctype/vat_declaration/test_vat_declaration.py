@@ -5,6 +5,130 @@ from __future__ import unicode_literals
 
 import frappe
 import unittest
+from unittest.mock import patch, MagicMock
+from erpnextswiss.erpnextswiss.doctype.vat_declaration import vat_declaration
+
+ACCOUNTS = [
+	frappe._dict({'name': "1100 - Debtors", 'account_number': "1100"}),
+	frappe._dict({'name': "1170 - Input VAT", 'account_number': "1170", 'tax_code': "400", 'tax_rate': 8.1}),
+	frappe._dict({'name': "2000 - Creditors", 'account_number': "2000"}),
+	frappe._dict({'name': "2200 - VAT", 'account_number': "2200", 'tax_code': "303", 'tax_rate': 8.1}),
+	frappe._dict({'name': "3200 - Sales", 'account_number': "3200"}),
+	frappe._dict({'name': "3400 - Sales export", 'account_number': "3400"}),
+	frappe._dict({'name': "4200 - Purchases", 'account_number': "4200"})
+]
+DOCUMENTS = {
+	"Sales Invoice": [
+		frappe._dict({'name': "SINV-1", 'posting_date': "2025-01-10", 'grand_total': 108.1, 'rounded_total': 108.1}),
+		frappe._dict({'name': "SINV-2", 'posting_date': "2025-01-20", 'grand_total': 40.0, 'rounded_total': 40.0})
+	],
+	"Purchase Invoice": [
+		frappe._dict({'name': "PINV-1", 'posting_date': "2025-01-15", 'grand_total': 54.05, 'rounded_total': 54.05})
+	],
+	"Payment Entry": [
+		frappe._dict({'name': "PE-1", 'posting_date': "2025-02-01", 'payment_type': "Receive"})
+	]
+}
+# half of SINV-1 is paid
+PAYMENT_REFERENCES = [
+	frappe._dict({'parent': "PE-1", 'reference_doctype': "Sales Invoice", 'reference_name': "SINV-1",
+		'allocated_amount': 54.05, 'total_amount': 108.1})
+]
+ITEMS = {
+	"Sales Invoice Item": [
+		frappe._dict({'parent': "SINV-1", 'item_tax_template': "VAT 8.1", 'income_account': "3200 - Sales", 'net_amount': 100.0}),
+		frappe._dict({'parent': "SINV-2", 'item_tax_template': None, 'income_account': "3400 - Sales export", 'net_amount': 40.0})
+	],
+	"Purchase Invoice Item": [
+		frappe._dict({'parent': "PINV-1", 'item_tax_template': "VAT 8.1", 'expense_account': "4200 - Purchases", 'net_amount': 50.0})
+	]
+}
+
+def gl_entry(voucher_type, voucher_no, account, debit=0, credit=0):
+	return frappe._dict({'voucher_type': voucher_type, 'voucher_no': voucher_no, 'account': account,
+		'debit': debit, 'credit': credit, 'against': None, 'remarks': None})
+
+GL_ENTRIES = [
+	gl_entry("Sales Invoice", "SINV-1", "1100 - Debtors", debit=108.1),
+	gl_entry("Sales Invoice", "SINV-1", "3200 - Sales", credit=100.0),
+	gl_entry("Sales Invoice", "SINV-1", "2200 - VAT", credit=8.1),
+	gl_entry("Sales Invoice", "SINV-2", "1100 - Debtors", debit=40.0),
+	gl_entry("Sales Invoice", "SINV-2", "3400 - Sales export", credit=40.0),
+	gl_entry("Purchase Invoice", "PINV-1", "4200 - Purchases", debit=50.0),
+	gl_entry("Purchase Invoice", "PINV-1", "1170 - Input VAT", debit=4.05),
+	gl_entry("Purchase Invoice", "PINV-1", "2000 - Creditors", credit=54.05)
+]
+
+def get_all(doctype, filters=None, fields=None, **kwargs):
+	# the records of the period, filtered like the declaration queries them
+	names = (filters or {}).get('name') or (filters or {}).get('parent') or (filters or {}).get('voucher_no')
+	if doctype == "Account":
+		return ACCOUNTS
+	if doctype == "Payment Entry Reference":
+		return [r for r in PAYMENT_REFERENCES if r.parent in names[1]]
+	if doctype == "Payment Entry Deduction" or (filters or {}).get('is_consolidated') or doctype == "Journal Entry":
+		return []
+	if doctype == "GL Entry":
+		return [e for e in GL_ENTRIES if e.voucher_no in names[1]]
+	if doctype in ITEMS:
+		return [frappe._dict(i) for i in ITEMS[doctype] if i.parent in names[1]]
+	records = DOCUMENTS.get(doctype, [])
+	if names:
+		records = [r for r in records if r.name in names[1]]
+	return records
+
+def get_taxable_account(account, item_tax_template=None):
+	return [{'rate': 8.1}] if item_tax_template else []
 
 class TestVATDeclaration(unittest.TestCase):
-	pass
+	def run_declaration(self, function, flat=False):
+		db = MagicMock()
+		db.get_all.side_effect = get_all
+		with patch.object(frappe, "db", db, create=True), \
+				patch.object(frappe, "get_meta", return_value=MagicMock(has_field=lambda f: True), create=True), \
+				patch.object(vat_declaration, "get_taxable_account", side_effect=get_taxable_account):
+			return function("2025-01-01", "2025-03-31", flat=flat)
+
+	def get_total_invoiced(self, flat=False):
+		return self.run_declaration(vat_declaration.get_total_invoiced, flat)
+
+	def test_total_invoiced(self):
+		result = self.get_total_invoiced()
+		self.assertEqual(result['sums_by_tax_code'], {
+			"303": {'total_debit': 0, 'total_credit': 8.1},
+			"400": {'total_debit': 4.05, 'total_credit': 0}
+		})
+		self.assertEqual(result['net_sell'], {'total_debit': 0, 'total_credit': 100.0})
+		self.assertEqual(result['net_purchase'], {'total_debit': 50.0, 'total_credit': 0})
+		# export without VAT
+		self.assertEqual(result['no_vat_sell'], {'total_debit': 0, 'total_credit': 40.0})
+		self.assertEqual([(e['document_name'], e['no_vat_sell']) for e in result['summary_no_vat'][:-1]], [("SINV-2", 40.0)])
+
+	def test_total_invoiced_summaries(self):
+		result = self.get_total_invoiced()
+		self.assertEqual(result['summary_sales_invoice'][0], {'document_type': "Sales Invoice", 'document_name': "SINV-1",
+			'posting_date': "2025-01-10", 'vat_303': 8.1, 'net_sell': 100.0, 'net_purchase': 0})
+		self.assertEqual(result['summary_purchase_invoice'][0]['vat_400'], 4.05)
+		self.assertEqual(result['summary_purchase_invoice'][0]['net_purchase'], 50.0)
+		self.assertEqual([(e['voucher_no'], e['tax_code'], e['net_sell']) for e in result['si_gl_entries'][:-1]],
+			[("SINV-1", "303", 100.0)])
+		self.assertEqual(result['si_vat_summary'][-1], {'tax_code': "", 'tax_rate': "", 'total_vat': 8.1,
+			'total_net_sell': 100.0, 'total_net_purchase': 0})
+		self.assertEqual(result['pi_vat_summary'][-1]['total_vat'], 4.05)
+
+	def test_total_invoiced_flat(self):
+		result = self.get_total_invoiced(flat=True)
+		# flat rate: purchases are not declared, the sales GL entries are listed
+		self.assertEqual(result['net_purchase'], {'total_debit': 0, 'total_credit': 0})
+		self.assertEqual(result['net_sell'], {'total_debit': 0, 'total_credit': 100.0})
+		self.assertEqual(result['si_vat_summary'], [])
+
+	def test_total_payments(self):
+		result = self.run_declaration(vat_declaration.get_total_payments)
+		# the payment covers half of SINV-1: half of its VAT and net amount, on the payment date
+		self.assertEqual(result['sums_by_tax_code'], {"303": {'total_debit': 0, 'total_credit': 4.05}})
+		self.assertEqual(result['net_sell'], {'total_debit': 0, 'total_credit': 50.0})
+		self.assertEqual(result['summary_sales_invoice'][0], {'document_type': "Sales Invoice", 'document_name': "SINV-1",
+			'posting_date': "2025-01-10", 'vat_303': 4.05, 'net_sell': 50.0, 'net_purchase': 0})
+		self.assertEqual([(e['voucher_no'], e['paid_date'], e['credit']) for e in result['si_gl_entries'][:-1]],
+			[("SINV-1", "2025-02-01", 4.05)])
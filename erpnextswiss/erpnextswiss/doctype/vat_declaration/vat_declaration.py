@@ -8,6 +8,7 @@ from frappe.model.document import Document
 from frappe import _
 from datetime import datetime
 from frappe.utils import flt
+from erpnextswiss.erpnextswiss.utils import get_chunks
 
 @frappe.whitelist()
 def get_total_payments(start_date, end_date, company=None, flat=False):
@@ -50,19 +51,24 @@ def get_total_payments(start_date, end_date, company=None, flat=False):
         "Payment Entry": pe_gl_entries
     }
 
+    filters = {"posting_date": ["between", [start_date, end_date]], "docstatus": 1}
     if company:
-        payment_entries = frappe.db.get_all("Payment Entry", filters={"posting_date": ["between", [start_date, end_date]], "docstatus": 1, "company": company}, fields=["name"])
-    else:
-        payment_entries = frappe.db.get_all("Payment Entry", filters={"posting_date": ["between", [start_date, end_date]], "docstatus": 1}, fields=["name"])
-    frappe.neolog("payment_entries", payment_entries)
+        filters["company"] = company
+    payment_entries = frappe.db.get_all("Payment Entry", filters=filters, fields=["name", "posting_date"])
+    consolidated_invoices = frappe.db.get_all("Sales Invoice", filters=dict(filters, is_consolidated=1), fields=["name", "posting_date"])
+    journal_entries = frappe.db.get_all("Journal Entry", filters=filters, fields=["name"])
+
+    # prefetch all records of the period
+    data = VatDeclarationData()
+    data.load_payment_references([payment_entry.name for payment_entry in payment_entries])
+    documents = [(reference.reference_doctype, reference.reference_name) for references in data.payment_references.values() for reference in references]
+    documents += [("Sales Invoice", invoice.name) for invoice in consolidated_invoices]
+    documents += [("Journal Entry", journal_entry.name) for journal_entry in journal_entries]
+    data.load_documents(documents)
+
     for payment_entry in payment_entries:
         summary_sums_by_tax_code = {}
-        '''summary_net_sell = {"total_debit": 0, "total_credit": 0}
-        summary_net_purchase = {"total_debit": 0, "total_credit": 0}
-        summary_no_vat_sell = {"total_debit": 0, "total_credit": 0}'''
         summary_no_vat_purchase = {"total_debit": 0, "total_credit": 0}
-        si_merge_taxable_accounts = {}
-        pi_merge_taxable_accounts = {}
         split_si_gl_entries = []
         split_pi_gl_entries = []
         split_je_gl_entries = []
@@ -71,30 +77,16 @@ def get_total_payments(start_date, end_date, company=None, flat=False):
             "Purchase Invoice": split_pi_gl_entries,
             "Journal Entry": split_je_gl_entries
         }
-        doc = frappe.get_doc("Payment Entry", payment_entry.name)
-        #frappe.neolog("references", doc.references)
-        for reference in doc.references:
-            handle_entries(reference.reference_doctype, reference.reference_name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, received=True, reference=reference, summary_sums_by_tax_code=summary_sums_by_tax_code, summary_no_vat_purchase=summary_no_vat_purchase, split_entries=split_entries, pe_date=doc.posting_date)
-        
-        '''if not frappe.db.get_all("Payment Entry Deduction", filters={"parent": payment_entry.name}):
-            continue
-        handle_entries("Payment Entry", payment_entry.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, reference=payment_entry)'''
-    frappe.neolog("pi_gl_entries pi", pi_gl_entries)
-         
+        for reference in data.payment_references.get(payment_entry.name, []):
+            handle_entries(reference.reference_doctype, reference.reference_name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, received=True, reference=reference, summary_sums_by_tax_code=summary_sums_by_tax_code, summary_no_vat_purchase=summary_no_vat_purchase, split_entries=split_entries, pe_date=payment_entry.posting_date, data=data)
 
-    if company:
-        consolidated_invoices = frappe.db.get_all("Sales Invoice", filters={"posting_date": ["between", [start_date, end_date]], "is_consolidated": 1, "docstatus": 1, "company": company}, fields=["name", "posting_date"])
-    else:
-        consolidated_invoices = frappe.db.get_all("Sales Invoice", filters={"posting_date": ["between", [start_date, end_date]], "is_consolidated": 1, "docstatus": 1}, fields=["name", "posting_date"])
+    # summary over all consolidated invoices and journal entries (as a fresh worker would accumulate it)
+    summary_sums_by_tax_code = {}
     for invoice in consolidated_invoices:
-        handle_entries("Sales Invoice", invoice.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, pe_date=invoice.posting_date)
+        handle_entries("Sales Invoice", invoice.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, summary_sums_by_tax_code=summary_sums_by_tax_code, pe_date=invoice.posting_date, data=data)
 
-    if company:
-        journal_entries = frappe.db.get_all("Journal Entry", filters={"posting_date": ["between", [start_date, end_date]], "docstatus":1, "company": company}, fields=["name"])
-    else:
-        journal_entries = frappe.db.get_all("Journal Entry", filters={"posting_date": ["between", [start_date, end_date]], "docstatus":1}, fields=["name"])
     for journal_entry in journal_entries:
-        handle_entries("Journal Entry", journal_entry.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries)             
+        handle_entries("Journal Entry", journal_entry.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, summary_sums_by_tax_code=summary_sums_by_tax_code, data=data)
     
     summary_journal_entry, summary_journal_entry_old, summary_journal_entry_new = sort_split_list(summary_journal_entry, [], [])                
 
@@ -103,7 +95,6 @@ def get_total_payments(start_date, end_date, company=None, flat=False):
     summary_purchase_invoice = sort_split_list(summary_purchase_invoice)
 
     summary_no_vat = sort_split_list(summary_no_vat)
-    #frappe.neolog("si_gl_entries", si_gl_entries)
     
     si_vat_summary = get_recap_values(si_gl_entries, "Sales Invoice", flat)
     
@@ -125,35 +116,6 @@ def get_total_payments(start_date, end_date, company=None, flat=False):
     
     no_vat_pi_entries = sort_entries(no_vat_pi_entries)
     
-    # Dictionary to count occurrences
-    counts = {}
-
-    # Loop through the list of dictionaries and count occurrences
-    for record in pi_gl_entries:
-        key = (record["voucher_no"], record["debit"], record["credit"])
-        if key in counts:
-            counts[key].append(record)
-        else:
-            counts[key] = [record]
-
-    # Extract all entries that have more than one occurrence
-    repeated_entries = [entries for entries in counts.values() if len(entries) > 1]
-
-    # Flatten the list of repeated entries
-    repeated_entries_flat = [item for sublist in repeated_entries for item in sublist]
-
-    # Display the repeated entries
-    for entry in repeated_entries_flat:
-        pass
-    frappe.neolog("repeated_entries", repeated_entries_flat)
-    
-    payment_references = frappe.get_all(
-            'Payment Entry Reference',
-            filters={'reference_name': "ACC-PINV-2024-00196"},
-            fields=['name', 'parent', 'reference_name']
-        )
-    frappe.neolog("payment_references", payment_references)
-
     return {"sums_by_tax_code": sums_by_tax_code, "net_sell": net_sell, "net_purchase": net_purchase,
             "no_vat_sell": no_vat_sell, "summary_sales_invoice_old": summary_sales_invoice_old,
             "summary_sales_invoice_new": summary_sales_invoice_new, "summary_sales_invoice": summary_sales_invoice,
@@ -203,36 +165,38 @@ def get_total_invoiced(start_date, end_date, company=None, flat=False):
         "Payment Entry": pe_gl_entries
     }
 
+    filters = {"posting_date": ["between", [start_date, end_date]], "docstatus": 1}
     if company:
-        invoices = frappe.db.get_all("Sales Invoice", filters={"posting_date": ["between", [start_date, end_date]], "docstatus": 1, "company": company}, fields=["name"])
-    else:
-        invoices = frappe.db.get_all("Sales Invoice", filters={"posting_date": ["between", [start_date, end_date]], "docstatus": 1}, fields=["name"])
-    for invoice in invoices:
-        handle_entries("Sales Invoice", invoice.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries)
+        filters["company"] = company
+    sales_invoices = frappe.db.get_all("Sales Invoice", filters=filters, fields=["name"])
+    purchase_invoices = frappe.db.get_all("Purchase Invoice", filters=filters, fields=["name"])
+    journal_entries = frappe.db.get_all("Journal Entry", filters=filters, fields=["name"])
+    payment_entries = frappe.db.get_all("Payment Entry", filters=filters, fields=["name", "payment_type"])
+
+    # prefetch all records of the period; only payment entries with deductions are relevant
+    data = VatDeclarationData()
+    deduction_parents = data.get_deduction_parents([payment_entry.name for payment_entry in payment_entries])
+    payment_entries = [payment_entry for payment_entry in payment_entries if payment_entry.name in deduction_parents]
+    data.load_documents(
+        [("Sales Invoice", invoice.name) for invoice in sales_invoices]
+        + [("Purchase Invoice", invoice.name) for invoice in purchase_invoices]
+        + [("Journal Entry", journal_entry.name) for journal_entry in journal_entries]
+        + [("Payment Entry", payment_entry.name) for payment_entry in payment_entries]
+    )
 
-    if company:
-        invoices = frappe.db.get_all("Purchase Invoice", filters={"posting_date": ["between", [start_date, end_date]], "docstatus": 1, "company": company}, fields=["name"])
-    else:
-        invoices = frappe.db.get_all("Purchase Invoice", filters={"posting_date": ["between", [start_date, end_date]], "docstatus": 1}, fields=["name"])
-    for invoice in invoices:
-        handle_entries("Purchase Invoice", invoice.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries)
+    # summary over all documents (as a fresh worker would accumulate it)
+    summary_sums_by_tax_code = {}
+    for invoice in sales_invoices:
+        handle_entries("Sales Invoice", invoice.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, summary_sums_by_tax_code=summary_sums_by_tax_code, data=data)
 
-    if company:
-        journal_entries = frappe.db.get_all("Journal Entry", filters={"posting_date": ["between", [start_date, end_date]], "docstatus":1, "company": company}, fields=["name"])
-    else:
-        journal_entries = frappe.db.get_all("Journal Entry", filters={"posting_date": ["between", [start_date, end_date]], "docstatus":1}, fields=["name"])
-    for journal_entry in journal_entries:
-        handle_entries("Journal Entry", journal_entry.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries)
+    for invoice in purchase_invoices:
+        handle_entries("Purchase Invoice", invoice.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, summary_sums_by_tax_code=summary_sums_by_tax_code, data=data)
 
-    if company:
-        payment_entries = frappe.db.get_all("Payment Entry", filters={"posting_date": ["between", [start_date, end_date]], "docstatus": 1, "company": company}, fields=["name", "payment_type"])
-    else:
-        payment_entries = frappe.db.get_all("Payment Entry", filters={"posting_date": ["between", [start_date, end_date]], "docstatus": 1}, fields=["name", "payment_type"])
+    for journal_entry in journal_entries:
+        handle_entries("Journal Entry", journal_entry.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, summary_sums_by_tax_code=summary_sums_by_tax_code, data=data)
 
     for payment_entry in payment_entries:
-        if not frappe.db.get_all("Payment Entry Deduction", filters={"parent": payment_entry.name}):
-            continue
-        handle_entries("Payment Entry", payment_entry.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, reference=payment_entry, payment_type=payment_entry.payment_type)
+        handle_entries("Payment Entry", payment_entry.name, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, reference=payment_entry, payment_type=payment_entry.payment_type, summary_sums_by_tax_code=summary_sums_by_tax_code, data=data)
 
     '''if company:
         payment_entries = frappe.db.get_all("Payment Entry", filters={"posting_date": ["between", [start_date, end_date]], "docstatus": 1, "company": company}, fields=["name"])
@@ -388,13 +352,94 @@ def sort_entries(data):
         return sorted_final
     return data
     
-def handle_entries(dt, dn, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, received=False, reference=None, summary_sums_by_tax_code={}, summary_no_vat_purchase=None, split_entries=None, payment_type=None, pe_date=None):
+class VatDeclarationData:
+    """
+    Records of a declaration period, loaded with a few queries per doctype
+    instead of one query per document and GL entry
+    """
+    def __init__(self):
+        self.accounts = {
+            account.name: account
+            for account in frappe.db.get_all("Account", fields=["name", "tax_code", "tax_rate", "account_number"])
+        }
+        self.documents = {}
+        self.gl_entries = {}
+        self.items = {}
+        self.payment_references = {}
+        self.taxable_accounts = {}
+
+    def load_payment_references(self, payment_entries):
+        for chunk in get_chunks(payment_entries):
+            for reference in frappe.db.get_all("Payment Entry Reference",
+                    filters={"parent": ["in", chunk], "parenttype": "Payment Entry"},
+                    fields=["parent", "reference_doctype", "reference_name", "allocated_amount", "total_amount"],
+                    order_by="parent, idx"):
+                self.payment_references.setdefault(reference.parent, []).append(reference)
+        return
+
+    def get_deduction_parents(self, payment_entries):
+        parents = set()
+        for chunk in get_chunks(payment_entries):
+            parents.update(frappe.db.get_all("Payment Entry Deduction",
+                filters={"parent": ["in", chunk]}, pluck="parent", distinct=True))
+        return parents
+
+    def load_documents(self, documents):
+        """
+        Load posting dates, totals, items and GL entries of (doctype, name) pairs
+        """
+        names_by_doctype = {}
+        for dt, dn in documents:
+            if (dt, dn) not in self.documents:
+                names_by_doctype.setdefault(dt, set()).add(dn)
+        for dt, names in names_by_doctype.items():
+            meta = frappe.get_meta(dt)
+            fields = ["name"] + [f for f in ("posting_date", "grand_total", "rounded_total") if meta.has_field(f)]
+            for chunk in get_chunks(names):
+                for document in frappe.db.get_all(dt, filters={"name": ["in", chunk]}, fields=fields):
+                    self.documents[(dt, document.name)] = document
+            if dt in ("Sales Invoice", "Purchase Invoice"):
+                account_field = "income_account" if "Sales" in dt else "expense_account"
+                for chunk in get_chunks(names):
+                    for item in frappe.db.get_all(dt + " Item", filters={"parent": ["in", chunk]},
+                            fields=["parent", "item_tax_template", account_field, "net_amount", "amount"]):
+                        self.items.setdefault((dt, item.pop("parent")), []).append(item)
+        voucher_nos = set(dn for names in names_by_doctype.values() for dn in names) - set(self.gl_entries)
+        for voucher_no in voucher_nos:
+            self.gl_entries[voucher_no] = []
+        for chunk in get_chunks(voucher_nos):
+            for gl_entry in frappe.db.get_all("GL Entry", filters={"voucher_no": ["in", chunk], "is_cancelled": 0}, fields=['*']):
+                self.gl_entries[gl_entry.voucher_no].append(gl_entry)
+        return
+
+    def get_value(self, dt, dn, fieldname):
+        return (self.documents.get((dt, dn)) or {}).get(fieldname)
+
+    def get_gl_entries(self, voucher_no):
+        return self.gl_entries.get(voucher_no, [])
+
+    def get_items(self, dt, dn):
+        return self.items.get((dt, dn), [])
+
+    def get_account(self, account):
+        return self.accounts.get(account) or frappe._dict()
+
+    def get_taxable_account(self, account, item_tax_template=None):
+        key = (account, item_tax_template)
+        if key not in self.taxable_accounts:
+            self.taxable_accounts[key] = get_taxable_account(account, item_tax_template)
+        return self.taxable_accounts[key]
+
+def handle_entries(dt, dn, flat, sums_by_tax_code, sell_account_start, sell_account_end, purchase_account_start, purchase_account_end, net_sell, net_purchase, no_vat_sell, summaries, summary_no_vat, entries, no_vat_entries, received=False, reference=None, summary_sums_by_tax_code={}, summary_no_vat_purchase=None, split_entries=None, payment_type=None, pe_date=None, data=None):
+    if not data:
+        data = VatDeclarationData()
+        data.load_documents([(dt, dn)])
     summary_dt = summaries[dt]
     dt_gl_entries = entries[dt]
     summary_net_sell = {"total_debit": 0, "total_credit": 0}
     summary_net_purchase = {"total_debit": 0, "total_credit": 0}
     summary_no_vat_sell = {"total_debit": 0, "total_credit": 0}
-    gl_entries = frappe.db.get_all("GL Entry", filters={"voucher_no": dn, "is_cancelled": 0}, fields=['*'])
+    gl_entries = data.get_gl_entries(dn)
     has_vat = False
     add_sell_debit = 0
     add_sell_credit = 0
@@ -402,7 +447,7 @@ def handle_entries(dt, dn, flat, sums_by_tax_code, sell_account_start, sell_acco
     add_purchase_credit = 0
     merge_taxable_accounts = {}
     split_dt_gl_entries = []
-    posting_date = frappe.db.get_value(dt, dn, "posting_date")
+    posting_date = data.get_value(dt, dn, "posting_date")
     if received:
         ratio = 1
         if dt != "Payment Entry":
@@ -411,19 +456,20 @@ def handle_entries(dt, dn, flat, sums_by_tax_code, sell_account_start, sell_acco
             rounded_total = None
             grand_total = None
             if meta.has_field("grand_total"):
-                grand_total = frappe.db.get_value(reference.reference_doctype, reference.reference_name, "grand_total")
+                grand_total = data.get_value(reference.reference_doctype, reference.reference_name, "grand_total")
             if meta.has_field("rounded_total"):
-                rounded_total = frappe.db.get_value(reference.reference_doctype, reference.reference_name, "rounded_total")
+                rounded_total = data.get_value(reference.reference_doctype, reference.reference_name, "rounded_total")
             if not rounded_total and not grand_total:
                 grand_total = reference.total_amount
-            posting_date = frappe.db.get_value(reference.reference_doctype, reference.reference_name, "posting_date")
+            posting_date = data.get_value(reference.reference_doctype, reference.reference_name, "posting_date")
             ref_doc_total = rounded_total or grand_total
             ratio = allocated / ref_doc_total
             #frappe.neolog("voucher: {}, ratio: {}".format(reference.reference_name, ratio))
             summary_sums_by_tax_code_variable = {}
 
     for gl_entry in gl_entries:
-        tax_code, tax_rate = frappe.db.get_value("Account", gl_entry.account, ["tax_code", "tax_rate"])
+        account = data.get_account(gl_entry.account)
+        tax_code, tax_rate = account.tax_code, account.tax_rate
         if tax_code:
             if tax_code not in sums_by_tax_code:
                 sums_by_tax_code[tax_code] = {
@@ -486,7 +532,7 @@ def handle_entries(dt, dn, flat, sums_by_tax_code, sell_account_start, sell_acco
                 entry_gl["against_account"] = split_remarks[0] if split_remarks else None
             split_dt_gl_entries.append(entry_gl)
         else:
-            account_number = frappe.db.get_value("Account", gl_entry.account, "account_number")
+            account_number = account.account_number
             if not account_number:
                 account_link = frappe.utils.get_link_to_form("Account", gl_entry.account)
                 doc_link = frappe.utils.get_link_to_form(dt, dn)
@@ -531,8 +577,7 @@ def handle_entries(dt, dn, flat, sums_by_tax_code, sell_account_start, sell_acco
                 add_purchase_credit += gl_entry.credit * ratio if received else gl_entry.credit
                 
     if any(keyword in dt for keyword in ["Sales", "Purchase"]):
-        fields = ["item_tax_template", "income_account", "net_amount", "amount"] if "Sales" in dt else ["item_tax_template", "expense_account", "net_amount", "amount"]
-        items = frappe.db.get_all(dt + " Item", filters={"parent": dn}, fields=fields)
+        items = data.get_items(dt, dn)
         net_sell_vat = 0
         net_purchase_vat = 0
         no_vat_entry = {
@@ -546,10 +591,10 @@ def handle_entries(dt, dn, flat, sums_by_tax_code, sell_account_start, sell_acco
             if item.item_code in ["Freeline", "Freeline"]:
                 continue
             item_account = item.income_account if "Sales" in dt else item.expense_account
-            taxable_account_data = get_taxable_account(item_account, item.item_tax_template)
+            taxable_account_data = data.get_taxable_account(item_account, item.item_tax_template)
             if taxable_account_data:
                 rate = taxable_account_data[0].get("rate")
-                account = frappe.db.get_value("Account", item_account, "account_number")
+                account = data.get_account(item_account).account_number
                 item_amount = item.net_amount if item.net_amount else item.amount
                 
                 if rate not in merge_taxable_accounts:
@@ -2,7 +2,19 @@
 // For license information, please see license.txt
 
 frappe.ui.form.on('VAT query', {
-	// refresh: function(frm) {
-
-	// }
+	refresh: function(frm) {
+		if ((!frm.doc.__islocal) && (frm.doc.materialize)) {
+			frm.add_custom_button(__("Rebuild"), function() {
+				frappe.call({
+					'method': "erpnextswiss.erpnextswiss.vat_control.enqueue_rebuild",
+					'args': {
+						'vat_query': frm.doc.name
+					},
+					'callback': function(response) {
+						frappe.show_alert(response.message.result);
+					}
+				});
+			});
+		}
+	}
 });
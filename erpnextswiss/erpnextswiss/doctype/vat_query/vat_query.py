@@ -6,6 +6,7 @@ from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
 from frappe import _
+from erpnextswiss.erpnextswiss.vat_control import clear, enqueue_rebuild, get_unsupported_doctypes
 
 class VATquery(Document):
     def validate(self):
@@ -13,5 +14,27 @@ class VATquery(Document):
         for kw in forbidden_keywords:
             if kw in self.query.lower():
                 frappe.throw( _("Only select queries are allowed") )
+        if self.materialize:
+            # materialized rows are only refreshed for Sales Invoice, Purchase Invoice and Journal Entry
+            try:
+                unsupported = get_unsupported_doctypes(self.query)
+            except Exception as err:
+                frappe.throw( _("Materialize requires a doctype column: {0}").format(err) )
+            if unsupported:
+                frappe.throw( _("Materialize is not available for queries on {0}").format(", ".join(str(d) for d in unsupported)) )
+    
+    def on_update(self):
+        # materialized rows (VAT Control Entry) follow the query
+        before = self.get_doc_before_save()
+        if not self.materialize:
+            if before and before.materialize:
+                clear(self.name)
+        elif not before or not before.materialize or before.query != self.query:
+            enqueue_rebuild(self.name)
+        return
+    
+    def on_trash(self):
+        clear(self.name)
+        return
             
 
@@ -12,21 +12,17 @@ import frappe
 from frappe.utils import add_days
 from datetime import datetime, date
 from erpnextswiss.erpnextswiss.ebics_utils import prepare_ebics_date, prepare_date_range, translate_ebics_error, log_ebics_request
+from erpnextswiss.erpnextswiss.ebics_scheduler import sync_all, sync_range, sync_connection as sync_single_connection
 
 def sync(debug=False):
+    """
+    Sync all enabled connections (in parallel, see ebics_scheduler)
+    """
     if debug:
         print("Starting sync...")
-    enabled_connections = frappe.get_all("ebics Connection", filters={'enable_sync': 1}, fields=['name'])
+    results = sync_all(debug=debug)
     if debug:
-        print("Sync enabled for {0}".format(enabled_connections))
-        
-    for connection in enabled_connections:
-        if debug:
-            print("Syncing {0}".format(connection['name']))
-        sync_connection(connection['name'], debug)
-        
-    if debug:
-        print("Sync completed")
+        print("Sync completed: {0}".format(results))
     return
             
 def sync_connection(connection, debug=False):
@@ -34,22 +30,9 @@ def sync_connection(connection, debug=False):
         print("Connection not found. Please check {0}.".format(connection) )
         return
         
-    conn = frappe.get_doc("ebics Connection", connection)
-    if not conn.synced_until:
-        # try to sync last week
-        date = add_days(datetime.today(), -7).date()
-    else:
-        date = add_days(conn.synced_until, 1)
-    
-    while date <= datetime.today().date():
-        if debug:
-            print("Syncing {0}...".format(date.strftime("%Y-%m-%d")))
-            
-        conn.get_transactions(date.strftime("%Y-%m-%d"))
-        # note: sync date update happens in the transaction record when there are results
-        
-        date = add_days(date, 1)
-    
+    result = sync_single_connection(connection, debug=debug)
+    if debug:
+        print("{0}".format(result))
     return
 
 @frappe.whitelist()
@@ -90,29 +73,11 @@ def sync_connection_ui(connection_name, debug=False):
         days_to_sync = (today - start_date).days + 1  # +1 to include today
         
         # Perform sync
-        date = start_date
-        statements_created = 0
-        errors = []
-        days_processed = 0
-        
-        while date <= today:
-            days_processed += 1
-            if debug:
-                print("Syncing {0}...".format(date.strftime("%Y-%m-%d")))
-                
-            try:
-                conn.get_transactions(date.strftime("%Y-%m-%d"))
-                # Check if a statement was created for this date
-                if frappe.db.exists("ebics Statement", 
-                    {'ebics_connection': connection_name, 'date': date.strftime("%Y-%m-%d")}):
-                    statements_created += 1
-            except Exception as e:
-                error_msg = "Error on {0}: {1}".format(date.strftime("%d.%m.%Y"), str(e))
-                errors.append(error_msg)
-                if debug:
-                    print(error_msg)
-                    
-            date = add_days(date, 1)
+        result = sync_range(connection_name, start_date, today, debug=debug)
+        days_processed = result.get('days_processed')
+        errors = result.get('errors')
+        if result.get('skipped'):
+            errors.append("Another synchronisation of this connection is running")
         
         # Get final statistics
         final_count = frappe.db.count("ebics Statement", filters={'ebics_connection': connection_name})
@@ -254,8 +219,6 @@ def sync_date_range(connection_name, from_date, to_date):
         if not frappe.db.exists("ebics Connection", connection_name):
             frappe.throw("Connection not found: {0}".format(connection_name))
         
-        conn = frappe.get_doc("ebics Connection", connection_name)
-        
         # Convert dates using utility function
         from_date_str, to_date_str, from_date_obj, to_date_obj = prepare_date_range(from_date, to_date)
         
@@ -267,49 +230,12 @@ def sync_date_range(connection_name, from_date, to_date):
         pending_count = frappe.db.count("ebics Statement", {'ebics_connection': connection_name, 'status': 'Pending'})
         completed_count = frappe.db.count("ebics Statement", {'ebics_connection': connection_name, 'status': 'Completed'})
         
-        # Perform sync
-        date = from_date_obj
-        statements_created = 0
-        errors = []
-        days_processed = 0
-        
-        # Check if we should force daily sync
-        if hasattr(frappe.flags, 'force_daily_sync') and frappe.flags.force_daily_sync:
-            date = from_date_obj
-        else:
-            try:
-                # Call get_transactions_range which should handle the full range
-                conn.get_transactions_range(from_date_str, to_date_str)
-                days_processed = days_to_sync
-                
-                # Count statements created in the range
-                statements_created = frappe.db.count("ebics Statement", {
-                    'ebics_connection': connection_name,
-                    'date': ['between', [from_date.strftime("%Y-%m-%d"), to_date.strftime("%Y-%m-%d")]]
-                })
-            except AttributeError:
-                date = from_date
-            
-            while date <= to_date:
-                days_processed += 1
-                
-                try:
-                    conn.get_transactions(date.strftime("%Y-%m-%d"))
-                    # Check if a statement was created for this date
-                    if frappe.db.exists("ebics Statement", 
-                        {'ebics_connection': connection_name, 'date': date.strftime("%Y-%m-%d")}):
-                        statements_created += 1
-                except Exception as e:
-                    error_msg = "Error on {0}: {1}".format(date.strftime("%d.%m.%Y"), str(e))
-                    errors.append(error_msg)
-                    
-                date = add_days(date, 1)
-        
-        # Update sync date if needed
-        if to_date > (conn.synced_until or datetime(1900, 1, 1).date()):
-            conn.synced_until = to_date
-            conn.save()
-            frappe.db.commit()
+        # Perform sync: day by day, an interrupted run of this range resumes where it stopped
+        result = sync_range(connection_name, from_date_obj, to_date_obj)
+        days_processed = result.get('days_processed')
+        errors = result.get('errors')
+        if result.get('skipped'):
+            errors.append("Another synchronisation of this connection is running")
         
         # Get final counts
         final_count = frappe.db.count("ebics Statement", {'ebics_connection': connection_name})
@@ -319,7 +245,7 @@ def sync_date_range(connection_name, from_date, to_date):
         message = f"""
 ## Sync Summary
 
-**Date Range:** {from_date.strftime("%d.%m.%Y")} to {to_date.strftime("%d.%m.%Y")}  
+**Date Range:** {from_date_obj.strftime("%d.%m.%Y")} to {to_date_obj.strftime("%d.%m.%Y")}  
 **Days Processed:** {days_processed} of {days_to_sync}  
 **New Statements Imported:** {new_statements}
 
@@ -812,9 +738,11 @@ def import_all_available(connection_name, debug=False):
         
         for account, content in data.items():
             try:
-                from erpnextswiss.erpnextswiss.page.bank_wizard.bank_wizard import read_camt053_meta
-                meta = read_camt053_meta(content)
-                bank_statement_id = meta.get('msgid')
+                from erpnextswiss.erpnextswiss.page.bank_wizard.bank_wizard import read_camt053_meta, try_parse_camt_document
+                # None if the content is malformed: the statement is stored anyway, but not parsed
+                camt_document = try_parse_camt_document(content)
+                meta = read_camt053_meta(content, camt_document)
+                bank_statement_id = meta.get('msgid') if meta.get('msgid') != 'n/a' else None      # n/a: header not readable
                 statement_date = meta.get('statement_date')
                 
                 # Track latest date
@@ -834,13 +762,18 @@ def import_all_available(connection_name, debug=False):
                     'ebics_connection': connection_name,
                     'file_name': account,
                     'xml_content': content,
+                    # also set if the content cannot be parsed, so that a re-delivery is detected as duplicate
+                    'bank_statement_id': bank_statement_id,
                     'date': statement_date or datetime.today().strftime("%Y-%m-%d"),
                     'company': conn.company
                 })
                 stmt.insert()
                 frappe.db.commit()
-                stmt.parse_content(debug=debug)
-                stmt.process_transactions()
+                if camt_document:
+                    stmt.parse_content(debug=debug, camt_document=camt_document)
+                    stmt.process_transactions()
+                else:
+                    errors.append(f"Unable to parse {account}: stored without transactions")
                 imported += 1
                 
             except Exception as e:
@@ -18,6 +18,7 @@ from typing import Dict, Any, Optional
 import frappe
 from frappe import _
 from frappe.utils import now
+from erpnextswiss.erpnextswiss.ebics_worker import EbicsWorkerError, IDEMPOTENT_ACTIONS, get_worker_pool, use_php_worker
 
 class EbicsManager:
     """
@@ -157,6 +158,37 @@ class EbicsManager:
             hashlib.sha256
         ).hexdigest()
     
+    def _execute_php(self, action: str, final_request: str, env: Dict[str, str]) -> subprocess.CompletedProcess:
+        """
+        Run a signed request on a persistent PHP worker, fall back to a one-shot PHP process
+        """
+        if use_php_worker():
+            try:
+                stdout = get_worker_pool(self.php_service, env).execute(final_request, timeout=60)
+                try:
+                    code = json.loads(stdout).get('code', 200)
+                except ValueError:
+                    code = 200          # reported as invalid response below
+                return subprocess.CompletedProcess(['php', self.php_service, '--worker'],
+                    0 if code == 200 else 1, stdout, "")
+            except EbicsWorkerError as err:
+                if err.timeout and err.request_sent:
+                    raise subprocess.TimeoutExpired(['php', self.php_service, '--worker'], 60)
+                if err.request_sent and action not in IDEMPOTENT_ACTIONS:
+                    # the order may have reached the bank, do not send it twice
+                    return subprocess.CompletedProcess(['php', self.php_service, '--worker'], 1, "", str(err))
+                frappe.log_error(f"Action: {action}\n{err}", "EBICS Worker Fallback")
+        
+        return subprocess.run(
+            ['php', self.php_service],
+            input=final_request,
+            capture_output=True,
+            text=True,
+            timeout=60,  # Increased timeout for complex operations
+            check=False,
+            env=env
+        )
+    
     def _call_php_service(self, action: str, params: Dict[str, Any]) -> Dict[str, Any]:
         """
         Call the PHP service securely via subprocess
@@ -197,15 +229,7 @@ class EbicsManager:
                 )
             
             # Execute PHP script
-            result = subprocess.run(
-                ['php', self.php_service],
-                input=final_request,
-                capture_output=True,
-                text=True,
-                timeout=60,  # Increased timeout for complex operations
-                check=False,
-                env=env
-            )
+            result = self._execute_php(action, final_request, env)
             
             if result.returncode != 0:
                 frappe.log_error(
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+"""
+ebics Auto Posting
+==================
+
+Creates and submits the payment entries of all fully matched transactions
+of an ebics Statement (matched amount = amount, with a party or employee
+match) in a background job.
+
+Accounts, currencies, exchange rates and the referenced invoices are
+loaded once per statement. Payments are posted in chunks: the payment
+entries of a chunk and the status of their transaction rows are committed
+together, so that after a crash (or timeout) the job resumes with the
+rows that are still pending. Statements with an unfinished run are picked
+up again by the hourly scheduler (resume_auto_posting); a run that fails
+outside of a single transaction sets the status "Error" and is not resumed.
+
+    $ bench execute erpnextswiss.erpnextswiss.ebics_posting.post_statement --kwargs "{'statement': 'EBICS-STMT-00001', 'debug': True}"
+"""
+
+import ast
+import time
+import frappe
+from frappe import _
+from frappe.utils import flt, getdate, now
+from erpnext.setup.utils import get_exchange_rate
+from erpnextswiss.erpnextswiss.page.bank_wizard.bank_wizard import get_default_accounts, get_payable_account
+from erpnextswiss.erpnextswiss.utils import get_chunks
+
+CHUNK_SIZE = 20
+LOCK_KEY = "erpnextswiss_ebics_auto_posting:{0}"
+LOCK_TIMEOUT = 600              # seconds, renewed with every chunk
+QUEUED_KEY = "erpnextswiss_ebics_auto_posting_queued:{0}"
+JOB_TIMEOUT = 15000             # seconds
+
+@frappe.whitelist()
+def enqueue_auto_posting(statement):
+    if not frappe.has_permission("ebics Statement", "write", statement):
+        frappe.throw( _("Not permitted"), frappe.PermissionError)
+    # modified is bumped so that forms opened before cannot write their (stale) rows back
+    frappe.db.set_value("ebics Statement", statement, 'auto_posting_status', "Queued")
+    # a queued job is only resumed by the scheduler after the job timeout
+    frappe.cache().set(frappe.cache().make_key(QUEUED_KEY.format(statement)), 1, ex=JOB_TIMEOUT)
+    frappe.enqueue("erpnextswiss.erpnextswiss.ebics_posting.post_statement",
+        queue='long',
+        timeout=JOB_TIMEOUT,
+        enqueue_after_commit=True,
+        job_name="ebics_auto_posting_{0}".format(statement),
+        statement=statement)
+    return {'result': _('Started...')}
+
+"""
+Posting lock per statement (redis SET NX EX, atomic across workers)
+"""
+def acquire_lock(statement):
+    return bool(frappe.cache().set(frappe.cache().make_key(LOCK_KEY.format(statement)), 1, nx=True, ex=LOCK_TIMEOUT))
+
+def renew_lock(statement):
+    frappe.cache().expire(frappe.cache().make_key(LOCK_KEY.format(statement)), LOCK_TIMEOUT)
+
+def release_lock(statement):
+    frappe.cache().delete(frappe.cache().make_key(LOCK_KEY.format(statement)))
+
+def is_locked(statement):
+    return bool(frappe.cache().exists(frappe.cache().make_key(LOCK_KEY.format(statement))))
+
+def post_statement(statement, chunk_size=CHUNK_SIZE, debug=False):
+    """
+    Post all fully matched pending transactions of a statement
+    :returns:   dict with posted, errors, duration and payments_per_second (None if not posted)
+    """
+    if not acquire_lock(statement):
+        # another job is posting this statement
+        return None
+    start = time.time()
+    posted = 0
+    errors = 0
+    try:
+        frappe.cache().delete(frappe.cache().make_key(QUEUED_KEY.format(statement)))
+        frappe.db.set_value("ebics Statement", statement, 'auto_posting_status', "Running")
+        frappe.db.commit()
+        doc = frappe.get_doc("ebics Statement", statement)
+        context = PostingContext(doc)
+        rows = [t for t in doc.transactions if is_postable(t)]
+        context.load_references(rows)
+        for chunk in get_chunks(rows, chunk_size):
+            for t in chunk:
+                if post_transaction(context, t):
+                    posted += 1
+                else:
+                    errors += 1
+            # payment entries and row status of this chunk are committed together (rows are written
+            # without modified, so the statement is touched to reject saves of forms loaded meanwhile)
+            frappe.db.set_value("ebics Statement", statement, 'modified', now(), update_modified=False)
+            frappe.db.commit()
+            renew_lock(statement)
+            frappe.publish_realtime("ebics_auto_posting_progress", {
+                'statement': statement,
+                'progress': posted + errors,
+                'total': len(rows)
+            })
+            if debug:
+                print("{0}/{1} transactions ({2:.1f} s)".format(posted + errors, len(rows), time.time() - start))
+
+        if all(t.status == "Completed" for t in doc.transactions):
+            frappe.db.set_value("ebics Statement", statement, 'status', "Completed")
+        frappe.db.set_value("ebics Statement", statement, 'auto_posting_status', "Completed")
+        frappe.db.commit()
+    except Exception as err:
+        # do not leave the statement "Running" (the scheduler would resume it forever)
+        frappe.db.rollback()
+        frappe.db.set_value("ebics Statement", statement, 'auto_posting_status', "Error")
+        frappe.db.commit()
+        frappe.log_error("{0}: {1}\n{2}".format(statement, err, frappe.get_traceback()), "ebics auto posting failed")
+        frappe.publish_realtime("ebics_auto_posting_progress", {
+            'statement': statement,
+            'posted': posted,
+            'errors': errors + 1,
+            'done': True
+        })
+        return None
+    finally:
+        release_lock(statement)
+
+    duration = time.time() - start
+    result = {
+        'statement': statement,
+        'posted': posted,
+        'errors': errors,
+        'duration': round(duration, 2),
+        'payments_per_second': round(posted / duration, 2) if duration else 0
+    }
+    frappe.logger().info("ebics auto posting {statement}: {posted} posted, {errors} errors in {duration} s "
+        "({payments_per_second} payments/s)".format(**result))
+    frappe.publish_realtime("ebics_auto_posting_progress", dict(result, done=True))
+
+    # run post-processing triggers
+    frappe.get_doc("ebics Statement", statement).post_process()
+    return result
+
+def is_postable(t):
+    if t.status != "Pending" or t.payment_entry:
+        return False
+    if flt(t.matched_amount) != flt(t.amount) or not (t.party_match or t.employee_match):
+        return False
+    # outflows need a purchase invoice or expense claim match
+    return t.credit_debit != "DBIT" or bool(t.invoice_matches or t.expense_matches)
+
+def post_transaction(context, t):
+    """
+    Create and submit the payment entry of one transaction row and store its status on the row
+    :returns:   True if the payment entry has been submitted
+    """
+    frappe.db.savepoint("ebics_auto_posting")
+    try:
+        payment_entry = context.make_payment_entry(t)
+        t.payment_entry = payment_entry.name
+        t.status = "Completed"
+        t.remarks = None
+    except Exception as err:
+        frappe.db.rollback(save_point="ebics_auto_posting")
+        t.payment_entry = None
+        t.status = "Error"
+        t.remarks = "{0}".format(err)
+    frappe.db.set_value("ebics Statement Transaction", t.name, {
+        'payment_entry': t.payment_entry,
+        'status': t.status,
+        'remarks': t.remarks
+    }, update_modified=False)
+    return t.status == "Completed"
+
+"""
+Accounts, currencies, exchange rates and referenced documents of one statement
+"""
+class PostingContext:
+    def __init__(self, statement):
+        self.statement = statement
+        self.company = statement.company or frappe.get_cached_value("Account", statement.account, "company")
+        default_accounts = get_default_accounts(statement.account)
+        self.receivable_account = default_accounts.get('receivable_account')
+        self.payable_account = default_accounts.get('payable_account')
+        self.employee_payable_account = get_payable_account(self.company, employee=True)['account']
+        self.company_currency = frappe.get_cached_value("Company", self.company, "default_currency")
+        self.account_currency = frappe.get_cached_value("Account", statement.account, "account_currency")
+        self.exchange_gain_loss_account = frappe.get_cached_value("Company", self.company, "exchange_gain_loss_account")
+        self.round_off_cost_center = frappe.get_cached_value("Company", self.company, "round_off_cost_center")
+        self.exchange_rates = {}
+        self.references = {}
+
+    def load_references(self, rows):
+        """
+        Amounts of all invoices and expense claims referenced by the rows
+        """
+        names = {"Sales Invoice": set(), "Purchase Invoice": set(), "Expense Claim": set()}
+        for t in rows:
+            names[self.get_reference_type(t)].update(self.get_references(t))
+        for doctype, fields in (
+                ("Sales Invoice", ['base_grand_total AS total_amount', 'outstanding_amount']),
+                ("Purchase Invoice", ['base_grand_total AS total_amount', 'outstanding_amount']),
+                ("Expense Claim", ['total_claimed_amount AS total_amount', 'total_claimed_amount AS outstanding_amount'])):
+            for chunk in get_chunks(names[doctype]):
+                for r in frappe.get_all(doctype, filters={'name': ['in', chunk]}, fields=['name'] + fields):
+                    self.references[(doctype, r.name)] = r
+
+    def get_references(self, t):
+        references = t.expense_matches if (t.credit_debit == "DBIT" and not t.invoice_matches) else t.invoice_matches
+        return ast.literal_eval(references) if references else []
+
+    def get_reference_type(self, t):
+        if t.credit_debit != "DBIT":
+            return "Sales Invoice"
+        return "Purchase Invoice" if t.invoice_matches else "Expense Claim"
+
+    def get_exchange_rate(self, date):
+        if self.account_currency == self.company_currency:
+            return 1
+        date = getdate(date)
+        if date not in self.exchange_rates:
+            self.exchange_rates[date] = get_exchange_rate(from_currency=self.account_currency,
+                to_currency=self.company_currency, transaction_date=date)
+        return self.exchange_rates[date]
+
+    def make_payment_entry(self, t):
+        """
+        Same payment entry as bank_wizard.make_payment_entry (auto submit), from the cached context
+        """
+        exchange_rate = self.get_exchange_rate(t.date)
+        payment_entry = frappe.get_doc({
+            'doctype': 'Payment Entry',
+            'paid_amount': float(t.amount),
+            'received_amount': float(t.amount),
+            'reference_no': t.unique_reference,
+            'reference_date': t.date,
+            'posting_date': t.date,
+            'remarks': "{0}, {1}, {2}".format(t.transaction_reference or "", t.party_name or "", t.party_address or ""),
+            'camt_amount': float(t.amount),
+            'bank_account_no': t.party_iban,
+            'company': self.company,
+            'source_exchange_rate': exchange_rate,
+            'target_exchange_rate': exchange_rate
+        })
+        reference_type = self.get_reference_type(t)
+        if t.credit_debit != "DBIT":
+            # inflow: debtor
+            payment_entry.update({
+                'payment_type': "Receive",
+                'party_type': "Customer",
+                'party': t.party_match,
+                'paid_to': self.statement.account
+            })
+        else:
+            # outflow: purchase invoice or expense
+            payment_entry.update({
+                'payment_type': "Pay",
+                'party_type': "Supplier" if reference_type == "Purchase Invoice" else "Employee",
+                'party': t.party_match if reference_type == "Purchase Invoice" else t.employee_match,
+                'paid_from': self.statement.account
+            })
+            if reference_type == "Expense Claim":
+                payment_entry.paid_to = self.employee_payable_account or self.payable_account      # note: at creation, this is ignored
+        payment_entry.insert()
+
+        # add references after insert (otherwise they are overwritten)
+        allocations = []
+        for reference_name in self.get_references(t):
+            reference = self.references.get((reference_type, reference_name))
+            if not reference:
+                frappe.throw( _("{0} {1} not found").format(_(reference_type), reference_name) )
+            allocated_amount = min(flt(payment_entry.paid_amount), flt(reference.outstanding_amount))
+            payment_entry.append("references", {
+                'reference_doctype': reference_type,
+                'reference_name': reference_name,
+                'total_amount': reference.total_amount,
+                'outstanding_amount': reference.outstanding_amount,
+                'allocated_amount': allocated_amount
+            })
+            payment_entry.unallocated_amount -= allocated_amount
+            allocations.append((reference, allocated_amount))
+        payment_entry.save()
+
+        if payment_entry.difference_amount != 0:
+            # for auto-submit, we need to clear this out to the exchange account
+            payment_entry.append("deductions", {
+                'account': self.exchange_gain_loss_account,
+                'cost_center': self.round_off_cost_center,
+                'amount': payment_entry.difference_amount
+            })
+            payment_entry.save()
+        payment_entry.submit()
+        # several transactions of a statement can pay the same invoice
+        for reference, allocated_amount in allocations:
+            reference.outstanding_amount = flt(reference.outstanding_amount) - allocated_amount
+        return payment_entry
+
+"""
+Scheduler (hourly): continue unfinished runs (e.g. after a worker crash or timeout)
+"""
+def resume_auto_posting():
+    # note: statements with status "Error" are not resumed (see error log)
+    for statement in frappe.get_all("ebics Statement",
+            filters={'auto_posting_status': ['in', ["Queued", "Running"]]}, fields=['name', 'auto_posting_status']):
+        if is_locked(statement.name):
+            continue            # still running
+        if statement.auto_posting_status == "Queued" \
+                and frappe.cache().exists(frappe.cache().make_key(QUEUED_KEY.format(statement.name))):
+            continue            # job still waiting in the queue
+        enqueue_auto_posting(statement.name)
+    return
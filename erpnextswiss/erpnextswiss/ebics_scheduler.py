@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+"""
+EBICS Download Scheduler
+========================
+
+Downloads Z53 (and optionally Z54) statements for all sync-enabled
+connections. Connections are processed in parallel, up to
+ebics_sync_max_workers at a time. The days of one connection always run
+one after another: EBICS order sequencing does not allow parallel orders
+of the same subscriber, and a database lock per connection also keeps
+other processes away while a connection is syncing.
+
+Progress is persisted after every day:
+    - scheduled sync: ebics Connection.synced_until
+    - date ranges: ebics Connection.sync_range_from/_to/_next, so that
+      an interrupted range continues where it stopped
+
+Failed downloads are retried with exponential backoff. A day that still
+fails stops its connection, so that no day is skipped.
+
+Settings (ERPNextSwiss Settings, section EBICS Sync):
+    enable_ebics_sync, ebics_sync_from/_to (time window of the
+    scheduled run), ebics_sync_lookback_days, ebics_sync_max_workers,
+    ebics_sync_max_retries, ebics_sync_intraday
+"""
+
+import base64
+import io
+import time
+import random
+import zipfile
+import frappe
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from frappe.utils import cint, getdate, get_time, now_datetime
+from erpnextswiss.erpnextswiss.ebics_manager import EbicsManager
+from erpnextswiss.erpnextswiss.page.bank_wizard.bank_wizard import read_camt053_meta, try_parse_camt_document
+
+RETRY_BASE_DELAY = 5                # seconds, doubled with each attempt
+# EBICS return codes that will not go away by retrying
+PERMANENT_ERROR_CODES = ['091001', '091002', '091003', '091004', '091006', '091008', '091010', '061001', '061002']
+
+class EbicsSyncError(Exception):
+    pass
+
+def get_sync_settings():
+    settings = frappe.get_doc("ERPNextSwiss Settings", "ERPNextSwiss Settings")
+    order_types = ['Z53']
+    if cint(settings.get("ebics_sync_intraday")):
+        order_types.append('Z54')
+    return frappe._dict({
+        'enabled': cint(settings.get("enable_ebics_sync")),
+        'from_time': settings.get("ebics_sync_from"),
+        'to_time': settings.get("ebics_sync_to"),
+        'lookback_days': cint(settings.get("ebics_sync_lookback_days")) or 7,
+        'max_workers': cint(settings.get("ebics_sync_max_workers")) or 4,
+        'max_retries': cint(settings.get("ebics_sync_max_retries")) or 3,
+        'order_types': order_types
+    })
+
+def in_sync_window(settings, now=None):
+    """
+    True if now lies in the configured time window (may pass midnight)
+    """
+    if not settings.from_time or not settings.to_time:
+        return True
+    now = (now or now_datetime()).time()
+    from_time = get_time(settings.from_time)
+    to_time = get_time(settings.to_time)
+    if from_time <= to_time:
+        return from_time <= now <= to_time
+    return now >= from_time or now <= to_time
+
+def scheduled_sync():
+    """
+    Scheduler hook (hourly): sync all connections within the configured window
+    """
+    settings = get_sync_settings()
+    if not settings.enabled or not in_sync_window(settings):
+        return
+    return sync_all(settings=settings)
+
+def sync_all(settings=None, debug=False):
+    """
+    Sync all enabled connections from their synced_until up to today
+    """
+    settings = settings or get_sync_settings()
+    connections = frappe.get_all("ebics Connection",
+        filters={'enable_sync': 1, 'activated': 1}, fields=['name', 'synced_until'])
+    return run_jobs([get_sync_job(c.name, c.synced_until, settings) for c in connections], settings, debug)
+
+def sync_connection(connection, settings=None, debug=False):
+    """
+    Sync one connection from its synced_until up to today
+    """
+    settings = settings or get_sync_settings()
+    synced_until = frappe.get_value("ebics Connection", connection, "synced_until")
+    return run_jobs([get_sync_job(connection, synced_until, settings)], settings, debug)[connection]
+
+def get_sync_job(connection, synced_until, settings):
+    today = getdate()
+    start_date = today - timedelta(days=settings.lookback_days)
+    if synced_until:
+        start_date = max(start_date, getdate(synced_until) + timedelta(days=1))
+    # today is always fetched again: its end of day statement may come later
+    return (connection, min(start_date, today), today, False)
+
+def sync_range(connection, from_date, to_date, settings=None, debug=False):
+    """
+    Sync one connection for a date range, resuming an interrupted run of the same range
+    """
+    settings = settings or get_sync_settings()
+    return run_jobs([(connection, getdate(from_date), getdate(to_date), True)], settings, debug)[connection]
+
+def run_jobs(jobs, settings, debug=False):
+    """
+    Run (connection, from_date, to_date, is_range) jobs, one thread per connection
+    """
+    results = {}
+    if not jobs:
+        return results
+    site = frappe.local.site
+    user = frappe.session.user
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, min(settings.max_workers, len(jobs)))) as executor:
+        futures = {
+            job[0]: executor.submit(_run_in_site, site, user, sync_connection_days, job, settings, debug)
+            for job in jobs
+        }
+        for connection, future in futures.items():
+            try:
+                results[connection] = future.result()
+            except Exception as err:
+                frappe.log_error("{0}: {1}".format(connection, err), "EBICS Sync Error")
+                results[connection] = {'days_processed': 0, 'statements': 0, 'errors': [str(err)]}
+    # start a new transaction to see what the threads have committed
+    frappe.db.commit()
+    if debug:
+        print("Synced {0} connections in {1:.1f} s".format(len(jobs), time.time() - start))
+    return results
+
+def _run_in_site(site, user, function, *args):
+    """
+    Run a function in its own frappe context (thread-local db connection)
+    """
+    frappe.init(site=site)
+    frappe.connect()
+    frappe.set_user(user)
+    try:
+        return function(*args)
+    finally:
+        frappe.destroy()
+
+def sync_connection_days(job, settings, debug=False):
+    connection, from_date, to_date, is_range = job
+    result = {'days_processed': 0, 'statements': 0, 'errors': [], 'skipped': False}
+    lock_name = "ebics_sync:{0}".format(connection)
+    if not frappe.db.sql("""SELECT GET_LOCK(%(lock)s, 0)""", {'lock': lock_name})[0][0]:
+        # another process is syncing this connection
+        result['skipped'] = True
+        return result
+    try:
+        conn = frappe.get_doc("ebics Connection", connection)
+        day = from_date
+        if is_range and conn.get("sync_range_next") \
+                and getdate(conn.sync_range_from) == from_date and getdate(conn.sync_range_to) == to_date:
+            day = getdate(conn.sync_range_next)
+            if debug:
+                print("{0}: resuming at {1}".format(connection, day))
+        manager = EbicsManager(connection)
+        while day <= to_date:
+            try:
+                for order_type in settings.order_types:
+                    result['statements'] += download_day(manager, conn, order_type, day, settings.max_retries, debug)
+            except Exception as err:
+                frappe.db.rollback()
+                result['errors'].append("{0}: {1}".format(day.strftime("%d.%m.%Y"), err))
+                frappe.log_error("{0} on {1}: {2}".format(connection, day, err), "EBICS Sync Error")
+                break
+            result['days_processed'] += 1
+            save_progress(conn, day, from_date, to_date, is_range)
+            day += timedelta(days=1)
+        if is_range and day > to_date:
+            # range completed
+            conn.db_set({'sync_range_from': None, 'sync_range_to': None, 'sync_range_next': None}, update_modified=False)
+            frappe.db.commit()
+    finally:
+        frappe.db.sql("""SELECT RELEASE_LOCK(%(lock)s)""", {'lock': lock_name})
+    return result
+
+def save_progress(conn, day, from_date, to_date, is_range):
+    values = {}
+    if is_range:
+        values.update({'sync_range_from': from_date, 'sync_range_to': to_date, 'sync_range_next': day + timedelta(days=1)})
+    # synced_until only moves forward and never includes today; it is always
+    # written because the manager sets it to now() after each download
+    synced_until = min(day, getdate() - timedelta(days=1))
+    if conn.synced_until and getdate(conn.synced_until) > synced_until:
+        synced_until = conn.synced_until
+    values['synced_until'] = synced_until
+    conn.db_set(values, update_modified=False)
+    frappe.db.commit()
+    return
+
+def download_day(manager, conn, order_type, day, max_retries, debug=False):
+    """
+    Download and import the statements of one order type and day, returns the number of new statements
+    """
+    date_str = day.strftime("%Y-%m-%d")
+    attempt = 0
+    while True:
+        try:
+            result = manager.execute_order(order_type, dateFrom=date_str, dateTo=date_str)
+        except Exception as err:
+            result = {'success': False, 'error': str(err)}
+        if result.get('success'):
+            break
+        if "{0}".format(result.get('code')) in PERMANENT_ERROR_CODES or attempt >= max_retries:
+            raise EbicsSyncError("{0} {1}".format(order_type, result.get('message') or result.get('error')))
+        delay = RETRY_BASE_DELAY * (2 ** attempt) + random.uniform(0, 1)
+        if debug:
+            print("{0} {1} {2} failed, retry in {3:.1f} s".format(conn.name, order_type, date_str, delay))
+        time.sleep(delay)
+        attempt += 1
+
+    imported = 0
+    for file_name, content in get_statement_files(result.get('data')):
+        if import_statement(conn, file_name, content, order_type, date_str):
+            imported += 1
+    if debug:
+        print("{0} {1} {2}: {3} new statements".format(conn.name, order_type, date_str, imported))
+    return imported
+
+def get_statement_files(data):
+    """
+    Yield (file name, xml) from a base64 download (zip container or single xml)
+    """
+    if not data:
+        return
+    raw = base64.b64decode(data)
+    if zipfile.is_zipfile(io.BytesIO(raw)):
+        with zipfile.ZipFile(io.BytesIO(raw)) as container:
+            for name in container.namelist():
+                if not name.endswith("/"):
+                    yield name, container.read(name).decode("utf-8")
+    else:
+        yield "statement.xml", raw.decode("utf-8")
+
+def import_statement(conn, file_name, content, order_type, date_str):
+    # parsed once for the duplicate check and the transactions (None if the content is malformed)
+    camt_document = try_parse_camt_document(content)
+    meta = read_camt053_meta(content, camt_document)
+    bank_statement_id = meta.get('msgid') if meta.get('msgid') != 'n/a' else None      # n/a: header not readable
+    if bank_statement_id and frappe.db.exists('ebics Statement', {'bank_statement_id': bank_statement_id}):
+        return False
+    statement = frappe.get_doc({
+        'doctype': 'ebics Statement',
+        'ebics_connection': conn.name,
+        'file_name': file_name,
+        'xml_content': content,
+        # also set if the content cannot be parsed, so that a re-delivery is detected as duplicate
+        'bank_statement_id': bank_statement_id,
+        'date': meta.get('statement_date') or date_str,
+        'company': conn.company,
+        'statement_type': "Intraday" if order_type == "Z54" else "End of Day"
+    })
+    statement.insert()
+    frappe.db.commit()
+    if camt_document:
+        statement.parse_content(camt_document=camt_document)
+        statement.process_transactions()
+    # else: the raw download is kept, the statement can be parsed again once the content is fixed
+    return True
@@ -2,6 +2,11 @@
 /**
  * Unified EBICS Service using ebics-client-php v3.x
  * Provides a secure bridge between Python and the mature EBICS library
+ *
+ * Modes:
+ *  php unified_ebics_service.php            one request on stdin, one response on stdout
+ *  php unified_ebics_service.php --worker   long-lived worker: framed requests/responses
+ *                                           ("<length>\n<json>") on stdin/stdout until EOF
  * 
  * @author Claude
  * @date 2025-08-20
@@ -35,6 +40,9 @@ class UnifiedEbicsService {
     private $keyringManager;
     private $sitePath;
     private $secretKey;
+    private $workerMode = false;
+    private $seenNonces = [];
+    private $served = 0;
     
     public function __construct() {
         // Get security key from environment
@@ -76,26 +84,88 @@ class UnifiedEbicsService {
     }
     
     public function handle() {
+        // Read request from stdin
+        $input = file_get_contents('php://stdin');
+        $response = $this->handleMessage($input);
+        $this->output($response);
+        exit($response['code'] === 200 ? 0 : 1);
+    }
+    
+    /**
+     * Worker mode: serve framed requests until stdin is closed
+     */
+    public function serve() {
+        $this->workerMode = true;
+        while (true) {
+            $header = fgets(STDIN);
+            if ($header === false) {
+                break;          // pool closed the pipe
+            }
+            $length = intval(trim($header));
+            $input = $length > 0 ? $this->readBytes(STDIN, $length) : '';
+            if ($input === null) {
+                break;
+            }
+            
+            // keep stray output of libraries out of the response channel
+            ob_start();
+            try {
+                $response = $this->handleMessage($input);
+            } catch (\Throwable $e) {
+                $response = $this->buildResponse(['error' => $e->getMessage()], 500);
+            }
+            $stray = ob_get_clean();
+            if ($stray !== false && $stray !== '') {
+                error_log("EBICS worker output: " . $stray);
+            }
+            
+            $frame = json_encode($response);
+            fwrite(STDOUT, strlen($frame) . "\n" . $frame);
+            fflush(STDOUT);
+            $this->served++;
+            gc_collect_cycles();
+        }
+    }
+    
+    private function readBytes($stream, $length) {
+        $data = '';
+        while (strlen($data) < $length) {
+            $chunk = fread($stream, $length - strlen($data));
+            if ($chunk === false || ($chunk === '' && feof($stream))) {
+                return null;
+            }
+            $data .= $chunk;
+        }
+        return $data;
+    }
+    
+    /**
+     * Verify and process one request, returns the signed response
+     */
+    public function handleMessage($input) {
         try {
-            // Read request from stdin
-            $input = file_get_contents('php://stdin');
             if (!$input) {
-                $this->error("No input provided", 400);
+                return $this->buildResponse(['error' => "No input provided"], 400);
             }
             
             $request = json_decode($input, true);
             if (!$request) {
-                $this->error("Invalid JSON input", 400);
+                return $this->buildResponse(['error' => "Invalid JSON input"], 400);
             }
             
             // Verify signature
             if (!$this->verifySignature($request)) {
-                $this->error("Invalid signature", 403);
+                return $this->buildResponse(['error' => "Invalid signature"], 403);
             }
             
             // Verify timestamp (max 60 seconds)
             if (isset($request['timestamp']) && abs(time() - $request['timestamp']) > 60) {
-                $this->error("Request expired", 403);
+                return $this->buildResponse(['error' => "Request expired"], 403);
+            }
+            
+            // A long-lived worker must not accept a signed request twice
+            if ($this->workerMode && !$this->acceptNonce($request['nonce'] ?? null)) {
+                return $this->buildResponse(['error' => "Request replayed"], 403);
             }
             
             // Process request
@@ -104,14 +174,30 @@ class UnifiedEbicsService {
                 $request['params']
             );
             
-            // Respond with success
-            $this->respond($result);
+            return $this->buildResponse($result);
             
         } catch (Exception $e) {
-            $this->error($e->getMessage(), 500);
+            return $this->buildResponse(['error' => $e->getMessage()], 500);
         }
     }
     
+    private function acceptNonce($nonce) {
+        if (!$nonce) {
+            return false;
+        }
+        $now = time();
+        foreach ($this->seenNonces as $seen => $timestamp) {
+            if ($now - $timestamp > 120) {
+                unset($this->seenNonces[$seen]);
+            }
+        }
+        if (isset($this->seenNonces[$nonce])) {
+            return false;
+        }
+        $this->seenNonces[$nonce] = $now;
+        return true;
+    }
+    
     private function verifySignature($request) {
         if (!isset($request['signature'])) {
             return false;
@@ -144,6 +230,15 @@ class UnifiedEbicsService {
     
     private function processRequest($action, $params) {
         switch($action) {
+            case 'PING':
+                // health check of the worker pool
+                return [
+                    'success' => true,
+                    'pid' => getmypid(),
+                    'served' => $this->served,
+                    'memory' => memory_get_usage(true)
+                ];
+                
             case 'GENERATE_KEYS':
                 return $this->generateKeys($params);
                 
@@ -1462,7 +1557,7 @@ try {
         }
     }
     
-    private function respond($data, $code = 200) {
+    private function buildResponse($data, $code = 200) {
         $response = [
             'data' => $data,
             'timestamp' => time(),
@@ -1473,8 +1568,15 @@ try {
         $message = json_encode($response, JSON_UNESCAPED_SLASHES | JSON_UNESCAPED_UNICODE);
         $response['signature'] = hash_hmac('sha256', $message, $this->secretKey);
         
-        // Output
+        return $response;
+    }
+    
+    private function output($response) {
         fwrite(STDOUT, json_encode($response));
+    }
+    
+    private function respond($data, $code = 200) {
+        $this->output($this->buildResponse($data, $code));
         exit($code === 200 ? 0 : 1);
     }
     
@@ -1487,7 +1589,11 @@ try {
 if (php_sapi_name() === 'cli' && basename(__FILE__) === basename($argv[0] ?? '')) {
     try {
         $service = new UnifiedEbicsService();
-        $service->handle();
+        if (in_array('--worker', $argv ?? [], true)) {
+            $service->serve();
+        } else {
+            $service->handle();
+        }
     } catch (Exception $e) {
         fwrite(STDERR, "Fatal error: " . $e->getMessage() . "\n");
         exit(1);
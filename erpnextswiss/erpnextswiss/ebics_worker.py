@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+"""
+EBICS PHP Worker Pool
+=====================
+
+Long-lived `php unified_ebics_service.php --worker` processes. Starting
+php for every order pays interpreter boot and composer autoload each
+time; a worker is started once and then serves framed requests
+("<length>\\n<json>") on stdin/stdout. Requests and responses are the
+same HMAC-signed JSON documents as in the one-shot mode.
+
+The pool checks idle workers with a signed PING, enforces a timeout per
+request and replaces workers that crashed, timed out or served
+max_requests orders. Callers fall back to the one-shot subprocess when
+no worker can be used (see EbicsManager._call_php_service).
+
+Site config:
+    ebics_php_worker: 0 to disable the worker mode (default 1)
+    ebics_php_worker_pool_size: workers per process and site (default 2)
+    ebics_php_worker_max_requests: requests before a worker is recycled (default 200)
+    ebics_php_worker_idle_timeout: seconds before an idle worker is stopped (default 300)
+"""
+
+import os
+import json
+import time
+import hmac
+import atexit
+import hashlib
+import secrets
+import selectors
+import subprocess
+import threading
+import frappe
+
+# orders that can safely be sent again after a worker failure
+IDEMPOTENT_ACTIONS = ['PING', 'HPB', 'HAA', 'HTD', 'PTK', 'Z52', 'Z53', 'Z54', 'FDL', 'GET_INI_LETTER']
+
+HEALTH_CHECK_INTERVAL = 60          # seconds of idleness before a worker is pinged
+HEALTH_CHECK_TIMEOUT = 10
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+class EbicsWorkerError(Exception):
+    """
+    Worker failure; request_sent tells whether the order might have reached
+    the php side (and thus must not blindly be sent again)
+    """
+    def __init__(self, message, request_sent=False, timeout=False):
+        super(EbicsWorkerError, self).__init__(message)
+        self.request_sent = request_sent
+        self.timeout = timeout
+
+def build_signed_request(action, params, secret_key):
+    """
+    Build a signed request document as the php service expects it
+    """
+    request = {
+        "action": action,
+        "params": params,
+        "timestamp": int(time.time()),
+        "nonce": secrets.token_hex(16)
+    }
+    request_json = json.dumps(request, sort_keys=True, separators=(',', ':'))
+    request["signature"] = hmac.new(secret_key.encode(), request_json.encode(), hashlib.sha256).hexdigest()
+    return json.dumps(request, separators=(',', ':'))
+
+def use_php_worker():
+    return bool(frappe.conf.get('ebics_php_worker', 1))
+
+class EbicsWorker:
+    """
+    One php process in worker mode
+    """
+    def __init__(self, script, env, stderr_path=None):
+        self.stderr = open(stderr_path, "ab") if stderr_path else subprocess.DEVNULL
+        self.process = subprocess.Popen(
+            ['php', script, '--worker'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.stderr,
+            env=env,
+            cwd=os.path.dirname(script)
+        )
+        self.started = time.time()
+        self.last_used = self.started
+        self.requests = 0
+        self._buffer = bytearray()
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.process.stdout, selectors.EVENT_READ)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def request(self, payload, timeout=60):
+        """
+        Send one request document, return the response document (str)
+        """
+        data = payload.encode("utf-8")
+        try:
+            self.process.stdin.write("{0}\n".format(len(data)).encode("ascii") + data)
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError) as err:
+            raise EbicsWorkerError("Unable to send request to worker: {0}".format(err), request_sent=False)
+        self.requests += 1
+        deadline = time.time() + timeout
+        header = self._read_until(lambda: self._buffer.find(b"\n") + 1, deadline)
+        try:
+            length = int(header.strip())
+        except ValueError:
+            raise EbicsWorkerError("Invalid frame header from worker: {0}".format(header[:100]), request_sent=True)
+        body = self._read_until(lambda: length if len(self._buffer) >= length else 0, deadline)
+        self.last_used = time.time()
+        return body.decode("utf-8")
+
+    def _read_until(self, frame_end, deadline):
+        """
+        Read from the worker until frame_end() returns the frame length
+        """
+        while True:
+            end = frame_end()
+            if end:
+                frame = bytes(self._buffer[:end])
+                del self._buffer[:end]
+                return frame
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise EbicsWorkerError("Worker timeout", request_sent=True, timeout=True)
+            if not self._selector.select(timeout=remaining):
+                continue
+            chunk = os.read(self.process.stdout.fileno(), 65536)
+            if not chunk:
+                raise EbicsWorkerError("Worker terminated (exit code {0})".format(self.process.poll()), request_sent=True)
+            self._buffer.extend(chunk)
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+            self.process.wait()
+        self._selector.close()
+        if self.stderr is not subprocess.DEVNULL:
+            self.stderr.close()
+        return
+
+class EbicsWorkerPool:
+    """
+    Pool of php workers for one service script and site
+    """
+    def __init__(self, script, env, secret_key, size=2, max_requests=200, idle_timeout=300, stderr_path=None):
+        self.script = script
+        self.env = env
+        self.secret_key = secret_key
+        self.size = max(1, int(size))
+        self.max_requests = int(max_requests)
+        self.idle_timeout = int(idle_timeout)
+        self.stderr_path = stderr_path
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self.started_workers = 0
+        self.failed_workers = 0
+
+    def execute(self, payload, timeout=60):
+        """
+        Run one signed request on a worker, return the response document (str)
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise EbicsWorkerError("No EBICS worker available", request_sent=False, timeout=True)
+        try:
+            worker = self._acquire()
+            try:
+                response = worker.request(payload, timeout=timeout)
+            except EbicsWorkerError:
+                # never reuse a worker in an unknown state
+                self.failed_workers += 1
+                worker.stop()
+                raise
+            self._release(worker)
+            return response
+        finally:
+            self._slots.release()
+
+    def _acquire(self):
+        with self._lock:
+            now = time.time()
+            expired = [w for w in self._idle if now - w.last_used > self.idle_timeout]
+            self._idle = [w for w in self._idle if w not in expired]
+        # stop workers that were idle for too long
+        for worker in expired:
+            worker.stop()
+        while True:
+            with self._lock:
+                worker = self._idle.pop() if self._idle else None
+            if not worker:
+                break
+            if self.is_healthy(worker):
+                return worker
+            self.failed_workers += 1
+            worker.stop()
+        try:
+            worker = EbicsWorker(self.script, self.env, self.stderr_path)
+        except OSError as err:
+            raise EbicsWorkerError("Unable to start EBICS worker: {0}".format(err), request_sent=False)
+        self.started_workers += 1
+        return worker
+
+    def _release(self, worker):
+        if not worker.is_alive() or worker.requests >= self.max_requests:
+            worker.stop()
+            return
+        with self._lock:
+            self._idle.append(worker)
+        return
+
+    def is_healthy(self, worker):
+        """
+        Process alive and, after a longer idle time, answering a signed PING
+        """
+        if not worker.is_alive():
+            return False
+        if time.time() - worker.last_used < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            response = json.loads(worker.request(build_signed_request('PING', {}, self.secret_key),
+                timeout=HEALTH_CHECK_TIMEOUT))
+            return response.get('code') == 200
+        except (EbicsWorkerError, ValueError):
+            return False
+
+    def stop(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop().stop()
+        return
+
+    def get_status(self):
+        return {
+            'size': self.size,
+            'idle_workers': len(self._idle),
+            'started_workers': self.started_workers,
+            'failed_workers': self.failed_workers
+        }
+
+def get_worker_pool(script, env):
+    """
+    Return the worker pool of this process for a service script and site
+    """
+    key = (script, env.get("FRAPPE_SITE"), env.get("EBICS_INTERNAL_SECRET"))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = EbicsWorkerPool(
+                script,
+                env,
+                env.get("EBICS_INTERNAL_SECRET"),
+                size=frappe.conf.get('ebics_php_worker_pool_size', 2),
+                max_requests=frappe.conf.get('ebics_php_worker_max_requests', 200),
+                idle_timeout=frappe.conf.get('ebics_php_worker_idle_timeout', 300),
+                stderr_path=os.path.join(frappe.utils.get_bench_path(), "logs", "ebics_worker.log")
+            )
+        return _pools[key]
+
+@atexit.register
+def stop_worker_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.stop()
+    return
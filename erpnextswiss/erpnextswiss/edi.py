@@ -7,10 +7,12 @@
 from datetime import datetime
 import frappe
 import hashlib
+import re
 from frappe.utils import cint
 from frappe.desk.form.load import get_attachments
 from datetime import datetime
 from frappe import _
+from erpnextswiss.erpnextswiss.utils import get_chunks
 
 """
 Creates a new EDI File of PRICAT type
@@ -354,6 +356,21 @@ def get_item_from_gtin(gtin):
     else:
         return None
 
+def get_items_from_gtins(gtins):
+    """
+    Map GTINs to item codes (first EAN barcode match, as get_item_from_gtin)
+    """
+    items = {}
+    for chunk in get_chunks(set(g for g in gtins if g)):
+        for match in frappe.db.sql("""
+            SELECT `barcode`, `parent`
+            FROM `tabItem Barcode`
+            WHERE `barcode_type` = "EAN"
+              AND `barcode` IN %(gtins)s;
+        """, {'gtins': tuple(chunk)}, as_dict=True):
+            items.setdefault(match['barcode'], match['parent'])
+    return items
+
 def get_address_from_gln(gln):
     gln_matches = frappe.get_all("Address",
         filters={'branch_gln': gln},
@@ -400,7 +417,8 @@ def parse_communication(edi_file, communication):
         content = f.get_content()
         # check if content has line feeds
         if content and not "\n" in content:
-            content = content.replace("'", "'\n")
+            # break after each segment terminator (not after a released apostrophe)
+            content = re.sub(r"((?:[^?']|\?[\s\S])*')", r"\1\n", content)
         edi.filename = f.file_name
         edi.content = content
         edi.save(ignore_permissions=True)
@@ -547,16 +565,131 @@ def create_orders(edi_file):
     frappe.db.commit()
     return
     
+"""
+EDIFACT tokenizer: the UNA service string advice defines the delimiters
+(defaults below), the release character escapes a delimiter in a value.
+Line breaks between segments are ignored.
+"""
+UNA_DEFAULTS = {
+    'component': ":",
+    'data': "+",
+    'decimal': ".",
+    'release': "?",
+    'terminator': "'"
+}
+READ_CHUNK_SIZE = 65536
+
 def get_segments(content):
-    return content.split("\n")
+    return iter_segments(content)
 
-def parse_segment(segment):
-    structure = segment.split("+")
-    matrix = []
-    for s in structure:
-        matrix.append(s.split(":"))
+def iter_segments(content, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield the segments of an interchange as [[element component, ...], ...],
+    content is a string, bytes or a file-like object (read in chunks)
+    """
+    chunks = iter_chunks(content, chunk_size)
+    buffer = ""
+    # read enough to detect the service string advice
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer.lstrip("\ufeff \r\n")) >= 9:
+            break
+    buffer = buffer.lstrip("\ufeff \r\n")
+    delimiters = dict(UNA_DEFAULTS)
+    if buffer.startswith("UNA") and len(buffer) >= 9:
+        delimiters.update({
+            'component': buffer[3],
+            'data': buffer[4],
+            'decimal': buffer[5],
+            'release': buffer[6],
+            'terminator': buffer[8]
+        })
+        buffer = buffer[9:]
+    segment_pattern = get_segment_pattern(delimiters)
+    
+    while True:
+        position = 0
+        while True:
+            match = segment_pattern.match(buffer, position)
+            if not match:
+                break
+            position = match.end()
+            if match.group(1).strip():
+                yield split_segment(match.group(1), delimiters)
+        buffer = buffer[position:]
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        buffer += chunk
+    # last segment without terminator
+    if buffer.strip():
+        if buffer.endswith(delimiters['release']):
+            buffer = buffer[:-1]
+        yield split_segment(buffer, delimiters)
+    return
+
+def iter_chunks(content, chunk_size=READ_CHUNK_SIZE):
+    if content is None:
+        return
+    if hasattr(content, "read"):
+        while True:
+            chunk = content.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
+    else:
+        if isinstance(content, bytes):
+            content = content.decode("utf-8")
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+    return
+
+def get_segment_pattern(delimiters):
+    # a segment: any character but terminator, release and line breaks, or a released character
+    return re.compile(r"((?:[^{t}{r}\r\n]|{r}[\s\S])*)([{t}\r\n])".format(
+        t=re.escape(delimiters['terminator']),
+        r=re.escape(delimiters['release'])
+    ))
+
+def split_segment(segment, delimiters=UNA_DEFAULTS):
+    """
+    Split a segment (without terminator) into elements and components
+    """
+    segment = segment.strip()
+    release = delimiters['release']
+    if release not in segment:
+        return [element.split(delimiters['component']) for element in segment.split(delimiters['data'])]
+    matrix = [[]]
+    value = []
+    released = False
+    for c in segment:
+        if released:
+            value.append(c)
+            released = False
+        elif c == release:
+            released = True
+        elif c == delimiters['data']:
+            matrix[-1].append("".join(value))
+            matrix.append([])
+            value = []
+        elif c == delimiters['component']:
+            matrix[-1].append("".join(value))
+            value = []
+        else:
+            value.append(c)
+    matrix[-1].append("".join(value))
     return matrix
 
+def parse_segment(segment):
+    segment = segment.strip()
+    if segment.endswith(UNA_DEFAULTS['terminator']) and not segment.endswith(UNA_DEFAULTS['release'] + UNA_DEFAULTS['terminator']):
+        segment = segment[:-1]
+    return split_segment(segment)
+
+def parse_number(value):
+    # both decimal marks are allowed in EDIFACT
+    return float((value or "").replace(",", "."))
+
 def parse_date(date_str, date_code):
     if date_code == "102" or date_code == "102'":
         return datetime.strptime(date_str, "%Y%m%d")
@@ -569,13 +702,16 @@ def parse_edi(segments):
     sender_gln = None
     recipient_gln = None
     for segment in segments:
-        structure = parse_segment(segment)
+        structure = parse_segment(segment) if isinstance(segment, str) else segment
         if structure[0][0] == "UNB":
             # header
             sender_gln = structure[2][0]
             recipient_gln = structure[3][0]
         elif structure[0][0] == "UNH":
             # message header
+            # resolve items of an unterminated previous message
+            if data:
+                set_item_codes(data[-1]['items'])
             # create new file structure
             data.append({
                 'items': []
@@ -587,7 +723,7 @@ def parse_edi(segments):
         elif structure[0][0] == "BGM":
             # begin message
             try:
-                data[-1]['reference'] = (structure[2][0] or "").replace("'", "")
+                data[-1]['reference'] = structure[2][0] or ""
                 data[-1]['action'] = structure[3][0]
             except:
                 data[-1]['action'] = 9          # default to add
@@ -606,7 +742,7 @@ def parse_edi(segments):
             elif structure[1][0] == "63":        # requested latest delivery date
                 data[-1]['latest_delivery_date'] = parse_date(structure[1][1], structure[1][2])
         elif structure[0][0] == "RFF":
-            data[-1]['reference'] = (structure[1][1] or "").replace("'", "")
+            data[-1]['reference'] = structure[1][1] or ""
         elif structure[0][0] == "NAD":
             # name and address
             if structure[1][0] == "SU":        # supplier
@@ -623,29 +759,40 @@ def parse_edi(segments):
             data[-1]['location_gln'] = structure[2][0]
             location_gln = structure[2][0]
         elif structure[0][0] == "LIN":
-            # line item
-            # find item
-            item_barcode = structure[3][0]
-            item_code = get_item_from_gtin(item_barcode)
+            # line item (item code is resolved per message)
             data[-1]['items'].append({
-                'barcode': item_barcode,
-                'item_code': item_code,
+                'barcode': structure[3][0],
                 'location_gln': location_gln            # apply last found location gln
             })
         elif structure[0][0] == "PRI":
             # price details
             if structure[1][0] == "AAA":
-                data[-1]['items'][-1]['calculation_net_rate'] = float((structure[1][1] or "").replace("'", ""))
+                data[-1]['items'][-1]['calculation_net_rate'] = parse_number(structure[1][1])
             elif structure[1][0] == "NTP":
-                data[-1]['items'][-1]['net_unit_rate'] = float((structure[1][1] or "").replace("'", ""))
+                data[-1]['items'][-1]['net_unit_rate'] = parse_number(structure[1][1])
         elif structure[0][0] == "QTY":
             # quantity
-            data[-1]['items'][-1]['qty'] = float(structure[1][1].split("'")[0])
+            data[-1]['items'][-1]['qty'] = parse_number(structure[1][1])
         elif structure[0][0] == "UNT":
             # message trailer
             data[-1]['segments'] = structure[1][0]
+            set_item_codes(data[-1]['items'])
     
+    if data:
+        set_item_codes(data[-1]['items'])
     return data
+
+"""
+Resolve the item codes of all line items of a message in one query
+"""
+def set_item_codes(items):
+    pending = [item for item in items if 'item_code' not in item]
+    if not pending:
+        return
+    item_codes = get_items_from_gtins([item['barcode'] for item in pending])
+    for item in pending:
+        item['item_code'] = item_codes.get(item['barcode'])
+    return
     
 def purify_string(s):
     return (s or "").replace("\r", "").replace("\n", "")
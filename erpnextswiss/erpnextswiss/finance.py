@@ -6,78 +6,126 @@ from frappe import _
 from frappe.utils.background_jobs import enqueue
 from frappe.utils.file_manager import save_file, remove_all
 from erpnext.setup.utils import get_exchange_rate as get_core_exchange_rate
-from frappe.utils import rounded
+from frappe.utils import rounded, flt
+from itertools import groupby
+from erpnextswiss.erpnextswiss.utils import get_chunks
+
+ACCOUNT_BATCH_SIZE = 50            # accounts per GL Entry query of the account sheets
 
 """ Jinja hook to create account sheets """
 def get_account_sheets(fiscal_year, company=None):
+    if frappe.flags.stream_account_sheets:
+        # long fiscal year print: render account by account
+        return AccountSheets(fiscal_year, company)
+    return list(iter_account_sheets(fiscal_year, company))
+
+"""
+Lazy sequence of account sheets: each iteration reads the sheets again batch
+by batch (see iter_account_sheets), len() only counts the accounts, so a
+print format can use |length, if and several loops like on a list
+"""
+class AccountSheets(object):
+    def __init__(self, fiscal_year, company=None):
+        self.fiscal_year = fiscal_year
+        self.company = company
+        self._length = None
+
+    def __iter__(self):
+        return iter_account_sheets(self.fiscal_year, self.company)
+
+    def __len__(self):
+        if self._length is None:
+            fy = frappe.get_doc("Fiscal Year", self.fiscal_year)
+            self._length = frappe.db.sql("""
+                SELECT COUNT(DISTINCT `tabGL Entry`.`account`)
+                FROM `tabGL Entry`
+                JOIN `tabAccount` ON `tabAccount`.`name` = `tabGL Entry`.`account`
+                WHERE `tabAccount`.`disabled` = 0
+                  AND `tabAccount`.`company` LIKE %(company)s
+                  AND `tabGL Entry`.`posting_date` BETWEEN %(start_date)s AND %(end_date)s;""",
+                {'company': self.company or "%", 'start_date': fy.year_start_date, 'end_date': fy.year_end_date})[0][0]
+        return self._length
+
+    def __bool__(self):
+        return len(self) > 0
+
+"""
+Generator of account sheets (one per account with transactions in the fiscal year)
+
+Opening balances come from one grouped query, period entries are read
+for batches of accounts ordered by account and posting date, so only the
+entries of one batch are held in memory.
+"""
+def iter_account_sheets(fiscal_year, company=None):
     fy = frappe.get_doc("Fiscal Year", fiscal_year)
-    _opening_debit = 0
-    _opening_credit = 0
-    account_data = []
+    filters = {'disabled': 0}
     if company:
-        accounts = frappe.get_all("Account", filters={'disabled': 0, 'company': company}, fields=['name', 'report_type'], order_by='name')
-    else:
-        accounts = frappe.get_all("Account", filters={'disabled': 0}, fields=['name', 'report_type'], order_by='name')
-    for account in accounts:
-        _balance = 0
-        _data = {'account': account.name, 'transactions': [], 'report_type': account.report_type}
-        transactions = frappe.get_all("GL Entry", filters=[
-            ['account', '=', account.name],
-            ['posting_date', '>=', fy.year_start_date],
-            ['posting_date', '<=', fy.year_end_date]
-        ], fields=['posting_date', 'debit', 'credit', 'remarks', 'voucher_no', 'creation', 'is_opening'],
-        order_by='posting_date')
-        if transactions:
-            # calculate opening for balance sheet accounts
-            # reset counters
-            _opening_debit = 0
-            _opening_credit = 0 
-            if account.report_type == "Balance Sheet":
-                # compute opening balance
-                opening_transactions = frappe.get_all("GL Entry", filters=[
-                  ['account', '=', account.name],
-                  ['posting_date', '<', fy.year_start_date]
-                ], fields=['debit', 'credit'])     
-                # compute debit and credit at opening
-                for opening_txn in opening_transactions:
-                    _opening_debit += opening_txn.debit
-                    _opening_credit += opening_txn.credit
-                # consolidate debit/credit
-                if _opening_debit > _opening_credit:
-                    _delta = _opening_debit - _opening_credit
-                    _opening_debit = _delta
-                    _opening_credit = 0
-                else:
-                    _delta = _opening_credit - _opening_debit
-                    _opening_debit = 0
-                    _opening_credit = _delta
-                _data['opening_debit'] = _opening_debit
-                _data['opening_credit'] = _opening_credit
-                _balance = (_opening_debit - _opening_credit)
-            # reset counters for period sum
-            _opening_debit = 0
-            _opening_credit = 0 
-            # loop through transactions
-            for transaction in transactions:
-                # update current debit/credit
-                _opening_debit += transaction.debit
-                _opening_credit += transaction.credit
-                _balance += (transaction.debit - transaction.credit)
-                _data['transactions'].append({
-                    'posting_date': transaction.posting_date,
-                    'debit': transaction.debit,
-                    'credit': transaction.credit,
-                    'balance': _balance,
-                    'voucher_no': transaction.voucher_no,
-                    'remarks': transaction.remarks
-                })
-            # compute closing balance, debit and credit ar sums of transactions
-            _data['closing_debit'] = _opening_debit
-            _data['closing_credit'] = _opening_credit
-            _data['closing_balance'] = _balance
-            # append data to storage
-            account_data.append(_data)
-    return account_data
+        filters['company'] = company
+    accounts = frappe.get_all("Account", filters=filters, fields=['name', 'report_type'], order_by='name')
+    report_types = {account.name: account.report_type for account in accounts}
+    openings = get_opening_balances(
+        [account.name for account in accounts if account.report_type == "Balance Sheet"], fy.year_start_date)
+    for batch in get_chunks([account.name for account in accounts], ACCOUNT_BATCH_SIZE):
+        entries = frappe.db.sql("""
+            SELECT `account`, `posting_date`, `debit`, `credit`, `remarks`, `voucher_no`
+            FROM `tabGL Entry`
+            WHERE `account` IN %(accounts)s
+              AND `posting_date` BETWEEN %(start_date)s AND %(end_date)s
+            ORDER BY `account` ASC, `posting_date` ASC, `creation` ASC;""",
+            {'accounts': tuple(batch), 'start_date': fy.year_start_date, 'end_date': fy.year_end_date},
+            as_dict=True)
+        for account, transactions in groupby(entries, key=lambda entry: entry.account):
+            yield get_account_sheet(account, report_types[account], transactions, openings.get(account))
+        del entries
+
+"""
+Opening balances (debit, credit) by account before a date, consolidated to one side
+"""
+def get_opening_balances(accounts, date):
+    openings = {}
+    for batch in get_chunks(accounts):
+        for row in frappe.db.sql("""
+                SELECT `account`, SUM(`debit`) AS `debit`, SUM(`credit`) AS `credit`
+                FROM `tabGL Entry`
+                WHERE `account` IN %(accounts)s
+                  AND `posting_date` < %(date)s
+                GROUP BY `account`;""",
+                {'accounts': tuple(batch), 'date': date}, as_dict=True):
+            if flt(row.debit) > flt(row.credit):
+                openings[row.account] = (flt(row.debit) - flt(row.credit), 0)
+            else:
+                openings[row.account] = (0, flt(row.credit) - flt(row.debit))
+    return openings
+
+def get_account_sheet(account, report_type, transactions, opening=None):
+    _data = {'account': account, 'transactions': [], 'report_type': report_type}
+    _balance = 0
+    if report_type == "Balance Sheet":
+        _data['opening_debit'], _data['opening_credit'] = opening or (0, 0)
+        _balance = (_data['opening_debit'] - _data['opening_credit'])
+    _debit = 0
+    _credit = 0
+    for transaction, _balance in iter_running_balance(transactions, _balance):
+        _debit += transaction.debit
+        _credit += transaction.credit
+        _data['transactions'].append({
+            'posting_date': transaction.posting_date,
+            'debit': transaction.debit,
+            'credit': transaction.credit,
+            'balance': _balance,
+            'voucher_no': transaction.voucher_no,
+            'remarks': transaction.remarks
+        })
+    # closing debit and credit are sums of the period transactions
+    _data['closing_debit'] = _debit
+    _data['closing_credit'] = _credit
+    _data['closing_balance'] = _balance
+    return _data
+
+def iter_running_balance(transactions, balance=0):
+    for transaction in transactions:
+        balance += (transaction.debit - transaction.credit)
+        yield transaction, balance
 
 # background job to create long pdf for fiscal year
 @frappe.whitelist()
@@ -100,7 +148,11 @@ def build_long_fiscal_year_print(fiscal_year):
         # create html
         if not c.print_format:
             frappe.log_error( _("Please specify a print format for company {0}", _("Print Fiscal Year") ) )
-        html = frappe.get_print("Fiscal Year", fiscal_year.name, print_format=c.print_format)
+        frappe.flags.stream_account_sheets = True
+        try:
+            html = frappe.get_print("Fiscal Year", fiscal_year.name, print_format=c.print_format)
+        finally:
+            frappe.flags.stream_account_sheets = False
         # create pdf
         pdf = frappe.utils.pdf.get_pdf(html)
         # save and attach pdf
@@ -1,37 +1,83 @@
 # -*- coding: utf-8 -*-
-# Copyright (c) 2018-2021, libracore (https://www.libracore.com) and contributors
+# Copyright (c) 2018-2025, libracore (https://www.libracore.com) and contributors
 # For license information, please see license.txt
 import frappe
 from frappe import _
+from frappe.utils import getdate
 from datetime import datetime, timedelta
+import numpy as np
+
+HOLIDAY_CALENDAR_CACHE = "erpnextswiss_holiday_calendar"
 
 def get_working_days_in_current_year(holiday_list):
     from_date = datetime(datetime.now().year, 1, 1)
     to_date = datetime.now()
     return get_working_days_between_dates(holiday_list, from_date, to_date)
-    
+
 def get_working_days_between_dates(holiday_list, from_date, to_date, debug=False):
-    # check parameters
-    if type(from_date) is str:
-        from_date = datetime.strptime(from_date, "%Y-%m-%d")
-    if type(to_date) is str:
-        to_date = datetime.strptime(to_date, "%Y-%m-%d")
-    # prepare
-    holidays = get_holidays(holiday_list)
-    date = from_date
-    days = 0
-    # loop through date range
-    while (date <= to_date):
-        # check if current day is a working day
-        if "{y:04}-{m:02}-{d:02}".format(y=date.year, m=date.month, d=date.day) not in holidays:
-            days += 1
-        date = date + timedelta(days=1)
-    return days
+    """
+    Number of days in the range (both included) that are not in the holiday list
+    """
+    from_date = getdate(from_date)
+    to_date = getdate(to_date)
+    if to_date < from_date:
+        return 0
+    # all week days are business days, only the holidays of the list are off
+    return int(np.busday_count(from_date, to_date + timedelta(days=1), busdaycal=get_busday_calendar(holiday_list)))
+
+def count_holidays(holiday_list, from_date, to_date):
+    """
+    Number of holidays of the list in the range (both included)
+    """
+    from_date = getdate(from_date)
+    to_date = getdate(to_date)
+    if to_date < from_date:
+        return 0
+    return (to_date - from_date).days + 1 - get_working_days_between_dates(holiday_list, from_date, to_date)
 
 def get_holidays(holiday_list):
-    sql_query = """SELECT `holiday_date` FROM `tabHoliday` WHERE `parent` = "{h}";""".format(h=holiday_list)
-    data = frappe.db.sql(sql_query, as_dict=True)
-    dates = []
-    for d in data:
-        dates.append(d['holiday_date'].strftime("%Y-%m-%d"))
-    return dates
+    return list(get_holiday_calendar(holiday_list).keys())
+
+"""
+Holiday calendar of a holiday list: {"YYYY-MM-DD": description}
+
+Cached in redis per holiday list (invalidated when the holiday list is saved)
+and for the current request.
+"""
+def get_holiday_calendar(holiday_list):
+    calendars = frappe.flags.holiday_calendars
+    if calendars is None:
+        calendars = frappe.flags.holiday_calendars = {}
+    if holiday_list not in calendars:
+        calendars[holiday_list] = frappe.cache().hget(HOLIDAY_CALENDAR_CACHE, holiday_list,
+            generator=lambda: load_holiday_calendar(holiday_list))
+    return calendars[holiday_list]
+
+def load_holiday_calendar(holiday_list):
+    calendar = {}
+    for holiday in frappe.db.sql("""
+            SELECT `holiday_date`, `description`
+            FROM `tabHoliday`
+            WHERE `parent` = %(holiday_list)s AND `parenttype` = "Holiday List"
+            ORDER BY `holiday_date` ASC;""", {'holiday_list': holiday_list}, as_dict=True):
+        calendar.setdefault(holiday['holiday_date'].strftime("%Y-%m-%d"), holiday['description'])
+    return calendar
+
+def get_busday_calendar(holiday_list):
+    busday_calendars = frappe.flags.busday_calendars
+    if busday_calendars is None:
+        busday_calendars = frappe.flags.busday_calendars = {}
+    if holiday_list not in busday_calendars:
+        busday_calendars[holiday_list] = np.busdaycalendar(weekmask="1111111",
+            holidays=np.array(list(get_holiday_calendar(holiday_list).keys()), dtype="datetime64[D]"))
+    return busday_calendars[holiday_list]
+
+"""
+Document hook (Holiday List: on_update, on_trash)
+"""
+def clear_holiday_calendar(doc, event=None):
+    frappe.cache().hdel(HOLIDAY_CALENDAR_CACHE, doc.name)
+    for calendars in (frappe.flags.holiday_calendars, frappe.flags.busday_calendars):
+        if calendars:
+            calendars.pop(doc.name, None)
+    return
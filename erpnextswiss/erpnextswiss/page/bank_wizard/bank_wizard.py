@@ -4,14 +4,13 @@
 
 import frappe
 from frappe import throw, _
-import hashlib
 import json
-from bs4 import BeautifulSoup
 import ast
 from frappe.utils import cint, flt
 from frappe.utils.data import get_url_to_form
 from erpnext.setup.utils import get_exchange_rate
-import datetime
+from erpnextswiss.erpnextswiss.camt import parse_camt
+from erpnextswiss.erpnextswiss.bank_matching import MatchIndex, ImportedReferences
 
 # this function tries to match the amount to an open sales invoice
 #
@@ -210,171 +209,68 @@ def get_first_company():
     companies = frappe.get_all("Company", filters=None, fields=['name'])
     return companies[0]['name']
 
+"""
+Parse a camt document once (see erpnextswiss.erpnextswiss.camt.parse_camt) with the
+entry settings of ERPNextSwiss Settings; the result can be passed to read_camt053_meta,
+read_camt053 and read_camt052_intraday
+"""
+def parse_camt_document(content, read_entries=True, settings=None):
+    if not settings:
+        settings = frappe.get_cached_doc("ERPNextSwiss Settings", "ERPNextSwiss Settings")
+    return parse_camt(content,
+        read_entries=read_entries,
+        use_entry_transaction_type=cint(settings.always_use_entry_transaction_type),
+        numeric_only_reference=(cint(settings.numeric_only_debtor_matching) == 1))
+
+"""
+Parse a camt document for an import: returns None (and logs the error) if the content
+cannot be parsed, so that the raw content can still be stored
+"""
+def try_parse_camt_document(content):
+    try:
+        return parse_camt_document(content)
+    except Exception as e:
+        frappe.log_error("Unable to parse camt content: {0}".format(str(e)), "CAMT053 Parsing Error")
+        return None
+
 """
 Interpret meta information of the camt.053 record
 
-Input: camt.053-xml-string
+Input: camt.053-xml-string (or an already parsed camt document)
 Output: meta-dict
 """
-def read_camt053_meta(content):
-    soup = BeautifulSoup(content, 'lxml-xml')  # Use lxml-xml for better namespace handling
-    meta = {}
-    
+def read_camt053_meta(content, camt_document=None):
     try:
-        # Try to get IBAN - handle both lowercase and uppercase tags
-        iban_element = soup.find('IBAN') or soup.find('iban')
-        if iban_element:
-            meta['iban'] = iban_element.get_text().strip()
-        else:
-            meta['iban'] = 'n/a'
+        if not camt_document:
+            # tolerant: also reads the header of malformed or truncated content
+            camt_document = parse_camt(content, read_entries=False, recover=True)
+        meta = camt_document.get_meta()
+        if meta['iban'] == 'n/a':
             frappe.log_error("Could not find IBAN in XML", "CAMT053 Parsing")
-        
-        # Try to get electronic sequence number
-        elec_seq = soup.find('ElctrncSeqNb') or soup.find('elctrncseqnb')
-        if elec_seq:
-            meta['electronic_sequence_number'] = elec_seq.get_text().strip()
-        else:
-            meta['electronic_sequence_number'] = 'n/a'
-        
-        # Try to get message ID from Stmt
-        stmt = soup.find('Stmt') or soup.find('stmt')
-        if stmt:
-            stmt_id = stmt.find('Id') or stmt.find('id')
-            if stmt_id:
-                meta['msgid'] = stmt_id.get_text().strip()
-            else:
-                meta['msgid'] = 'n/a'
-        else:
-            meta['msgid'] = 'n/a'
-        
-        # Try to get currency from balance or account
-        # First try from Bal/Amt
-        amt_element = soup.find('Amt') or soup.find('amt')
-        if amt_element and amt_element.has_attr('Ccy'):
-            meta['currency'] = amt_element['Ccy']
-        elif amt_element and amt_element.has_attr('ccy'):
-            meta['currency'] = amt_element['ccy']
-        else:
-            # Try from account currency
-            ccy_element = soup.find('Ccy') or soup.find('ccy')
-            if ccy_element:
-                meta['currency'] = ccy_element.get_text().strip()
-            else:
-                meta['currency'] = 'CHF'
-                
     except Exception as e:
         frappe.log_error("Error parsing CAMT053 meta: {0}".format(str(e)), "CAMT053 Parsing Error")
         meta = {
             'iban': 'n/a',
             'electronic_sequence_number': 'n/a',
             'msgid': 'n/a',
-            'currency': 'CHF'
+            'currency': 'CHF',
+            'opening_balance': 0.0,
+            'closing_balance': 0.0,
+            'statement_date': None
         }
-    # find balances - handle both uppercase and lowercase
-    try:
-        balances = soup.find_all('Bal') or soup.find_all('bal')
-        for balance in balances:
-            try:
-                # Get balance type
-                cd_element = balance.find('Cd') or balance.find('cd')
-                if cd_element:
-                    balance_type = cd_element.get_text().strip()
-                    # Get amount
-                    amt_element = balance.find('Amt') or balance.find('amt')
-                    if amt_element:
-                        amount_text = amt_element.get_text().strip()
-                        amount = float(amount_text)
-                        
-                        # Check if debit or credit
-                        cdtdbtind_element = balance.find('CdtDbtInd') or balance.find('cdtdbtind')
-                        if cdtdbtind_element:
-                            cdtdbt = cdtdbtind_element.get_text().strip()
-                            if cdtdbt == "DBIT":
-                                amount = -amount
-                        
-                        if balance_type == "OPBD":
-                            meta['opening_balance'] = amount
-                        elif balance_type == "CLBD":
-                            meta['closing_balance'] = amount
-            except Exception as e:
-                frappe.log_error("Error parsing balance: {0}".format(str(e)), "CAMT053 Balance Parsing")
-                continue
-    except Exception as e:
-        frappe.log_error("Error finding balances: {0}".format(str(e)), "CAMT053 Balance Search")
-        
-    # Set default values if not found
-    if 'opening_balance' not in meta:
-        meta['opening_balance'] = 0.0
-    if 'closing_balance' not in meta:
-        meta['closing_balance'] = 0.0
-    
-    # Extract statement date from FrDtTm or ToDtTm
-    try:
-        # Try to find statement date/time elements
-        # First try FrDtTm (From Date Time)
-        fr_dt_tm_element = soup.find('FrDtTm') or soup.find('frdttm')
-        if fr_dt_tm_element:
-            dt_element = fr_dt_tm_element.find('Dt') or fr_dt_tm_element.find('dt')
-            if dt_element:
-                date_text = dt_element.get_text().strip()
-                # Ensure the date is in YYYY-MM-DD format
-                if len(date_text) == 10 and date_text[4] == '-' and date_text[7] == '-':
-                    meta['statement_date'] = date_text
-                else:
-                    frappe.log_error(f"Unexpected date format in FrDtTm: {date_text}", "CAMT053 Date Format")
-        
-        # If not found, try ToDtTm (To Date Time)
-        if 'statement_date' not in meta:
-            to_dt_tm_element = soup.find('ToDtTm') or soup.find('todttm')
-            if to_dt_tm_element:
-                dt_element = to_dt_tm_element.find('Dt') or to_dt_tm_element.find('dt')
-                if dt_element:
-                    date_text = dt_element.get_text().strip()
-                    # Ensure the date is in YYYY-MM-DD format
-                    if len(date_text) == 10 and date_text[4] == '-' and date_text[7] == '-':
-                        meta['statement_date'] = date_text
-                    else:
-                        frappe.log_error(f"Unexpected date format in ToDtTm: {date_text}", "CAMT053 Date Format")
-        
-        # If still not found, try CreDtTm (Creation Date Time) as fallback
-        if 'statement_date' not in meta:
-            cre_dt_tm_element = soup.find('CreDtTm') or soup.find('credttm')
-            if cre_dt_tm_element:
-                # CreDtTm usually contains datetime directly as text
-                datetime_str = cre_dt_tm_element.get_text().strip()
-                # Extract just the date part (YYYY-MM-DD)
-                if 'T' in datetime_str:
-                    meta['statement_date'] = datetime_str.split('T')[0]
-                else:
-                    meta['statement_date'] = datetime_str[:10]
-                    
-    except Exception as e:
-        frappe.log_error("Error extracting statement date: {0}".format(str(e)), "CAMT053 Date Parsing")
-        meta['statement_date'] = None
-            
     return meta
 
+
 @frappe.whitelist()
-def read_camt053(content, account):
+def read_camt053(content, account, camt_document=None):
     settings = frappe.get_doc("ERPNextSwiss Settings", "ERPNextSwiss Settings")
     
-    #read_camt_transactions_re(content)
-    soup = BeautifulSoup(content, 'lxml-xml')  # Use lxml-xml for better namespace handling
-    
-    # general information
+    # parse once (unless already parsed by the caller): header and entries in a single pass
     try:
-        # Try to find IBAN - handle both uppercase and lowercase
-        iban_element = soup.find('IBAN') or soup.find('iban')
-        if iban_element:
-            iban = iban_element.get_text().strip()
-        else:
-            # fallback (Credit Suisse will provide bank account number instead of IBAN)
-            iban = "n/a"
-            othr_element = soup.find('Othr') or soup.find('othr')
-            if othr_element:
-                id_element = othr_element.find('Id') or othr_element.find('id')
-                if id_element:
-                    iban = id_element.get_text().strip()
+        if not camt_document:
+            camt_document = parse_camt_document(content, settings=settings)
+        # general information (fallback for Credit Suisse: bank account number instead of IBAN)
+        iban = camt_document.iban
     except Exception as e:
         # node not found, probably wrong format
         iban = "n/a"
@@ -389,8 +285,8 @@ def read_camt053(content, account):
         frappe.msgprint("No account found for IBAN {0}. Make sure there is an account in the chart of accounts with this IBAN, account type Bank and not disabled.".format(iban), _("Bank Import IBAN validation"))
         accounts = [{'name': 'n/a'}]
 
-    # transactions - handle both uppercase and lowercase
-    entries = soup.find_all('Ntry') or soup.find_all('ntry')
+    # transactions
+    entries = camt_document.get_entries() if camt_document else []
     transactions = read_camt_transactions(entries, account, settings)
     html = render_transactions(transactions)
     
@@ -405,195 +301,34 @@ def render_transactions(transactions):
     return html
 
 def read_camt_transactions(transaction_entries, account, settings, debug=False):
+    """
+    Match parsed camt entries (see erpnextswiss.erpnextswiss.camt.parse_camt)
+    against parties and open documents
+    """
     company = frappe.get_value("Account", account, "company")
+    # open documents and parties are loaded once per statement
+    match_index = MatchIndex(settings)
+    # resolve already imported transactions in bulk
+    transaction_entries = list(transaction_entries)
+    imported_references = ImportedReferences()
+    imported_references.prefetch([t['unique_reference'] for e in transaction_entries for t in e['transactions']], company)
+    imported_references.prefetch([e['unique_reference'] for e in transaction_entries if not e['transactions']])
     txns = []
     for entry in transaction_entries:
-        entry_soup = BeautifulSoup(str(entry), 'lxml')
-        if entry_soup.bookgdt.dt:
-            date = entry_soup.bookgdt.dt.get_text()
-        elif entry_soup.bookgdt.dttm:
-            date = entry_soup.bookgdt.dttm.get_text()[:10]
-        else:
-            date = datetime.datetime.today().strftime("%Y-%m-%d")
-        transactions = entry_soup.find_all('txdtls')
-        # fetch entry amount as fallback
-        entry_amount = float(entry_soup.amt.get_text())
-        entry_currency = entry_soup.amt['ccy']
-        # fetch global account service reference
-        try:
-            global_account_service_reference = entry_soup.acctsvcrref.get_text()
-        except:
-            global_account_service_reference = ""
-        transaction_count = 0
-        if transactions and len(transactions) > 0:
-            for transaction in transactions:
-                transaction_count += 1
-                transaction_soup = BeautifulSoup(str(transaction), 'lxml')
-                # --- find transaction type: paid or received: (DBIT: paid, CRDT: received)
-                if settings.always_use_entry_transaction_type:
-                    credit_debit = entry_soup.cdtdbtind.get_text()
-                else:
-                    try:
-                        credit_debit = transaction_soup.cdtdbtind.get_text()
-                    except:
-                        # fallback to entry indicator
-                        credit_debit = entry_soup.cdtdbtind.get_text()
-                
-                # collect payment instruction id
-                try:
-                    payment_instruction_id = transaction_soup.pmtinfid.get_text()
-                except:
-                    payment_instruction_id = None
-                
-                # --- find unique reference
-                try:
-                    # try to use the account service reference
-                    unique_reference = transaction_soup.txdtls.refs.acctsvcrref.get_text()
-                except:
-                    # fallback: use tx id
-                    try:
-                        unique_reference = transaction_soup.txid.get_text()
-                    except:
-                        # fallback to pmtinfid
-                        try:
-                            unique_reference = transaction_soup.pmtinfid.get_text()
-                        except:
-                            try:
-                                if entry_soup.ntryref:
-                                    unique_reference = entry_soup.ntryref.get_text()
-                                elif global_account_service_reference != "":
-                                    # fallback to group account service reference plus transaction_count
-                                    unique_reference = "{0}-{1}".format(global_account_service_reference, transaction_count)
-                                else:
-                                    # fallback ntry reference or booking code (wise) (for banks this is often not unique)
-                                    unique_reference = entry_soup.bktxcd.prtry.cd.get_text()
-                            except:
-                                # fallback to ustrd (do not use)
-                                # unique_reference = transaction_soup.ustrd.get_text()
-                                # fallback to hash
-                                amount = transaction_soup.txdtls.amt.get_text()
-                                party = transaction_soup.nm.get_text()
-                                code = "{0}:{1}:{2}".format(date, amount, party)
-                                if settings.debug_mode:
-                                    frappe.log_error("Code: {0}".format(code))
-                                unique_reference = hashlib.md5(code.encode("utf-8")).hexdigest()
-                # --- find amount and currency
-                try:
-                    # try to find as <TxAmt>
-                    amount = float(transaction_soup.txdtls.txamt.amt.get_text())
-                    currency = transaction_soup.txdtls.txamt.amt['ccy']
-                except:
-                    try:
-                        # fallback to pure <AMT>
-                        amount = float(transaction_soup.txdtls.amt.get_text())
-                        currency = transaction_soup.txdtls.amt['ccy']
-                    except:
-                        # fallback to amount from entry level
-                        amount = entry_amount
-                        currency = entry_currency
-                try:
-                    # --- find party IBAN
-                    if credit_debit == "DBIT":
-                        # use RltdPties:Cdtr
-                        party_soup = BeautifulSoup(str(transaction_soup.txdtls.rltdpties.cdtr), 'lxml') 
-                        try:
-                            party_iban = transaction_soup.cdtracct.id.iban.get_text()
-                        except:
-                            party_iban = ""
-                    else:
-                        # CRDT: use RltdPties:Dbtr
-                        party_soup = BeautifulSoup(str(transaction_soup.txdtls.rltdpties.dbtr), 'lxml')
-                        try:
-                            party_iban = transaction_soup.dbtracct.id.iban.get_text()
-                        except:
-                            party_iban = ""
-                    try:
-                        party_name = party_soup.nm.get_text()
-                        if party_soup.strtnm:
-                            # parse by street name, ...
-                            try:
-                                street = party_soup.strtnm.get_text()
-                                try:
-                                    street_number = party_soup.bldgnb.get_text()
-                                    address_line1 = "{0} {1}".format(street, street_number)
-                                except:
-                                    address_line1 = street
-                                    
-                            except:
-                                address_line1 = ""
-                            try:
-                                plz = party_soup.pstcd.get_text()
-                            except:
-                                plz = ""
-                            try:
-                                town = party_soup.twnnm.get_text()
-                            except:
-                                town = ""
-                            address_line2 = "{0} {1}".format(plz, town)
-                        else:
-                            # parse by address lines
-                            try:
-                                address_lines = party_soup.find_all("adrline")
-                                address_line1 = address_lines[0].get_text()
-                                address_line2 = address_lines[1].get_text()
-                            except:
-                                # in case no address is provided
-                                address_line1 = ""
-                                address_line2 = ""                            
-                    except:
-                        # party is not defined (e.g. DBIT from Bank)
-                        try:
-                            # this is a fallback for ZKB which does not provide nm tag, but address line
-                            address_lines = party_soup.find_all("adrline")
-                            party_name = address_lines[0].get_text()
-                        except:
-                            party_name = "not found"
-                        address_line1 = ""
-                        address_line2 = ""
-                    try:
-                        country = party_soup.ctry.get_text()
-                    except:
-                        country = ""
-                    if (address_line1 != "") and (address_line2 != ""):
-                        party_address = "{0}, {1}, {2}".format(
-                            address_line1,
-                            address_line2,
-                            country)
-                    elif (address_line1 != ""):
-                        party_address = "{0}, {1}".format(address_line1, country)
-                    else:
-                        party_address = "{0}".format(country)
-                except:
-                    # key related parties not found / no customer info
-                    party_name = ""
-                    party_address = ""
-                    party_iban = ""
-                try:
-                    charges = float(transaction_soup.chrgs.ttlchrgsandtaxamt[text])
-                except:
-                    charges = 0.0
-
-                try:
-                    # try to find ESR reference
-                    transaction_reference = transaction_soup.rmtinf.strd.cdtrrefinf.ref.get_text()
-                except:
-                    try:
-                        # try to find a user-defined reference (e.g. SINV.)
-                        transaction_reference = transaction_soup.rmtinf.ustrd.get_text()
-                    except:
-                        try:
-                            # try to find an end-to-end ID
-                            transaction_reference = transaction_soup.endtoendid.get_text() 
-                        except:
-                            try:
-                                # try to find an AddtlTxInf
-                                transaction_reference = transaction_soup.addtltxinf.get_text() 
-                            except:
-                                # in case of numeric only matching, do not fall back to transaction id
-                                if cint(settings.numeric_only_debtor_matching) == 1:
-                                    transaction_reference = "???"
-                                else:
-                                    transaction_reference = unique_reference
+        date = entry['date']
+        entry_amount = entry['amount']
+        entry_currency = entry['currency']
+        if entry['transactions']:
+            for transaction in entry['transactions']:
+                credit_debit = transaction['credit_debit']
+                payment_instruction_id = transaction['payment_instruction_id']
+                unique_reference = transaction['unique_reference']
+                amount = transaction['amount']
+                currency = transaction['currency']
+                party_name = transaction['party_name']
+                party_address = transaction['party_address']
+                party_iban = transaction['party_iban']
+                transaction_reference = transaction['transaction_reference']
                 # debug: show collected record in error log
                 if settings.debug_mode:
                     frappe.log_error("""type:{type}\ndate:{date}\namount:{currency} {amount}\nunique ref:{unique}
@@ -604,153 +339,21 @@ def read_camt_transactions(transaction_entries, account, settings, debug=False):
                         payment_instruction_id=payment_instruction_id))
                 
                 # check if this transaction is already recorded
-                match_payment_entry = frappe.get_all('Payment Entry', 
-                    filters={'reference_no': unique_reference, 'company': company}, 
-                    fields=['name'])
+                match_payment_entry = imported_references.get_payment_entry(unique_reference, company)
                 if match_payment_entry:
                     if debug or settings.debug_mode:
-                        frappe.log_error("Transaction {0} is already imported in {1}.".format(unique_reference, match_payment_entry[0]['name']))
+                        frappe.log_error("Transaction {0} is already imported in {1}.".format(unique_reference, match_payment_entry))
                 else:
                     # try to find matching parties & invoices
-                    party_match = None
-                    employee_match = None
-                    invoice_matches = []
-                    expense_matches = None
-                    matched_amount = 0.0
                     if credit_debit == "DBIT":
-                        # match by payment instruction id
-                        possible_pinvs = []
-                        if payment_instruction_id:
-                            try:
-                                payment_instruction_fields = payment_instruction_id.split("-")
-                                try:
-                                    payment_instruction_row = int(payment_instruction_fields[-1]) + 1
-                                except:
-                                    # invalid payment instruction id (cannot parse, e.g. on LSV or foreign pain.001 source) - no match
-                                    payment_instruction_row = None
-                                if len(payment_instruction_fields) > 3:
-                                    # revision in payment proposal
-                                    payment_proposal_id = "{0}-{1}".format(payment_instruction_fields[1], payment_instruction_fields[2])
-                                elif len(payment_instruction_fields) > 1:
-                                    payment_proposal_id = payment_instruction_fields[1]
-                                else:
-                                    payment_proposal_id = None
-                                # find original instruction record
-                                payment_proposal_payments = frappe.get_all("Payment Proposal Payment", 
-                                    filters={'parent': payment_proposal_id, 'idx': payment_instruction_row},
-                                    fields=['receiver', 'receiver_address_line1', 'receiver_address_line2', 'iban', 'reference', 'receiver_id', 'esr_reference'])
-                                # supplier
-                                if payment_proposal_payments:
-                                    if payment_proposal_payments[0]['receiver_id'] and frappe.db.exists("Supplier", payment_proposal_payments[0]['receiver_id']):
-                                        party_match = payment_proposal_payments[0]['receiver_id']
-                                    else:
-                                        # fallback to supplier name
-                                        match_suppliers = frappe.get_all("Supplier", filters={'supplier_name': payment_proposal_payments[0]['receiver']}, 
-                                            fields=['name'])
-                                        if match_suppliers and len(match_suppliers) > 0:
-                                            party_match = match_suppliers[0]['name']
-                                    # purchase invoice reference match (take each part separately)
-                                    if payment_proposal_payments[0]['esr_reference']:
-                                        # match by esr reference number
-                                        possible_pinvs = frappe.get_all("Purchase Invoice",
-                                            filters=[['docstatus', '=', 1],
-                                                ['outstanding_amount', '>', 0],
-                                                ['esr_reference_number', '=', payment_proposal_payments[0]['esr_reference']]
-                                            ],
-                                            fields=['name', 'supplier', 'outstanding_amount', 'bill_no', 'esr_reference_number'])
-                                    else:
-                                        # check each individual reference (combined pinvs)
-                                        possible_pinvs = frappe.get_all("Purchase Invoice",
-                                                filters=[['docstatus', '=', 1],
-                                                    ['outstanding_amount', '>', 0],
-                                                    ['bill_no', 'IN', payment_proposal_payments[0]['reference']]
-                                                ],
-                                                fields=['name', 'supplier', 'outstanding_amount', 'bill_no', 'esr_reference_number'])
-                            except Exception as err:
-                                # this can be the case for malformed instruction ids
-                                frappe.log_error(err, "Match payment instruction error")
-                        # suppliers 
-                        if not possible_pinvs:
-                            # no payment proposal, try to estimate from other data
-                            if not party_match:
-                                # find suplier from name
-                                match_suppliers = frappe.get_all("Supplier", 
-                                    filters={'supplier_name': party_name, 'disabled': 0}, 
-                                    fields=['name'])
-                                if match_suppliers:
-                                    party_match = match_suppliers[0]['name']
-                            if party_match:
-                                # restrict pinvs to supplier
-                                possible_pinvs = frappe.get_all("Purchase Invoice",
-                                    filters=[['docstatus', '=', 1], ['outstanding_amount', '>', 0], ['supplier', '=', party_match]],
-                                    fields=['name', 'supplier', 'outstanding_amount', 'bill_no', 'esr_reference_number'])
-                            else:
-                                # purchase invoices
-                                possible_pinvs = frappe.get_all("Purchase Invoice", 
-                                    filters=[['docstatus', '=', 1], ['outstanding_amount', '>', 0]], 
-                                    fields=['name', 'supplier', 'outstanding_amount', 'bill_no', 'esr_reference_number'])
-                        if possible_pinvs:
-                            for pinv in possible_pinvs:
-                                if ((pinv['name'] in transaction_reference) \
-                                    or ((pinv['bill_no'] or pinv['name']) in transaction_reference) \
-                                    or (pinv['esr_reference_number'] and (pinv['esr_reference_number'].replace(" ", "") in transaction_reference.replace(" ", ""))) \
-                                    or (payment_instruction_id == transaction_reference)):              # this is an override for Postfinance combined transactions that will not relay transaction ids
-                                    invoice_matches.append(pinv['name'])
-                                    # override party match in case there is one from the sales invoice
-                                    party_match = pinv['supplier']
-                                    # add total matched amount
-                                    matched_amount += float(pinv['outstanding_amount'])
-                        # employees 
-                        match_employees = frappe.get_all("Employee", 
-                            filters={'employee_name': party_name, 'status': 'active'}, 
-                            fields=['name'])
-                        if match_employees:
-                            employee_match = match_employees[0]['name']
-                        # expense claims
-                        possible_expenses = frappe.get_all("Expense Claim", 
-                            filters=[['docstatus', '=', 1], ['status', '=', 'Unpaid']], 
-                            fields=['name', 'employee', 'total_claimed_amount'])
-                        if possible_expenses:
-                            expense_matches = []
-                            for exp in possible_expenses:
-                                if exp['name'] in transaction_reference:
-                                    expense_matches.append(exp['name'])
-                                    # override party match in case there is one from the sales invoice
-                                    employee_match = exp['employee']
-                                    # add total matched amount
-                                    matched_amount += float(exp['total_claimed_amount'])           
+                        party_match, employee_match, invoice_matches, expense_matches, matched_amount = match_index.match_payable(
+                            party_name, transaction_reference, payment_instruction_id)
                     else:
                         # customers & sales invoices
-                        match_customers = frappe.get_all("Customer", filters={'customer_name': party_name, 'disabled': 0}, fields=['name'])
-                        if match_customers:
-                            party_match = match_customers[0]['name']
-                        # sales invoices
-                        possible_sinvs = frappe.get_all("Sales Invoice", 
-                            filters=[['outstanding_amount', '>', 0], ['docstatus', '=', 1]], 
-                            fields=['name', 'customer', 'customer_name', 'outstanding_amount', 'esr_reference'])
-                        if possible_sinvs:
-                            invoice_matches = []
-                            for sinv in possible_sinvs:
-                                is_match = False
-                                if sinv['name'] in transaction_reference or ('esr_reference' in sinv and sinv['esr_reference'] and sinv['esr_reference'] == transaction_reference):
-                                    # matched exact sales invoice reference or ESR reference
-                                    is_match = True
-                                elif cint(settings.numeric_only_debtor_matching) == 1:
-                                    # allow the numeric part matching
-                                    if get_numeric_only_reference(sinv['name']) in transaction_reference: 
-                                        # matched numeric part and customer name
-                                        is_match = True
-                                elif cint(settings.ignore_special_characters) == 1:
-                                    if remove_special_characters(sinv['name']) in remove_special_characters(transaction_reference):
-                                        # matched without special characters
-                                        is_match = True
-
-                                if is_match:
-                                    invoice_matches.append(sinv['name'])
-                                    # override party match in case there is one from the sales invoice
-                                    party_match = sinv['customer']
-                                    # add total matched amount
-                                    matched_amount += float(sinv['outstanding_amount'])
+                        party_match, invoice_matches, matched_amount = match_index.match_receivable(
+                            party_name, transaction_reference)
+                        employee_match = None
+                        expense_matches = None
                                         
                     # reset invoice matches in case there are no matches
                     try:
@@ -780,46 +383,28 @@ def read_camt_transactions(transaction_entries, account, settings, debug=False):
                     txns.append(new_txn)
         else:
             # transaction without TxDtls: occurs at CS when transaction is from a pain.001 instruction
-            # get unique ID
-            try:
-                unique_reference = entry_soup.acctsvcrref.get_text()
-            except:
-                # fallback: use tx id
-                try:
-                    unique_reference = entry_soup.txid.get_text()
-                except:
-                    # fallback to pmtinfid
-                    try:
-                        unique_reference = entry_soup.pmtinfid.get_text()
-                    except:
-                        # fallback to hash
-                        code = "{0}:{1}:{2}".format(date, entry_currency, entry_amount)
-                        unique_reference = hashlib.md5(code.encode("utf-8")).hexdigest()
+            unique_reference = entry['unique_reference']
             # check if this transaction is already recorded
-            match_payment_entry = frappe.get_all('Payment Entry', filters={'reference_no': unique_reference}, fields=['name'])
+            match_payment_entry = imported_references.get_payment_entry(unique_reference)
             if match_payment_entry:
                 if debug or settings.debug_mode:
-                    frappe.log_error("Transaction {0} is already imported in {1}.".format(unique_reference, match_payment_entry[0]['name']))
+                    frappe.log_error("Transaction {0} is already imported in {1}.".format(unique_reference, match_payment_entry))
             else:
                 # --- find transaction type: paid or received: (DBIT: paid, CRDT: received)
-                credit_debit = entry_soup.cdtdbtind.get_text()
+                credit_debit = entry['credit_debit']
                 # find payment instruction ID
                 try:
-                    payment_instruction_id = entry_soup.pmtinfid.get_text()     # instruction ID, PMTINF-[payment proposal]-row
+                    payment_instruction_id = entry['payment_instruction_id']     # instruction ID, PMTINF-[payment proposal]-row
                     payment_instruction_fields = payment_instruction_id.split("-")
                     payment_instruction_row = int(payment_instruction_fields[-1]) + 1
                     payment_proposal_id = payment_instruction_fields[1]
                     # find original instruction record
-                    payment_proposal_payments = frappe.get_all("Payment Proposal Payment", 
-                        filters={'parent': payment_proposal_id, 'idx': payment_instruction_row},
-                        fields=['receiver', 'receiver_address_line1', 'receiver_address_line2', 'iban', 'reference'])
+                    payment_proposal_payment = match_index.get_payment_proposal_payment(payment_proposal_id, payment_instruction_row)
+                    payment_proposal_payments = [payment_proposal_payment] if payment_proposal_payment else []
                     # suppliers 
                     party_match = None
                     if payment_proposal_payments:
-                        match_suppliers = frappe.get_all("Supplier", filters={'supplier_name': payment_proposal_payments[0]['receiver']}, 
-                            fields=['name'])
-                        if match_suppliers:
-                            party_match = match_suppliers[0]['name']
+                        party_match = match_index.find_supplier(payment_proposal_payments[0]['receiver'])
                     # purchase invoices 
                     invoice_match = None
                     matched_amount = 0
@@ -1033,16 +618,6 @@ def create_reference(payment_entry, invoice_reference, invoice_type="Sales Invoi
     payment_record.save()
     return
 
-def get_numeric_only_reference(s):
-    n = ""
-    for c in s:
-        if c.isdigit():
-            n += c
-    return n
-
-def remove_special_characters(s):
-    return (s or "").replace(" ", "").replace("-", "")
-
 @frappe.whitelist()
 def validate_journal_template(template_name, transaction_type, bank_account):
     """
@@ -1225,185 +800,33 @@ def make_journal_entry_from_template(template_name, transaction, bank_account, c
 Read and parse CAMT.052 (intraday bank statement) file
 This is similar to CAMT.053 but provides real-time intraday information
 
-Input: camt.052-xml-string
+Input: camt.052-xml-string (or an already parsed camt document)
 Output: dict with transactions and meta information
 """
-def read_camt052_intraday(content):
-    soup = BeautifulSoup(content, 'lxml-xml')
-    transactions = []
-    meta = {}
-    
+def read_camt052_intraday(content, camt_document=None):
     try:
-        # Get account information
-        iban_element = soup.find('IBAN') or soup.find('iban')
-        if iban_element:
-            meta['iban'] = iban_element.get_text().strip()
-        else:
-            meta['iban'] = 'n/a'
-            
-        # Get report ID
-        rpt = soup.find('Rpt') or soup.find('rpt')
-        if rpt:
-            rpt_id = rpt.find('Id') or rpt.find('id')
-            if rpt_id:
-                meta['report_id'] = rpt_id.get_text().strip()
-            else:
-                meta['report_id'] = 'n/a'
-                
-            # Get creation date/time
-            cre_dt_tm = rpt.find('CreDtTm') or rpt.find('credttm')
-            if cre_dt_tm:
-                meta['creation_datetime'] = cre_dt_tm.get_text().strip()
-        
-        # Get currency
-        amt_element = soup.find('Amt') or soup.find('amt')
-        if amt_element and amt_element.has_attr('Ccy'):
-            meta['currency'] = amt_element['Ccy']
-        elif amt_element and amt_element.has_attr('ccy'):
-            meta['currency'] = amt_element['ccy']
-        else:
-            meta['currency'] = 'CHF'
-            
-        # Get current balance (intraday)
-        balances = soup.find_all('Bal') or soup.find_all('bal')
-        for balance in balances:
-            try:
-                cd_element = balance.find('Cd') or balance.find('cd')
-                if cd_element:
-                    balance_type = cd_element.get_text().strip()
-                    amt_element = balance.find('Amt') or balance.find('amt')
-                    if amt_element:
-                        amount = float(amt_element.get_text().strip())
-                        
-                        # Check if debit or credit
-                        cdtdbtind_element = balance.find('CdtDbtInd') or balance.find('cdtdbtind')
-                        if cdtdbtind_element:
-                            cdtdbt = cdtdbtind_element.get_text().strip()
-                            if cdtdbt == "DBIT":
-                                amount = -amount
-                                
-                        if balance_type == "ITBD":  # Intraday balance
-                            meta['intraday_balance'] = amount
-                        elif balance_type == "CLAV":  # Available balance
-                            meta['available_balance'] = amount
-            except Exception as e:
-                frappe.log_error("Error parsing CAMT052 balance: {0}".format(str(e)))
-                
-        # Parse transactions (entries)
-        entries = soup.find_all('Ntry') or soup.find_all('ntry')
-        
-        for entry in entries:
-            try:
-                # Get amount
-                amt_element = entry.find('Amt') or entry.find('amt')
-                if amt_element:
-                    amount = float(amt_element.get_text().strip())
-                else:
-                    continue
-                    
-                # Get credit/debit indicator
-                cdtdbtind_element = entry.find('CdtDbtInd') or entry.find('cdtdbtind')
-                if cdtdbtind_element:
-                    credit_debit = cdtdbtind_element.get_text().strip()
-                else:
-                    credit_debit = "DBIT"
-                    
-                # Get booking date
-                booking_date = None
-                dt_element = entry.find('BookgDt') or entry.find('bookgdt')
-                if dt_element:
-                    dt = dt_element.find('Dt') or dt_element.find('dt')
-                    if dt:
-                        booking_date = dt.get_text().strip()
-                        
-                # Get value date
-                value_date = None
-                val_dt_element = entry.find('ValDt') or entry.find('valdt')
-                if val_dt_element:
-                    dt = val_dt_element.find('Dt') or val_dt_element.find('dt')
-                    if dt:
-                        value_date = dt.get_text().strip()
-                        
-                # Use booking date or value date
-                transaction_date = booking_date or value_date or datetime.now().strftime('%Y-%m-%d')
-                
-                # Get transaction details
-                tx_dtls = entry.find_all('TxDtls') or entry.find_all('txdtls')
-                
-                for detail in tx_dtls:
-                    tx_data = {
-                        'date': transaction_date,
-                        'amount': amount,
-                        'credit_debit': credit_debit,
-                        'status': 'Pending'  # Intraday transactions are usually pending
-                    }
-                    
-                    # Get references
-                    refs = detail.find('Refs') or detail.find('refs')
-                    if refs:
-                        acct_svcr_ref = refs.find('AcctSvcrRef') or refs.find('acctsvcrref')
-                        if acct_svcr_ref:
-                            tx_data['unique_reference'] = acct_svcr_ref.get_text().strip()
-                            
-                    # Get party information
-                    rltd_pties = detail.find('RltdPties') or detail.find('rltdpties')
-                    if rltd_pties:
-                        # For credit - get debtor info
-                        if credit_debit == "CRDT":
-                            dbtr = rltd_pties.find('Dbtr') or rltd_pties.find('dbtr')
-                            if dbtr:
-                                nm = dbtr.find('Nm') or dbtr.find('nm')
-                                if nm:
-                                    tx_data['party_name'] = nm.get_text().strip()
-                                    
-                            dbtr_acct = rltd_pties.find('DbtrAcct') or rltd_pties.find('dbtracct')
-                            if dbtr_acct:
-                                iban = dbtr_acct.find('IBAN') or dbtr_acct.find('iban')
-                                if iban:
-                                    tx_data['party_iban'] = iban.get_text().strip()
-                        else:
-                            # For debit - get creditor info
-                            cdtr = rltd_pties.find('Cdtr') or rltd_pties.find('cdtr')
-                            if cdtr:
-                                nm = cdtr.find('Nm') or cdtr.find('nm')
-                                if nm:
-                                    tx_data['party_name'] = nm.get_text().strip()
-                                    
-                            cdtr_acct = rltd_pties.find('CdtrAcct') or rltd_pties.find('cdtracct')
-                            if cdtr_acct:
-                                iban = cdtr_acct.find('IBAN') or cdtr_acct.find('iban')
-                                if iban:
-                                    tx_data['party_iban'] = iban.get_text().strip()
-                                    
-                    # Get remittance information
-                    rmt_inf = detail.find('RmtInf') or detail.find('rmtinf')
-                    if rmt_inf:
-                        # Check for structured reference
-                        strd = rmt_inf.find('Strd') or rmt_inf.find('strd')
-                        if strd:
-                            cdtr_ref_inf = strd.find('CdtrRefInf') or strd.find('cdtrrefinf')
-                            if cdtr_ref_inf:
-                                ref = cdtr_ref_inf.find('Ref') or cdtr_ref_inf.find('ref')
-                                if ref:
-                                    tx_data['transaction_reference'] = ref.get_text().strip()
-                        else:
-                            # Check for unstructured reference
-                            ustrd = rmt_inf.find('Ustrd') or rmt_inf.find('ustrd')
-                            if ustrd:
-                                tx_data['transaction_reference'] = ustrd.get_text().strip()
-                                
-                    transactions.append(tx_data)
-                    
-            except Exception as e:
-                frappe.log_error("Error parsing CAMT052 entry: {0}".format(str(e)), "CAMT052 Parser")
-                continue
-                
+        if not camt_document:
+            camt_document = parse_camt_document(content)
     except Exception as e:
         frappe.log_error("Error parsing CAMT052: {0}".format(str(e)), "CAMT052 Parser")
         return None
-        
+    
+    transactions = []
+    for entry in camt_document.get_entries():
+        for transaction in entry['transactions']:
+            transactions.append({
+                'date': transaction['date'],
+                'amount': transaction['amount'],
+                'currency': transaction['currency'],
+                'credit_debit': transaction['credit_debit'],
+                'unique_reference': transaction['unique_reference'],
+                'party_name': transaction['party_name'],
+                'party_iban': transaction['party_iban'],
+                'transaction_reference': transaction['transaction_reference'],
+                'status': 'Pending'  # Intraday transactions are usually pending
+            })
+            
     return {
-        'meta': meta,
+        'meta': camt_document.get_report_meta(),
         'transactions': transactions
     }
-    
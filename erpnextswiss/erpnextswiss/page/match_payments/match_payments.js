@@ -120,32 +120,66 @@ function match(page) {
 }
 
 function auto_match(page, method="docid") {
-    //try {                   
-        // enable waiting gif
-        frappe.match_payments.start_wait();
-        
-        // call match method 
-        frappe.call({
-            method: 'erpnextswiss.erpnextswiss.page.match_payments.match_payments.auto_match',
-            args: {
-                'method': method
-            },
-            callback: function(r) {
-                if (r.message) {   
-                    if (r.message.payments.length > 0) {    
-                        frappe.show_alert( __("Matched {0} sales invoices.").replace("{0}", String(r.message.payments.length)));      
-                        submit_all(r.message.payments, page);
-                    } else {
-                        completed(page, false);
-                        frappe.show_alert( __("No matches found.") );
+    // enable waiting gif
+    frappe.match_payments.start_wait();
+    
+    // find candidates (with confidence), then allocate and submit in the background
+    frappe.call({
+        method: 'erpnextswiss.erpnextswiss.page.match_payments.match_payments.find_matches',
+        args: {
+            'method': method
+        },
+        callback: function(r) {
+            if ((r.message) && (r.message.candidates.length > 0)) {
+                var min_confidence = r.message.auto_match_confidence;
+                var payments = new Set(r.message.candidates.map(c => c.payment_entry));
+                var certain = r.message.candidates.filter(c => c.confidence >= min_confidence);
+                frappe.match_payments.end_wait();
+                if (certain.length === 0) {
+                    completed(page, false);
+                    frappe.msgprint( __("Found {0} matches for {1} payments, but none with high confidence. Please match them manually.")
+                        .replace("{0}", String(r.message.candidates.length))
+                        .replace("{1}", String(payments.size)) );
+                    return;
+                }
+                frappe.confirm(
+                    __("Found {0} matches for {1} payments ({2} with high confidence). Allocate and submit the {2} matches with high confidence?")
+                        .replace("{0}", String(r.message.candidates.length))
+                        .replace("{1}", String(payments.size))
+                        .replace(/\{2\}/g, String(certain.length)),
+                    function() {
+                        apply_matches(page, method, min_confidence);
                     }
-                } 
+                );
+            } else {
+                completed(page, false);
+                frappe.show_alert( __("No matches found.") );
             }
-        }); 
-    //}
-    //catch (err) {
-    //     frappe.msgprint( __("Please select a payment entry.") );
-    //}
+        }
+    }); 
+}
+
+function apply_matches(page, method, min_confidence) {
+    frappe.realtime.on("match_payments_progress", function(data) {
+        if (data.done) {
+            frappe.hide_progress();
+            frappe.realtime.off("match_payments_progress");
+            frappe.show_alert( __("Matched {0} payments ({1} errors).").replace("{0}", String(data.progress - data.errors)).replace("{1}", String(data.errors)) );
+            completed(page);
+        } else {
+            frappe.show_progress(__("Match payments"), data.progress, data.total);
+        }
+    });
+    frappe.call({
+        method: 'erpnextswiss.erpnextswiss.page.match_payments.match_payments.enqueue_apply_matches',
+        args: {
+            'method': method,
+            'min_confidence': min_confidence
+        },
+        callback: function(r) {
+            frappe.show_alert( __("Allocating payments...") );
+        }
+    });
 }
 
 function submit(payment_entry, page) {
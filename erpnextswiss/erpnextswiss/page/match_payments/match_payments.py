@@ -4,7 +4,14 @@
 from __future__ import unicode_literals
 import frappe
 from frappe import throw, _
+from frappe.utils import cint, flt
 from erpnextswiss.erpnextswiss.page.bankimport.bankimport import create_reference
+from erpnextswiss.erpnextswiss.bank_matching import PaymentMatcher
+from erpnextswiss.erpnextswiss.utils import get_chunks
+
+CHUNK_SIZE = 20
+# minimum confidence of the matches that are allocated and submitted in the background
+AUTO_MATCH_CONFIDENCE = 0.7
 
 @frappe.whitelist()
 def get_open_sales_invoices():
@@ -66,26 +73,93 @@ def submit_all(payment_entries):
     return { 'message': "Done" }
 
 @frappe.whitelist()
-def auto_match(method="docid"):
-    # make method lower case
-    method = method.lower()
-    # prepare array of matched payments
-    matched_payments = []
-    # read all new payments
-    new_payments = get_unallocated_payment_entries()['unallocated_payment_entries']
-    # loop through all unpaid sales invoices
-    pending_sales_invoices = get_open_sales_invoices()['unpaid_sales_invoices']
-    for unpaid_sales_invoice in pending_sales_invoices:
-        if method == "docid":
-            for payment in new_payments:
-                if unpaid_sales_invoice['name'] in payment['remarks']:
-                    matched_payment_entry = match(unpaid_sales_invoice['name'], payment['name'])['payment_entry']
-                    matched_payments.append(matched_payment_entry)
-        elif method == "esr":
-            # only check Sales Invoice records with an ESR reference
-            if unpaid_sales_invoice['esr_reference']:
-                for payment in new_payments:
-                    if unpaid_sales_invoice['esr_reference'].replace(' ', '') in payment['remarks']:
-                        matched_payment_entry = match(unpaid_sales_invoice['name'], payment['name'])['payment_entry']
-                        matched_payments.append(matched_payment_entry)
-    return { 'message': "Done", 'payments': matched_payments }
+def auto_match(method="docid", min_confidence=0):
+    # match and allocate (without submit), see apply_matches
+    result = apply_matches(method, min_confidence, submit=False)
+    return { 'message': "Done", 'payments': result['payments'] }
+
+@frappe.whitelist()
+def find_matches(method="docid", min_confidence=0):
+    """
+    Candidate matches (payment entry, sales invoice, customer, confidence) without changing anything
+    """
+    return {
+        'candidates': get_matcher(method).get_candidates(flt(min_confidence)),
+        'auto_match_confidence': AUTO_MATCH_CONFIDENCE
+    }
+
+@frappe.whitelist()
+def enqueue_apply_matches(method="docid", min_confidence=AUTO_MATCH_CONFIDENCE):
+    # only the matches the user confirmed (at least the given confidence) are submitted
+    min_confidence = flt(min_confidence)
+    frappe.enqueue("erpnextswiss.erpnextswiss.page.match_payments.match_payments.apply_matches",
+        queue='long',
+        timeout=15000,
+        method=method,
+        min_confidence=min_confidence,
+        submit=True,
+        notify=True)
+    return { 'message': _("Started...") }
+
+def get_matcher(method="docid"):
+    return PaymentMatcher(
+        get_open_sales_invoices()['unpaid_sales_invoices'],
+        get_unallocated_payment_entries()['unallocated_payment_entries'],
+        method)
+
+def apply_matches(method="docid", min_confidence=0, submit=True, notify=False):
+    """
+    Allocate the matched sales invoices to their payment entries (and submit them)
+    :returns:   dict with the allocated payments and errors per payment entry
+    """
+    matcher = get_matcher(method)
+    allocations = matcher.get_allocations(flt(min_confidence))
+    invoices = {sinv['name']: sinv for sinv in matcher.sales_invoices}
+    payments = []
+    errors = []
+    for chunk in get_chunks(allocations.keys(), CHUNK_SIZE):
+        for payment_entry in chunk:
+            frappe.db.savepoint("match_payments")
+            try:
+                allocate(payment_entry, allocations[payment_entry], invoices, submit)
+                payments.append(payment_entry)
+            except Exception as err:
+                frappe.db.rollback(save_point="match_payments")
+                errors.append({'payment_entry': payment_entry, 'error': "{0}".format(err)})
+        frappe.db.commit()
+        if cint(notify):
+            publish_progress(len(payments) + len(errors), len(allocations))
+    if errors:
+        frappe.log_error("\n".join("{0}: {1}".format(e['payment_entry'], e['error']) for e in errors), "Match payments")
+    if cint(notify):
+        publish_progress(len(payments) + len(errors), len(allocations), done=True, errors=len(errors))
+    return { 'payments': payments, 'errors': errors }
+
+def allocate(payment_entry, allocation, invoices, submit=True):
+    """
+    Assign the customer and add all sales invoice references with one save
+    """
+    payment_entry_record = frappe.get_doc("Payment Entry", payment_entry)
+    payment_entry_record.party = allocation['customer']
+    for sales_invoice, allocated_amount in allocation['references']:
+        payment_entry_record.append("references", {
+            'reference_doctype': "Sales Invoice",
+            'reference_name': sales_invoice,
+            'total_amount': invoices[sales_invoice]['base_grand_total'],
+            'outstanding_amount': invoices[sales_invoice]['outstanding_amount'],
+            'allocated_amount': allocated_amount
+        })
+        payment_entry_record.unallocated_amount = flt(payment_entry_record.unallocated_amount) - allocated_amount
+    payment_entry_record.save()
+    if submit:
+        payment_entry_record.submit()
+    return
+
+def publish_progress(progress, total, done=False, errors=0):
+    frappe.publish_realtime("match_payments_progress", {
+        'progress': progress,
+        'total': total,
+        'done': done,
+        'errors': errors
+    }, user=frappe.session.user)
+    return
@@ -7,7 +7,8 @@ import frappe
 from frappe import throw, _
 import time
 from erpnextswiss.erpnextswiss.common_functions import get_building_number, get_street_name, get_pincode, get_city
-import html              # used to escape xml content
+from erpnextswiss.erpnextswiss.pain_writer import PainWriter, PAIN001_CH_03, format_amount
+from erpnextswiss.erpnextswiss.utils import get_chunks
 
 @frappe.whitelist()
 def get_payments():
@@ -27,326 +28,87 @@ def generate_payment_file(payments):
         payments = eval(payments)
         # remove empty items in case there should be any (bigfix for issue #2)
         payments = list(filter(None, payments))
+        if not payments:
+            raise IndexError()
 
-        payment_details = frappe.db.get_all("Payment Entry", filters={"name": ["in", payments]}, fields=["name", "paid_from"])
-
-        # Sort the payment details by the entire payment_account string
-        sorted_payment_details = sorted(payment_details, key=lambda x: x['paid_from'])
-
-        # Extract the sorted payment names
-        sorted_payments = [entry['name'] for entry in sorted_payment_details]
+        data = PaymentFileData(payments)
 
         # array for skipped payments
         skipped = []
 
-        # create xml header
-        content = make_line("<?xml version=\"1.0\" encoding=\"UTF-8\"?>")
-        # define xml template reference
-        content += make_line("<Document xmlns=\"http://www.six-interbank-clearing.com/de/pain.001.001.03.ch.02.xsd\" xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\" xsi:schemaLocation=\"http://www.six-interbank-clearing.com/de/pain.001.001.03.ch.02.xsd pain.001.001.03.ch.02.xsd\">")
-        # transaction holder
-        content += make_line("  <CstmrCdtTrfInitn>")
-        ### Group Header (GrpHdr, A-Level)
-        # create group header
-        content += make_line("    <GrpHdr>")
-        # message ID (unique, SWIFT-characters only)
-        content += make_line("      <MsgId>MSG-" + time.strftime("%Y%m%d%H%M%S") + "</MsgId>")
-        # creation date and time ( e.g. 2010-02-15T07:30:00 )
-        content += make_line("      <CreDtTm>" + time.strftime("%Y-%m-%dT%H:%M:%S") + "</CreDtTm>")
-        # number of transactions in the file
+        ### Payment Information (PmtInf, B-Level)
+        # validate and compile all transactions first (count and control sum go into the header)
+        # groups: one B-level per paying account (sorted by the account string)
+        groups = []
+        remarks = []
         transaction_count = 0
-        transaction_count_identifier = "<!-- $COUNT -->"
-        content += make_line("      <NbOfTxs>" + transaction_count_identifier + "</NbOfTxs>")
-        # total amount of all transactions ( e.g. 15850.00 )  (sum of all amounts)
         control_sum = 0.0
-        control_sum_identifier = "<!-- $CONTROL_SUM -->"
-        content += make_line("      <CtrlSum>" + control_sum_identifier + "</CtrlSum>")
-        # initiating party requires at least name or identification
-        content += make_line("      <InitgPty>")
-        # initiating party name ( e.g. MUSTER AG )
-        content += make_line("        <Nm>" + html.escape(get_company_name(payments[0])) + "</Nm>")
-        content += make_line("      </InitgPty>")
-        content += make_line("    </GrpHdr>")
-
-        ### Payment Information (PmtInf, B-Level)
-        # payment information records (1 .. 99'999)
-        actual_account = ""
-        for payment in sorted_payments:
-            # create temporary code block to compile the payment record (only add to overall on submit)
-            # use 'continue' to skip a record (in case a validation fails)
-            payment_content = ""
-            # retrieve the payment entry record
-            payment_record = frappe.get_doc('Payment Entry', payment)
-            if actual_account != "" and payment_record.paid_from != actual_account:
-                payment_content += make_line("      </PmtInf>")
-            if payment_record.paid_from != actual_account:
-                actual_account = payment_record.paid_from
-                # create the payment entries
-                payment_content += make_line("    <PmtInf>")
-                # unique (in this file) identification for the payment ( e.g. PMTINF-01, PMTINF-PE-00005 )
-                payment_content += make_line("      <PmtInfId>PMTINF-" + payment + "</PmtInfId>")
-                # payment method (TRF or TRA, no impact in Switzerland)
-                payment_content += make_line("      <PmtMtd>TRF</PmtMtd>")
-                # batch booking (true or false; recommended true)
-                payment_content += make_line("      <BtchBookg>true</BtchBookg>")
-                # Requested Execution Date (e.g. 2010-02-22)
-                payment_content += make_line("      <ReqdExctnDt>{0}</ReqdExctnDt>".format(
-                    payment_record.posting_date))
-                # debitor (technically ignored, but recommended)
-                payment_content += make_line("      <Dbtr>")
-                # debitor name
-                payment_content += make_line("        <Nm>" +
-                    html.escape(payment_record.company) + "</Nm>")
-                # postal address (recommendadtion: do not use)
-                #content += make_line("        <PstlAdr>")
-                #content += make_line("          <Ctry>CH</Ctry>")
-                #content += make_line("          <AdrLine>SELDWYLA</AdrLine>")
-                #content += make_line("        </PstlAdr>")
-                payment_content += make_line("      </Dbtr>")
-                # debitor account (sender) - IBAN
-                payment_account = frappe.get_doc('Account', payment_record.paid_from)
-                payment_content += make_line("      <DbtrAcct>")
-                payment_content += make_line("        <Id>")
-                if payment_account.iban:
-                    payment_content += make_line("          <IBAN>{0}</IBAN>".format(
-                        payment_account.iban.replace(" ", "") ))
-                else:
-                    # no paying account IBAN: not valid record, skip
-                    content += add_invalid_remark( _("{0}: no account IBAN found ({1})".format(
-                        payment, payment_record.paid_from) ) )
-                    skipped.append(payment)
-                    continue
-                payment_content += make_line("        </Id>")
-                if payment_record.transaction_type == "IBAN":
-                    payment_content += make_line("        <Tp>")
-                    payment_content += make_line("          <Prtry>NOA</Prtry>")
-                    payment_content += make_line("        </Tp>")
-                payment_content += make_line("      </DbtrAcct>")
-                if payment_account.bic:
-                    # debitor agent (sender) - BIC
-                    payment_content += make_line("      <DbtrAgt>")
-                    payment_content += make_line("        <FinInstnId>")
-                    payment_content += make_line("          <BIC>{0}</BIC>".format(payment_account.bic))
-                    payment_content += make_line("        </FinInstnId>")
-                    payment_content += make_line("      </DbtrAgt>")
-
-            ### Credit Transfer Transaction Information (CdtTrfTxInf, C-Level)
-            payment_content += make_line("      <CdtTrfTxInf>")
-            # payment identification
-            payment_content += make_line("        <PmtId>")
-            # instruction identification 
-            payment_content += make_line("          <InstrId>INSTRID-" + payment + "</InstrId>")
-            # end-to-end identification (should be used and unique within B-level; payment entry name)
-            payment_content += make_line("          <EndToEndId>" + payment + "</EndToEndId>")
-            payment_content += make_line("        </PmtId>")
-            # payment type information
-            payment_content += make_line("        <PmtTpInf>")
-            # service level: only used for SEPA (currently not implemented)
-            if payment_record.transaction_type == "SEPA":
-                payment_content += make_line("          <SvcLvl>")
-                # service level code (e.g. SEPA)
-                payment_content += make_line("            <Cd>SEPA</Cd>")
-                payment_content += make_line("          </SvcLvl>")
-            # local instrument
-            if payment_record.transaction_type == "ESR":
-                payment_content += make_line("          <LclInstrm>")
-                # proprietary (nothing or CH01 for ESR)
-                payment_content += make_line("            <Prtry>CH01</Prtry>")
-                payment_content += make_line("          </LclInstrm>")
-            if payment_record.transaction_type == "QRR" or payment_record.transaction_type == "SCOR":
-                # proprietary (QRR)
-                payment_content += make_line("          <InstrPrty>NORM</InstrPrty>")
-            if payment_record.transaction_type == "IBAN":
-                # proprietary (QRR)
-                payment_content += make_line("          <InstrPrty>NORM</InstrPrty>")
-            payment_content += make_line("        </PmtTpInf>")
-            # amount 
-            payment_content += make_line("        <Amt>")
-            payment_content += make_line("          <InstdAmt Ccy=\"{0}\">{1:.2f}</InstdAmt>".format(
-                payment_record.paid_from_account_currency,
-                payment_record.paid_amount))
-            payment_content += make_line("        </Amt>")
-            # creditor account
-            # creditor account identification
-            if payment_record.transaction_type == "ESR":
-                # add creditor information
-                creditor_info = add_creditor_info(payment_record)
-                if creditor_info:
-                    payment_content += creditor_info
-                else:
-                    # no address found, skip entry (not valid)
-                    content += add_invalid_remark( _("{0}: no address (or country) found").format(payment) )
-                    skipped.append(payment)
-                    continue
-                # ESR payment
-                payment_content += make_line("        <CdtrAcct>")
-                payment_content += make_line("          <Id>")
-                payment_content += make_line("            <Othr>")
-                # ESR participant number
-                if payment_record.esr_participant_number:
-                    payment_content += make_line("              <Id>" +
-                        payment_record.esr_participant_number + "</Id>")
-                else:
-                    # no particpiation number: not valid record, skip
-                    content += add_invalid_remark( _("{0}: no ESR participation number found").format(payment) )
-                    skipped.append(payment)
-                    continue
-                payment_content += make_line("            </Othr>")
-                payment_content += make_line("          </Id>")
-                payment_content += make_line("        </CdtrAcct>")
-                # Remittance Information
-                payment_content += make_line("        <RmtInf>")
-                payment_content += make_line("          <Strd>")
-                # Creditor Reference Information
-                payment_content += make_line("            <CdtrRefInf>")
-                # ESR reference 
-                if payment_record.esr_reference:
-                    payment_content += make_line("              <Ref>" +
-                        payment_record.esr_reference.replace(" ", "") + "</Ref>")
-                else:
-                    # no ESR reference: not valid record, skip
-                    content += add_invalid_remark( _("{0}: no ESR reference found").format(payment) )
-                    skipped.append(payment)
-                    continue
-                payment_content += make_line("            </CdtrRefInf>")
-                payment_content += make_line("          </Strd>")
-                payment_content += make_line("        </RmtInf>")
-            elif payment_record.transaction_type == "QRR" or payment_record.transaction_type == "SCOR":
-                # add creditor information
-                creditor_info = add_creditor_info(payment_record)
-                if creditor_info:
-                    payment_content += creditor_info
-                else:
-                    # no address found, skip entry (not valid)
-                    content += add_invalid_remark( _("{0}: no address (or country) found").format(payment) )
-                    frappe.log_error("No address found ({0})".format(payment), "Payment File")
-                    skipped.append(payment)
-                    continue
-                # QRR payment
-                payment_content += make_line("        <CdtrAcct>")
-                payment_content += make_line("          <Id>")
-                # QRR participant number
-                if payment_record.esr_participant_number:
-                    payment_content += make_line("            <IBAN>" +
-                        payment_record.esr_participant_number + "</IBAN>")
-                else:
-                    # no particpiation number: not valid record, skip
-                    content += add_invalid_remark( _("{0}: no ESR participation number found").format(payment) )
-                    frappe.log_error("No ESR participation number found ({0})".format(payment), "Payment File")
-                    skipped.append(payment)
-                    continue
-                payment_content += make_line("          </Id>")
-                payment_content += make_line("        </CdtrAcct>")
-                # Remittance Information
-                payment_content += make_line("        <RmtInf>")
-                payment_content += make_line("          <Strd>")
-                # Creditor Reference Information
-                payment_content += make_line("            <CdtrRefInf>")
-                # QRR reference
-                if payment_record.esr_reference:
-                    payment_content += make_line("              <Tp>")
-                    payment_content += make_line("                <CdOrPrtry>")
-                    if payment_record.transaction_type == "QRR":
-                        payment_content += make_line("                  <Prtry>QRR</Prtry>")
-                    elif payment_record.transaction_type == "SCOR":
-                        payment_content += make_line("                  <Cd>SCOR</Cd>")
-                    payment_content += make_line("                </CdOrPrtry>")
-                    payment_content += make_line("              </Tp>")
-                    payment_content += make_line("              <Ref>" +
-                        payment_record.esr_reference.replace(" ", "") + "</Ref>")
-                else:
-                    # no ESR reference: not valid record, skip
-                    content += add_invalid_remark( _("{0}: no ESR reference found").format(payment) )
-                    skipped.append(payment)
-                    continue
-                payment_content += make_line("            </CdtrRefInf>")
-                payment_content += make_line("          </Strd>")
-                payment_content += make_line("        </RmtInf>")
-
-            elif payment_record.transaction_type == "IBAN":
-                # IBAN payment
-                # add creditor information
-                payment_content += make_line("        <ChrgBr>DEBT</ChrgBr>")
-                creditor_info = add_creditor_info(payment_record)
-                if creditor_info:
-                    payment_content += creditor_info
-                else:
-                    # no address found, skip entry (not valid)
-                    content += add_invalid_remark( _("{0}: no address (or country) found").format(payment) )
-                    skipped.append(payment)
-                    continue
-
-                if payment_record.bic:
-                    payment_content += make_line("        <CdtrAgt>")
-                    payment_content += make_line("          <FinInstnId>")
-                    payment_content += make_line("            <BIC>" +
-                        payment_record.bic + "</BIC>")
-                    payment_content += make_line("          </FinInstnId>")
-                    payment_content += make_line("        </CdtrAgt>")
-
-                payment_content += make_line("        <CdtrAcct>")
-                payment_content += make_line("          <Id>")
-                if payment_record.iban:
-                    payment_content += make_line("            <IBAN>{0}</IBAN>".format(
-                        payment_record.iban.replace(" ", "") ))
-                else:
-                    # no iban: not valid record, skip
-                    content += add_invalid_remark( _("{0}: no IBAN found").format(payment) )
-                    skipped.append(payment)
-                    continue
-                payment_content += make_line("          </Id>")
-                payment_content += make_line("        </CdtrAcct>")
-
-            else:
-                # IBAN or SEPA payment
-                # add creditor information
-                creditor_info = add_creditor_info(payment_record)
-                if creditor_info:
-                    payment_content += creditor_info
-                else:
-                    # no address found, skip entry (not valid)
-                    content += add_invalid_remark( _("{0}: no address (or country) found").format(payment) )
-                    skipped.append(payment)
-                    continue
-                # creditor agent (BIC, optional; removed to resolve issue #15)
-                #if payment_record.bic:
-                #    payment_content += make_line("        <CdtrAgt>")
-                #    payment_content += make_line("          <FinInstnId>")
-                #    payment_content += make_line("            <BIC>" +
-                #        payment_record.bic + "</BIC>")
-                #    payment_content += make_line("          </FinInstnId>")
-                #    payment_content += make_line("        </CdtrAgt>")
-                # creditor account
-                payment_content += make_line("        <CdtrAcct>")
-                payment_content += make_line("          <Id>")
-                if payment_record.iban:
-                    payment_content += make_line("            <IBAN>{0}</IBAN>".format(
-                        payment_record.iban.replace(" ", "") ))
-                else:
-                    # no iban: not valid record, skip
-                    content += add_invalid_remark( _("{0}: no IBAN found").format(payment) )
-                    skipped.append(payment)
-                    continue
-                payment_content += make_line("          </Id>")
-                payment_content += make_line("        </CdtrAcct>")
-
-            # close payment record
-            payment_content += make_line("      </CdtTrfTxInf>")
-            #payment_content += make_line("    </PmtInf>")
-            # once the payment is extracted for payment, submit the record
+        for payment_record in sorted(data.payment_entries, key=lambda x: x['paid_from']):
+            payment = payment_record.name
+            payment_account = data.accounts.get(payment_record.paid_from) or {}
+            if not payment_account.get('iban'):
+                # no paying account IBAN: not valid record, skip
+                remarks.append( _("{0}: no account IBAN found ({1})".format(
+                    payment, payment_record.paid_from) ) )
+                skipped.append(payment)
+                continue
+            transaction, remark = get_transaction(payment_record, data)
+            if not transaction:
+                remarks.append(remark)
+                skipped.append(payment)
+                continue
+            if not groups or groups[-1]['account'] != payment_record.paid_from:
+                groups.append({
+                    'account': payment_record.paid_from,
+                    'iban': payment_account.get('iban').replace(" ", ""),
+                    'bic': payment_account.get('bic'),
+                    'first': payment_record,
+                    'transactions': []
+                })
+            groups[-1]['transactions'].append(transaction)
             transaction_count += 1
             control_sum += payment_record.paid_amount
-            content += payment_content
-            #////payment_record.submit()
-            #payment_record.save()
-        # add footer
-        content += make_line("    </PmtInf>")
-        content += make_line("  </CstmrCdtTrfInitn>")
-        content += make_line("</Document>")
-        # insert control numbers
-        content = content.replace(transaction_count_identifier, "{0}".format(transaction_count))
-        content = content.replace(control_sum_identifier, "{:.2f}".format(control_sum))
 
-        return { 'content': content, 'skipped': skipped }
+        with PainWriter(PAIN001_CH_03, "CstmrCdtTrfInitn") as writer:
+            ### Group Header (GrpHdr, A-Level)
+            writer.group_header(
+                msg_id="MSG-" + time.strftime("%Y%m%d%H%M%S"),      # message ID (unique, SWIFT-characters only)
+                transaction_count=transaction_count,
+                control_sum=control_sum,
+                initiating_party=data.get_company_name(payments[0])
+            )
+            for remark in remarks:
+                writer.comment(remark)
+            for group in groups:
+                first = group['first']
+                with writer.block("PmtInf"):
+                    # unique (in this file) identification for the payment ( e.g. PMTINF-01, PMTINF-PE-00005 )
+                    writer.element("PmtInfId", "PMTINF-" + first.name)
+                    # payment method (TRF or TRA, no impact in Switzerland)
+                    writer.element("PmtMtd", "TRF")
+                    # batch booking (true or false; recommended true)
+                    writer.element("BtchBookg", "true")
+                    # Requested Execution Date (e.g. 2010-02-22)
+                    writer.element("ReqdExctnDt", first.posting_date)
+                    # debitor (technically ignored, but recommended)
+                    with writer.block("Dbtr"):
+                        writer.element("Nm", first.company)
+                    # debitor account (sender) - IBAN
+                    with writer.block("DbtrAcct"):
+                        with writer.block("Id"):
+                            writer.element("IBAN", group['iban'])
+                        if first.transaction_type == "IBAN":
+                            with writer.block("Tp"):
+                                writer.element("Prtry", "NOA")
+                    if group['bic']:
+                        # debitor agent (sender) - BIC
+                        with writer.block("DbtrAgt"):
+                            with writer.block("FinInstnId"):
+                                writer.element("BIC", group['bic'])
+                    for transaction in group['transactions']:
+                        write_transaction(writer, transaction)
+
+        return { 'content': writer.getvalue(), 'skipped': skipped }
     except IndexError:
         frappe.msgprint( _("Please select at least one payment."), _("Information") )
         return
@@ -354,67 +116,202 @@ def generate_payment_file(payments):
         frappe.throw( _("Error while generating xml. Make sure that you made required customisations to the DocTypes.") )
         return
 
-def add_creditor_info(payment_record):
-    payment_content = ""
+"""
+Prefetch everything a payment file needs: payment entries, paying accounts,
+creditor addresses (suppliers, customers, employees) and country codes
+"""
+class PaymentFileData:
+    PAYMENT_ENTRY_FIELDS = ['name', 'company', 'posting_date', 'paid_from', 'paid_from_account_currency', 
+        'paid_amount', 'party_type', 'party', 'transaction_type', 'esr_participant_number', 
+        'esr_reference', 'iban', 'bic']
+    
+    def __init__(self, payments):
+        self.payment_entries = []
+        for chunk in get_chunks(payments):
+            self.payment_entries += frappe.get_all("Payment Entry", filters={'name': ['in', chunk]}, 
+                fields=self.PAYMENT_ENTRY_FIELDS)
+        self.accounts = {}
+        for chunk in get_chunks(set(p.paid_from for p in self.payment_entries if p.paid_from)):
+            for a in frappe.get_all("Account", filters={'name': ['in', chunk]}, fields=['name', 'iban', 'bic']):
+                self.accounts[a.name] = a
+        self.country_codes = get_country_codes()
+        self.addresses = get_billing_addresses(
+            [(p.party_type, p.party) for p in self.payment_entries if p.party_type in ("Supplier", "Customer")])
+        self.employees = {}
+        for chunk in get_chunks(set(p.party for p in self.payment_entries if p.party_type == "Employee")):
+            for e in frappe.get_all("Employee", filters={'name': ['in', chunk]}, 
+                    fields=['name', 'employee_name', 'permanent_address', 'current_address']):
+                self.employees[e.name] = e
+        return
+    
+    def get_company_name(self, payment_entry):
+        for p in self.payment_entries:
+            if p.name == payment_entry:
+                return p.company
+        return get_company_name(payment_entry)
+
+"""
+Compile the C-level data of a payment entry, returns (transaction, None) or (None, remark) if invalid
+"""
+def get_transaction(payment_record, data):
+    payment = payment_record.name
+    transaction = {
+        'name': payment,
+        'transaction_type': payment_record.transaction_type,
+        'currency': payment_record.paid_from_account_currency,
+        'amount': payment_record.paid_amount
+    }
     # creditor information
-    payment_content += make_line("        <Cdtr>") 
+    creditor = get_creditor_info(payment_record, data)
+    if not creditor:
+        # no address found, skip entry (not valid)
+        if payment_record.transaction_type in ("QRR", "SCOR"):
+            frappe.log_error("No address found ({0})".format(payment), "Payment File")
+        return None, _("{0}: no address (or country) found").format(payment)
+    transaction['creditor'] = creditor
+    # creditor account identification
+    if payment_record.transaction_type in ("ESR", "QRR", "SCOR"):
+        if not payment_record.esr_participant_number:
+            # no particpiation number: not valid record, skip
+            if payment_record.transaction_type != "ESR":
+                frappe.log_error("No ESR participation number found ({0})".format(payment), "Payment File")
+            return None, _("{0}: no ESR participation number found").format(payment)
+        if not payment_record.esr_reference:
+            # no ESR reference: not valid record, skip
+            return None, _("{0}: no ESR reference found").format(payment)
+        transaction['esr_participant_number'] = payment_record.esr_participant_number
+        transaction['esr_reference'] = payment_record.esr_reference.replace(" ", "")
+    else:
+        if not payment_record.iban:
+            # no iban: not valid record, skip
+            return None, _("{0}: no IBAN found").format(payment)
+        transaction['iban'] = payment_record.iban.replace(" ", "")
+        if payment_record.transaction_type == "IBAN":
+            transaction['bic'] = payment_record.bic
+    return transaction, None
+
+### Credit Transfer Transaction Information (CdtTrfTxInf, C-Level)
+def write_transaction(writer, transaction):
+    transaction_type = transaction['transaction_type']
+    with writer.block("CdtTrfTxInf"):
+        # payment identification
+        with writer.block("PmtId"):
+            # instruction identification 
+            writer.element("InstrId", "INSTRID-" + transaction['name'])
+            # end-to-end identification (should be used and unique within B-level; payment entry name)
+            writer.element("EndToEndId", transaction['name'])
+        # payment type information
+        with writer.block("PmtTpInf"):
+            if transaction_type == "SEPA":
+                # service level code (e.g. SEPA)
+                with writer.block("SvcLvl"):
+                    writer.element("Cd", "SEPA")
+            elif transaction_type == "ESR":
+                # local instrument, proprietary (nothing or CH01 for ESR)
+                with writer.block("LclInstrm"):
+                    writer.element("Prtry", "CH01")
+            elif transaction_type in ("QRR", "SCOR", "IBAN"):
+                writer.element("InstrPrty", "NORM")
+        # amount 
+        with writer.block("Amt"):
+            writer.element("InstdAmt", format_amount(transaction['amount']), Ccy=transaction['currency'])
+        if transaction_type == "IBAN":
+            writer.element("ChrgBr", "DEBT")
+        write_creditor(writer, transaction['creditor'])
+        if transaction_type == "ESR":
+            # ESR payment: participant number and reference
+            with writer.block("CdtrAcct"):
+                with writer.block("Id"):
+                    with writer.block("Othr"):
+                        writer.element("Id", transaction['esr_participant_number'])
+            with writer.block("RmtInf"):
+                with writer.block("Strd"):
+                    with writer.block("CdtrRefInf"):
+                        writer.element("Ref", transaction['esr_reference'])
+        elif transaction_type in ("QRR", "SCOR"):
+            # QRR/SCOR payment: QR-IBAN and reference
+            with writer.block("CdtrAcct"):
+                with writer.block("Id"):
+                    writer.element("IBAN", transaction['esr_participant_number'])
+            with writer.block("RmtInf"):
+                with writer.block("Strd"):
+                    with writer.block("CdtrRefInf"):
+                        with writer.block("Tp"):
+                            with writer.block("CdOrPrtry"):
+                                if transaction_type == "QRR":
+                                    writer.element("Prtry", "QRR")
+                                else:
+                                    writer.element("Cd", "SCOR")
+                        writer.element("Ref", transaction['esr_reference'])
+        else:
+            # IBAN or SEPA payment (creditor agent BIC only for IBAN; removed for SEPA to resolve issue #15)
+            if transaction.get('bic'):
+                with writer.block("CdtrAgt"):
+                    with writer.block("FinInstnId"):
+                        writer.element("BIC", transaction['bic'])
+            with writer.block("CdtrAcct"):
+                with writer.block("Id"):
+                    writer.element("IBAN", transaction['iban'])
+    return
+
+def write_creditor(writer, creditor):
+    with writer.block("Cdtr"):
+        # name of the creditor/supplier
+        writer.element("Nm", creditor['name'])
+        # address of creditor/supplier (should contain at least country and first address line
+        with writer.block("PstlAdr"):
+            if creditor.get('street'):
+                writer.element("StrtNm", creditor['street'])
+                if creditor.get('building'):
+                    writer.element("BldgNb", creditor['building'])
+            writer.element("PstCd", creditor['pincode'])
+            writer.element("TwnNm", creditor['city'])
+            writer.element("Ctry", creditor['country_code'])
+    return
+
+def get_creditor_info(payment_record, data):
     # name of the creditor/supplier
-    name = html.escape(payment_record.party)
-    if payment_record.party_type == "Employee":
-        name = html.escape(frappe.get_value("Employee", payment_record.party, "employee_name"))
-    payment_content += make_line("          <Nm>" + name + "</Nm>")
+    name = payment_record.party
     # address of creditor/supplier (should contain at least country and first address line
-    # get supplier address
     if payment_record.party_type == "Supplier" or payment_record.party_type == "Customer":
-        supplier_address = get_billing_address(payment_record.party, payment_record.party_type)
+        # get supplier address
+        supplier_address = data.addresses.get((payment_record.party_type, payment_record.party))
         if supplier_address == None:
             return None
-        street = get_street_name(supplier_address.address_line1)
-        building = get_building_number(supplier_address.address_line1)
-        plz = supplier_address.pincode
-        city = supplier_address.city
         # country (has to be a two-digit code)
-        try:
-            country_code = frappe.get_value('Country', supplier_address.country, 'code').upper()
-        except:
-            country_code = "CH"
+        country_code = data.country_codes.get(supplier_address.country) or "CH"
+        return {
+            'name': name,
+            'street': get_street_name(supplier_address.address_line1),
+            'building': get_building_number(supplier_address.address_line1),
+            'pincode': supplier_address.pincode,
+            'city': supplier_address.city,
+            'country_code': country_code
+        }
     elif payment_record.party_type == "Employee":
-        employee = frappe.get_doc("Employee", payment_record.party)
-        if employee.permanent_address:
-           address = employee.permanent_address
-        elif employee.current_address:
-            address = employee.current_address
-        else:
+        employee = data.employees.get(payment_record.party)
+        if not employee:
+            return None
+        address = employee.permanent_address or employee.current_address
+        if not address:
             # no address found
             return None
         try:
             lines = address.split("\n")
-            street = get_street_name(lines[0])
-            building = get_building_number(lines[0])
-            plz = get_pincode(lines[1])
-            city = get_city(lines[1])
-            country_code = "CH"
+            return {
+                'name': employee.employee_name,
+                'street': get_street_name(lines[0]),
+                'building': get_building_number(lines[0]),
+                'pincode': get_pincode(lines[1]),
+                'city': get_city(lines[1]),
+                'country_code': "CH"
+            }
         except:
             # invalid address
             return None
     else:
         # unknown supplier type
         return None
-    payment_content += make_line("          <PstlAdr>")
-    # street name
-    if street:
-        payment_content += make_line("            <StrtNm>" + street + "</StrtNm>")
-    # building number
-    if building and street:
-        payment_content += make_line("            <BldgNb>" + building + "</BldgNb>")
-    # postal code
-    payment_content += make_line("            <PstCd>{0}</PstCd>".format(plz))
-    # town name
-    payment_content += make_line("            <TwnNm>" + city + "</TwnNm>")
-    payment_content += make_line("            <Ctry>" + country_code + "</Ctry>")
-    payment_content += make_line("          </PstlAdr>")
-    payment_content += make_line("        </Cdtr>") 
-    return payment_content
 
 def get_total_amount(payments):
     # get total amount from all payments
@@ -428,61 +325,47 @@ def get_total_amount(payments):
 def get_company_name(payment_entry):
     return frappe.get_value('Payment Entry', payment_entry, 'company')
 
-# adds Windows-compatible line endings (to make the xml look nice)
-def make_line(line):
-    return line + "\r\n"
-
-# add a remark if a payment entry was skipped
-def add_invalid_remark(remark):
-    return make_line("    <!-- " + remark + " -->")
+def get_country_codes():
+    return {c.name: (c.code or "").upper() for c in frappe.get_all("Country", fields=['name', 'code'])}
 
 # try to find the optimal billing address
 def get_billing_address(supplier_name, supplier_type="Supplier"):
-    if supplier_type == "Customer":
-        linked_addresses = frappe.get_all('Dynamic Link',
-        filters={
-            'link_doctype': 'customer',
-            'link_name': supplier_name,
-            'parenttype': 'Address'
-        },
-        fields=['parent'])
-    else:
-        linked_addresses = frappe.get_all('Dynamic Link',
-        filters={
-            'link_doctype': 'supplier',
-            'link_name': supplier_name,
-            'parenttype': 'Address'
-        },
-        fields=['parent'])
-    if len(linked_addresses) > 0:
-        if len(linked_addresses) > 1:
-            for address_name in linked_addresses:
-                address = frappe.get_doc('Address', address_name)
-                if address.address_type == "Billing":
-                    # this is a billing address, keep as option
-                    billing_address = address
-                    if address.is_primary_address == 1:
-                        # this is the primary billing address
-                        return address
-                if address.is_primary_address == 1:
-                    # this is a primary but not billing address
-                    primary_address = address
-            # evaluate best address found
-            if billing_address:
-                # found one or more billing address (but no primary)
-                return billing_address
-            elif primary_address:
-                # found no billing but a primary address
-                return primary_address
-            else:
-                # found neither billing nor a primary address
-                return frappe.get_doc('Address', linked_addresses[0].parent)
-        else:
-            # return the one (and only) address 
-            return frappe.get_doc('Address', linked_addresses[0].parent)
-    else:
-        # no address found
-        return None
+    return get_billing_addresses([(supplier_type, supplier_name)]).get((supplier_type, supplier_name))
+
+"""
+Find the optimal billing address for a list of (party type, party): primary billing address,
+then any billing address, then the primary address, then the first linked address
+"""
+def get_billing_addresses(parties):
+    parties = set(parties)
+    links = {}
+    for party_type in ("Supplier", "Customer"):
+        names = [p[1] for p in parties if p[0] == party_type]
+        for chunk in get_chunks(names):
+            for link in frappe.get_all('Dynamic Link',
+                    filters={
+                        'link_doctype': party_type,
+                        'link_name': ['in', chunk],
+                        'parenttype': 'Address'
+                    },
+                    fields=['parent', 'link_name']):
+                links.setdefault((party_type, link.link_name), []).append(link.parent)
+    
+    addresses = {}
+    for chunk in get_chunks(set(a for linked in links.values() for a in linked)):
+        for address in frappe.get_all("Address", filters={'name': ['in', chunk]},
+                fields=['name', 'address_line1', 'pincode', 'city', 'country', 'address_type', 'is_primary_address']):
+            addresses[address.name] = address
+    
+    billing_addresses = {}
+    for party, linked in links.items():
+        candidates = [addresses[a] for a in linked if a in addresses]
+        if not candidates:
+            continue
+        billing = [a for a in candidates if a.address_type == "Billing"]
+        primary = [a for a in candidates if a.is_primary_address == 1]
+        billing_addresses[party] = ([a for a in billing if a.is_primary_address == 1] or billing or primary or candidates)[0]
+    return billing_addresses
 
 @frappe.whitelist()
 def generate_payment_file_from_payroll(payroll_entry):
@@ -496,14 +379,16 @@ def generate_payment_file_from_payroll(payroll_entry):
         }, fields=['name', 'posting_date', 'rounded_total', 'employee_name', 'employee', 'bank_account_no'])
     company = frappe.get_doc('Company', payroll_record.company)
     country_code = frappe.get_value("Country", company.country, 'code').upper()
+    # collect address information of all employees at once
+    employees = {}
+    for chunk in get_chunks(set(s['employee'] for s in salary_slips)):
+        for e in frappe.get_all("Employee", filters={'name': ['in', chunk]}, 
+                fields=['name', 'permanent_address', 'current_address']):
+            employees[e.name] = e
     for salary_slip in salary_slips:
-        # collect address information
-        employee = frappe.get_doc("Employee", salary_slip['employee'])
-        if employee.permanent_address:
-           address = employee.permanent_address
-        elif employee.current_address:
-            address = employee.current_address
-        else:
+        employee = employees.get(salary_slip['employee']) or {}
+        address = employee.get('permanent_address') or employee.get('current_address')
+        if not address:
             frappe.throw( _("No address for employee {0} found.").format(salary_slip['employee_name']) )
         lines = address.split("\n")
         street = get_street_name(lines[0])
@@ -512,20 +397,21 @@ def generate_payment_file_from_payroll(payroll_entry):
         city = get_city(lines[1])
 
         payments.append({
-            'payment_id': html.escape("PMTINF-{0}".format(salary_slip['name'])),
+            'name': salary_slip['name'],
+            'payment_id': "PMTINF-{0}".format(salary_slip['name']),
             'execution_date': salary_slip['posting_date'],
-            'instruction_id': html.escape("INSTRID-{0}".format(salary_slip['name'])),
-            'endtoend_id': html.escape("{0}".format(salary_slip['name'])),
+            'instruction_id': "INSTRID-{0}".format(salary_slip['name']),
+            'endtoend_id': "{0}".format(salary_slip['name']),
             'transaction_type': "SEPA",
             'amount': salary_slip['rounded_total'],
             'currency': company.default_currency,
-            'receiver_name': html.escape(salary_slip['employee_name']),
-            'receiver_street': html.escape(street),
-            'receiver_building': html.escape(building),
-            'receiver_city': html.escape(city),
-            'receiver_pincode': html.escape(pincode),
+            'receiver_name': salary_slip['employee_name'],
+            'receiver_street': street,
+            'receiver_building': building,
+            'receiver_city': city,
+            'receiver_pincode': pincode,
             'receiver_country': country_code,
-            'receiver_iban': salary_slip['bank_account_no'].replace(" ", "")
+            'receiver_iban': (salary_slip['bank_account_no'] or "").replace(" ", "")
         })
     try:
         paid_from = frappe.get_value('Account', payroll_record.payment_account, 'iban').replace(" ", "")
@@ -534,7 +420,7 @@ def generate_payment_file_from_payroll(payroll_entry):
 
     pain001_data = {
         'msg_id': "MSG-" + payroll_record.name,
-        'company': html.escape(payroll_record.company),
+        'company': payroll_record.company,
         'payments': payments,
         'paid_from_iban': paid_from,
         'paid_from_bic': frappe.get_value('Account', payroll_record.payment_account, 'bic')
@@ -542,215 +428,90 @@ def generate_payment_file_from_payroll(payroll_entry):
     return generate_pain001(pain001_data)
 
 def generate_pain001(pain001_data):
-    # creates a pain.001 payment file from a payroll
-    #try:
-        # array for skipped payments
-        skipped = []
+    # creates a pain.001 payment file from a payroll (one B-level per payment)
+    # values are escaped by the writer
+    # array for skipped payments
+    skipped = []
+    remarks = []
+    payments = []
+    for payment in pain001_data['payments']:
+        if not pain001_data['paid_from_iban']:
+            # no paying account IBAN: not valid record, skip
+            remarks.append( _("{0}: no account IBAN found").format(payment['name']) )
+        elif payment['transaction_type'] == "ESR" and not payment.get('esr_participant_no'):
+            # no particpiation number: not valid record, skip
+            remarks.append( _("{0}: no ESR participation number found").format(payment['name']) )
+        elif payment['transaction_type'] == "ESR" and not payment.get('esr_reference'):
+            # no ESR reference: not valid record, skip
+            remarks.append( _("{0}: no ESR reference found").format(payment['name']) )
+        elif payment['transaction_type'] != "ESR" and not payment.get('receiver_iban'):
+            # no iban: not valid record, skip
+            remarks.append( _("{0}: no IBAN found").format(payment['name']) )
+        else:
+            payments.append(payment)
+            continue
+        skipped.append(payment['name'])
 
-        # create xml header
-        content = make_line("<?xml version=\"1.0\" encoding=\"UTF-8\"?>")
-        # define xml template reference
-        content += make_line("<Document xmlns=\"http://www.six-interbank-clearing.com/de/pain.001.001.03.ch.02.xsd\" xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\" xsi:schemaLocation=\"http://www.six-interbank-clearing.com/de/pain.001.001.03.ch.02.xsd pain.001.001.03.ch.02.xsd\">")
-        # transaction holder
-        content += make_line("  <CstmrCdtTrfInitn>")
+    with PainWriter(PAIN001_CH_03, "CstmrCdtTrfInitn") as writer:
         ### Group Header (GrpHdr, A-Level)
-        # create group header
-        content += make_line("    <GrpHdr>")
-        # message ID (unique, SWIFT-characters only)
-        content += make_line("      <MsgId>{0}</MsgId>".format(pain001_data['msg_id']))
-        # creation date and time ( e.g. 2010-02-15T07:30:00 )
-        content += make_line("      <CreDtTm>{0}</CreDtTm>".format(time.strftime("%Y-%m-%dT%H:%M:%S")))
-        # number of transactions in the file
-        transaction_count = 0
-        transaction_count_identifier = "<!-- $COUNT -->"
-        content += make_line("      <NbOfTxs>{0}</NbOfTxs>".format(transaction_count_identifier))
-        # total amount of all transactions ( e.g. 15850.00 )  (sum of all amounts)
-        control_sum = 0.0
-        control_sum_identifier = "<!-- $CONTROL_SUM -->"
-        content += make_line("      <CtrlSum>{0}</CtrlSum>".format(control_sum_identifier))
-        # initiating party requires at least name or identification
-        content += make_line("      <InitgPty>")
-        # initiating party name ( e.g. MUSTER AG )
-        content += make_line("        <Nm>{0}</Nm>".format(html.escape(pain001_data['company'])))
-        content += make_line("      </InitgPty>")
-        content += make_line("    </GrpHdr>")
-
+        writer.group_header(
+            msg_id=pain001_data['msg_id'],
+            transaction_count=len(payments),
+            control_sum=sum(p['amount'] for p in payments),
+            initiating_party=pain001_data['company']
+        )
+        for remark in remarks:
+            writer.comment(remark)
         ### Payment Information (PmtInf, B-Level)
-        # payment information records (1 .. 99'999)
-        for payment in pain001_data['payments']:
-            # create temporary code block to compile the payment record (only add to overall on submit)
-            # use 'continue' to skip a record (in case a validation fails)
-            payment_content = ""
-            # create the payment entries
-            payment_content += make_line("    <PmtInf>")
-            # unique (in this file) identification for the payment ( e.g. PMTINF-01, PMTINF-PE-00005 )
-            payment_content += make_line("      <PmtInfId>{0}</PmtInfId>".format(payment['payment_id']))
-            # payment method (TRF or TRA, no impact in Switzerland)
-            payment_content += make_line("      <PmtMtd>TRF</PmtMtd>")
-            # batch booking (true or false; recommended true)
-            payment_content += make_line("      <BtchBookg>true</BtchBookg>")
-            # Requested Execution Date (e.g. 2010-02-22)
-            payment_content += make_line("      <ReqdExctnDt>{0}</ReqdExctnDt>".format(
-                payment['execution_date']))
-            # debitor (technically ignored, but recommended)
-            payment_content += make_line("      <Dbtr>")
-            # debitor name
-            payment_content += make_line("        <Nm>{0}</Nm>".format(html.escape(pain001_data['company'])))
-            # postal address (recommendadtion: do not use)
-            #content += make_line("        <PstlAdr>")
-            #content += make_line("          <Ctry>CH</Ctry>")
-            #content += make_line("          <AdrLine>SELDWYLA</AdrLine>")
-            #content += make_line("        </PstlAdr>")
-            payment_content += make_line("      </Dbtr>")
-            # debitor account (sender) - IBAN
-            payment_content += make_line("      <DbtrAcct>")
-            payment_content += make_line("        <Id>")
-            if pain001_data['paid_from_iban']:
-                payment_content += make_line("          <IBAN>{0}</IBAN>".format(
-                    pain001_data['paid_from_iban'].replace(" ", "") ))
-            else:
-                # no paying account IBAN: not valid record, skip
-                content += add_invalid_remark( _("{0}: no account IBAN found ({1})".format(
-                    payment, payment_record.paid_from) ) )
-                skipped.append(payment)
-                continue
-            payment_content += make_line("        </Id>")
-            payment_content += make_line("      </DbtrAcct>")
-            if pain001_data['paid_from_bic']:
-                # debitor agent (sender) - BIC
-                payment_content += make_line("      <DbtrAgt>")
-                payment_content += make_line("        <FinInstnId>")
-                payment_content += make_line("          <BIC>{0}</BIC>".format(pain001_data['paid_from_bic']))
-                payment_content += make_line("        </FinInstnId>")
-                payment_content += make_line("      </DbtrAgt>")
-
-            ### Credit Transfer Transaction Information (CdtTrfTxInf, C-Level)
-            payment_content += make_line("      <CdtTrfTxInf>")
-            # payment identification
-            payment_content += make_line("        <PmtId>")
-            # instruction identification 
-            payment_content += make_line("          <InstrId>{0}</InstrId>".format(payment['instruction_id']))
-            # end-to-end identification (should be used and unique within B-level; payment entry name)
-            payment_content += make_line("          <EndToEndId>{0}</EndToEndId>".format(payment['endtoend_id']))
-            payment_content += make_line("        </PmtId>")
-            # payment type information
-            payment_content += make_line("        <PmtTpInf>")
-            # service level: only used for SEPA (currently not implemented)
-            if payment['transaction_type'] == "SEPA":
-                payment_content += make_line("          <SvcLvl>")
-                # service level code (e.g. SEPA)
-                payment_content += make_line("            <Cd>SEPA</Cd>")
-                payment_content += make_line("          </SvcLvl>")
-            # local instrument
-            if payment['transaction_type'] == "ESR":
-                payment_content += make_line("          <LclInstrm>")
-                # proprietary (nothing or CH01 for ESR)
-                payment_content += make_line("            <Prtry>CH01</Prtry>")
-                payment_content += make_line("          </LclInstrm>")
-            payment_content += make_line("        </PmtTpInf>")
-            # amount
-            payment_content += make_line("        <Amt>")
-            payment_content += make_line("          <InstdAmt Ccy=\"{0}\">{1:.2f}</InstdAmt>".format(
-                payment['currency'], payment['amount']))
-            payment_content += make_line("        </Amt>")
-            # creditor account
-            # creditor account identification
-            if payment['transaction_type'] == "ESR":
-                # add creditor information
-                payment_content += make_line("        <Cdtr>") 
-                payment_content += make_line("          <Nm>{0}</Nm>".format(html.escape(payment['receiver_name'])))
-                payment_content += make_line("          <PstlAdr>")
-                payment_content += make_line("            <StrtNm>{0}</StrtNm>".format(payment['receiver_street']))
-                payment_content += make_line("            <BldgNb>{0}</BldgNb>".format(payment['receiver_building']))
-                payment_content += make_line("            <PstCd>{0}</PstCd>".format(payment['receiver_pincode']))
-                payment_content += make_line("            <TwnNm>{0}</TwnNm>".format(payment['receiver_city']))
-                payment_content += make_line("            <Ctry>{0}</Ctry>".format(payment['receiver_country']))
-                payment_content += make_line("          </PstlAdr>")
-                payment_content += make_line("        </Cdtr>") 
-                # ESR payment
-                payment_content += make_line("        <CdtrAcct>")
-                payment_content += make_line("          <Id>")
-                payment_content += make_line("            <Othr>")
-                # ESR participant number
-                if payment['esr_participant_no']:
-                    payment_content += make_line("              <Id>{0}</Id>".format(payment['esr_participant_no']))
-                else:
-                    # no particpiation number: not valid record, skip
-                    content += add_invalid_remark( _("{0}: no ESR participation number found").format(payment['name']) )
-                    skipped.append(payment['name'])
-                    continue
-                payment_content += make_line("            </Othr>")
-                payment_content += make_line("          </Id>")
-                payment_content += make_line("        </CdtrAcct>")
-                # Remittance Information
-                payment_content += make_line("        <RmtInf>")
-                payment_content += make_line("          <Strd>")
-                # Creditor Reference Information
-                payment_content += make_line("            <CdtrRefInf>")
-                # ESR reference 
-                if payment['esr_reference']:
-                    payment_content += make_line("              <Ref>{0}</Ref>".format(payment['esr_reference']))
-                else:
-                    # no ESR reference: not valid record, skip
-                    content += add_invalid_remark( _("{0}: no ESR reference found").format(payment['name']) )
-                    skipped.append(payment['name'])
-                    continue
-                payment_content += make_line("            </CdtrRefInf>")
-                payment_content += make_line("          </Strd>")
-                payment_content += make_line("        </RmtInf>")
-            else:
-                # IBAN or SEPA payment
-                # add creditor information
-                payment_content += make_line("        <Cdtr>") 
-                payment_content += make_line("          <Nm>{0}</Nm>".format(html.escape(payment['receiver_name'])))
-                payment_content += make_line("          <PstlAdr>")
-                payment_content += make_line("            <StrtNm>{0}</StrtNm>".format(payment['receiver_street']))
-                payment_content += make_line("            <BldgNb>{0}</BldgNb>".format(payment['receiver_building']))
-                payment_content += make_line("            <PstCd>{0}</PstCd>".format(payment['receiver_pincode']))
-                payment_content += make_line("            <TwnNm>{0}</TwnNm>".format(payment['receiver_city']))
-                payment_content += make_line("            <Ctry>{0}</Ctry>".format(payment['receiver_country']))
-                payment_content += make_line("          </PstlAdr>")
-                payment_content += make_line("        </Cdtr>")
-                # creditor agent (BIC, optional; removed to resolve issue #15)
-                #if payment_record.bic:
-                #    payment_content += make_line("        <CdtrAgt>")
-                #    payment_content += make_line("          <FinInstnId>")
-                #    payment_content += make_line("            <BIC>" +
-                #        payment_record.bic + "</BIC>")
-                #    payment_content += make_line("          </FinInstnId>")
-                #    payment_content += make_line("        </CdtrAgt>")
-                # creditor account
-                payment_content += make_line("        <CdtrAcct>")
-                payment_content += make_line("          <Id>")
-                if payment['receiver_iban']:
-                    payment_content += make_line("            <IBAN>{0}</IBAN>".format(
-                        payment['receiver_iban'].replace(" ", "") ))
-                else:
-                    # no iban: not valid record, skip
-                    content += add_invalid_remark( _("{0}: no IBAN found").format(payment['name']) )
-                    skipped.append(payment['name'])
-                    continue
-                payment_content += make_line("          </Id>")
-                payment_content += make_line("        </CdtrAcct>")
-
-            # close payment record
-            payment_content += make_line("      </CdtTrfTxInf>")
-            payment_content += make_line("    </PmtInf>")
-            # once the payment is extracted for payment, submit the record
-            transaction_count += 1
-            control_sum += payment['amount']
-            content += payment_content
-        # add footer
-        content += make_line("  </CstmrCdtTrfInitn>")
-        content += make_line("</Document>")
-        # insert control numbers
-        content = content.replace(transaction_count_identifier, "{0}".format(transaction_count))
-        content = content.replace(control_sum_identifier, "{:.2f}".format(control_sum))
-
-        return { 'content': content, 'skipped': skipped }
-    #except IndexError:
-    #    frappe.msgprint( _("Please select at least one payment."), _("Information") )
-    #    return
-    #except:
-    #    frappe.throw( _("Error while generating xml. Make sure that you made required customisations to the DocTypes.") )
-    #    return
+        for payment in payments:
+            with writer.block("PmtInf"):
+                writer.element("PmtInfId", payment['payment_id'])
+                writer.element("PmtMtd", "TRF")
+                writer.element("BtchBookg", "true")
+                writer.element("ReqdExctnDt", payment['execution_date'])
+                with writer.block("Dbtr"):
+                    writer.element("Nm", pain001_data['company'])
+                with writer.block("DbtrAcct"):
+                    with writer.block("Id"):
+                        writer.element("IBAN", pain001_data['paid_from_iban'].replace(" ", ""))
+                if pain001_data['paid_from_bic']:
+                    with writer.block("DbtrAgt"):
+                        with writer.block("FinInstnId"):
+                            writer.element("BIC", pain001_data['paid_from_bic'])
+                ### Credit Transfer Transaction Information (CdtTrfTxInf, C-Level)
+                with writer.block("CdtTrfTxInf"):
+                    with writer.block("PmtId"):
+                        writer.element("InstrId", payment['instruction_id'])
+                        writer.element("EndToEndId", payment['endtoend_id'])
+                    with writer.block("PmtTpInf"):
+                        if payment['transaction_type'] == "SEPA":
+                            with writer.block("SvcLvl"):
+                                writer.element("Cd", "SEPA")
+                        elif payment['transaction_type'] == "ESR":
+                            with writer.block("LclInstrm"):
+                                writer.element("Prtry", "CH01")
+                    with writer.block("Amt"):
+                        writer.element("InstdAmt", format_amount(payment['amount']), Ccy=payment['currency'])
+                    with writer.block("Cdtr"):
+                        writer.element("Nm", payment['receiver_name'])
+                        with writer.block("PstlAdr"):
+                            writer.element("StrtNm", payment['receiver_street'])
+                            writer.element("BldgNb", payment['receiver_building'])
+                            writer.element("PstCd", payment['receiver_pincode'])
+                            writer.element("TwnNm", payment['receiver_city'])
+                            writer.element("Ctry", payment['receiver_country'])
+                    if payment['transaction_type'] == "ESR":
+                        with writer.block("CdtrAcct"):
+                            with writer.block("Id"):
+                                with writer.block("Othr"):
+                                    writer.element("Id", payment['esr_participant_no'])
+                        with writer.block("RmtInf"):
+                            with writer.block("Strd"):
+                                with writer.block("CdtrRefInf"):
+                                    writer.element("Ref", payment['esr_reference'])
+                    else:
+                        with writer.block("CdtrAcct"):
+                            with writer.block("Id"):
+                                writer.element("IBAN", payment['receiver_iban'].replace(" ", ""))
+
+    return { 'content': writer.getvalue(), 'skipped': skipped }
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+"""
+Payment Initiation Writer
+=========================
+
+Incremental writer for ISO 20022 payment initiation files (pain.001 credit
+transfers, pain.008 direct debits) on lxml's xmlfile: elements are written
+to the output as they come, nothing is concatenated or patched afterwards.
+The number of transactions and the control sum go into the group header,
+so callers validate their transactions first and then write them.
+
+    with PainWriter(PAIN001_CH_03, "CstmrCdtTrfInitn") as writer:
+        writer.group_header(msg_id, count, control_sum, company)
+        with writer.block("PmtInf"):
+            writer.element("PmtInfId", "PMTINF-1")
+            ...
+    content = writer.getvalue()
+
+All text is escaped by the writer, do not pass html.escape'd values.
+"""
+
+import io
+import time
+from contextlib import contextmanager
+from lxml import etree
+
+XSI = "http://www.w3.org/2001/XMLSchema-instance"
+
+PAIN001_CH_03 = (
+    "http://www.six-interbank-clearing.com/de/pain.001.001.03.ch.02.xsd",
+    "http://www.six-interbank-clearing.com/de/pain.001.001.03.ch.02.xsd pain.001.001.03.ch.02.xsd"
+)
+PAIN008_CH_03 = (
+    "http://www.six-interbank-clearing.com/de/pain.008.001.03.ch.02.xsd",
+    "http://www.six-interbank-clearing.com/de/pain.008.001.03.ch.02.xsd  pain.008.001.03.ch.02.xsd"
+)
+PAIN008_02 = (
+    "urn:iso:std:iso:20022:tech:xsd:pain.008.001.02",
+    "urn:iso:std:iso:20022:tech:xsd:pain.008.001.02 pain.008.001.02.xsd"
+)
+PAIN008_08 = (
+    "urn:iso:std:iso:20022:tech:xsd:pain.008.001.08",
+    "urn:iso:std:iso:20022:tech:xsd:pain.008.001.08 pain.008.001.08.xsd"
+)
+
+class PainWriter:
+    def __init__(self, schema, root, output=None, indent="  "):
+        self.namespace, self.schema_location = schema
+        self.root = root
+        self.output = output if output is not None else io.BytesIO()
+        self.indent = indent
+        self._depth = 0
+        self._xf = None
+        self._contexts = []
+
+    def __enter__(self):
+        self.output.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        self._enter(etree.xmlfile(self.output, encoding="UTF-8"))
+        self._enter(self._xf.element(self._tag("Document"),
+            {"{%s}schemaLocation" % XSI: self.schema_location},
+            nsmap={None: self.namespace, 'xsi': XSI}))
+        self._depth = 1
+        self._newline()
+        self._enter(self._xf.element(self._tag(self.root)))
+        self._depth = 2
+        return self
+
+    def _enter(self, context):
+        result = context.__enter__()
+        if self._xf is None:
+            self._xf = result
+        self._contexts.append(context)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        while self._contexts:
+            self._depth -= 1
+            if not exc_type and self._depth >= 0:
+                self._newline()
+            self._contexts.pop().__exit__(exc_type, exc_value, traceback)
+        return False
+
+    def _tag(self, tag):
+        return "{%s}%s" % (self.namespace, tag)
+
+    def _newline(self):
+        self._xf.write("\n" + self.indent * self._depth)
+
+    @contextmanager
+    def block(self, tag, **attrib):
+        """
+        Write an element with children (use as context manager)
+        """
+        self._newline()
+        with self._xf.element(self._tag(tag), attrib):
+            self._depth += 1
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+            self._newline()
+
+    def element(self, tag, text=None, **attrib):
+        """
+        Write a leaf element, None text writes an empty element
+        """
+        self._newline()
+        with self._xf.element(self._tag(tag), attrib):
+            if text is not None:
+                self._xf.write("{0}".format(text))
+        return
+
+    def comment(self, text):
+        self._newline()
+        self._xf.write(etree.Comment(" {0} ".format(text).replace("--", "- -")))
+        return
+
+    def group_header(self, msg_id, transaction_count, control_sum, initiating_party, created=None):
+        """
+        Group header (A-level) with the precomputed number of transactions and control sum
+        """
+        with self.block("GrpHdr"):
+            self.element("MsgId", msg_id)
+            self.element("CreDtTm", created or time.strftime("%Y-%m-%dT%H:%M:%S"))
+            self.element("NbOfTxs", "{0:d}".format(transaction_count))
+            self.element("CtrlSum", format_amount(control_sum))
+            with self.block("InitgPty"):
+                self.element("Nm", initiating_party)
+        return
+
+    def getvalue(self):
+        return self.output.getvalue().decode("utf-8")
+
+def format_amount(amount):
+    return "{0:.2f}".format(amount or 0)
@@ -4,6 +4,7 @@
 from __future__ import unicode_literals
 import frappe
 from frappe import _
+from erpnextswiss.erpnextswiss.vat_control import get_control_items
 
 def execute(filters=None):
     columns, data = [], []
@@ -29,14 +30,12 @@ def execute(filters=None):
     return columns, data
 
 def get_data(from_date, end_date, code, company="%"):
-    # try to fetch data from VAT query
+    # try to fetch data from VAT query (materialized, see vat_control)
     if frappe.db.exists("VAT query", "viewVAT_{code}".format(code=code)):
-        sql_query = ("""SELECT * 
-                FROM ({query}) AS `s` 
-                WHERE `s`.`posting_date` >= '{start_date}' 
-                AND `s`.`posting_date` <= '{end_date}'""".format(
-                query=frappe.get_value("VAT query", "viewVAT_{code}".format(code=code), "query"),
-                start_date=from_date, end_date=end_date).replace("{company}", company))      
+        try:
+            return get_control_items("viewVAT_{code}".format(code=code), from_date, end_date, company)
+        except:
+            return []
     else:
         # fallback database view
         sql_query = """SELECT
@@ -5,7 +5,7 @@ from __future__ import unicode_literals
 import frappe
 from frappe import _
 import datetime, calendar
-from erpnextswiss.erpnextswiss.report.worktime_overview.worktime_overview import get_employee_overtime, get_target_time
+from erpnextswiss.erpnextswiss.report.worktime_overview.worktime_overview import get_employee_overtime, get_data_of_employee
 
 def execute(filters=None):
     columns = get_columns()
@@ -34,30 +34,14 @@ def get_data(filters):
         FROM `tabActivity Type Determination`
         WHERE `company` = "{company}";""".format(company=filters.company), as_dict=True):
         off_types.append(t['activity_type'])
+    # all timesheet blocks and holidays of the month
+    blocks_by_day = get_blocks_by_day(filters.employee, days[0], days[-1])
+    holiday_remarks = get_holiday_remarks(days[0], days[-1])
     # expand all days
     data = []
     total_working_hours = 0
     for day in days:
-        sql_query = """
-            SELECT
-                `tabTimesheet Detail`.`hours`,
-                `tabTimesheet Detail`.`from_time`,
-                `tabTimesheet Detail`.`to_time`,
-                `tabTimesheet Detail`.`activity_type`
-            FROM `tabTimesheet Detail`
-            WHERE `tabTimesheet Detail`.`name` IN (
-                SELECT `tLookup`.`name`
-                FROM `tabTimesheet Detail` AS `tLookup`
-                LEFT JOIN `tabTimesheet` ON `tabTimesheet`.`name` = `tLookup`.`parent`
-                WHERE 
-                    `tabTimesheet`.`docstatus` = 1
-                    AND `tabTimesheet`.`employee` = "{employee}"
-                    AND DATE(`tLookup`.`from_time`) = "{date}"
-            )
-            ORDER BY `tabTimesheet Detail`.`from_time` ASC;""".format(
-                employee=filters.employee, date=day)
-        
-        blocks = frappe.db.sql(sql_query, as_dict=True)
+        blocks = blocks_by_day.get(day, [])
         
         working_hours = 0
         remarks = None
@@ -84,14 +68,7 @@ def get_data(filters):
         
         # for holidays, try to fetch remarks from holiday list
         if not remarks:
-            holidays = frappe.db.sql("""
-                SELECT `description` 
-                FROM `tabHoliday` 
-                WHERE `parenttype` = "Holiday List"
-                  AND `parentfield` = "holidays"
-                  AND `holiday_date` = "{day}";""".format(day=day), as_dict=True)
-            if len(holidays) > 0:
-                remarks = holidays[0]['description']
+            remarks = holiday_remarks.get(day)
                 
         total_working_hours += working_hours    
         data.append({
@@ -110,8 +87,9 @@ def get_data(filters):
     lookup_filters.to_date = datetime.date(filters.year, filters.month, num_days)
     lookup_filters.company = filters.company
     
-    target_hours = get_target_time(lookup_filters, filters.employee)
-    monthly_overtime = get_employee_overtime(lookup_filters)
+    monthly_overview = get_data_of_employee(lookup_filters)[0]
+    target_hours = monthly_overview[2]
+    monthly_overtime = round(monthly_overview[4], 3)
     
     # set full year
     lookup_filters.from_date = datetime.date(filters.year, 1, 1)
@@ -130,3 +108,34 @@ def get_data(filters):
         'remarks': frappe.get_value("Employee", filters.employee, "employee_name")
     })
     return data
+
+def get_blocks_by_day(employee, from_date, to_date):
+    blocks_by_day = {}
+    for block in frappe.db.sql("""
+            SELECT
+                `tabTimesheet Detail`.`hours`,
+                `tabTimesheet Detail`.`from_time`,
+                `tabTimesheet Detail`.`to_time`,
+                `tabTimesheet Detail`.`activity_type`
+            FROM `tabTimesheet Detail`
+            LEFT JOIN `tabTimesheet` ON `tabTimesheet`.`name` = `tabTimesheet Detail`.`parent`
+            WHERE 
+                `tabTimesheet`.`docstatus` = 1
+                AND `tabTimesheet`.`employee` = %(employee)s
+                AND DATE(`tabTimesheet Detail`.`from_time`) BETWEEN %(from_date)s AND %(to_date)s
+            ORDER BY `tabTimesheet Detail`.`from_time` ASC;""",
+            {'employee': employee, 'from_date': from_date, 'to_date': to_date}, as_dict=True):
+        blocks_by_day.setdefault(block['from_time'].date(), []).append(block)
+    return blocks_by_day
+
+def get_holiday_remarks(from_date, to_date):
+    remarks = {}
+    for holiday in frappe.db.sql("""
+            SELECT `holiday_date`, `description` 
+            FROM `tabHoliday` 
+            WHERE `parenttype` = "Holiday List"
+              AND `parentfield` = "holidays"
+              AND `holiday_date` BETWEEN %(from_date)s AND %(to_date)s;""",
+            {'from_date': from_date, 'to_date': to_date}, as_dict=True):
+        remarks.setdefault(holiday['holiday_date'], holiday['description'])
+    return remarks
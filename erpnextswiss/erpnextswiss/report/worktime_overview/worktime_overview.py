@@ -8,6 +8,8 @@ from frappe.utils.data import date_diff, getdate, add_days
 from datetime import date, timedelta
 from erpnext.hr.doctype.leave_application.leave_application import get_leave_details
 from frappe.utils import cint
+from erpnextswiss.erpnextswiss.hr import count_holidays
+from erpnextswiss.erpnextswiss.utils import get_chunks
 
 def execute(filters=None):
     if "HR Manager" in frappe.get_roles(frappe.session.user):
@@ -45,32 +47,12 @@ def get_columns(filters):
     
 def get_data_of_employee(filters):
     if filters.employee:
-        employee = frappe.get_doc("Employee", filters.employee)
+        employee = filters.employee
     else:
-        employee_name = get_employee_name(frappe.session.user)
-        employee = frappe.get_doc("Employee", employee_name)
-        
-    actual = get_actual_time(filters, employee.name)
-    target = get_target_time(filters, employee.name)
-    diff = actual - target
-    data = []
-    
-    _data = [
-        employee.name,
-        employee.employee_name,
-        target,
-        actual,
-        diff,
-        get_holiday_balance(employee.name, filters.to_date)
-    ]
-    
-    activity_type_determinations = get_activity_type_determinations(filters, employee.name)
-    for activity_type_determination in activity_type_determinations:
-        _data.append(activity_type_determination)
-        
-    data.append(_data)
+        employee = get_employee_name(frappe.session.user)
     
-    return data
+    worktime_data = WorktimeData(filters, [employee])
+    return [get_employee_row(filters, employee, worktime_data)]
     
 def get_data_of_all_employees(filters):
     employees = frappe.db.sql("""
@@ -80,84 +62,145 @@ def get_data_of_all_employees(filters):
             `company` = "{company}"
             AND (`relieving_date` IS NULL OR `relieving_date` >= "{start_date}")
         ;""".format(company=filters.company, start_date=getdate(filters.from_date)), as_dict=True)
-    data = []
     
-    for _employee in employees:
-        employee = frappe.get_doc("Employee", _employee.name)
-        actual = get_actual_time(filters, employee.name)
-        target = get_target_time(filters, employee.name)
-        diff = actual - target
-        
-        _data = [
-            employee.name,
-            employee.employee_name,
-            target,
-            actual,
-            diff,
-            get_holiday_balance(employee.name, filters.to_date)
-        ]
-        
-        activity_type_determinations = get_activity_type_determinations(filters, employee.name)
-        for activity_type_determination in activity_type_determinations:
-            _data.append(activity_type_determination)
-            
-        data.append(_data)
+    # degrees, leaves and timesheet hours of all employees in one pass
+    worktime_data = WorktimeData(filters, [e.name for e in employees])
+    data = []
+    for employee in employees:
+        data.append(get_employee_row(filters, employee.name, worktime_data))
     
     return data
 
+def get_employee_row(filters, employee, worktime_data):
+    actual = get_actual_time(filters, employee, worktime_data)
+    target = get_target_time(filters, employee, worktime_data)
+    diff = actual - target
+    
+    _data = [
+        employee,
+        worktime_data.get_employee(employee).employee_name,
+        target,
+        actual,
+        diff,
+        get_holiday_balance(employee, filters.to_date)
+    ]
+    
+    activity_type_determinations = get_activity_type_determinations(filters, employee, worktime_data)
+    for activity_type_determination in activity_type_determinations:
+        _data.append(activity_type_determination)
+    
+    return _data
 
-def get_target_time(filters, employee):
-    degrees = get_degrees(employee)
+"""
+Employees, employment degrees, carryovers, leave applications and timesheet hours
+of the report period, loaded once for all employees of the report
+"""
+class WorktimeData:
+    def __init__(self, filters, employees):
+        self.filters = filters
+        self.employees = {}
+        self.degrees = {}
+        self.carryovers = {}
+        self.actual_times = {}
+        self.activity_times = {}
+        self.leave_days = {}
+        self.daily_hours = get_daily_hours(filters)
+        self.additions = get_activity_type_additions(filters.company)
+        self.leave_based = (frappe.db.get_single_value("Worktime Settings", "vacation_hours_based_on") == 'Leave Application')
+        for chunk in get_chunks(employees):
+            self.load(tuple(chunk))
+    
+    def load(self, employees):
+        for e in frappe.db.sql("""
+                SELECT `name`, `employee_name`, `date_of_joining`
+                FROM `tabEmployee`
+                WHERE `name` IN %(employees)s;""", {'employees': employees}, as_dict=True):
+            self.employees[e.name] = e
+        for d in frappe.db.sql("""
+                SELECT `parent`, `degree`, `date`
+                FROM `tabEmployment Degree`
+                WHERE `parent` IN %(employees)s
+                ORDER BY `date` ASC;""", {'employees': employees}, as_dict=True):
+            self.degrees.setdefault(d.parent, []).append(d)
+        for cp in frappe.db.sql("""
+                SELECT `parent`, `year`, `amount`
+                FROM `tabCarryover and Payouts`
+                WHERE `parent` IN %(employees)s AND `parenttype` = "Employee";""", {'employees': employees}, as_dict=True):
+            key = (cp.parent, str(cp.year))
+            self.carryovers[key] = self.carryovers.get(key, 0) + (cp.amount or 0)
+        for t in frappe.db.sql("""
+                SELECT `tabTimesheet`.`employee`, `tabTimesheet Detail`.`activity_type`, SUM(`tabTimesheet Detail`.`hours`) AS `hours`
+                FROM `tabTimesheet Detail`
+                JOIN `tabTimesheet` ON `tabTimesheet`.`name` = `tabTimesheet Detail`.`parent`
+                WHERE DATE(`tabTimesheet Detail`.`from_time`) >= %(from_date)s AND DATE(`tabTimesheet Detail`.`from_time`) <= %(to_date)s
+                  AND `tabTimesheet Detail`.`docstatus` = 1
+                  AND `tabTimesheet`.`employee` IN %(employees)s
+                GROUP BY `tabTimesheet`.`employee`, `tabTimesheet Detail`.`activity_type`;""",
+                {'employees': employees, 'from_date': getdate(self.filters.from_date), 'to_date': getdate(self.filters.to_date)},
+                as_dict=True):
+            self.actual_times[t.employee] = self.actual_times.get(t.employee, 0) + (t.hours or 0)
+            self.activity_times[(t.employee, t.activity_type)] = t.hours or 0
+        if self.leave_based:
+            leave_applications = get_leave_applications(employees, self.filters.company)
+            for employee in employees:
+                self.leave_days[employee] = get_leave_days(leave_applications.get(employee, []))
+    
+    def get_employee(self, employee):
+        return self.employees.get(employee) or frappe._dict({'name': employee})
+    
+    def get_degrees(self, employee):
+        return self.degrees.get(employee, [])
+    
+    def get_carryover(self, employee, year):
+        return self.carryovers.get((employee, str(year)), 0)
+    
+    def get_leave_days(self, employee):
+        if employee not in self.leave_days:
+            self.leave_days[employee] = get_leave_days(
+                get_leave_applications([employee], self.filters.company).get(employee, []))
+        return self.leave_days[employee]
+
+def get_target_time(filters, employee, worktime_data=None):
+    worktime_data = worktime_data or WorktimeData(filters, [employee])
+    degrees = worktime_data.get_degrees(employee)
+    
+    employee_joining_date = worktime_data.get_employee(employee).date_of_joining
+    if not employee_joining_date or getdate(employee_joining_date) < getdate(filters.from_date):
+        start_date = getdate(filters.from_date)
+    else:
+        start_date = getdate(employee_joining_date)
+    end_date = getdate(filters.to_date)
     
     # if more than one degree
     if len(degrees) > 1:
         working_hours = 0
-        target_per_day = get_daily_hours(filters)
-        degree_list = []
+        target_per_day = worktime_data.daily_hours
         i = 0
         i_max = len(degrees) - 1
         while i < len(degrees):
-            data = {}
+            # each degree is valid until the day before the next degree
+            degree_start = getdate(degrees[i].date)
             if i != i_max:
-                data["start"] = degrees[i].date.strftime("%Y-%m-%d")
-                data["end"] = add_days(degrees[i + 1].date.strftime("%Y-%m-%d"), -1)
-                data["degree"] = degrees[i].degree
+                degree_end = getdate(add_days(degrees[i + 1].date, -1))
             else:
-                data["start"] = degrees[i].date.strftime("%Y-%m-%d")
-                data["end"] = filters.to_date
-                data["degree"] = degrees[i].degree
-            degree_list.append(data)
+                degree_end = end_date
+            range_start = max(start_date, degree_start)
+            range_end = min(end_date, degree_end)
+            if range_start <= range_end:
+                days = date_diff(range_end, range_start) + 1
+                off_days = get_off_days(range_start, range_end, filters.company, employee, worktime_data)
+                working_hours += (((days - off_days) * target_per_day) / 100 ) * degrees[i].degree
             i += 1
-            
-        employee_joining_date = frappe.get_doc("Employee", employee).date_of_joining
-        if getdate(employee_joining_date) < getdate(filters.from_date):
-            start_date = getdate(filters.from_date)
-        else:
-            start_date = getdate(employee_joining_date)
-            
-        end_date = getdate(filters.to_date)
-        delta = timedelta(days=1)
-        while start_date <= end_date:
-            for degree_range in degree_list:
-                if getdate(degree_range["start"]) <= start_date <= getdate(degree_range["end"]):
-                    working_hours += (((1 - get_off_days(start_date.strftime("%Y-%m-%d"), start_date.strftime("%Y-%m-%d"), filters.company, employee)) * target_per_day) / 100 ) * degree_range["degree"]
-            start_date += delta
         target_time = working_hours
         
     # if only one degree or no degrees
     else:
-        employee_joining_date = frappe.get_doc("Employee", employee).date_of_joining
-        if getdate(employee_joining_date) < getdate(filters.from_date):
-            start_date = filters.from_date
-        else:
-            start_date = employee_joining_date
-            
-        days = date_diff(filters.to_date, start_date) + 1
-        off_days = get_off_days(start_date, filters.to_date, filters.company, employee)
+        days = date_diff(end_date, start_date) + 1
+        off_days = get_off_days(start_date, end_date, filters.company, employee, worktime_data)
         if len(degrees) > 0:
-            target_per_day = (get_daily_hours(filters) / 100) * degrees[0].degree
+            target_per_day = (worktime_data.daily_hours / 100) * degrees[0].degree
         else:
-            target_per_day = get_daily_hours(filters)
+            target_per_day = worktime_data.daily_hours
         target_time = (days - off_days) * target_per_day
     
     return target_time
@@ -166,73 +209,96 @@ def get_degrees(employee):
     degrees = frappe.db.sql("""SELECT `degree`, `date` FROM `tabEmployment Degree` WHERE `parent` = '{employee}' ORDER BY `date` ASC""".format(employee=employee), as_dict=True)
     return degrees
     
-def get_off_days(from_date, to_date, company, employee=None):
+def get_off_days(from_date, to_date, company, employee=None, worktime_data=None):
     off_days = 0
-    year = getdate(from_date).strftime("%Y")
-
-    check_leave_application = False
-    if employee and frappe.get_doc("Worktime Settings", "Worktime Settings").vacation_hours_based_on == 'Leave Application':
-        check_leave_application = True
-    
-    holiday_lists = frappe.db.sql("""SELECT `year`, `public_holiday_list` FROM `tabPublic Holiday List` WHERE `year` = '{year}' AND `company` = '{company}' LIMIT 1""".format(year=year, company=company), as_dict=True)
-    if len(holiday_lists) > 0:
-        holiday_list = holiday_lists[0].public_holiday_list
-        _holiday_list_entries = frappe.db.sql("""SELECT `holiday_date` FROM `tabHoliday` WHERE `parent` = '{holiday_list}'""".format(holiday_list=holiday_list), as_list=True)
-        holiday_list_entries = []
-        for entry in _holiday_list_entries:
-            holiday_list_entries.append(entry[0])
-            
-        start_date = getdate(from_date)
-        end_date = getdate(to_date)
-        delta = timedelta(days=1)
-        while start_date <= end_date:
-            if start_date in holiday_list_entries:
-                off_days += 1
-            start_date += delta
+    from_date = getdate(from_date)
+    to_date = getdate(to_date)
+    
+    # public holidays, from the public holiday list of each year
+    year_start = from_date
+    while year_start <= to_date:
+        year_end = min(to_date, date(year_start.year, 12, 31))
+        holiday_list = get_public_holiday_list(company, year_start.year)
+        if holiday_list:
+            off_days += count_holidays(holiday_list, year_start, year_end)
+        year_start = date(year_start.year + 1, 1, 1)
     
-    if check_leave_application:
-        leave_applications = frappe.db.sql("""
+    if not employee:
+        return off_days
+    
+    if worktime_data:
+        if not worktime_data.leave_based:
+            return off_days
+        full_day_off, half_day_off = worktime_data.get_leave_days(employee)
+    else:
+        if frappe.db.get_single_value("Worktime Settings", "vacation_hours_based_on") != 'Leave Application':
+            return off_days
+        full_day_off, half_day_off = get_leave_days(get_leave_applications([employee], company).get(employee, []))
+    
+    for day in full_day_off:
+        if from_date <= day <= to_date:
+            off_days += 1
+    for day in half_day_off:
+        if from_date <= day <= to_date and day not in full_day_off:
+            off_days += 0.5
+    
+    return off_days
+
+def get_public_holiday_list(company, year):
+    public_holiday_lists = frappe.flags.public_holiday_lists
+    if public_holiday_lists is None:
+        public_holiday_lists = frappe.flags.public_holiday_lists = {}
+    if (company, year) not in public_holiday_lists:
+        holiday_lists = frappe.db.sql("""
+            SELECT `public_holiday_list` 
+            FROM `tabPublic Holiday List` 
+            WHERE `year` = %(year)s AND `company` = %(company)s 
+            LIMIT 1;""", {'year': str(year), 'company': company}, as_dict=True)
+        public_holiday_lists[(company, year)] = holiday_lists[0].public_holiday_list if len(holiday_lists) > 0 else None
+    return public_holiday_lists[(company, year)]
+
+def get_leave_applications(employees, company):
+    leave_applications = {}
+    for leave_application in frappe.db.sql("""
             SELECT
+                `employee`,
                 `from_date`,
                 `to_date`,
                 `half_day`,
                 `half_day_date`
             FROM `tabLeave Application`
-            WHERE `employee` = '{employee}'
+            WHERE `employee` IN %(employees)s
             AND `status` = 'Approved'
-            AND `company` = '{company}'
+            AND `company` = %(company)s
             AND `docstatus` = 1
             AND `leave_type` NOT IN (
                 SELECT `name`
                 FROM `tabLeave Type`
                 WHERE `is_lwp` = 1
             )
-        """.format(employee=employee, company=company), as_dict=True)
-        full_day_off = []
-        half_day_of = []
-
-        for leave_application in leave_applications:
-            if cint(leave_application.half_day) == 1 and leave_application.half_day_date:
-                half_day_of.append(leave_application.half_day_date)
-            start_date = getdate(leave_application.from_date)
-            end_date = getdate(leave_application.to_date)
-            delta = timedelta(days=1)
-            while start_date <= end_date:
-                if start_date not in half_day_of:
-                    full_day_off.append(start_date)
-                start_date += delta
+        """, {'employees': tuple(employees), 'company': company}, as_dict=True):
+        leave_applications.setdefault(leave_application.employee, []).append(leave_application)
+    return leave_applications
 
-        start_date = getdate(from_date)
-        end_date = getdate(to_date)
+def get_leave_days(leave_applications):
+    """
+    Full and half days off (sets of dates) from the leave applications of an employee
+    """
+    full_day_off = set()
+    half_day_of = set()
+    
+    for leave_application in leave_applications:
+        if cint(leave_application.half_day) == 1 and leave_application.half_day_date:
+            half_day_of.add(getdate(leave_application.half_day_date))
+        start_date = getdate(leave_application.from_date)
+        end_date = getdate(leave_application.to_date)
         delta = timedelta(days=1)
         while start_date <= end_date:
-            if start_date in full_day_off:
-                off_days += 1
-            elif start_date in half_day_of:
-                off_days += 0.5
+            if start_date not in half_day_of:
+                full_day_off.add(start_date)
             start_date += delta
-            
-    return off_days
+    
+    return full_day_off, half_day_of
     
 def get_holiday_balance(employee, to_date):
     leave_details = get_leave_details(employee, to_date)
@@ -244,35 +310,23 @@ def get_holiday_balance(employee, to_date):
     
     return float(remaining_days)
     
-def get_actual_time(filters, employee):
-    from_date = filters.from_date
-    to_date = filters.to_date
-    try:
-        actual_time = frappe.db.sql("""SELECT SUM(`hours`) FROM `tabTimesheet Detail`
-                                        WHERE DATE(`from_time`) >= '{from_date}' AND DATE(`from_time`) <= '{to_date}'
-                                        AND `docstatus` = 1 AND `parent` IN (
-                                            SELECT `name` FROM `tabTimesheet` WHERE `employee` = '{employee}'
-                                        )""".format(from_date=from_date, to_date=to_date, employee=employee), as_list=True)[0][0]
-        if not actual_time:
-            actual_time = 0
-    except:
-        actual_time = 0
+def get_actual_time(filters, employee, worktime_data=None):
+    worktime_data = worktime_data or WorktimeData(filters, [employee])
+    actual_time = worktime_data.actual_times.get(employee, 0)
         
     if cint(filters.get('ignore_py')) == 1:
         return actual_time
     
     # handle carryover and payouts
-    employee = frappe.get_doc("Employee", employee)
-    if employee.carryover_and_payouts:
-        year = getdate(from_date).strftime("%Y")
-        for cp in employee.carryover_and_payouts:
-            if str(cp.year) == year:
-                actual_time += cp.amount
+    actual_time += worktime_data.get_carryover(employee, getdate(filters.from_date).strftime("%Y"))
                 
     return actual_time
 
+def get_activity_type_additions(company):
+    return frappe.db.sql("""SELECT `company`, `activity_type`, `column_label` FROM `tabActivity Type Determination` WHERE `company` = '{company}' ORDER BY `idx` ASC""".format(company=company), as_dict=True)
+
 def add_activity_type_determination(filters, columns):
-    additions = frappe.db.sql("""SELECT `company`, `activity_type`, `column_label` FROM `tabActivity Type Determination` WHERE `company` = '{company}' ORDER BY `idx` ASC""".format(company=filters.company), as_dict=True)
+    additions = get_activity_type_additions(filters.company)
     loop = 1
     for addition in additions:
         new_column = {"label": _(addition.column_label), "fieldname": "annex_" + str(loop), "fieldtype": "Float", "width": 50}
@@ -280,23 +334,11 @@ def add_activity_type_determination(filters, columns):
         loop += 1
     return columns
     
-def get_activity_type_determinations(filters, employee):
-    from_date = filters.from_date
-    to_date = filters.to_date
+def get_activity_type_determinations(filters, employee, worktime_data=None):
+    worktime_data = worktime_data or WorktimeData(filters, [employee])
     times = []
-    additions = frappe.db.sql("""SELECT `company`, `activity_type`, `column_label` FROM `tabActivity Type Determination` WHERE `company` = '{company}' ORDER BY `idx` ASC""".format(company=filters.company), as_dict=True)
-    for addition in additions:
-        try:
-            actual_time = frappe.db.sql("""SELECT SUM(`hours`) FROM `tabTimesheet Detail`
-                                            WHERE DATE(`from_time`) >= '{from_date}' AND DATE(`from_time`) <= '{to_date}'
-                                            AND `docstatus` = 1 AND `activity_type` = '{activity_type}' AND `parent` IN (
-                                                SELECT `name` FROM `tabTimesheet` WHERE `employee` = '{employee}'
-                                            )""".format(from_date=from_date, to_date=to_date, employee=employee, activity_type=addition.activity_type), as_list=True)[0][0]
-            if not actual_time:
-                actual_time = 0
-        except:
-            actual_time = 0
-        times.append(actual_time)
+    for addition in worktime_data.additions:
+        times.append(worktime_data.activity_times.get((employee, addition.activity_type), 0))
         
     return times
     
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+import unittest
+from erpnextswiss.erpnextswiss.bank_matching import AhoCorasick, PaymentMatcher, get_name_key
+
+class TestBankMatching(unittest.TestCase):
+    def test_multi_pattern_search(self):
+        automaton = AhoCorasick()
+        for value, pattern in enumerate(["SINV-00012", "SINV-0001", "00012", "PINV-7"]):
+            automaton.add(pattern, value)
+        self.assertEqual(automaton.search("Payment SINV-00012 thanks"), {0, 1, 2})
+        self.assertEqual(automaton.search("PINV-77"), {3})
+        self.assertEqual(automaton.search(""), set())
+
+    def test_empty_pattern_matches_any_text(self):
+        automaton = AhoCorasick()
+        automaton.add("", "always")
+        self.assertEqual(automaton.search("anything"), {"always"})
+
+    def test_name_key(self):
+        self.assertEqual(get_name_key("Müller AG  "), get_name_key("MULLER ag"))
+        self.assertIsNone(get_name_key(None))
+
+    def test_payment_matcher(self):
+        sales_invoices = [
+            {'name': "SINV-00012", 'customer': "C1", 'outstanding_amount': 100.0, 'esr_reference': None},
+            {'name': "SINV-0001", 'customer': "C2", 'outstanding_amount': 50.0, 'esr_reference': None},
+            {'name': "SINV-00013", 'customer': "C1", 'outstanding_amount': 80.0, 'esr_reference': None}
+        ]
+        payments = [
+            {'name': "PE-1", 'party': "Default", 'paid_amount': 100.0, 'remarks': "Zahlung SINV-00012, SINV-00013."},
+            {'name': "PE-2", 'party': "C2", 'paid_amount': 20.0, 'remarks': "sinv-0001"}
+        ]
+        matcher = PaymentMatcher(sales_invoices, payments, "docid")
+        candidates = {(c['payment_entry'], c['sales_invoice']): c['confidence'] for c in matcher.get_candidates()}
+        # exact token and amount, exact token, contained in a longer token, case insensitive token and party
+        self.assertEqual(candidates, {("PE-1", "SINV-00012"): 0.9, ("PE-1", "SINV-00013"): 0.7,
+            ("PE-1", "SINV-0001"): 0.4, ("PE-2", "SINV-0001"): 0.8})
+        allocations = matcher.get_allocations(min_confidence=0.5)
+        self.assertEqual(allocations, {
+            "PE-1": {'customer': "C1", 'references': [("SINV-00012", 100.0)]},
+            "PE-2": {'customer': "C2", 'references': [("SINV-0001", 20.0)]}
+        })
+
+    def test_payment_matcher_esr(self):
+        sales_invoices = [{'name': "SINV-1", 'customer': "C1", 'outstanding_amount': 10.0,
+            'esr_reference': "21 00000 00003 13947 14300 09017"}]
+        payments = [{'name': "PE-1", 'party': None, 'paid_amount': 10.0, 'remarks': "ESR 21 00000 00003 13947 14300 09017"}]
+        candidates = PaymentMatcher(sales_invoices, payments, "esr").get_candidates()
+        self.assertEqual([(c['sales_invoice'], c['confidence']) for c in candidates], [("SINV-1", 0.6)])
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+import unittest
+from erpnextswiss.erpnextswiss.camt import iter_camt_entries, read_account_iban, parse_camt
+from erpnextswiss.erpnextswiss.tests.benchmark_camt import make_camt053, make_camt, legacy_parse_entries, legacy_read_meta, _comparable
+
+class TestCamt(unittest.TestCase):
+    def assert_same_as_legacy(self, content, **kwargs):
+        streamed = [_comparable(e) for e in iter_camt_entries(content, **kwargs)]
+        legacy = [_comparable(e) for e in legacy_parse_entries(content, **kwargs)]
+        self.assertEqual(streamed, legacy)
+
+    def test_matches_legacy_parser(self):
+        self.assert_same_as_legacy(make_camt053(40))
+
+    def test_matches_legacy_parser_with_settings(self):
+        self.assert_same_as_legacy(make_camt053(40), use_entry_transaction_type=True, numeric_only_reference=True)
+
+    def test_without_namespace(self):
+        self.assert_same_as_legacy(make_camt053(8, namespace=""))
+
+    def test_bytes_content(self):
+        content = make_camt053(8)
+        self.assertEqual(list(iter_camt_entries(content)), list(iter_camt_entries(content.encode("utf-8"))))
+
+    def test_account_iban(self):
+        self.assertEqual(read_account_iban(make_camt053(4)), "CH9300762011623852957")
+        self.assertEqual(read_account_iban("<Document><Acct><Id><Othr><Id>0815</Id></Othr></Id></Acct></Document>"), "0815")
+
+    def test_parse_camt053(self):
+        content = make_camt053(12)
+        camt_document = parse_camt(content)
+        self.assertEqual((camt_document.message_type, camt_document.version), ("camt.053", "04"))
+        self.assertEqual(camt_document.get_entries(), list(iter_camt_entries(content)))
+        self.assertEqual(camt_document.get_meta(), legacy_read_meta(content))
+
+    def test_parse_camt_versions(self):
+        for message_type in ("camt.052", "camt.053", "camt.054"):
+            for version in ("04", "08"):
+                camt_document = parse_camt(make_camt(message_type, version, entries=8, statements=2))
+                self.assertEqual((camt_document.message_type, camt_document.version), (message_type, version))
+                self.assertEqual([len(s.entries) for s in camt_document.statements], [8, 8])
+        camt_document = parse_camt(make_camt053(4, namespace=""))
+        self.assertEqual((camt_document.message_type, camt_document.version), ("camt.053", None))
+
+    def test_parse_camt_statements(self):
+        camt_document = parse_camt(make_camt053(8, statements=3), read_entries=False)
+        self.assertEqual([s.id for s in camt_document.statements], ["STMT-1", "STMT-2", "STMT-3"])
+        self.assertEqual(camt_document.statements[2].iban, "CH9300762011623852959")
+        self.assertEqual(camt_document.statements[1].balances, {'OPBD': 1000.0, 'CLBD': 2000.0})
+        self.assertEqual(camt_document.get_entries(), [])
+
+    def test_report_meta(self):
+        meta = parse_camt(make_camt("camt.052", "08", entries=4)).get_report_meta()
+        self.assertEqual(meta['report_id'], "STMT-1")
+        self.assertEqual(meta['intraday_balance'], 1000.0)
+        self.assertEqual(meta['available_balance'], 2000.0)
+
+    def test_parse_camt_recover(self):
+        content = make_camt053(10)[:3000]
+        with self.assertRaises(Exception):
+            parse_camt(content)
+        meta = parse_camt(content, read_entries=False, recover=True).get_meta()
+        self.assertEqual(meta['msgid'], "STMT-1")
+        self.assertEqual(meta['iban'], "CH9300762011623852957")
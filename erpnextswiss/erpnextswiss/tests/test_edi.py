@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+import io
+import unittest
+from erpnextswiss.erpnextswiss.edi import iter_segments, parse_segment, parse_number
+
+SLSRPT = ("UNA:+.? 'UNB+UNOC:3+7601001000001:14+7601001000002:14+250101:1200+1'"
+    "UNH+1+SLSRPT:D:96A:UN:EAN004'BGM+73E+SR?+01+9'DTM+137:20250101:102'"
+    "LOC+162+7601001000003::9'LIN+1++7612345678901:EN'QTY+153:12'UNT+7+1'UNZ+1+1'")
+
+class TestEdi(unittest.TestCase):
+    def test_segments(self):
+        segments = list(iter_segments(SLSRPT))
+        self.assertEqual(len(segments), 9)
+        self.assertEqual(segments[0][0][0], "UNB")
+        self.assertEqual(segments[5], [['LIN'], ['1'], [''], ['7612345678901', 'EN']])
+
+    def test_release_character(self):
+        segments = list(iter_segments(SLSRPT))
+        self.assertEqual(segments[2], [['BGM'], ['73E'], ['SR+01'], ['9']])
+        self.assertEqual(list(iter_segments("RFF+ON:A?:B?'C??'")), [[['RFF'], ['ON', "A:B'C?"]]])
+
+    def test_una_delimiters(self):
+        content = "UNA|*,# ~QTY*21|2,5~RFF*ON|A#*B~"
+        self.assertEqual(list(iter_segments(content)), [[['QTY'], ['21', '2,5']], [['RFF'], ['ON', 'A*B']]])
+        self.assertEqual(parse_number("2,5"), 2.5)
+
+    def test_line_breaks_and_chunks(self):
+        with_line_breaks = SLSRPT.replace("'", "'\r\n")
+        self.assertEqual(list(iter_segments(with_line_breaks, chunk_size=7)), list(iter_segments(SLSRPT)))
+        self.assertEqual(list(iter_segments(io.BytesIO(SLSRPT.encode("utf-8")), chunk_size=5)), list(iter_segments(SLSRPT)))
+
+    def test_parse_segment(self):
+        self.assertEqual(parse_segment("QTY+12:5'"), [['QTY'], ['12', '5']])
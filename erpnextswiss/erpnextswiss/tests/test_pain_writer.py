@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+import unittest
+from lxml import etree
+from erpnextswiss.erpnextswiss.pain_writer import PainWriter, PAIN001_CH_03, PAIN008_08, format_amount
+
+class TestPainWriter(unittest.TestCase):
+    def test_document(self):
+        with PainWriter(PAIN001_CH_03, "CstmrCdtTrfInitn") as writer:
+            writer.group_header("MSG-1", 2, 30.5, "Müller & Söhne <AG>", created="2025-01-01T12:00:00")
+            writer.comment("skipped -- no iban")
+            with writer.block("PmtInf"):
+                writer.element("InstdAmt", format_amount(10), Ccy="CHF")
+        content = writer.getvalue()
+        self.assertTrue(content.startswith('<?xml version="1.0" encoding="UTF-8"?>\n<Document'))
+        root = etree.fromstring(content.encode("utf-8"))
+        ns = {'p': PAIN001_CH_03[0]}
+        self.assertEqual(root.findtext("p:CstmrCdtTrfInitn/p:GrpHdr/p:NbOfTxs", namespaces=ns), "2")
+        self.assertEqual(root.findtext("p:CstmrCdtTrfInitn/p:GrpHdr/p:CtrlSum", namespaces=ns), "30.50")
+        self.assertEqual(root.findtext("p:CstmrCdtTrfInitn/p:GrpHdr/p:InitgPty/p:Nm", namespaces=ns), "Müller & Söhne <AG>")
+        amount = root.find("p:CstmrCdtTrfInitn/p:PmtInf/p:InstdAmt", namespaces=ns)
+        self.assertEqual((amount.text, amount.get("Ccy")), ("10.00", "CHF"))
+        self.assertIn('\n    <PmtInf>\n      <InstdAmt Ccy="CHF">10.00</InstdAmt>\n    </PmtInf>', content)
+
+    def test_namespace(self):
+        with PainWriter(PAIN008_08, "CstmrDrctDbtInitn") as writer:
+            writer.element("Empty")
+        root = etree.fromstring(writer.getvalue().encode("utf-8"))
+        self.assertEqual(root.tag, "{%s}Document" % PAIN008_08[0])
+        self.assertEqual(root[0][0].tag, "{%s}Empty" % PAIN008_08[0])
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+import unittest
+from unittest.mock import patch, MagicMock
+import frappe
+from erpnextswiss.erpnextswiss import vat_control
+
+QUERY = """SELECT `doctype`, `name`, `posting_date`, `base_grand_total`, `total_taxes_and_charges` FROM `viewVAT_302`"""
+LIVE_ROWS = [
+    frappe._dict({'doctype': "Sales Invoice", 'name': "SINV-A-1", 'posting_date': "2025-01-10",
+        'base_grand_total': 108.1, 'total_taxes_and_charges': 8.1}),
+    frappe._dict({'doctype': "Sales Invoice", 'name': "SINV-B-1", 'posting_date': "2025-02-10",
+        'base_grand_total': 216.2, 'total_taxes_and_charges': 16.2})
+]
+VOUCHER_COMPANIES = {"SINV-A-1": "Company A", "SINV-B-1": "Company B"}
+
+class TestVatControl(unittest.TestCase):
+    def test_company_rows_without_placeholder(self):
+        # a query without {company} is evaluated once, each row goes to the company of its voucher
+        with patch.object(vat_control, "get_live_items", return_value=LIVE_ROWS) as get_live_items, \
+                patch.object(vat_control, "get_voucher_companies", return_value=VOUCHER_COMPANIES):
+            company_rows = vat_control.get_company_rows(QUERY, ["Company A", "Company B"])
+        self.assertEqual(get_live_items.call_count, 1)
+        self.assertEqual([r.name for r in company_rows["Company A"]], ["SINV-A-1"])
+        self.assertEqual([r.name for r in company_rows["Company B"]], ["SINV-B-1"])
+
+    def test_consistency_without_placeholder(self):
+        def get_all(doctype, filters=None, fields=None):
+            # materialized rows: one row per voucher with its own company
+            return [frappe._dict({'name': r.name, 'posting_date': r.posting_date,
+                'base_grand_total': r.base_grand_total, 'total_taxes_and_charges': r.total_taxes_and_charges})
+                for r in LIVE_ROWS if VOUCHER_COMPANIES[r.name] == filters['company']]
+
+        with patch.object(vat_control, "get_live_items", return_value=LIVE_ROWS), \
+                patch.object(vat_control, "get_voucher_companies", return_value=VOUCHER_COMPANIES), \
+                patch.object(vat_control, "get_companies", return_value=["Company A", "Company B"]), \
+                patch.object(frappe, "get_value", return_value=frappe._dict({'query': QUERY, 'last_rebuild': "2025-03-01"}), create=True), \
+                patch.object(frappe, "get_all", side_effect=get_all, create=True):
+            result = vat_control.check_consistency("viewVAT_302", "2025-01-01", "2025-03-31", debug=False)
+        self.assertEqual(result['extra'], [])
+        self.assertEqual(result['missing'], [])
+        self.assertTrue(result['consistent'])
+
+    def test_rebuild_unsupported_doctype(self):
+        # rows of other doctypes are never refreshed: the query stays unbuilt (evaluated live)
+        rows = LIVE_ROWS + [frappe._dict({'doctype': "Payment Entry", 'name': "PE-1", 'posting_date': "2025-01-12"})]
+        db = MagicMock()
+        with patch.object(vat_control, "get_materialized_queries", return_value=[frappe._dict({'name': "viewVAT_302", 'query': QUERY})]), \
+                patch.object(vat_control, "get_companies", return_value=["Company A"]), \
+                patch.object(vat_control, "get_company_rows", return_value={"Company A": rows}), \
+                patch.object(vat_control, "insert_records") as insert_records, \
+                patch.object(frappe, "db", db, create=True), \
+                patch.object(frappe, "log_error", create=True):
+            vat_control.rebuild()
+        insert_records.assert_not_called()
+        db.set_value.assert_called_once_with("VAT query", "viewVAT_302", 'last_rebuild', None, update_modified=False)
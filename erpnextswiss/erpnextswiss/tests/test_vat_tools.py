@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+import unittest
+from erpnextswiss.erpnextswiss.vat_tools import reconcile
+
+class TestVatTools(unittest.TestCase):
+    def test_reconcile(self):
+        control_items = [
+            {'name': "SINV-1", 'total_taxes_and_charges': 8.1, 'base_grand_total': 108.1},
+            {'name': "SINV-2", 'total_taxes_and_charges': 16.2, 'base_grand_total': 216.2},
+            {'name': "SINV-3", 'total_taxes_and_charges': 2.6, 'base_grand_total': 34.6},
+            {'name': "SINV-4", 'total_taxes_and_charges': 0, 'base_grand_total': 10}
+        ]
+        gl_sums = {"SINV-1": -8.1, "SINV-2": -16.0, "JV-1": -5.0}
+        result = reconcile(control_items, gl_sums, "tax")
+        self.assertEqual(result['mismatches'], [{'voucher_no': "SINV-2", 'gl_amount': 16.0, 'control_amount': 16.2}])
+        self.assertEqual(result['missing_in_gl'], [{'voucher_no': "SINV-3", 'amount': 2.6}])
+        self.assertEqual(result['missing_in_control'], [{'voucher_no': "JV-1", 'amount': 5.0}])
+        self.assertEqual(result['skipped'], ["SINV-4"])
+        self.assertEqual((result['control_sum'], result['gl_sum']), (26.9, -29.1))
+        self.assertFalse(result['ok'])
+
+    def test_reconcile_ok(self):
+        result = reconcile([{'name': "PINV-1", 'total_taxes_and_charges': 0.3, 'base_grand_total': 4.0}],
+            {"PINV-1": 0.1 + 0.2}, "tax")
+        self.assertTrue(result['ok'])
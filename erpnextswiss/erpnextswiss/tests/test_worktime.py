@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+import unittest
+import frappe
+from datetime import date
+from erpnextswiss.erpnextswiss.hr import get_working_days_between_dates, count_holidays
+from erpnextswiss.erpnextswiss.report.worktime_overview.worktime_overview import get_leave_days
+
+class TestWorktime(unittest.TestCase):
+    def setUp(self):
+        # request cache of the holiday calendars, see hr.get_holiday_calendar
+        frappe.flags.holiday_calendars = {
+            "_Test Holidays": {"2025-01-01": "Neujahr", "2025-01-02": "Berchtoldstag", "2025-08-01": "Bundesfeier"}
+        }
+        frappe.flags.busday_calendars = {}
+
+    def tearDown(self):
+        frappe.flags.holiday_calendars = None
+        frappe.flags.busday_calendars = None
+
+    def test_working_days(self):
+        self.assertEqual(get_working_days_between_dates("_Test Holidays", "2025-01-01", "2025-01-31"), 29)
+        self.assertEqual(get_working_days_between_dates("_Test Holidays", date(2025, 1, 1), date(2025, 12, 31)), 362)
+        self.assertEqual(get_working_days_between_dates("_Test Holidays", "2025-08-01", "2025-08-01"), 0)
+        self.assertEqual(get_working_days_between_dates("_Test Holidays", "2025-02-01", "2025-01-01"), 0)
+        self.assertEqual(count_holidays("_Test Holidays", "2024-12-31", "2025-01-05"), 2)
+
+    def test_leave_days(self):
+        leave_applications = [
+            frappe._dict({'from_date': date(2025, 3, 3), 'to_date': date(2025, 3, 5), 'half_day': 0, 'half_day_date': None}),
+            frappe._dict({'from_date': date(2025, 3, 10), 'to_date': date(2025, 3, 10), 'half_day': 1,
+                'half_day_date': date(2025, 3, 10)})
+        ]
+        full_day_off, half_day_off = get_leave_days(leave_applications)
+        self.assertEqual(full_day_off, {date(2025, 3, 3), date(2025, 3, 4), date(2025, 3, 5)})
+        self.assertEqual(half_day_off, {date(2025, 3, 10)})
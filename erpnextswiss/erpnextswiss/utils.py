@@ -8,6 +8,9 @@ import frappe
 from frappe import _
 from datetime import datetime
 
+# maximum number of values per IN (...) query
+QUERY_CHUNK_SIZE = 1000
+
 def has_attachments(dn, dt=None):
     if dt:
         files = frappe.get_all("File", filters={'attached_to_name': dn, 'attached_to_doctype': dt}, fields=['name'])
@@ -39,3 +42,11 @@ def get_first_day_of_first_cw(year):
         else:
             date = frappe.utils.add_days(date, 1)
     return first_day_of_first_cw
+
+def get_chunks(values, size=QUERY_CHUNK_SIZE):
+    """
+    Split a list of values into chunks for IN (...) queries
+    """
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
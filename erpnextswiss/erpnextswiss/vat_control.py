@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+"""
+VAT Control
+===========
+
+The VAT queries (doctype VAT query, e.g. viewVAT_200) are user-defined
+SELECTs over the whole ledger. Evaluating them for every report run and
+for every code of a declaration print re-scans the ledger each time, so
+their result is materialized in VAT Control Entry, one row per
+(VAT query, company, voucher row):
+
+    - full rebuild: rebuild() (all or one query), also after saving a VAT query
+    - incremental: on submit/cancel of Sales/Purchase Invoice and Journal
+      Entry, the rows of this voucher are evaluated again (background job)
+
+A query without {company} returns the vouchers of all companies: it is
+evaluated once and each row is stored with the company of its voucher.
+
+Only rows of the voucher doctypes above are refreshed, so a query that
+returns other doctypes cannot be materialized (VAT query.validate) and is
+evaluated live if it starts to return them later.
+
+Readers use get_control_items(); a query that has not been built yet (or
+has Materialize disabled) is evaluated live as before. check_consistency()
+compares the materialized rows with a live evaluation.
+
+    $ bench execute erpnextswiss.erpnextswiss.vat_control.rebuild
+    $ bench execute erpnextswiss.erpnextswiss.vat_control.check_consistency --kwargs "{'vat_query': 'viewVAT_200', 'from_date': '2025-01-01', 'to_date': '2025-03-31'}"
+"""
+
+import time
+import frappe
+from frappe import _
+from frappe.utils import flt, getdate, now
+from erpnextswiss.erpnextswiss.bulk_import import insert_batch
+from erpnextswiss.erpnextswiss.utils import get_chunks
+
+CONTROL_DOCTYPE = "VAT Control Entry"
+VOUCHER_DOCTYPES = ["Sales Invoice", "Purchase Invoice", "Journal Entry"]
+CONTROL_FIELDS = ['posting_date', 'base_grand_total', 'taxes_and_charges', 'total_taxes_and_charges', 'remarks']
+BATCH_SIZE = 500
+
+def get_control_items(vat_query, from_date, end_date, company="%"):
+    """
+    Rows of a VAT query (name, posting_date, base_grand_total, taxes_and_charges,
+    total_taxes_and_charges, remarks) in a period, from the materialized table if built
+    """
+    query = frappe.db.get_value("VAT query", vat_query, ['query', 'materialize', 'last_rebuild'], as_dict=True)
+    if query.materialize and query.last_rebuild:
+        return frappe.db.sql("""
+            SELECT
+                `voucher_type` AS `doctype`,
+                `voucher_no` AS `name`,
+                `posting_date`,
+                `base_grand_total`,
+                `taxes_and_charges`,
+                `total_taxes_and_charges`,
+                `remarks`
+            FROM `tab{doctype}`
+            WHERE `vat_query` = %(vat_query)s
+              AND `company` LIKE %(company)s
+              AND `posting_date` BETWEEN %(from_date)s AND %(end_date)s
+            ORDER BY `posting_date` ASC, `voucher_no` ASC;""".format(doctype=CONTROL_DOCTYPE),
+            {'vat_query': vat_query, 'company': company or "%", 'from_date': from_date, 'end_date': end_date},
+            as_dict=True)
+    return get_live_items(query.query, company, from_date, end_date)
+
+def get_live_items(query, company="%", from_date=None, end_date=None, voucher=None):
+    """
+    Evaluate a VAT query (optionally limited to a period or a voucher)
+    """
+    # note: the query is user sql (with {company} and possibly % wildcards), so no query parameters
+    conditions = []
+    if from_date:
+        conditions.append("`s`.`posting_date` >= '{0}'".format(getdate(from_date)))
+    if end_date:
+        conditions.append("`s`.`posting_date` <= '{0}'".format(getdate(end_date)))
+    if voucher:
+        conditions.append("`s`.`name` = {0}".format(frappe.db.escape(voucher)))
+    sql_query = """SELECT *
+            FROM ({query}) AS `s`
+            {where}""".format(query=query,
+            where=("WHERE " + " AND ".join(conditions)) if conditions else "").replace("{company}", company or "%")
+    return frappe.db.sql(sql_query, as_dict=True)
+
+def get_companies():
+    return [c.name for c in frappe.get_all("Company", fields=['name'])]
+
+def get_company_rows(query, companies, from_date=None, end_date=None):
+    """
+    Evaluate a VAT query for several companies: {company: rows}
+
+    A query without {company} returns the vouchers of all companies: it is
+    evaluated once and each row is assigned to the company of its voucher
+    """
+    if "{company}" in query:
+        return {company: get_live_items(query, company, from_date, end_date) for company in companies}
+    rows = get_live_items(query, "%", from_date, end_date)
+    voucher_companies = get_voucher_companies(rows)
+    company_rows = {company: [] for company in companies}
+    for row in rows:
+        company = voucher_companies.get(row.get('name'))
+        if company in company_rows:
+            company_rows[company].append(row)
+    return company_rows
+
+def get_voucher_companies(rows):
+    """
+    Company of the vouchers of VAT query rows: {voucher: company}
+    """
+    vouchers = {}
+    for row in rows:
+        vouchers.setdefault(row.get('doctype'), set()).add(row.get('name'))
+    voucher_companies = {}
+    for doctype, names in vouchers.items():
+        # rows without doctype: look up in all voucher doctypes
+        for voucher_doctype in ([doctype] if doctype in VOUCHER_DOCTYPES else VOUCHER_DOCTYPES):
+            for chunk in get_chunks(names):
+                for voucher in frappe.get_all(voucher_doctype, filters={'name': ['in', chunk]},
+                        fields=['name', 'company']):
+                    voucher_companies[voucher.name] = voucher.company
+    return voucher_companies
+
+def get_unsupported_doctypes(query):
+    """
+    Doctypes returned by a VAT query that are not refreshed on submit/cancel
+    """
+    sql_query = """SELECT DISTINCT `s`.`doctype`
+            FROM ({query}) AS `s`""".format(query=query).replace("{company}", "%")
+    return [row.doctype for row in frappe.db.sql(sql_query, as_dict=True) if row.doctype not in VOUCHER_DOCTYPES]
+
+def get_materialized_queries():
+    return frappe.get_all("VAT query", filters={'materialize': 1}, fields=['name', 'query', 'last_rebuild'])
+
+def get_records(vat_query, company, rows):
+    records = []
+    for row in rows:
+        record = {
+            'name': frappe.generate_hash(length=12),
+            'vat_query': vat_query,
+            'company': company,
+            'voucher_type': row.get('doctype'),
+            'voucher_no': row.get('name')
+        }
+        for field in CONTROL_FIELDS:
+            record[field] = row.get(field)
+        records.append(record)
+    return records
+
+def insert_records(records):
+    for i in range(0, len(records), BATCH_SIZE):
+        insert_batch(CONTROL_DOCTYPE, records[i:i + BATCH_SIZE])
+    return
+
+@frappe.whitelist()
+def enqueue_rebuild(vat_query=None):
+    frappe.only_for("System Manager")
+    frappe.enqueue("erpnextswiss.erpnextswiss.vat_control.rebuild",
+        queue='long',
+        timeout=15000,
+        vat_query=vat_query)
+    return {'result': _('Started...')}
+
+def rebuild(vat_query=None, debug=False):
+    """
+    Full rebuild of one (or all materialized) VAT queries for all companies
+    """
+    queries = get_materialized_queries()
+    if vat_query:
+        queries = [q for q in queries if q.name == vat_query]
+    companies = get_companies()
+    for query in queries:
+        start = time.time()
+        frappe.db.sql("""DELETE FROM `tab{doctype}` WHERE `vat_query` = %(vat_query)s;""".format(doctype=CONTROL_DOCTYPE),
+            {'vat_query': query.name})
+        count = 0
+        try:
+            company_rows = get_company_rows(query.query, companies)
+        except Exception as err:
+            frappe.log_error("{0}: {1}".format(query.name, err), "VAT control rebuild failed")
+            continue
+        unsupported = set(row.get('doctype') for rows in company_rows.values() for row in rows) - set(VOUCHER_DOCTYPES)
+        if unsupported:
+            # these rows would never be refreshed: leave the query unbuilt (evaluated live)
+            frappe.log_error("{0}: {1}".format(query.name, ", ".join(str(d) for d in unsupported)),
+                "VAT control: query not materialized")
+            frappe.db.set_value("VAT query", query.name, 'last_rebuild', None, update_modified=False)
+            frappe.db.commit()
+            continue
+        for company, rows in company_rows.items():
+            records = get_records(query.name, company, rows)
+            insert_records(records)
+            count += len(records)
+        frappe.db.set_value("VAT query", query.name, 'last_rebuild', now(), update_modified=False)
+        frappe.db.commit()
+        if debug:
+            print("{0}: {1} rows in {2:.1f} s".format(query.name, count, time.time() - start))
+    return
+
+def clear(vat_query):
+    frappe.db.sql("""DELETE FROM `tab{doctype}` WHERE `vat_query` = %(vat_query)s;""".format(doctype=CONTROL_DOCTYPE),
+        {'vat_query': vat_query})
+    frappe.db.set_value("VAT query", vat_query, 'last_rebuild', None, update_modified=False)
+    return
+
+"""
+Document hook (Sales Invoice, Purchase Invoice, Journal Entry: on_submit, on_cancel)
+"""
+def on_voucher_change(doc, event=None):
+    if not frappe.db.exists("VAT query", {'materialize': 1}):
+        return
+    frappe.enqueue("erpnextswiss.erpnextswiss.vat_control.refresh_voucher",
+        queue='short',
+        enqueue_after_commit=True,
+        company=doc.company,
+        voucher=doc.name)
+    return
+
+def refresh_voucher(company, voucher):
+    """
+    Evaluate all built VAT queries again for one voucher
+    """
+    for query in get_materialized_queries():
+        if not query.last_rebuild:
+            continue
+        rows = get_live_items(query.query, company, voucher=voucher)
+        frappe.db.sql("""DELETE FROM `tab{doctype}`
+            WHERE `vat_query` = %(vat_query)s AND `company` = %(company)s AND `voucher_no` = %(voucher)s;""".format(doctype=CONTROL_DOCTYPE),
+            {'vat_query': query.name, 'company': company, 'voucher': voucher})
+        insert_records(get_records(query.name, company, rows))
+    frappe.db.commit()
+    return
+
+def check_consistency(vat_query, from_date, to_date, company=None, debug=True):
+    """
+    Compare the materialized rows with a live evaluation of the VAT query
+    :returns:   dict with missing (live only), extra (materialized only) and different rows per company
+    """
+    query = frappe.get_value("VAT query", vat_query, ['query', 'last_rebuild'], as_dict=True)
+    companies = [company] if company else get_companies()
+    result = {'vat_query': vat_query, 'last_rebuild': query.last_rebuild, 'missing': [], 'extra': [], 'different': []}
+    company_rows = get_company_rows(query.query, companies, from_date, to_date)
+    for company in companies:
+        live = group_rows(company_rows[company])
+        materialized = group_rows(frappe.get_all(CONTROL_DOCTYPE,
+            filters={'vat_query': vat_query, 'company': company, 'posting_date': ['between', [from_date, to_date]]},
+            fields=['voucher_no AS name'] + CONTROL_FIELDS))
+        for voucher, rows in live.items():
+            if voucher not in materialized:
+                result['missing'].append({'company': company, 'voucher': voucher})
+            elif rows != materialized[voucher]:
+                result['different'].append({'company': company, 'voucher': voucher,
+                    'live': rows, 'materialized': materialized[voucher]})
+        for voucher in materialized:
+            if voucher not in live:
+                result['extra'].append({'company': company, 'voucher': voucher})
+    result['consistent'] = not (result['missing'] or result['extra'] or result['different'])
+    if debug:
+        print("{0}: {1} missing, {2} extra, {3} different".format(vat_query,
+            len(result['missing']), len(result['extra']), len(result['different'])))
+    return result
+
+def group_rows(rows):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row.get('name'), []).append((
+            "{0}".format(getdate(row.get('posting_date')) if row.get('posting_date') else None),
+            round(flt(row.get('base_grand_total')), 2),
+            round(flt(row.get('total_taxes_and_charges')), 2)
+        ))
+    # the order of rows within a voucher is not relevant
+    return {voucher: sorted(values) for voucher, values in grouped.items()}
@@ -1,104 +1,173 @@
 # -*- coding: utf-8 -*-
-# Copyright (c) 2018-2023, libracore (https://www.libracore.com) and contributors
+# Copyright (c) 2018-2025, libracore (https://www.libracore.com) and contributors
 # For license information, please see license.txt
+#
+# Reconcile the VAT control (VAT queries) against the general ledger, e.g.
+#  $ bench execute erpnextswiss.erpnextswiss.vat_tools.check_vat_code --kwargs "{'company': 'ACME', 'code': '302', 'from_date': '2025-01-01', 'to_date': '2025-03-31', 'accounts': ['2201']}"
+#  $ bench execute erpnextswiss.erpnextswiss.vat_tools.check_vat_declaration --kwargs "{'vat_declaration': 'VAT-2025-00001', 'codes': {'302': ['2201'], '200': {'accounts': ['3200'], 'valuation': 'value'}}}"
+#
 
-def check_vat_code(company, code, from_date, to_date, accounts, valuation="tax"):
-    from frappe.utils import flt
-    # get data from control
-    vat_query = frappe.get_doc("VAT query", "viewVAT_{0}".format(code))
-    control_items = frappe.db.sql("""SELECT * 
-                FROM ({query}) AS `s` 
-                WHERE `s`.`posting_date` >= '{start_date}' 
-                AND `s`.`posting_date` <= '{end_date}'""".format(
-                query=vat_query.query,
-                start_date=from_date, end_date=to_date).replace("{company}", company),
-                as_dict=True)
-    
-    # get general ledger entries
-    account_names = []
-    for a in accounts:
-        _accounts = frappe.db.sql("""
-            SELECT `name` 
-            FROM `tabAccount` 
-            WHERE `account_number` = "{a}" OR `name` = "{a}";""".format(a=a), as_dict=True)
-        for _a in _accounts:
-            if _a['name'] not in account_names:
-                account_names.append(_a['name'])
-    
-    gl_entries = frappe.db.sql("""
-        SELECT `name`, `voucher_no`, SUM(`debit`) AS `debit`, SUM(`credit`) AS `credit` 
-        FROM `tabGL Entry` 
-        WHERE 
-            `account` IN ("{accounts}")
-            AND `posting_date` BETWEEN "{start}" AND "{end}"
-            AND `company` = "{company}"
-        GROUP BY `voucher_no`
-            ;""".format(accounts="\", \"".join(account_names), start=from_date, end=to_date, company=company), 
-        as_dict=True)
-        
-    # check that all control items are in the general ledger
-    control_sum = 0
+import time
+import frappe
+from frappe.utils import flt
+from erpnextswiss.erpnextswiss.vat_control import get_control_items
+
+def check_vat_code(company, code, from_date, to_date, accounts, valuation="tax", debug=False):
+    """
+    Reconcile one VAT code
+    :params:accounts:   account numbers or names the code is booked to
+    :params:valuation:  "tax" (compare tax amounts) or "value" (compare grand totals)
+    :returns:           dict with sums, mismatches, missing_in_gl, missing_in_control, skipped and duration
+    """
+    return check_vat_codes(company, from_date, to_date, {code: {'accounts': accounts, 'valuation': valuation}},
+        debug=debug)[code]
+
+def check_vat_declaration(vat_declaration, codes, debug=False):
+    """
+    Reconcile all VAT codes of a VAT declaration (company and period from the declaration)
+    """
+    declaration = frappe.get_doc("VAT Declaration", vat_declaration)
+    return check_vat_codes(declaration.company, declaration.start_date, declaration.end_date, codes, debug=debug)
+
+def check_vat_codes(company, from_date, to_date, codes, debug=False):
+    """
+    Reconcile several VAT codes in one pass over the general ledger
+    :params:codes:      {code: [accounts]} or {code: {'accounts': [accounts], 'valuation': "tax"|"value"}}
+    :returns:           {code: result of the code} (see reconcile)
+    """
+    start = time.time()
+    if isinstance(codes, str):
+        codes = frappe.parse_json(codes)
+    codes = {
+        code: (settings if isinstance(settings, dict) else {'accounts': settings})
+        for code, settings in codes.items()
+    }
+    account_names = get_account_names(set(a for settings in codes.values() for a in settings.get('accounts') or []))
+    gl_index = GLIndex(company, from_date, to_date, set(n for names in account_names.values() for n in names))
+    if debug:
+        print("General ledger: {0} vouchers in {1:.2f} s".format(len(gl_index.vouchers), time.time() - start))
+
+    results = {}
+    for code, settings in codes.items():
+        code_start = time.time()
+        accounts = []
+        for a in settings.get('accounts') or []:
+            accounts += [n for n in account_names.get(a, []) if n not in accounts]
+        control_items = get_control_items("viewVAT_{0}".format(code), from_date, to_date, company)
+        results[code] = reconcile(control_items, gl_index.get_sums(accounts), settings.get('valuation') or "tax")
+        results[code].update({
+            'code': code,
+            'accounts': accounts,
+            'duration': round(time.time() - code_start, 3)
+        })
+        if debug:
+            print_result(results[code])
+    if debug:
+        print("Total: {0} codes in {1:.2f} s".format(len(codes), time.time() - start))
+    return results
+
+def get_account_names(accounts):
+    """
+    Resolve account numbers or names: {number or name: [account names]}
+    """
+    account_names = {}
+    if not accounts:
+        return account_names
+    for a in frappe.db.sql("""
+            SELECT `name`, `account_number`
+            FROM `tabAccount`
+            WHERE `account_number` IN %(accounts)s OR `name` IN %(accounts)s;""",
+            {'accounts': tuple(accounts)}, as_dict=True):
+        for key in (a['account_number'], a['name']):
+            if key in accounts and a['name'] not in account_names.setdefault(key, []):
+                account_names[key].append(a['name'])
+    return account_names
+
+class GLIndex:
+    """
+    General ledger balances (debit - credit) of a period by account and voucher
+    """
+    def __init__(self, company, from_date, to_date, accounts):
+        self.by_account = {}
+        self.vouchers = set()
+        if not accounts:
+            return
+        for entry in frappe.db.sql("""
+                SELECT `account`, `voucher_no`, SUM(`debit`) - SUM(`credit`) AS `balance`
+                FROM `tabGL Entry`
+                WHERE
+                    `account` IN %(accounts)s
+                    AND `posting_date` BETWEEN %(start)s AND %(end)s
+                    AND `company` = %(company)s
+                GROUP BY `account`, `voucher_no`;""",
+                {'accounts': tuple(accounts), 'start': from_date, 'end': to_date, 'company': company}, as_dict=True):
+            self.by_account.setdefault(entry['account'], []).append((entry['voucher_no'], flt(entry['balance'])))
+            self.vouchers.add(entry['voucher_no'])
+
+    def get_sums(self, accounts):
+        """
+        {voucher_no: debit - credit} over a set of accounts
+        """
+        sums = {}
+        for account in accounts:
+            for voucher_no, balance in self.by_account.get(account, []):
+                sums[voucher_no] = sums.get(voucher_no, 0) + balance
+        return sums
+
+def reconcile(control_items, gl_sums, valuation="tax"):
+    """
+    Compare control items with the general ledger sums by voucher
+    """
+    field = 'total_taxes_and_charges' if valuation == "tax" else 'base_grand_total'
+    result = {
+        'valuation': valuation,
+        'control_sum': 0,
+        'gl_sum': 0,
+        'mismatches': [],
+        'missing_in_gl': [],
+        'missing_in_control': [],
+        'skipped': []
+    }
+    control_by_voucher = {}
     for control_item in control_items:
-        checked = False
-        mismatch = False
-        if valuation == "tax" and flt(control_item['total_taxes_and_charges']) != 0:
-            control_sum += flt(control_item['total_taxes_and_charges'])
-            # test by tax amount
-            for entry in gl_entries:
-                if entry['voucher_no'] == control_item['name']:
-                    if abs(entry['debit'] - entry['credit']) == abs(control_item['total_taxes_and_charges']):
-                        checked = True
-                        continue
-                    else:
-                        mismatch = True
-                        print("{0}: amount mismatch between {1} and {2}".format(entry['voucher_no'], 
-                            abs(entry['debit'] - entry['credit']), abs(control_item['total_taxes_and_charges'])))
-            if not checked and not mismatch:
-                print("{0} not in general ledger (tax {1})".format(control_item['name'], flt(control_item['total_taxes_and_charges'])))
-            #else:
-            #    print("{0} OK".format(control_item['name']))
-        elif valuation == "value" and flt(control_item['base_grand_total']) != 0:
-            control_sum += flt(control_item['base_grand_total'])
-            # test by valuation amount
-            for entry in gl_entries:
-                if entry['voucher_no'] == control_item['name']:
-                    if abs(entry['debit'] - entry['credit']) == abs(control_item['base_grand_total']):
-                        checked = True
-                        continue
-                    else:
-                        mismatch = True
-                        print("{0}: amount mismatch between {1} and {2}".format(entry['voucher_no'], 
-                            abs(entry['debit'] - entry['credit']), abs(control_item['base_grand_total'])))
-            if not checked and not mismatch:
-                print("{0} not in general ledger ({1})".format(control_item['name'], flt(control_item['base_grand_total'])))
-            #else:
-            #    print("{0} OK".format(control_item['name']))
-        else:
-            print("Skipping {0}".format(control_item['name']))
+        amount = flt(control_item.get(field))
+        if amount == 0:
+            result['skipped'].append(control_item['name'])
+            continue
+        result['control_sum'] += amount
+        control_by_voucher.setdefault(control_item['name'], []).append(amount)
+
+    # check that all control items are in the general ledger and vice versa
+    for voucher_no, amounts in control_by_voucher.items():
+        if voucher_no not in gl_sums:
+            for amount in amounts:
+                result['missing_in_gl'].append({'voucher_no': voucher_no, 'amount': amount})
+            continue
+        gl_amount = round(abs(gl_sums[voucher_no]), 2)
+        for amount in amounts:
+            if round(abs(amount), 2) != gl_amount:
+                result['mismatches'].append({'voucher_no': voucher_no, 'gl_amount': gl_amount,
+                    'control_amount': round(abs(amount), 2)})
+    for voucher_no, balance in gl_sums.items():
+        result['gl_sum'] += balance
+        if voucher_no not in control_by_voucher:
+            result['missing_in_control'].append({'voucher_no': voucher_no, 'amount': round(abs(balance), 2)})
 
-    # check that all general ledger entries are in the control
-    gl_sum = 0
-    for entry in gl_entries:
-        checked = False
-        mismatch = False
-        gl_sum += (entry['debit'] - entry['credit'])
-        for control_item in control_items:
-            if entry['voucher_no'] == control_item['name']:
-                if valuation == "tax" and abs(entry['debit'] - entry['credit']) == abs(control_item['total_taxes_and_charges']):
-                    checked = True
-                    continue
-                elif valuation == "value" and abs(entry['debit'] - entry['credit']) == abs(control_item['base_grand_total']):
-                    checked = True
-                    continue
-                else:
-                    mismatch = True
-                    print("{0}: amount mismatch between {1} and {2}".format(entry['voucher_no'], 
-                        abs(entry['debit'] - entry['credit']),
-                        abs(control_item['total_taxes_and_charges']) if valuation == "tax" else abs(control_item['base_grand_total'])))
-        if not checked and not mismatch:
-            print("{0} not in control ({1})".format(entry['voucher_no'], abs(entry['debit'] - entry['credit'])))
+    result['control_sum'] = round(result['control_sum'], 2)
+    result['gl_sum'] = round(result['gl_sum'], 2)
+    result['difference'] = round(result['control_sum'] - abs(result['gl_sum']), 2)
+    result['ok'] = abs(result['difference']) < 0.01 and not (result['mismatches'] or result['missing_in_gl']
+        or result['missing_in_control'])
+    return result
 
-    print("Control sum: {0}\tGL sum: {1}\t{2}\t{3}".format(round(control_sum, 2), round(gl_sum, 2),
-        "OK" if (control_sum - gl_sum) < 0.01 else "Check",
-        (round(control_sum, 2) - round(abs(gl_sum), 2))))
-    
+def print_result(result):
+    for mismatch in result['mismatches']:
+        print("{0}: amount mismatch between {1} and {2}".format(mismatch['voucher_no'], mismatch['gl_amount'],
+            mismatch['control_amount']))
+    for missing in result['missing_in_gl']:
+        print("{0} not in general ledger ({1})".format(missing['voucher_no'], missing['amount']))
+    for missing in result['missing_in_control']:
+        print("{0} not in control ({1})".format(missing['voucher_no'], missing['amount']))
+    print("{0}\tControl sum: {1}\tGL sum: {2}\t{3}\t{4}\t({5:.3f} s)".format(result['code'], result['control_sum'],
+        result['gl_sum'], "OK" if result['ok'] else "Check", result['difference'], result['duration']))
+    return
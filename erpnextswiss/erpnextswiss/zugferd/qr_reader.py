@@ -6,67 +6,78 @@
 
 import fitz             # part of pymupdf (note: for Py3.5, use pymupdf==1.16.18)
 import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 import cv2              # part of opencv-python
 import numpy as np
 import frappe
-from frappe.utils import flt
+from frappe.utils import flt, cint
 from datetime import date
 
 settings = {
-    'dpi': 300
+    'dpi': 300,
+    'fast_dpi': 150,                # a swiss qr code (46 mm) has about 270 px at 150 dpi
+    'payment_part_height': 110      # mm, the payment part is the bottom 105 mm of an A4 page
 }
 
 @frappe.whitelist()
-def find_qr_content_from_pdf(filename):
+def find_qr_content_from_pdf(filename, fast=True):
     codes = []
     
     # open PDF file
     pdf_file = fitz.open(filename)
-
-    # try to load zxing-cpp for improved reading performance
-    has_zxingcpp = False
-    try:
-        import zxingcpp
-        has_zxingcpp = True
-    except:
-        pass
     
-    # read by page
-    for page in pdf_file:
-        # get the page as image
-        try:
-            pix = page.get_pixmap(dpi=settings['dpi'])
-        except:
-            pix = page.getPixmap(matrix=fitz.Matrix(2, 2))                  # fall back to v1.16.18
-        # cv2 reader
-        qcd = cv2.QRCodeDetector()
-        # get bytes array of image
+    if cint(fast):
+        # fast passes (grayscale): payment part and full pages at low resolution, then full pages
+        # at full resolution; stops at the first swiss qr code
+        codes = find_qr_codes_fast(pdf_file)
+    else:
+        # classic pass: full pages at full resolution (colour)
+        # try to load zxing-cpp for improved reading performance
+        has_zxingcpp = False
         try:
-            image_bytes = np.asarray(bytearray(pix.tobytes()), dtype="uint8")
+            import zxingcpp
+            has_zxingcpp = True
         except:
-            image_bytes = np.asarray(bytearray(pix.getImageData()), dtype="uint8")
-        img = cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
-        # add border to be able to detect it
-        color = [255, 255, 255]
-        top, bottom, left, right = [150]*4
-        img_with_border = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+            pass
+    
+        # read by page
+        for page in pdf_file:
+            # get the page as image
+            try:
+                pix = page.get_pixmap(dpi=settings['dpi'])
+            except:
+                pix = page.getPixmap(matrix=fitz.Matrix(2, 2))                  # fall back to v1.16.18
+            # cv2 reader
+            qcd = cv2.QRCodeDetector()
+            # get bytes array of image
+            try:
+                image_bytes = np.asarray(bytearray(pix.tobytes()), dtype="uint8")
+            except:
+                image_bytes = np.asarray(bytearray(pix.getImageData()), dtype="uint8")
+            img = cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
+            # add border to be able to detect it
+            color = [255, 255, 255]
+            top, bottom, left, right = [150]*4
+            img_with_border = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
 
-        if has_zxingcpp:
-            for result in zxingcpp.read_barcodes(img_with_border):
-                code = result.text
-                if code:
-                    codes.append(code)
+            if has_zxingcpp:
+                for result in zxingcpp.read_barcodes(img_with_border):
+                    code = result.text
+                    if code:
+                        codes.append(code)
 
-        else:
-            # use classic CV2/QrCodeDetector
-            retval, decoded_info, points, straight_qrcode = qcd.detectAndDecodeMulti(img_with_border)
+            else:
+                # use classic CV2/QrCodeDetector
+                retval, decoded_info, points, straight_qrcode = qcd.detectAndDecodeMulti(img_with_border)
 
-            if retval and len(decoded_info) > 0:
-                code = decoded_info[0]
-                codes.append(code)
+                if retval and len(decoded_info) > 0:
+                    code = decoded_info[0]
+                    codes.append(code)
     
-    # if codes are found, you can leave here; otherwise, go to image-wise parsing
+    # if codes are found (by either pass), you can leave here; otherwise, go to image-wise parsing
     if len(codes) > 0:
         return codes
     
@@ -121,6 +132,117 @@ def find_qr_content_from_pdf(filename):
             
     return codes
 
+"""
+Fast QR code search: renders (grayscale, no image encoding) first the payment
+part of each page at a low resolution, then the full pages at low and at full
+resolution. Returns as soon as a swiss QR code (SPC) is found, otherwise all
+passes run and the codes found by any of them are returned.
+"""
+def find_qr_codes_fast(pdf_file):
+    reader = get_qr_reader()
+    passes = [
+        (True, settings['fast_dpi']),
+        (False, settings['fast_dpi']),
+        (False, settings['dpi'])
+    ]
+    codes = []
+    for payment_part, dpi in passes:
+        for page in pdf_file:
+            for code in reader(render_page(page, dpi, payment_part)):
+                if is_swiss_qr(code):
+                    return [code]
+                if code not in codes:
+                    codes.append(code)
+    return codes
+
+def is_swiss_qr(code):
+    return (code or "").startswith("SPC") and len(code.replace("\r", "").split("\n")) > 30
+
+def render_page(page, dpi, payment_part=False):
+    """
+    Render a page (or its payment part at the bottom) as grayscale image with a white border
+    """
+    clip = page.rect
+    if payment_part:
+        height = settings['payment_part_height'] / 25.4 * 72        # mm to pt
+        clip = fitz.Rect(clip.x0, max(clip.y0, clip.y1 - height), clip.x1, clip.y1)
+    try:
+        pix = page.get_pixmap(dpi=dpi, clip=clip, colorspace=fitz.csGRAY, alpha=False)
+    except AttributeError:
+        pix = page.getPixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), clip=clip, colorspace=fitz.csGRAY, alpha=False)   # fall back to v1.16.18
+    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+    # add border to be able to detect codes at the edge
+    border = int(dpi / 6)
+    return cv2.copyMakeBorder(img, border, border, border, border, cv2.BORDER_CONSTANT, value=255)
+
+def get_qr_reader():
+    """
+    Returns a function image -> list of qr code texts (zxing-cpp if available, otherwise cv2)
+    """
+    try:
+        import zxingcpp
+        def read_zxingcpp(img):
+            try:
+                results = zxingcpp.read_barcodes(img, formats=zxingcpp.BarcodeFormat.QRCode)
+            except (AttributeError, TypeError):
+                results = zxingcpp.read_barcodes(img)
+            return [r.text for r in results if r.text]
+        return read_zxingcpp
+    except ImportError:
+        pass
+    # one detector for all images
+    qcd = cv2.QRCodeDetector()
+    def read_cv2(img):
+        retval, decoded_info, points, straight_qrcode = qcd.detectAndDecodeMulti(img)
+        if retval:
+            return [code for code in decoded_info if code]
+        return []
+    return read_cv2
+
+"""
+Read one pdf file: the embedded Factur-X / ZUGFeRD xml first, then the QR codes
+:return:    dict with file, source (zugferd, qr or None), xml, qr_codes, duration and error
+"""
+def read_pdf(filename):
+    start = time.time()
+    result = {'file': filename, 'source': None, 'xml': None, 'qr_codes': [], 'error': None}
+    try:
+        with open(filename, "rb") as f:
+            content = f.read()
+        try:
+            from facturx import get_facturx_xml_from_pdf
+            xml_filename, xml_content = get_facturx_xml_from_pdf(content)
+        except Exception:
+            # no embedded xml
+            xml_content = None
+        if xml_content:
+            result.update({'source': 'zugferd', 'xml': xml_content})
+        else:
+            codes = find_qr_content_from_pdf(filename)
+            if codes:
+                result.update({'source': 'qr', 'qr_codes': codes})
+    except Exception as err:
+        result['error'] = "{0}".format(err)
+    result['duration'] = round(time.time() - start, 3)
+    return result
+
+"""
+Read all pdf files of a folder in a pool of worker processes, e.g.
+    $ bench execute erpnextswiss.erpnextswiss.zugferd.qr_reader.read_folder --kwargs "{'path': '/home/frappe/scans'}"
+"""
+def read_folder(path, workers=None):
+    files = sorted(
+        os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(".pdf")
+    )
+    if not files:
+        return []
+    workers = min(int(workers or os.cpu_count() or 1), len(files))
+    if workers <= 1:
+        return [read_pdf(f) for f in files]
+    # spawn: the workers do not need (and must not share) the database connection of this process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return list(executor.map(read_pdf, files))
+
 """
 Extracts the relevant content for a purchase invoice from a QR code
 :params:qr_content:     list of qr codes (text)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025, libracore (https://www.libracore.com) and contributors
+# For license information, please see license.txt
+
+"""
+ZUGFeRD Batch
+=============
+
+Creates ZUGFeRD / Factur-X PDFs for many sales invoices at once. The
+master data of all invoices (customers, companies, users, addresses) is
+loaded once and the XML of each invoice is built in this process; print
+format rendering, wkhtmltopdf, XSD validation and embedding the XML run
+in a pool of worker processes, each with its own site connection.
+
+The PDFs are attached to their invoices (output "attach") or written to
+one private ZIP file (output "zip"). Invoices that fail are reported with
+their error and do not stop the batch.
+
+Site config:
+    zugferd_batch_workers: number of worker processes (default: number of CPUs)
+"""
+
+import os
+import time
+import zipfile
+import multiprocessing
+import frappe
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from frappe import _
+from frappe.utils import cint, now_datetime
+from frappe.utils.pdf import get_pdf
+from frappe.utils.file_manager import save_file
+from frappe.utils.background_jobs import enqueue
+from facturx import generate_from_binary
+try:            # factur-x v3.0 onwards
+    from facturx import xml_check_xsd
+except:         # factur-x before v3.0
+    from facturx import check_facturx_xsd as xml_check_xsd
+from erpnextswiss.erpnextswiss.zugferd.zugferd_xml import create_zugferd_xml, ZugferdMasterData
+
+@frappe.whitelist()
+def enqueue_create_zugferd_pdfs(sales_invoices=None, filters=None, output="attach", print_format=None, no_letterhead=0):
+    check_print_permission()
+    kwargs = {
+        'sales_invoices': sales_invoices,
+        'filters': filters,
+        'output': output,
+        'print_format': print_format,
+        'no_letterhead': no_letterhead,
+        'notify': True
+    }
+    enqueue("erpnextswiss.erpnextswiss.zugferd.zugferd_batch.create_zugferd_pdfs",
+        queue='long',
+        timeout=15000,
+        **kwargs)
+    return {'result': _('Started...')}
+
+@frappe.whitelist()
+def create_zugferd_pdfs(sales_invoices=None, filters=None, output="attach", print_format=None, no_letterhead=0,
+        workers=None, notify=False):
+    """
+    Create ZUGFeRD PDFs for a list of sales invoices (names) or the sales invoices matching filters
+    :params:output:     "attach" (attach each pdf to its invoice) or "zip" (one private zip file)
+    :returns:           dict with the number of created pdfs, errors per invoice, zip file url and metrics
+    """
+    check_print_permission()
+    start = time.time()
+    names = get_invoice_names(sales_invoices, filters)
+    invoices = []
+    errors = []
+    for name in names:
+        try:
+            sinv = frappe.get_doc("Sales Invoice", name)
+        except frappe.DoesNotExistError:
+            errors.append({'sales_invoice': name, 'error': _("Sales Invoice {0} not found").format(name)})
+            continue
+        if sinv.docstatus != 1:
+            errors.append({'sales_invoice': name, 'error': _("Sales Invoice {0} is not submitted").format(name)})
+        elif frappe.has_permission("Sales Invoice", "print", doc=sinv):
+            invoices.append(sinv)
+        else:
+            errors.append({'sales_invoice': name, 'error': _("Not permitted")})
+    master_data = ZugferdMasterData(invoices)
+
+    # build the xml content (database access) here, validation is done in the workers
+    jobs = []
+    for sinv in invoices:
+        try:
+            xml = create_zugferd_xml(sinv.name, verify=False, sinv=sinv, master_data=master_data)
+        except Exception as err:
+            errors.append({'sales_invoice': sinv.name, 'error': "{0}".format(err)})
+            continue
+        if xml:
+            jobs.append((sinv.name, xml))
+        else:
+            errors.append({'sales_invoice': sinv.name, 'error': _("XML generation failed")})
+    xml_duration = time.time() - start
+
+    workers = cint(workers) or cint(frappe.conf.get('zugferd_batch_workers')) or os.cpu_count() or 1
+    render_duration = 0
+    created = []
+    archive = ZugferdArchive() if output == "zip" else None
+    for result in render_invoices(jobs, print_format, no_letterhead, workers):
+        render_duration += result['duration']
+        if result.get('error'):
+            errors.append({'sales_invoice': result['sales_invoice'], 'error': result['error']})
+            continue
+        file_name = "{0}.pdf".format(result['sales_invoice'].replace(" ", "-").replace("/", "-"))
+        if archive:
+            archive.add(file_name, result['pdf'])
+        else:
+            save_file(file_name, result['pdf'], "Sales Invoice", result['sales_invoice'], is_private=1)
+            frappe.db.commit()
+        created.append(result['sales_invoice'])
+
+    file_url = archive.close() if archive else None
+    if errors:
+        frappe.log_error("\n".join("{0}: {1}".format(e['sales_invoice'], e['error']) for e in errors),
+            "ZUGFeRD batch")
+    duration = time.time() - start
+    result = {
+        'invoices': len(names),
+        'created': len(created),
+        'errors': errors,
+        'file_url': file_url,
+        'metrics': {
+            'workers': workers,
+            'duration': round(duration, 2),
+            'xml_duration': round(xml_duration, 2),
+            'render_duration': round(render_duration, 2),      # sum over all workers
+            'invoices_per_second': round(len(created) / duration, 2) if duration else 0
+        }
+    }
+    if cint(notify):
+        frappe.publish_realtime("zugferd_batch_done", result, user=frappe.session.user)
+    return result
+
+def check_print_permission():
+    if not frappe.has_permission("Sales Invoice", "print"):
+        frappe.throw( _("Not permitted"), frappe.PermissionError)
+
+def get_invoice_names(sales_invoices=None, filters=None):
+    if sales_invoices:
+        if isinstance(sales_invoices, str):
+            sales_invoices = frappe.parse_json(sales_invoices)
+        return list(sales_invoices)
+    filters = frappe.parse_json(filters) if isinstance(filters, str) else (filters or {})
+    if not filters:
+        frappe.throw( _("Please select sales invoices or set filters") )
+    if isinstance(filters, dict):
+        filters.setdefault('docstatus', 1)
+    return [s.name for s in frappe.get_all("Sales Invoice", filters=filters, fields=['name'], order_by='name ASC')]
+
+def render_invoices(jobs, print_format=None, no_letterhead=0, workers=1):
+    """
+    Yield the result of render_invoice for all (sales invoice, xml) jobs
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield render_invoice(job, print_format, no_letterhead)
+        return
+    # spawn: do not fork the database connection and site state of this process
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(frappe.local.site, frappe.session.user)) as executor:
+        futures = {executor.submit(render_invoice, job, print_format, no_letterhead): job[0] for job in jobs}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as err:
+                # e.g. a worker process died
+                yield {'sales_invoice': futures[future], 'pdf': None, 'error': str(err), 'duration': 0}
+
+def _init_worker(site, user):
+    frappe.init(site=site)
+    frappe.connect()
+    frappe.set_user(user)
+
+def render_invoice(job, print_format=None, no_letterhead=0):
+    """
+    Print format, pdf, xml validation and factur-x embedding of one invoice (runs in a worker)
+    """
+    sales_invoice, xml = job
+    start = time.time()
+    result = {'sales_invoice': sales_invoice, 'pdf': None, 'error': None}
+    try:
+        xml_content = xml.encode('utf-8')
+        if not xml_check_xsd(xml=xml_content):
+            result['error'] = _("XML validation failed")
+        else:
+            html = frappe.get_print("Sales Invoice", sales_invoice, print_format, no_letterhead=no_letterhead)
+            try:
+                pdf = get_pdf(html, print_format=print_format)
+            except:
+                # this is a fallback to Frappe ERPNext that does not support dynamic print format options (such as smart shrinking)
+                pdf = get_pdf(html)
+            result['pdf'] = generate_from_binary(pdf, xml_content)
+    except Exception as err:
+        result['error'] = "{0}".format(err)
+    result['duration'] = time.time() - start
+    return result
+
+class ZugferdArchive:
+    """
+    Private zip file, written while the pdfs come in
+    """
+    def __init__(self):
+        self.file_name = "zugferd-{0}.zip".format(now_datetime().strftime("%Y%m%d-%H%M%S"))
+        self.path = frappe.get_site_path("private", "files", self.file_name)
+        self.zip_file = zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED)
+
+    def add(self, file_name, content):
+        self.zip_file.writestr(file_name, content)
+
+    def close(self):
+        self.zip_file.close()
+        file_url = "/private/files/{0}".format(self.file_name)
+        frappe.get_doc({
+            'doctype': "File",
+            'file_name': self.file_name,
+            'file_url': file_url,
+            'is_private': 1
+        }).insert(ignore_permissions=True)
+        frappe.db.commit()
+        return file_url
@@ -18,18 +18,21 @@ except:         # factur-x before v3.0
     from facturx import check_facturx_xsd as xml_check_xsd
 from erpnextswiss.erpnextswiss.zugferd.codelist import get_unit_code
 import html          # used to escape xml content
+from erpnextswiss.erpnextswiss.utils import get_chunks
 
 """
 Creates an XML file from a sales invoice
 :params:sales_invoice:   document name of the sale invoice
 :returns:                xml content (string)
 """
-def create_zugferd_xml(sales_invoice, verify=True):
+def create_zugferd_xml(sales_invoice, verify=True, sinv=None, master_data=None):
     try:
         # get original document
-        sinv = frappe.get_doc("Sales Invoice", sales_invoice)
-        customer = frappe.get_doc("Customer", sinv.customer)
-        company = frappe.get_doc("Company", sinv.company)
+        sinv = sinv or frappe.get_doc("Sales Invoice", sales_invoice)
+        # customer, company, user, addresses (prefetched for batches, see ZugferdMasterData)
+        master_data = master_data or ZugferdMasterData([sinv])
+        customer = master_data.get_customer(sinv.customer)
+        company = master_data.get_company(sinv.company)
         # compile notes
         notes = []
         if sinv.terms:
@@ -46,7 +49,7 @@ def create_zugferd_xml(sales_invoice, verify=True):
                     title=sinv.title, number=sinv.name, date=sinv.posting_date))
             })
         # compile xml content
-        owner = frappe.get_doc("User", sinv.owner)
+        owner = master_data.get_user(sinv.owner)
         delivery_date = sinv.get('delivery_date') or sinv.get('posting_date')
         data = {
             'name': html.escape(sinv.name),
@@ -80,12 +83,11 @@ def create_zugferd_xml(sales_invoice, verify=True):
             'customer_contact_phone': html.escape(sinv.contact_mobile or ""),
             'customer_contact_email': html.escape(sinv.contact_email or ""),
             'is_return': cint(sinv.is_return),
-            'iban': frappe.get_value("Account", sinv.debit_to, "iban"),
+            'iban': master_data.get_iban(sinv.debit_to),
             'tax_category': "S"
         }
         if sinv.taxes_and_charges:
-            _taxes = frappe.get_doc("Sales Taxes and Charges Template", sinv.taxes_and_charges)
-            _tax_category = _taxes.get("tax_category")
+            _tax_category = master_data.get_tax_category(sinv.taxes_and_charges)
             data['tax_category'] = (_tax_category or "S").split(':')[0]
         data['items'] = []
         for item in sinv.items:
@@ -117,7 +119,7 @@ def create_zugferd_xml(sales_invoice, verify=True):
         else:
             data['overall_tax_rate_percent'] = 0
         
-        company_address = get_primary_address(target_name=sinv.company, target_type="Company")
+        company_address = master_data.get_company_address(sinv.company)
         if company_address:
             data['company_address'] = {
                 'address_line1': html.escape(company_address.address_line1 or ""),
@@ -134,9 +136,9 @@ def create_zugferd_xml(sales_invoice, verify=True):
                 'city': "",
                 'country_code': "CH"
             }            
-        customer_address = frappe.get_doc("Address", sinv.customer_address)
+        customer_address = master_data.get_address(sinv.customer_address)
         if customer_address:
-            customer_country_code = frappe.get_value("Country", customer_address.country, "code").upper()
+            customer_country_code = customer_address.country_code
             data['customer_address'] = {
                 'address_line1': html.escape(customer_address.address_line1 or ""),
                 'address_line2': html.escape(customer_address.address_line2 or ""),
@@ -152,9 +154,9 @@ def create_zugferd_xml(sales_invoice, verify=True):
                 'city': "",
                 'country_code': "CH"
             }
-        shipping_address = frappe.get_doc("Address", sinv.shipping_address_name)
+        shipping_address = master_data.get_address(sinv.shipping_address_name)
         if shipping_address:
-            shipping_country_code = frappe.get_value("Country", shipping_address.country, "code").upper()
+            shipping_country_code = shipping_address.country_code
             data['shipping_address'] = {
                 'address_line1': html.escape(shipping_address.address_line1 or ""),
                 'address_line2': html.escape(shipping_address.address_line2 or ""),
@@ -185,3 +187,59 @@ def create_zugferd_xml(sales_invoice, verify=True):
     except Exception as err:
         frappe.log_error("Failure during XML generation for {1}: {0}".format(err, sales_invoice), "ZUGFeRD")
         return None
+
+"""
+Master data of a set of sales invoices (customers, companies, users, accounts,
+tax templates and addresses), loaded once for all invoices of a batch
+"""
+class ZugferdMasterData:
+    def __init__(self, invoices):
+        self.customers = self.load("Customer", set(i.customer for i in invoices),
+            ['leitweg_id', 'invoice_network_id'])
+        self.companies = self.load("Company", set(i.company for i in invoices), ['tax_id'])
+        self.users = self.load("User", set(i.owner for i in invoices), ['full_name', 'phone', 'email'])
+        self.accounts = self.load("Account", set(i.debit_to for i in invoices), ['iban'])
+        self.tax_templates = self.load("Sales Taxes and Charges Template",
+            set(i.taxes_and_charges for i in invoices), ['tax_category'])
+        self.addresses = self.load("Address",
+            set([i.customer_address for i in invoices] + [i.shipping_address_name for i in invoices]),
+            ['address_line1', 'address_line2', 'pincode', 'city', 'country'])
+        country_codes = {}
+        for c in frappe.get_all("Country", fields=['name', 'code']):
+            country_codes[c.name] = (c.code or "").upper()
+        for address in self.addresses.values():
+            address['country_code'] = country_codes.get(address.country)
+        self.company_addresses = {}
+
+    def load(self, doctype, names, fields):
+        # custom fields (e.g. leitweg_id) might not exist in this system
+        meta = frappe.get_meta(doctype)
+        fields = ['name'] + [f for f in fields if meta.has_field(f)]
+        records = {}
+        for chunk in get_chunks([n for n in names if n]):
+            for record in frappe.get_all(doctype, filters={'name': ['in', chunk]}, fields=fields):
+                records[record.name] = record
+        return records
+
+    def get_customer(self, customer):
+        return self.customers.get(customer) or frappe._dict()
+
+    def get_company(self, company):
+        return self.companies.get(company) or frappe._dict()
+
+    def get_user(self, user):
+        return self.users.get(user) or frappe._dict()
+
+    def get_iban(self, account):
+        return (self.accounts.get(account) or {}).get('iban')
+
+    def get_tax_category(self, taxes_and_charges):
+        return (self.tax_templates.get(taxes_and_charges) or {}).get('tax_category')
+
+    def get_address(self, address):
+        return self.addresses.get(address)
+
+    def get_company_address(self, company):
+        if company not in self.company_addresses:
+            self.company_addresses[company] = get_primary_address(target_name=company, target_type="Company")
+        return self.company_addresses[company]
@@ -131,6 +131,34 @@ doc_events = {
     "Contact": {
         "on_update": "erpnextswiss.erpnextswiss.nextcloud.contacts.send_contact_to_nextcloud",
         "on_trash": "erpnextswiss.erpnextswiss.nextcloud.contacts.delete_contact_from_nextcloud"
+    },
+    "Sales Invoice": {
+        "on_submit": "erpnextswiss.erpnextswiss.vat_control.on_voucher_change",
+        "on_cancel": "erpnextswiss.erpnextswiss.vat_control.on_voucher_change"
+    },
+    "Purchase Invoice": {
+        "on_submit": "erpnextswiss.erpnextswiss.vat_control.on_voucher_change",
+        "on_cancel": "erpnextswiss.erpnextswiss.vat_control.on_voucher_change"
+    },
+    "Journal Entry": {
+        "on_submit": "erpnextswiss.erpnextswiss.vat_control.on_voucher_change",
+        "on_cancel": "erpnextswiss.erpnextswiss.vat_control.on_voucher_change"
+    },
+    "Holiday List": {
+        "on_update": "erpnextswiss.erpnextswiss.hr.clear_holiday_calendar",
+        "on_trash": "erpnextswiss.erpnextswiss.hr.clear_holiday_calendar"
+    },
+    "Lead": {
+        "on_change": "erpnextswiss.erpnextswiss.caldav.clear_crm_feed",
+        "on_trash": "erpnextswiss.erpnextswiss.caldav.clear_crm_feed"
+    },
+    "Customer": {
+        "on_change": "erpnextswiss.erpnextswiss.caldav.clear_crm_feed",
+        "on_trash": "erpnextswiss.erpnextswiss.caldav.clear_crm_feed"
+    },
+    "ToDo": {
+        "on_change": "erpnextswiss.erpnextswiss.caldav.clear_todo_feed",
+        "on_trash": "erpnextswiss.erpnextswiss.caldav.clear_todo_feed"
     }
 }
 
@@ -156,11 +184,12 @@ doc_events = {
 # }
 scheduler_events = {
     "daily": [
-        "erpnextswiss.erpnextswiss.doctype.inspection_equipment.inspection_equipment.check_calibration_status",
-        # "erpnextswiss.erpnextswiss.ebics.sync"  # Temporarily disabled
+        "erpnextswiss.erpnextswiss.doctype.inspection_equipment.inspection_equipment.check_calibration_status"
     ],
     "hourly": [
-        "erpnextswiss.erpnextswiss.edi.process_incoming"
+        "erpnextswiss.erpnextswiss.edi.process_incoming",
+        "erpnextswiss.erpnextswiss.ebics_scheduler.scheduled_sync",
+        "erpnextswiss.erpnextswiss.ebics_posting.resume_auto_posting"
     ]
 }
 
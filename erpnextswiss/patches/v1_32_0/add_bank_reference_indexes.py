@@ -0,0 +1,14 @@
+import frappe
+from frappe import _
+
+def execute():
+    # indexes for the bulk duplicate detection of imported bank transactions
+    try:
+        frappe.reload_doc("erpnextswiss", "doctype", "ebics_statement_transaction")
+        frappe.db.add_index("ebics Statement Transaction", ["unique_reference", "date"], "unique_reference_date_index")
+        frappe.db.add_index("Payment Entry", ["reference_no", "company"], "reference_no_company_index")
+        frappe.db.commit()
+    except Exception as err:
+        print("Unable to execute Patch add_bank_reference_indexes")
+        print(str(err))
+    return
@@ -0,0 +1,15 @@
+import frappe
+from frappe import _
+
+def execute():
+    # materialize the VAT queries (runs as background job after the migration)
+    try:
+        frappe.reload_doc("erpnextswiss", "doctype", "vat_query")
+        frappe.reload_doc("erpnextswiss", "doctype", "vat_control_entry")
+        frappe.db.add_index("VAT Control Entry", ["vat_query", "company", "posting_date"], "vat_query_company_date_index")
+        frappe.db.commit()
+        frappe.enqueue("erpnextswiss.erpnextswiss.vat_control.rebuild", queue='long', timeout=15000)
+    except Exception as err:
+        print("Unable to execute Patch build_vat_control_entries")
+        print(str(err))
+    return